@@ -4,6 +4,7 @@ This module creates and configures the Flask app instance.
 """
 from flask import Flask
 import os
+import threading
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -23,7 +24,19 @@ def create_app():
     app.config['DEBUG'] = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
 
     # Register routes
-    with app.app_context():
-        from . import routes
+    from .routes import bp
+    app.register_blueprint(bp)
+
+    # Build model clients in the background so the first chat request
+    # doesn't pay for client construction
+    if os.environ.get('MODEL_WARMUP', 'true').lower() == 'true':
+        from .services import gemini_service
+        threading.Thread(target=gemini_service.warm_model_clients, name='model-warmup', daemon=True).start()
+
+    # Run queued background jobs (course initialization) in this process.
+    # Dedicated worker containers run app.commands.job_worker instead.
+    if os.environ.get('JOB_WORKER_IN_PROCESS', 'true').lower() == 'true':
+        from .services import job_queue_service
+        job_queue_service.start_background_worker()
 
     return app
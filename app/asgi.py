@@ -0,0 +1,246 @@
+"""
+ASGI entry point (async serving mode).
+
+Serves the LLM-bound and high-volume endpoints with asyncio-native clients,
+so one process can hold hundreds of in-flight requests while they wait on
+Vertex AI, Gemini and Firestore:
+
+    POST /api/chat            async retrieval, embedding and generation
+    GET  /api/get-graph       async Firestore read (shares the course cache, version-checked), ETag/304
+    POST /api/log-node-click  async Firestore write
+    POST /api/rate-answer     async Firestore write
+
+Every other route (LTI launch, course initialization, streaming chat,
+analytics, ...) is served by the regular Flask app through WsgiToAsgi,
+unchanged.
+
+Usage:
+    uvicorn app.asgi:app --host 0.0.0.0 --port 5000 --workers 2
+
+The sync deployment (gunicorn run:app) keeps working as before; see
+app/commands/load_test.py for comparing the two modes.
+"""
+import asyncio
+import logging
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_accept_header, parse_date, parse_etags
+from werkzeug.wrappers import Response as WerkzeugResponse
+
+from . import create_app
+from .services import firestore_service, gemini_service, analytics_logging_service, semantic_cache_service, concurrency
+
+flask_app = create_app()
+
+# Shared with the Flask routes so both modes format responses identically
+from .routes import (_cite_sources, _server_timing, _chat_flight_key, _compressed, _validators_match, _validator_headers,
+                     _graph_validators, _graph_body, _graph_error, _course_not_found, _issued_log_doc_ids)
+
+logger = logging.getLogger(__name__)
+
+# Identical questions asked at the same time share one retrieval and one generation
+_context_flights = concurrency.AsyncSingleFlight('chat_retrieve')
+_answer_flights = concurrency.AsyncSingleFlight('chat_generate')
+
+
+async def _load_answer_context(course_id: str, query: str) -> tuple:
+    """
+    Looks up the course corpus and retrieves context for the question.
+    Returns (corpus_id, context, stage timings), so requests sharing the call all report them.
+    """
+    timings = {}
+    course_data = await concurrency.timed_async(timings, 'course', firestore_service.get_course_data_async(course_id))
+    corpus_id = course_data.to_dict().get('corpus_id')
+    context = await concurrency.timed_async(timings, 'retrieve', gemini_service.retrieve_answer_context_async(query, corpus_id))
+    return corpus_id, context, timings
+
+
+def _open_session(request):
+    """The Flask session of an ASGI request (both modes share the signed session cookie)."""
+    return flask_app.session_interface.open_session(flask_app, request)
+
+
+def _session_cookies(session) -> list:
+    """The Set-Cookie headers Flask would send for a modified session."""
+    holder = WerkzeugResponse()
+    flask_app.session_interface.save_session(flask_app, session, holder)
+    return holder.headers.getlist('Set-Cookie')
+
+
+async def chat(request):
+    """
+    Async /api/chat. Same request and response shape as the Flask route,
+    including the Server-Timing header and request coalescing.
+    """
+    started = time.perf_counter()
+    timings = {}
+    coalesced = False
+    try:
+        data = await request.json()
+        course_id = data.get('course_id')
+        query = data.get('query')
+        flight_key = _chat_flight_key(course_id, query)
+
+        query_vector = await concurrency.timed_async(timings, 'embed', analytics_logging_service.get_query_vector_async(query))
+        # The first lookup for a course loads its index from Firestore; keep it off the event loop
+        cached = await concurrency.timed_async(
+            timings, 'cache', asyncio.to_thread(semantic_cache_service.lookup, course_id, query_vector)
+        )
+
+        # Retrieval only runs when the question isn't answered from the cache
+        if cached:
+            answer, sources = cached['answer'], cached['sources']
+        else:
+            (corpus_id, context, context_timings), _ = await _context_flights.do(
+                flight_key, _load_answer_context, course_id, query
+            )
+            timings.update(context_timings)
+            (answer, sources), coalesced = await concurrency.timed_async(
+                timings, 'generate', _answer_flights.do(
+                    flight_key,
+                    gemini_service.generate_answer_with_context_async,
+                    query=query,
+                    corpus_id=corpus_id,
+                    context=context
+                )
+            )
+    except Exception as e:
+        logger.error(f"[CHAT ERROR] {str(e)}", exc_info=True)
+        return JSONResponse({
+            "error": str(e),
+            "response": f"Sorry, an error occurred: {str(e)}"
+        }, status_code=500)
+
+    timings['total'] = round((time.perf_counter() - started) * 1000, 1)
+
+    # Only queues the write; the background logging workers do the I/O
+    doc_id = await analytics_logging_service.enqueue_chat_query_async(
+        course_id=course_id,
+        query_text=query,
+        answer_text=answer,
+        sources=sources,
+        query_vector=query_vector,
+        metrics={'total_ms': timings['total'], 'stages_ms': dict(timings), 'streamed': False,
+                 'coalesced': coalesced, 'asgi': True}
+    )
+    if not cached and not coalesced:
+        semantic_cache_service.add_entry(course_id, query_vector, answer, sources, doc_id)
+
+    response = JSONResponse({
+        "answer": answer,
+        "sources": _cite_sources(sources),
+        "log_doc_id": doc_id,
+        "response": answer,
+        "cached": bool(cached),
+        "coalesced": coalesced
+    }, headers={'Server-Timing': _server_timing(timings)})
+    # Lets this client rate the answer before the background log write lands
+    if doc_id:
+        session = _open_session(request)
+        session['log_doc_ids'] = _issued_log_doc_ids(session, doc_id)
+        for cookie in _session_cookies(session):
+            response.headers.append('set-cookie', cookie)
+    return response
+
+
+async def get_graph(request):
+    """Async /api/get-graph; validators, body, errors and compression come from the Flask route's helpers."""
+    course_id = request.query_params.get('course_id')
+    if not course_id:
+        return JSONResponse({"error": "Missing required parameter: course_id"}, status_code=400)
+
+    raw = request.query_params.get('format') == 'raw'
+    try:
+        # Checked against the stored kg_version, so a 304 never vouches for another worker's stale copy
+        course_data = await firestore_service.get_course_data_async(course_id, validate='kg')
+        if not course_data.exists:
+            return JSONResponse(_course_not_found(course_id), status_code=404)
+
+        etag, last_modified = _graph_validators(course_data, raw)
+        headers = _validator_headers(etag, last_modified)
+        if _validators_match(etag, last_modified, parse_etags(request.headers.get('if-none-match')),
+                             parse_date(request.headers.get('if-modified-since'))):
+            return Response(status_code=304, headers=headers)
+
+        if raw:
+            graph = await firestore_service.get_knowledge_graph_json_async(course_id, course_data)
+        else:
+            graph = await firestore_service.get_knowledge_graph_async(course_id, course_data)
+        body = _graph_body(course_data, raw, graph)
+    except Exception as e:
+        return JSONResponse(_graph_error(e), status_code=500)
+    body, encoding_headers = _compressed(body, parse_accept_header(request.headers.get('accept-encoding')))
+    return Response(body, media_type='application/json', headers={**headers, **encoding_headers})
+
+
+async def log_node_click(request):
+    """Async /api/log-node-click."""
+    data = await request.json()
+    course_id = data.get('course_id')
+    node_id = data.get('node_id')
+    node_label = data.get('node_label')
+    node_type = data.get('node_type')
+
+    if not course_id or not node_id or not node_label:
+        return JSONResponse({
+            "error": "Missing required fields: course_id, node_id, node_label"
+        }, status_code=400)
+
+    doc_id = await analytics_logging_service.log_kg_node_click_async(
+        course_id=course_id,
+        node_id=node_id,
+        node_label=node_label,
+        node_type=node_type
+    )
+
+    return JSONResponse({
+        "success": True,
+        "log_doc_id": doc_id
+    })
+
+
+async def rate_answer(request):
+    """Async /api/rate-answer (404 for IDs that are neither stored nor issued to this session)."""
+    data = await request.json()
+    log_doc_id = data.get('log_doc_id')
+    rating = data.get('rating')
+
+    if not log_doc_id or not rating:
+        return JSONResponse({
+            "error": "Missing required fields: log_doc_id and rating"
+        }, status_code=400)
+
+    if rating not in ['helpful', 'not_helpful']:
+        return JSONResponse({
+            "error": "Invalid rating. Must be 'helpful' or 'not_helpful'"
+        }, status_code=400)
+
+    try:
+        issued = log_doc_id in _open_session(request).get('log_doc_ids', [])
+        if not await analytics_logging_service.rate_answer_async(log_doc_id, rating, issued=issued):
+            return JSONResponse({"error": "Answer not found"}, status_code=404)
+
+        return JSONResponse({
+            "success": True,
+            "message": "Rating recorded successfully"
+        })
+    except Exception as e:
+        logger.error(f"Failed to rate answer: {e}", exc_info=True)
+        return JSONResponse({
+            "error": "Failed to rate answer",
+            "message": str(e)
+        }, status_code=500)
+
+
+app = Starlette(routes=[
+    Route('/api/chat', chat, methods=['POST']),
+    Route('/api/get-graph', get_graph, methods=['GET']),
+    Route('/api/log-node-click', log_node_click, methods=['POST']),
+    Route('/api/rate-answer', rate_answer, methods=['POST']),
+    # Everything else is served by the sync Flask app
+    Mount('/', app=WsgiToAsgi(flask_app)),
+])
@@ -0,0 +1,153 @@
+"""
+Command to compare the CPU cost of building /api/get-graph response bodies.
+
+Builds the same graph response three ways and reports CPU time per
+response and body size:
+
+    strings     the default format: nodes/edges/data re-encoded as JSON
+                strings inside the JSON response (escaped twice)
+    raw_cold    ?format=raw, serializing the graph once
+    raw_cached  ?format=raw, reusing the bytes cached for the kg_version
+
+Usage:
+    python -m app.commands.benchmark_graph_response
+    python -m app.commands.benchmark_graph_response --topics 200 --files 600 --runs 50
+    python -m app.commands.benchmark_graph_response --course-id 12345
+
+Without --course-id a synthetic graph of the given size is used, so no
+cloud access is needed.
+
+Output example:
+    path            CPU ms/resp     body KB
+    strings                3.14       232.4
+    raw_cold               2.19       202.2
+    raw_cached             0.32       202.2
+"""
+import argparse
+import json
+import logging
+import statistics
+import sys
+import os
+import time
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from app.services import firestore_service
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def synthetic_graph(topic_count, file_count):
+    """
+    Builds a graph shaped like build_knowledge_graph output.
+
+    Returns:
+        (nodes, edges, data, indexed_files)
+    """
+    nodes = []
+    edges = []
+    data = {}
+    indexed_files = {}
+    for f in range(file_count):
+        file_id = str(1000 + f)
+        nodes.append({'id': file_id, 'label': f"Lecture {f} notes.pdf", 'group': 'file_pdf', 'x': f * 3.5, 'y': f * -2.25})
+        indexed_files[file_id] = {'name': f"Lecture {f} notes.pdf", 'hash': f"{f:040x}"}
+    for t in range(1, topic_count + 1):
+        topic_id = f"topic_{t}"
+        nodes.append({'id': topic_id, 'label': f"Topic {t}", 'group': 'topic', 'x': t * 7.0, 'y': t * 1.5})
+        for f in range(3):
+            edges.append({'from': topic_id, 'to': str(1000 + (t * 3 + f) % max(file_count, 1))})
+        if t > 1:
+            edges.append({'from': topic_id, 'to': f"topic_{t - 1}", 'type': 'related', 'similarity': 0.812})
+        data[topic_id] = {
+            'summary': f"Topic {t} covers \"key ideas\", worked examples and common mistakes. " * 8,
+            'sources': [f"Lecture {(t * 3 + f) % max(file_count, 1)} notes.pdf" for f in range(3)]
+        }
+    return nodes, edges, data, indexed_files
+
+
+def strings_body(nodes, edges, data, indexed_files):
+    """The default get-graph body: graph parts as JSON strings."""
+    return json.dumps({
+        'nodes': json.dumps(nodes),
+        'edges': json.dumps(edges),
+        'data': json.dumps(data),
+        'indexed_files': indexed_files
+    }).encode('utf-8')
+
+
+def raw_body(graph_json, indexed_files):
+    """The ?format=raw body (same splice as routes._raw_graph_body, which needs an app context)."""
+    return b''.join([graph_json[:-1], b',"indexed_files":', json.dumps(indexed_files).encode('utf-8'), b'}'])
+
+
+def measure(build, runs):
+    """Returns (median CPU ms, body bytes) over `runs` calls of build()."""
+    samples = []
+    body = b''
+    for _ in range(runs):
+        started = time.process_time()
+        body = build()
+        samples.append((time.process_time() - started) * 1000)
+    return statistics.median(samples), len(body)
+
+
+def run_benchmark(nodes, edges, data, indexed_files, runs=20):
+    """
+    Measures each response path.
+
+    Returns:
+        Dictionary mapping path to {'cpu_ms', 'bytes'}
+    """
+    cached = firestore_service._serialize_graph(nodes, edges, data)
+    paths = {
+        'strings': lambda: strings_body(nodes, edges, data, indexed_files),
+        'raw_cold': lambda: raw_body(firestore_service._serialize_graph(nodes, edges, data), indexed_files),
+        'raw_cached': lambda: raw_body(cached, indexed_files),
+    }
+    results = {}
+    for path, build in paths.items():
+        cpu_ms, size = measure(build, runs)
+        results[path] = {'cpu_ms': cpu_ms, 'bytes': size}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark get-graph response encoding')
+    parser.add_argument('--course-id', help='Use an initialized course instead of a synthetic graph')
+    parser.add_argument('--topics', type=int, default=150, help='Synthetic topic count (default: 150)')
+    parser.add_argument('--files', type=int, default=400, help='Synthetic file count (default: 400)')
+    parser.add_argument('--runs', type=int, default=20, help='Runs per path (default: 20)')
+    args = parser.parse_args()
+
+    if args.course_id:
+        course_doc = firestore_service.get_course_data(args.course_id)
+        if not course_doc.exists:
+            logger.error(f"Course {args.course_id} not found")
+            sys.exit(1)
+        nodes, edges, data = firestore_service.get_knowledge_graph(args.course_id, course_doc)
+        indexed_files = course_doc.to_dict().get('indexed_files')
+        label = f"course {args.course_id}"
+    else:
+        nodes, edges, data, indexed_files = synthetic_graph(args.topics, args.files)
+        label = f"synthetic, {args.topics} topics / {args.files} files"
+
+    results = run_benchmark(nodes, edges, data, indexed_files, args.runs)
+
+    print("\n" + "=" * 44)
+    print(f"GET-GRAPH RESPONSE BENCHMARK ({label})")
+    print("=" * 44)
+    print(f"{'path':<12} {'CPU ms/resp':>14} {'body KB':>11}")
+    for path, result in results.items():
+        print(f"{path:<12} {result['cpu_ms']:>14.2f} {result['bytes'] / 1024:>11.1f}")
+    print("=" * 44)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Command to compare the per-topic and batched topic summarization modes.
+
+Summarizes the same topics with each mode of kg_service.summarize_topics
+and reports wall time, generation calls and Gemini token usage.
+
+Usage:
+    python -m app.commands.benchmark_topic_summaries --course-id 12345
+    python -m app.commands.benchmark_topic_summaries --course-id 12345 \
+        --topics "Recursion, Sorting, Graphs" --runs 3
+
+Topics default to the course's current graph topics. The retrieval cache
+is cleared before every run so both modes pay for their own retrievals.
+
+Output example:
+    mode         wall s   calls   prompt tok   output tok   errors
+    per_topic      14.2       9        41250         2210        0
+    batched         6.8       1         9870         2050        0
+"""
+import argparse
+import logging
+import statistics
+import sys
+import os
+import time
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from app.services import firestore_service, gemini_service, kg_service, rag_service
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+MODES = ('per_topic', 'batched')
+
+
+def run_mode(topics, corpus_id, mode):
+    """
+    Summarizes the topics once with the given mode.
+
+    Returns:
+        dict with wall_s, calls, prompt_tokens, output_tokens and errors
+    """
+    rag_service.invalidate_retrieval_cache(corpus_id)
+    gemini_service.reset_token_usage()
+
+    started = time.perf_counter()
+    results = kg_service.summarize_topics(topics, corpus_id, mode=mode)
+    wall_s = time.perf_counter() - started
+
+    usage = gemini_service.get_token_usage()
+    return {
+        'wall_s': wall_s,
+        'calls': usage['calls'],
+        'prompt_tokens': usage['prompt_tokens'],
+        'output_tokens': usage['output_tokens'],
+        'errors': sum(1 for result in results if isinstance(result, Exception))
+    }
+
+
+def run_benchmark(topics, corpus_id, runs=1):
+    """
+    Runs each mode `runs` times and averages the results.
+
+    Returns:
+        Dictionary mapping mode to averaged run results
+    """
+    summary = {}
+    for mode in MODES:
+        logger.info(f"Summarizing {len(topics)} topics in {mode} mode ({runs} run(s))...")
+        mode_runs = [run_mode(topics, corpus_id, mode) for _ in range(runs)]
+        summary[mode] = {key: statistics.mean(run[key] for run in mode_runs) for key in mode_runs[0]}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-topic vs batched topic summaries')
+    parser.add_argument('--course-id', required=True, help='Canvas course ID (must be initialized)')
+    parser.add_argument('--topics', help='Comma-separated topics (default: the course graph topics)')
+    parser.add_argument('--runs', type=int, default=1, help='Runs per mode (default: 1)')
+    args = parser.parse_args()
+
+    if not gemini_service.project_id:
+        logger.error("GOOGLE_CLOUD_PROJECT environment variable not set")
+        sys.exit(1)
+
+    course_doc = firestore_service.get_course_data(args.course_id)
+    if not course_doc.exists:
+        logger.error(f"Course {args.course_id} not found")
+        sys.exit(1)
+    corpus_id = course_doc.to_dict().get('corpus_id')
+
+    if args.topics:
+        topics = [t.strip() for t in args.topics.split(',') if t.strip()]
+    else:
+        nodes, _, _ = firestore_service.get_knowledge_graph(args.course_id, course_doc)
+        topics = [node['label'] for node in nodes if node.get('group') == 'topic']
+    if len(topics) < 2:
+        logger.error("Need at least two topics to compare the modes")
+        sys.exit(1)
+
+    results = run_benchmark(topics, corpus_id, args.runs)
+
+    print("\n" + "=" * 68)
+    print(f"TOPIC SUMMARY BENCHMARK ({len(topics)} topics, {args.runs} run(s) per mode)")
+    print("=" * 68)
+    print(f"{'mode':<11} {'wall s':>7} {'calls':>7} {'prompt tok':>12} {'output tok':>12} {'errors':>8}")
+    for mode, result in results.items():
+        print(f"{mode:<11} {result['wall_s']:>7.1f} {result['calls']:>7.0f} {result['prompt_tokens']:>12.0f} "
+              f"{result['output_tokens']:>12.0f} {result['errors']:>8.0f}")
+    print("=" * 68)
+
+
+if __name__ == '__main__':
+    main()
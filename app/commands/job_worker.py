@@ -0,0 +1,67 @@
+"""
+Command to run background job workers (course initialization and sync).
+
+Usage:
+    python -m app.commands.job_worker
+    python -m app.commands.job_worker --threads 2
+
+Run it in its own container (with JOB_WORKER_IN_PROCESS=false on the web
+containers) so long jobs never compete with HTTP requests. Any number of
+workers can share the Firestore queue; each job runs on one worker at a
+time, and a job whose worker dies is picked up again once its lease runs
+out (JOB_LEASE_SECONDS).
+
+For local development set JOB_QUEUE_BACKEND=sqlite; the queue then lives
+in JOB_QUEUE_SQLITE_PATH and survives restarts.
+"""
+import argparse
+import logging
+import signal
+import sys
+import os
+import threading
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app.services import job_queue_service
+from app.services import course_init_service  # noqa: F401 (registers the initialize_course and sync_course handlers)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run background job workers')
+    parser.add_argument('--threads', type=int, default=1, help='Jobs run at once by this process (default: 1)')
+    args = parser.parse_args()
+
+    stop = threading.Event()
+
+    def _shutdown(signum, frame):
+        logger.info("Stopping after the running jobs finish...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+
+    workers = [
+        threading.Thread(target=job_queue_service.run_worker, kwargs={'stop': stop}, name=f'job-worker-{i}')
+        for i in range(args.threads)
+    ]
+    for worker in workers:
+        worker.start()
+    logger.info(f"Started {len(workers)} job worker(s) on the {job_queue_service.JOB_QUEUE_BACKEND} queue")
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == '__main__':
+    main()
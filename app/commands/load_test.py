@@ -0,0 +1,174 @@
+"""
+Command to load test the chat endpoint at increasing concurrency levels.
+
+Run it once against each serving mode on the same machine to compare how
+many concurrent chats each mode sustains for a given amount of memory:
+
+    # Sync mode (gunicorn threads/processes)
+    gunicorn --bind 0.0.0.0:5000 --workers 2 --threads 8 --timeout 120 run:app
+    python -m app.commands.load_test --course-id 12345 --input queries.json \
+        --base-url http://localhost:5000 --server-pid <gunicorn master pid> --label sync
+
+    # Async mode (single event loop per worker)
+    uvicorn app.asgi:app --host 0.0.0.0 --port 5000 --workers 2
+    python -m app.commands.load_test --course-id 12345 --input queries.json \
+        --base-url http://localhost:5000 --server-pid <uvicorn pid> --label asgi
+
+Input JSON format matches app.commands.run_queries (a list of questions, or
+an object with a "questions" key).
+
+For each concurrency level all requests are sent at once. The command
+reports success rate, latency percentiles, throughput and, with
+--server-pid, the peak RSS of the server process and its children.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import os
+import time
+from pathlib import Path
+
+import httpx
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from app.commands.run_queries import load_queries, latency_percentiles
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def _server_rss_mb(server_pid):
+    """Returns the combined RSS of a server process and its workers in MB."""
+    import psutil
+
+    try:
+        process = psutil.Process(server_pid)
+        processes = [process] + process.children(recursive=True)
+        return sum(p.memory_info().rss for p in processes) / (1024 * 1024)
+    except psutil.Error:
+        return None
+
+
+async def _sample_rss(server_pid, samples, stop):
+    """Samples server RSS every 100ms until stop is set."""
+    while not stop.is_set():
+        rss = _server_rss_mb(server_pid)
+        if rss is not None:
+            samples.append(rss)
+        await asyncio.sleep(0.1)
+
+
+async def _send_chat(client, endpoint, course_id, query):
+    """Sends one chat request and returns (ok, latency_ms)."""
+    started = time.perf_counter()
+    try:
+        response = await client.post(endpoint, json={"course_id": course_id, "query": query})
+        ok = response.status_code == 200
+    except httpx.HTTPError as e:
+        logger.debug(f"Request failed: {e}")
+        ok = False
+    return ok, (time.perf_counter() - started) * 1000
+
+
+async def run_level(base_url, course_id, queries, concurrency, timeout=120, server_pid=None):
+    """
+    Sends `concurrency` chat requests at once and summarizes the results.
+
+    Args:
+        base_url: Base URL of the application
+        course_id: Canvas course ID
+        queries: List of query strings to sample from
+        concurrency: Number of simultaneous requests
+        timeout: Per-request timeout in seconds
+        server_pid: Optional server PID to sample memory from
+
+    Returns:
+        dict: Summary for this concurrency level
+    """
+    endpoint = f"{base_url}/api/chat"
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    rss_samples = []
+    stop = asyncio.Event()
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits, verify=False) as client:
+        sampler = asyncio.create_task(_sample_rss(server_pid, rss_samples, stop)) if server_pid else None
+        started = time.perf_counter()
+        results = await asyncio.gather(*[
+            _send_chat(client, endpoint, course_id, random.choice(queries)) for _ in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - started
+        stop.set()
+        if sampler:
+            await sampler
+
+    latencies = [latency for ok, latency in results if ok]
+    successful = len(latencies)
+    return {
+        "concurrency": concurrency,
+        "successful": successful,
+        "failed": concurrency - successful,
+        "success_rate": round(successful / concurrency * 100, 1),
+        "latency_ms": latency_percentiles([round(latency, 1) for latency in latencies]),
+        "throughput_rps": round(successful / elapsed, 2) if elapsed else None,
+        "peak_rss_mb": round(max(rss_samples), 1) if rss_samples else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Load test /api/chat at increasing concurrency',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__
+    )
+    parser.add_argument('--course-id', required=True, help='Canvas course ID')
+    parser.add_argument('--input', required=True, help='Path to input JSON file containing queries')
+    parser.add_argument('--base-url', default='http://localhost:5000', help='Base URL of the application')
+    parser.add_argument('--levels', default='10,50,100,200,400', help='Comma-separated concurrency levels')
+    parser.add_argument('--timeout', type=int, default=120, help='Per-request timeout in seconds (default: 120)')
+    parser.add_argument('--server-pid', type=int, help='Server PID to sample memory from (includes workers)')
+    parser.add_argument('--label', default='', help='Name of the serving mode, stored with the results')
+    parser.add_argument('--output', help='Optional path to save the results as JSON')
+    args = parser.parse_args()
+
+    queries = load_queries(args.input)
+    if not queries:
+        logger.error("No queries found in input file")
+        return 1
+
+    levels = [int(level) for level in args.levels.split(',') if level.strip()]
+    summaries = []
+    for level in levels:
+        logger.info(f"Running {level} concurrent chats...")
+        summaries.append(asyncio.run(run_level(
+            args.base_url, args.course_id, queries, level, args.timeout, args.server_pid
+        )))
+
+    print("\n" + "=" * 78)
+    print(f"LOAD TEST {args.label}".rstrip())
+    print("=" * 78)
+    print(f"{'concurrency':>11} {'success %':>10} {'p50 ms':>10} {'p95 ms':>10} {'req/s':>8} {'peak RSS MB':>12}")
+    for summary in summaries:
+        print(f"{summary['concurrency']:>11} {summary['success_rate']:>10} "
+              f"{str(summary['latency_ms']['p50']):>10} {str(summary['latency_ms']['p95']):>10} "
+              f"{str(summary['throughput_rps']):>8} {str(summary['peak_rss_mb']):>12}")
+    print("=" * 78)
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"label": args.label, "base_url": args.base_url, "levels": summaries}, f, indent=2)
+        logger.info(f"Results saved to {args.output}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -19,12 +19,15 @@ Output JSON format:
         "total_queries": 3,
         "successful": 2,
         "failed": 1,
+        "latency_ms": {"p50": 1830.2, "p95": 2410.7},
         "results": [
             {
                 "query": "What is machine learning?",
                 "answer": "...",
                 "sources": [...],
                 "log_doc_id": "...",
+                "latency_ms": 1830.2,
+                "server_timing": {"embed": 92.1, "retrieve": 410.3, "generate": 1204.8, "total": 1702.5},
                 "status": "success"
             },
             {
@@ -98,6 +101,7 @@ def run_query(base_url, course_id, query_text, timeout=30):
     try:
         logger.info(f"Sending query: {query_text[:50]}...")
         
+        started = time.perf_counter()
         response = requests.post(
             endpoint,
             json=payload,
@@ -106,6 +110,8 @@ def run_query(base_url, course_id, query_text, timeout=30):
             verify=False  # Disable SSL verification for localhost
         )
         
+        latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        
         response.raise_for_status()
         
         data = response.json()
@@ -115,6 +121,8 @@ def run_query(base_url, course_id, query_text, timeout=30):
             "answer": data.get("answer") or data.get("response"),
             "sources": data.get("sources", []),
             "log_doc_id": data.get("log_doc_id"),
+            "latency_ms": latency_ms,
+            "server_timing": parse_server_timing(response.headers.get("Server-Timing")),
             "status": "success"
         }
     
@@ -146,6 +154,31 @@ def run_query(base_url, course_id, query_text, timeout=30):
         }
 
 
+def parse_server_timing(header):
+    """Parses a Server-Timing header ("embed;dur=92.1, ...") into {stage: ms}."""
+    timings = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        if name and params.startswith("dur="):
+            try:
+                timings[name] = float(params[4:])
+            except ValueError:
+                continue
+    return timings
+
+
+def latency_percentiles(latencies):
+    """Returns p50 and p95 of a list of latencies in ms (None when empty)."""
+    if not latencies:
+        return {"p50": None, "p95": None}
+    ordered = sorted(latencies)
+    
+    def percentile(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+    
+    return {"p50": percentile(0.50), "p95": percentile(0.95)}
+
+
 def run_batch_queries(base_url, course_id, queries, delay=1.0, timeout=30):
     """
     Run a batch of queries against the /api/chat endpoint.
@@ -189,6 +222,7 @@ def run_batch_queries(base_url, course_id, queries, delay=1.0, timeout=30):
         "total_queries": total,
         "successful": successful,
         "failed": failed,
+        "latency_ms": latency_percentiles([r["latency_ms"] for r in results if r["status"] == "success"]),
         "results": results
     }
 
@@ -287,6 +321,7 @@ def main():
         print(f"Successful:       {results['successful']}")
         print(f"Failed:           {results['failed']}")
         print(f"Success Rate:     {results['successful']/results['total_queries']*100:.1f}%")
+        print(f"Latency p50/p95:  {results['latency_ms']['p50']} / {results['latency_ms']['p95']} ms")
         print(f"Results saved to: {args.output}")
         print("="*60)
         
@@ -2,20 +2,53 @@
 Flask API Routes (ROLE 2: The "API Router")
 Handles all HTTP endpoints and connects frontend to core services.
 """
-from flask import request, render_template, jsonify, session, current_app as app
-from .services import firestore_service, rag_service, kg_service, canvas_service, gcs_service, gemini_service, analytics_logging_service, analytics_reporting_service
+from flask import Blueprint, request, render_template, jsonify, session, Response, stream_with_context
+from .services import firestore_service, rag_service, kg_service, gcs_service, gemini_service, analytics_logging_service, analytics_reporting_service, semantic_cache_service, concurrency, course_init_service, job_queue_service
+from .services.firestore_service import GraphVersionConflict, MAX_BATCH_WRITES
 import os
 import logging
-import shutil
 import json
+import time
+import gzip
+from datetime import datetime
+from werkzeug.datastructures import Accept
+from werkzeug.http import http_date, parse_accept_header, quote_etag
+
+try:
+    import brotli  # Optional; responses fall back to gzip without it
+except ImportError:
+    brotli = None
 
 logger = logging.getLogger(__name__)
 
-# Get Canvas API token from environment
-CANVAS_TOKEN = os.environ.get('CANVAS_API_TOKEN')
+# Registered on the app by create_app
+bp = Blueprint('routes', __name__)
+
+# Versioned graph and analytics responses at least this large are compressed (0 disables)
+COMPRESS_MIN_BYTES = int(os.environ.get('HTTP_COMPRESS_MIN_BYTES', '1024'))
+
+
+# LTI roles (substring match) that may use the teacher tools
+INSTRUCTOR_ROLES = ('teacher', 'instructor', 'professor')
+
 
+def _is_instructor_role(role: str) -> bool:
+    """True if an LTI role string names a teacher, instructor or professor."""
+    role_lower = (role or '').lower()
+    return any(name in role_lower for name in INSTRUCTOR_ROLES)
 
-@app.route('/health', methods=['GET'])
+
+@bp.app_errorhandler(GraphVersionConflict)
+def graph_version_conflict(e):
+    """Answers a graph edit computed from an outdated graph with 409 (nothing was written)."""
+    logger.warning(f"Concurrent graph edit, not applied: {e}")
+    return jsonify({
+        "error": "The knowledge graph was changed by another edit. Reload and try again.",
+        "message": str(e)
+    }), 409
+
+
+@bp.route('/health', methods=['GET'])
 def health_check():
     """
     Health check endpoint for container orchestration.
@@ -27,7 +60,7 @@ def health_check():
     }), 200
 
 
-@app.route('/launch', methods=['GET', 'POST'])
+@bp.route('/launch', methods=['GET', 'POST'])
 def launch():
     """
     Main LTI entry point from Canvas.
@@ -59,7 +92,7 @@ def launch():
                     role=role
                 )
             # Teachers get the teacher view
-            elif 'teacher' in role_lower or 'instructor' in role_lower or 'professor' in role_lower:
+            elif _is_instructor_role(role):
                 return render_template(
                     'teacher_view.html',
                     course_id=course_id,
@@ -86,7 +119,7 @@ def launch():
     )
 
 
-@app.route('/analytics/<course_id>', methods=['GET'])
+@bp.route('/analytics/<course_id>', methods=['GET'])
 def analytics_dashboard(course_id):
     """
     Analytics Dashboard - Professor-only page to view course analytics.
@@ -105,7 +138,7 @@ def analytics_dashboard(course_id):
     )
 
 
-@app.route('/student/<course_id>', methods=['GET'])
+@bp.route('/student/<course_id>', methods=['GET'])
 def student_view(course_id):
     """
     Student View - Interactive knowledge graph exploration interface.
@@ -144,189 +177,336 @@ def student_view(course_id):
     )
 
 
-@app.route('/api/initialize-course', methods=['POST'])
+@bp.route('/api/initialize-course', methods=['POST'])
 def initialize_course():
     """
-    Kicks off the entire RAG + KG pipeline.
-    This is a long-running request triggered by the professor.
+    Kicks off the entire RAG + KG pipeline for a course.
+    
+    The pipeline (Canvas download, GCS upload, corpus import, summaries,
+    knowledge graph) takes minutes, so it runs as a background job: the
+    course is set to GENERATING and the job is queued right away.
+    Poll /api/jobs/<job_id> for stage, progress and ETA.
     
-    Pipeline:
-    1. Create Firestore doc with status: GENERATING
-    2. Download files from Canvas to local storage
-    3. Upload files to Google Cloud Storage (GCS)
-    4. Create RAG corpus and import files from GCS
-    5. Build knowledge graph using RAG context
-    6. Clean up local and GCS files
-    7. Finalize Firestore doc with status: ACTIVE
+    After a failed run, initializing again resumes from the stage and file
+    where it stopped (see course_init_service) unless "resume" is false.
+    While an initialization is already queued or running its job is returned.
     
     Returns:
-        JSON response with status and corpus info
+        202 with job_id and status_url, or 409 while the course is being synced
     """
-    course_id = None
+    data = request.json or {}
+    course_id = data.get('course_id')
+    if not course_id:
+        return jsonify({"error": "course_id is required"}), 400
+    
     try:
-        data = request.json
-        course_id = data.get('course_id')
-        topics = data.get('topics')  # Optional now
-        
-        if not course_id:
-            return jsonify({"error": "course_id is required"}), 400
-        
-        logger.info(f"Starting initialization for course {course_id}")
-        # Step 1: Create Firestore doc with status: GENERATING
-        logger.info("Step 1: Creating Firestore document...")
-        firestore_service.create_course_doc(course_id)
-        
-        # Step 2: Download course files from Canvas (downloads to local storage)
-        logger.info("Step 2: Fetching course files from Canvas...")
-        files, indexed_files_map = canvas_service.get_course_files(
-            course_id=course_id,
-            token=CANVAS_TOKEN,
-            download=True  # Downloads files locally and adds local_path
-        )
-        
-        if not files:
-            logger.warning(f"No files found for course {course_id}")
-            return jsonify({"error": "No course files found"}), 404
-        
-        logger.info(f"Retrieved {len(files)} files from Canvas")
-        
-        # Step 3: Upload files to Google Cloud Storage (GCS)
-        logger.info("Step 3: Uploading files to Google Cloud Storage...")
-        files = gcs_service.upload_course_files(files, course_id)
-        
-        # Update indexed_files_map with GCS URIs
-        for file in files:
-            file_id = str(file.get('id'))
-            if file_id in indexed_files_map and file.get('gcs_uri'):
-                indexed_files_map[file_id]['gcs_uri'] = file.get('gcs_uri')
-                indexed_files_map[file_id]['display_name'] = file.get('display_name')
-        
-        # Count successful uploads
-        successful_uploads = sum(1 for f in files if f.get('gcs_uri'))
-        logger.info(f"Uploaded {successful_uploads}/{len(files)} files to GCS")
-        
-        # Step 4: Create RAG corpus and import files from GCS
-        logger.info("Step 4: Creating RAG corpus and importing files...")
-        corpus_id = rag_service.create_and_provision_corpus(
-            files=files,
-            corpus_name_suffix=f"Course {course_id}"
+        job_id = course_init_service.enqueue_initialization(
+            course_id,
+            topics=data.get('topics'),  # Optional: auto-extracted when empty
+            summary_mode=data.get('summary_mode'),  # Optional: 'per_topic' or 'batched'
+            resume=data.get('resume', True)  # false = discard checkpoints of an earlier failed run
         )
-        logger.info(f"Created corpus: {corpus_id}")
-
-        # Step 4.3: Summarize all files included:
-        file_to_summary = {}
-        files_processed = 0
-
-        for file in files:
-            local_path = file.get("local_path")
-            display_name = file.get("display_name") or f"file_{file.get('id')}"
+    except job_queue_service.JobConflictError as e:
+        return jsonify({"error": str(e), "job_id": e.job.get('id')}), 409
+    except Exception as e:
+        logger.error(f"Failed to queue initialization for course {course_id}: {e}", exc_info=True)
+        return jsonify({
+            "error": "Failed to initialize course",
+            "message": str(e)
+        }), 500
+    
+    logger.info(f"Queued initialization job {job_id} for course {course_id}")
+    return jsonify({
+        "status": "queued",
+        "job_id": job_id,
+        "status_url": f"/api/jobs/{job_id}"
+    }), 202
 
-            # Skip if no local path
-            if not local_path:
-                logger.info(f"Could not locate file path for {display_name}")
-                continue
 
-            summary = gemini_service.summarize_file(
-                file_path=local_path,
-            )
+@bp.route('/api/sync-course', methods=['POST'])
+def sync_course():
+    """
+    Updates an initialized course with the files that changed in Canvas.
 
-            file_to_summary[display_name] = summary
-            files_processed += 1
-            logger.info(f"File Name: {display_name}\nSummary: {summary}")
+    Diffs the Canvas file listing against the course's indexed_files and
+    only downloads, uploads and imports new or changed files, removes
+    deleted ones, and re-summarizes the topics whose sources changed.
+    Runs as a background job; the course stays ACTIVE meanwhile.
 
+    Returns:
+        202 with job_id and status_url (an already queued or running sync's),
+        or 409 if the course isn't ACTIVE or is being initialized
+    """
+    data = request.json or {}
+    course_id = data.get('course_id')
+    if not course_id:
+        return jsonify({"error": "course_id is required"}), 400
 
-        # Step 4.5: Extract Topics from summaries, autogenerate topics if not provided:
-        summaries = file_to_summary.values()
-        logger.info(f"topics: {topics}")
-        if not topics or not any(t.strip() for t in topics.split(",")):
-            logger.info("No topics provided, auto-extracting generating topics from files")
-            topics = kg_service.extract_topics_from_summaries(summaries)
-            logger.info(f"Auto-extracted topics: {topics}")
-        else:
-            topics = topics.split(",")
-        
-        # Step 5: Build knowledge graph
-        logger.info("Step 5: Building knowledge graph...")
-        kg_nodes, kg_edges, kg_data = kg_service.build_knowledge_graph(
-            topic_list=topics,
-            corpus_id=corpus_id,
-            files=files
-        )
-        logger.info("Knowledge graph built successfully")
-        
-        # Step 6: Clean up local files
-        logger.info("Step 6: Cleaning up local files...")
-        local_dir = os.path.join('app', 'data', 'courses', course_id)
-        if os.path.exists(local_dir):
-            shutil.rmtree(local_dir)
-            logger.info(f"Deleted local directory: {local_dir}")
-        
-        # Step 7: Keep GCS files for future use (no cleanup)
-        logger.info("Step 7: GCS files retained for source downloads")
-        
-        # Step 8: Finalize Firestore document with all data
-        logger.info("Step 8: Finalizing Firestore document...")
-        update_payload = {
-            'corpus_id': corpus_id,
-            'indexed_files': indexed_files_map,
-            'kg_nodes': kg_nodes,
-            'kg_edges': kg_edges,
-            'kg_data': kg_data
-        }
-        firestore_service.finalize_course_doc(course_id, update_payload)
-        
-        logger.info(f"Course {course_id} initialization complete!")
-        
-        return jsonify({
-            "status": "complete",
-            "corpus_id": corpus_id,
-            "files_count": len(files),
-            "uploaded_count": successful_uploads,
-            "kg_nodes": kg_nodes,
-            "kg_edges": kg_edges,
-            "kg_data": kg_data
-        })
+    status = firestore_service.get_course_state(course_id)
+    if status != 'ACTIVE':
+        return jsonify({"error": "Course is not initialized", "status": status}), 409
 
-        
+    try:
+        job_id = course_init_service.enqueue_sync(course_id, summary_mode=data.get('summary_mode'))
+    except job_queue_service.JobConflictError as e:
+        return jsonify({"error": str(e), "job_id": e.job.get('id')}), 409
     except Exception as e:
-        logger.error(f"Error initializing course {course_id or 'unknown'}: {str(e)}", exc_info=True)
-        
-        
-        # Try to update Firestore with error status
-        try:
-            firestore_service.db.collection(firestore_service.COURSES_COLLECTION).document(course_id).update({
-                'status': 'ERROR',
-                'error_message': str(e)
-            })
-        except:
-            pass
-        
+        logger.error(f"Failed to queue sync for course {course_id}: {e}", exc_info=True)
         return jsonify({
-            "error": "Failed to initialize course",
+            "error": "Failed to sync course",
             "message": str(e)
         }), 500
 
+    logger.info(f"Queued sync job {job_id} for course {course_id}")
+    return jsonify({
+        "status": "queued",
+        "job_id": job_id,
+        "status_url": f"/api/jobs/{job_id}"
+    }), 202
+
+
+@bp.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """
+    Reports a background job's status, stage, progress (0-1) and ETA.
+    """
+    try:
+        status = job_queue_service.get_job_status(job_id)
+    except Exception as e:
+        logger.error(f"Failed to read job {job_id}: {e}")
+        return jsonify({"error": str(e)}), 500
+    if status is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(status)
+
 
 CITE_THRESHOLD = 0.3
-@app.route('/api/chat', methods=['POST'])
+
+# Chat log IDs remembered in the session, so their answers can be rated
+# before the background log write lands
+SESSION_LOG_DOC_IDS = 20
+
+
+def _issued_log_doc_ids(session_data, doc_id: str) -> list:
+    """The session's recent chat log IDs with doc_id added (newest last)."""
+    recent = [issued for issued in session_data.get('log_doc_ids', []) if issued != doc_id]
+    return (recent + [doc_id])[-SESSION_LOG_DOC_IDS:]
+
+
+def _cite_sources(sources: list) -> list:
+    """Returns the sources close enough to cite, nearest first."""
+    cited = [source for source in sources if source.get('distance', 1.0) <= CITE_THRESHOLD]
+    return sorted(cited, key=lambda x: x['distance'])
+
+
+# Identical questions asked at the same time share one retrieval and one generation
+_context_flights = concurrency.SingleFlight('chat_retrieve')
+_answer_flights = concurrency.SingleFlight('chat_generate')
+
+
+def _chat_flight_key(course_id: str, query: str) -> tuple:
+    """Coalescing key for a chat question: the course plus the normalized query."""
+    return (course_id, rag_service.normalize_query(query))
+
+
+def _load_answer_context(course_id: str, query: str) -> tuple:
+    """
+    Looks up the course corpus and retrieves context for the question.
+    
+    Returns:
+        Tuple of (corpus_id, context, stage timings). The timings travel with
+        the result so every request sharing this call can report them.
+    """
+    timings = {}
+    course_data = concurrency.timed(timings, 'course', firestore_service.get_course_data, course_id)
+    corpus_id = course_data.to_dict().get('corpus_id')
+    context = concurrency.timed(timings, 'retrieve', gemini_service.retrieve_answer_context, query, corpus_id)
+    return corpus_id, context, timings
+
+
+def _answer_context(context_future, timings: dict) -> tuple:
+    """Waits for the retrieval started by _start_chat_pipeline and merges its stage timings."""
+    corpus_id, context, context_timings = context_future.result()
+    timings.update(context_timings)
+    return corpus_id, context
+
+
+def _start_chat_pipeline(course_id: str, query: str, timings: dict) -> tuple:
+    """
+    Checks the semantic cache and, on a miss, starts retrieval.
+    
+    The query embedding (needed for the semantic cache and the analytics
+    log) is computed first and looked up in the course's in-memory index;
+    retrieval (course lookup plus corpus query) is only started when no
+    cached answer is close enough, so cache hits cost no Vertex AI call.
+    
+    Concurrent requests for the same question join the retrieval already
+    in flight instead of starting their own.
+    
+    Returns:
+        Tuple of (query_vector, semantic cache hit or None,
+        future to pass to _answer_context, or None on a hit)
+    """
+    query_vector = concurrency.timed(timings, 'embed', analytics_logging_service.get_query_vector, query)
+    cached = concurrency.timed(timings, 'cache', semantic_cache_service.lookup, course_id, query_vector)
+    if cached:
+        return query_vector, cached, None
+    context_future, _ = _context_flights.submit(_chat_flight_key(course_id, query), _load_answer_context, course_id, query)
+    return query_vector, cached, context_future
+
+
+def _server_timing(timings: dict) -> str:
+    """Formats stage timings as a Server-Timing header value."""
+    return ", ".join(f"{stage};dur={duration}" for stage, duration in timings.items())
+
+
+# ============================================================================
+# CONDITIONAL GET AND COMPRESSION
+# ============================================================================
+
+def _version_validators(course: dict, kind: str) -> tuple:
+    """
+    Returns (etag, last_modified) for the course's graph ('kg') or
+    analytics report ('report'), or (None, None) if it isn't versioned yet.
+    The update time is part of the tag so a re-created course never reuses one.
+    """
+    version = course.get(f'{kind}_version')
+    if not isinstance(version, int):
+        return None, None
+    updated_at = course.get(f'{kind}_updated_at')
+    if not isinstance(updated_at, datetime):
+        updated_at = None
+    stamp = int(updated_at.timestamp()) if updated_at else 0
+    return f"{kind}-{version}-{stamp}", updated_at
+
+
+def _validators_match(etag: str, last_modified, if_none_match, if_modified_since) -> bool:
+    """
+    True if a client's cached copy is still current. Takes the parsed
+    If-None-Match (werkzeug ETags) and If-Modified-Since (datetime or None),
+    so the Flask and ASGI apps decide 304s the same way.
+    """
+    if not etag:
+        return False
+    if if_none_match:
+        return if_none_match.contains_weak(etag)
+    if if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0) <= if_modified_since
+    return False
+
+
+def _is_not_modified(etag: str, last_modified) -> bool:
+    """True if the client's cached copy (If-None-Match / If-Modified-Since) is still current."""
+    return _validators_match(etag, last_modified, request.if_none_match, request.if_modified_since)
+
+
+def _validator_headers(etag: str, last_modified) -> dict:
+    """The ETag, Last-Modified and Cache-Control headers of a versioned response."""
+    headers = {}
+    if etag:
+        # Weak: the same version is served gzip- or brotli-encoded
+        headers['ETag'] = quote_etag(etag, weak=True)
+        headers['Cache-Control'] = 'private, no-cache'
+    if last_modified:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+
+def _versioned(response, etag: str, last_modified):
+    """
+    Adds the cache validators to a response; clients revalidate on every use.
+    A 200 body is also compressed for the client (see _compressed).
+    """
+    response.headers.update(_validator_headers(etag, last_modified))
+    if response.status_code == 200:
+        body, headers = _compressed(response.get_data(), request.accept_encodings)
+        response.set_data(body)
+        response.headers.update(headers)
+    return response
+
+
+def _not_modified(etag: str, last_modified):
+    return _versioned(Response(status=304), etag, last_modified)
+
+
+def _encode_body(body: bytes, accept_encoding) -> tuple:
+    """
+    Compresses a response body with the best encoding the client accepts.
+
+    Encodings are weighed by their Accept-Encoding quality: q=0 refuses
+    one, and brotli is only preferred when the client rates it at least as
+    high as gzip.
+
+    Args:
+        body: The uncompressed body
+        accept_encoding: The request's Accept-Encoding (werkzeug Accept, e.g.
+                         request.accept_encodings, or the raw header string)
+
+    Returns:
+        Tuple of (body, encoding), with encoding None if the body was left as is
+    """
+    if not COMPRESS_MIN_BYTES or len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    accepted = accept_encoding if isinstance(accept_encoding, Accept) else parse_accept_header(accept_encoding)
+    br_quality = accepted['br'] if brotli is not None else 0
+    gzip_quality = accepted['gzip']
+    if br_quality > 0 and br_quality >= gzip_quality:
+        return brotli.compress(body, quality=5), 'br'
+    if gzip_quality > 0:
+        return gzip.compress(body, compresslevel=6), 'gzip'
+    return body, None
+
+
+def _compressed(body: bytes, accept_encoding) -> tuple:
+    """
+    Compresses a body for a response (see _encode_body).
+
+    Returns:
+        Tuple of (body, headers): Vary, plus Content-Encoding if the body was compressed
+    """
+    body, encoding = _encode_body(body, accept_encoding)
+    headers = {'Vary': 'Accept-Encoding'}
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return body, headers
+
+
+@bp.route('/api/chat', methods=['POST'])
 def chat():
     """
     Handles student questions using the RAG-powered TA bot.
+    
+    Per-stage latencies (embed, cache, course, retrieve, generate, total)
+    are returned in the Server-Timing header.
+    
+    Students asking the same question at the same time share one answer
+    ("coalesced": true) but each request is logged separately.
     """
+    started = time.perf_counter()
+    timings = {}
+    coalesced = False
     try:
         data = request.json
         course_id = data.get('course_id')
         query = data.get('query')
 
-        course_data = firestore_service.get_course_data(course_id)
-        
-        # Convert DocumentSnapshot to dict
-        data_dict = course_data.to_dict()
-        corpus_id = data_dict.get('corpus_id')
-        answer, sources  = gemini_service.generate_answer_with_context(
-            query=query,
-            corpus_id=corpus_id,
-        )
+        query_vector, cached, context_future = _start_chat_pipeline(course_id, query, timings)
+
+        # Serve repeated questions from the semantic cache when possible
+        if cached:
+            answer, sources = cached['answer'], cached['sources']
+        else:
+            corpus_id, context = _answer_context(context_future, timings)
+            (answer, sources), coalesced = concurrency.timed(
+                timings, 'generate', _answer_flights.do,
+                _chat_flight_key(course_id, query),
+                gemini_service.generate_answer_with_context,
+                query=query,
+                corpus_id=corpus_id,
+                context=context
+            )
+            if coalesced:
+                logger.info(f"Coalesced chat query for course {course_id} onto an in-flight answer")
     except Exception as e:
         print(f"[CHAT ERROR] {str(e)}")
         import traceback
@@ -336,39 +516,290 @@ def chat():
             "response": f"Sorry, an error occurred: {str(e)}"
         }), 500
 
+    timings['total'] = round((time.perf_counter() - started) * 1000, 1)
+
     logger.info(f"Logging chat query for course {course_id}: {query[:50]}...")
-    doc_id = analytics_logging_service.log_chat_query(
+    doc_id = analytics_logging_service.enqueue_chat_query(
         course_id=course_id,
         query_text=query,
         answer_text=answer,
-        sources=sources
+        sources=sources,
+        query_vector=query_vector,
+        metrics={'total_ms': timings['total'], 'stages_ms': dict(timings), 'streamed': False, 'coalesced': coalesced}
     )
+    # The request that generated the answer adds it to the semantic cache
+    if not cached and not coalesced:
+        semantic_cache_service.add_entry(course_id, query_vector, answer, sources, doc_id)
+    if doc_id:
+        session['log_doc_ids'] = _issued_log_doc_ids(session, doc_id)
 
-    return jsonify({
+    response = jsonify({
         "answer": answer,
-        "sources": [source for source in sources if source['distance'] <= CITE_THRESHOLD].sort(key=lambda x: x['distance']),
+        "sources": _cite_sources(sources),
         "log_doc_id": doc_id,
-        "response": answer 
+        "response": answer,
+        "cached": bool(cached),
+        "coalesced": coalesced
     })
+    response.headers['Server-Timing'] = _server_timing(timings)
+    return response
+
+
+def _sse_event(event: str, payload: dict) -> str:
+    """Formats one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
 
 
-@app.route('/api/get-graph', methods=['GET'])
+@bp.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Streaming variant of /api/chat using server-sent events.
+    
+    Request body:
+        {
+            "course_id": "12345",
+            "query": "What is recursion?"
+        }
+    
+    Event stream:
+        event: sources  data: {"sources": [...]}
+        event: token    data: {"text": "..."}   (repeated)
+        event: done     data: {"log_doc_id": "...", "ttft_ms": 412.3, "cached": false}
+        event: error    data: {"error": "..."}  (only if generation fails)
+    """
+    started = time.perf_counter()
+    timings = {}
+    data = request.json
+    course_id = data.get('course_id')
+    query = data.get('query')
+
+    try:
+        query_vector, cached, context_future = _start_chat_pipeline(course_id, query, timings)
+
+        if cached:
+            chunks, sources = iter([cached['answer']]), cached['sources']
+        else:
+            corpus_id, context = _answer_context(context_future, timings)
+            chunks, sources = gemini_service.generate_answer_with_context_stream(
+                query=query,
+                corpus_id=corpus_id,
+                context=context
+            )
+    except Exception as e:
+        logger.error(f"Failed to start chat stream: {e}", exc_info=True)
+        return jsonify({
+            "error": str(e),
+            "response": f"Sorry, an error occurred: {str(e)}"
+        }), 500
+
+    def generate():
+        yield _sse_event('sources', {"sources": _cite_sources(sources)})
+
+        answer_parts = []
+        ttft_ms = None
+        try:
+            for chunk in chunks:
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - started) * 1000
+                answer_parts.append(chunk)
+                yield _sse_event('token', {"text": chunk})
+        except Exception as e:
+            logger.error(f"Chat stream failed for course {course_id}: {e}", exc_info=True)
+            yield _sse_event('error', {"error": str(e)})
+            return
+
+        answer = "".join(answer_parts)
+        metrics = {
+            'ttft_ms': ttft_ms,
+            'total_ms': (time.perf_counter() - started) * 1000,
+            'stages_ms': dict(timings),
+            'streamed': True
+        }
+        logger.info(f"Streamed chat answer for course {course_id}: ttft={ttft_ms:.0f}ms" if ttft_ms is not None
+                    else f"Streamed empty chat answer for course {course_id}")
+
+        doc_id = analytics_logging_service.enqueue_chat_query(
+            course_id=course_id,
+            query_text=query,
+            answer_text=answer,
+            sources=sources,
+            query_vector=query_vector,
+            metrics=metrics
+        )
+        if not cached:
+            semantic_cache_service.add_entry(course_id, query_vector, answer, sources, doc_id)
+
+        yield _sse_event('done', {"log_doc_id": doc_id, "ttft_ms": ttft_ms, "cached": bool(cached)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',  # Don't let proxies buffer the stream
+            'Server-Timing': _server_timing(timings)  # Stages before the first byte
+        }
+    )
+
+
+def _raw_graph_body(graph_json: bytes, indexed_files) -> bytes:
+    """Appends indexed_files to a serialized {"nodes","edges","data"} object without decoding it."""
+    return b''.join([graph_json[:-1], b',"indexed_files":', json.dumps(indexed_files).encode('utf-8'), b'}'])
+
+
+# Shared by the Flask and ASGI get-graph handlers; only the Firestore reads
+# (sync or async) and the response objects differ between them
+
+def _graph_validators(course_data, raw: bool) -> tuple:
+    """(etag, last_modified) of a get-graph response; raw responses have their own tag."""
+    etag, last_modified = _version_validators(course_data.to_dict() or {}, 'kg')
+    if raw and etag:
+        etag = f"{etag}-raw"
+    return etag, last_modified
+
+
+def _graph_body(course_data, raw: bool, graph) -> bytes:
+    """
+    Builds the get-graph body from the course and its graph: the serialized
+    graph bytes for format=raw (see firestore_service.get_knowledge_graph_json),
+    otherwise the (nodes, edges, data) tuple, sent as JSON strings as the views expect.
+    """
+    indexed_files = course_data.get("indexed_files")  # File metadata with gcs_uri
+    if raw:
+        return _raw_graph_body(graph, indexed_files)
+    nodes, edges, data = graph
+    return json.dumps({
+        "nodes": json.dumps(nodes),
+        "edges": json.dumps(edges),
+        "data": json.dumps(data),
+        "indexed_files": indexed_files
+    }, separators=(',', ':')).encode('utf-8')
+
+
+def _course_not_found(course_id: str) -> dict:
+    return {"error": f"Course {course_id} not found"}
+
+
+def _graph_error(error: Exception) -> dict:
+    """Logs a failed get-graph request and returns its 500 body."""
+    logger.error(f"Failed to get graph: {error}", exc_info=True)
+    return {"error": "Failed to get graph", "message": str(error)}
+
+
+@bp.route('/api/get-graph', methods=['GET'])
 def get_graph():
     """
     Fetches the knowledge graph data for visualization.
+    
+    By default nodes, edges and data are JSON strings inside the response
+    (the original format). With ?format=raw they are plain JSON values,
+    written from the stored/cached graph bytes without re-encoding, so the
+    browser parses the payload once.
     """
     course_id = request.args.get('course_id')
-    course_data = firestore_service.get_course_data(course_id)
+    if not course_id:
+        return jsonify({"error": "Missing required parameter: course_id"}), 400
     
+    raw = request.args.get('format') == 'raw'
+    try:
+        # Checked against the stored kg_version, so a 304 never vouches for another worker's stale copy
+        course_data = firestore_service.get_course_data(course_id, validate='kg')
+        if not course_data.exists:
+            return jsonify(_course_not_found(course_id)), 404
+        
+        # Unchanged since the client's last load: skip reading and encoding the graph
+        etag, last_modified = _graph_validators(course_data, raw)
+        if _is_not_modified(etag, last_modified):
+            return _not_modified(etag, last_modified)
+        
+        if raw:
+            graph = firestore_service.get_knowledge_graph_json(course_id, course_data)
+        else:
+            graph = firestore_service.get_knowledge_graph(course_id, course_data)
+        body = _graph_body(course_data, raw, graph)
+    except Exception as e:
+        return jsonify(_graph_error(e)), 500
+    return _versioned(Response(body, mimetype='application/json'), etag, last_modified)
+
+
+@bp.route('/api/graph-skeleton', methods=['GET'])
+def get_graph_skeleton():
+    """
+    Fetches the first-paint view of the knowledge graph: topic nodes with
+    counts and topic-to-topic edges, without summaries, sources or files.
+    Topic details are loaded on demand from /api/topic-detail.
+    """
+    course_id = request.args.get('course_id')
+    if not course_id:
+        return jsonify({"error": "Missing required parameter: course_id"}), 400
+
+    try:
+        course_data = firestore_service.get_course_data(course_id, validate='kg')
+        if not course_data.exists:
+            return jsonify(_course_not_found(course_id)), 404
+
+        etag, last_modified = _version_validators(course_data.to_dict() or {}, 'kg')
+        if _is_not_modified(etag, last_modified):
+            return _not_modified(etag, last_modified)
+
+        nodes, edges, data = firestore_service.get_knowledge_graph(course_id, course_data)
+        skeleton = kg_service.graph_skeleton(nodes, edges, data)
+    except Exception as e:
+        logger.error(f"Failed to get graph skeleton: {e}", exc_info=True)
+        return jsonify({"error": "Failed to get graph skeleton", "message": str(e)}), 500
+    return _versioned(jsonify(skeleton), etag, last_modified)
+
+
+@bp.route('/api/topic-detail', methods=['GET'])
+def get_topic_detail():
+    """
+    Fetches one topic's summary, sources and linked file nodes (with the
+    gcs_uri needed to download them).
+    """
+    course_id = request.args.get('course_id')
+    topic_id = request.args.get('topic_id')
+    if not course_id or not topic_id:
+        return jsonify({"error": "Missing required parameters: course_id and topic_id"}), 400
+
+    try:
+        course_data = firestore_service.get_course_data(course_id, validate='kg')
+        if not course_data.exists:
+            return jsonify(_course_not_found(course_id)), 404
+
+        etag, last_modified = _version_validators(course_data.to_dict() or {}, 'kg')
+        if _is_not_modified(etag, last_modified):
+            return _not_modified(etag, last_modified)
+
+        nodes, edges, data = firestore_service.get_graph_topic(course_id, topic_id, course_data)
+        detail = kg_service.topic_detail(topic_id, nodes, edges, data, course_data.to_dict().get('indexed_files'))
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 404
+    except Exception as e:
+        logger.error(f"Failed to get topic detail: {e}", exc_info=True)
+        return jsonify({"error": "Failed to get topic detail", "message": str(e)}), 500
+    return _versioned(jsonify(detail), etag, last_modified)
+
+
+@bp.route('/api/performance-stats', methods=['GET'])
+def performance_stats():
+    """
+    Returns this worker's cache and request-coalescing counters.
+    "coalescing" reports, per stage, how many upstream calls were saved
+    by sharing an identical in-flight request.
+    
+    Instructor-only (the LTI role stored in the session at launch).
+    """
+    if not _is_instructor_role(session.get('role')):
+        return jsonify({"error": "Instructor access required"}), 403
     return jsonify({
-        "nodes": course_data.get("kg_nodes"),
-        "edges": course_data.get("kg_edges"),
-        "data": course_data.get("kg_data"),
-        "indexed_files": course_data.get("indexed_files")  # Include file metadata with gcs_uri
+        "retrieval_cache": rag_service.get_retrieval_cache_stats(),
+        "semantic_cache": semantic_cache_service.get_stats(),
+        "course_cache": firestore_service.get_course_cache_stats(),
+        "coalescing": concurrency.get_singleflight_stats()
     })
 
 
-@app.route('/api/init-logs/<course_id>', methods=['GET'])
+@bp.route('/api/init-logs/<course_id>', methods=['GET'])
 def get_init_logs(course_id):
     """
     Retrieves initialization logs for a course.
@@ -382,7 +813,7 @@ def get_init_logs(course_id):
         return jsonify({"error": str(e), "logs": []}), 500
 
 
-@app.route('/api/download-source', methods=['GET'])
+@bp.route('/api/download-source', methods=['GET'])
 def download_source():
     """
     Generates a signed URL for downloading a file from GCS.
@@ -401,7 +832,7 @@ def download_source():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route('/api/rate-answer', methods=['POST'])
+@bp.route('/api/rate-answer', methods=['POST'])
 def rate_answer():
     """
     Allows students to rate (like/dislike) an answer.
@@ -411,6 +842,9 @@ def rate_answer():
             "log_doc_id": "abc123",
             "rating": "helpful" | "not_helpful"
         }
+    
+    Returns 404 for an ID that isn't a stored chat log, unless this
+    session's chat requests were given it (the log may still be queued).
     """
     data = request.json
     log_doc_id = data.get('log_doc_id')
@@ -427,7 +861,9 @@ def rate_answer():
         }), 400
     
     try:
-        analytics_logging_service.rate_answer(log_doc_id, rating)
+        issued = log_doc_id in session.get('log_doc_ids', [])
+        if not analytics_logging_service.rate_answer(log_doc_id, rating, issued=issued):
+            return jsonify({"error": "Answer not found"}), 404
         
         return jsonify({
             "success": True,
@@ -441,7 +877,34 @@ def rate_answer():
         }), 500
 
 
-@app.route('/api/remove-topic', methods=['POST'])
+def _client_graph_data(kg_data: dict) -> dict:
+    """Drops the stored summary embeddings before topic data is sent to the browser."""
+    return {topic_id: {key: value for key, value in entry.items() if key != 'embedding'}
+            for topic_id, entry in kg_data.items()}
+
+
+def _changed_topic_records(existing_edges: list, existing_data: dict, updated_edges: list, updated_data: dict, skip: tuple = ()) -> dict:
+    """
+    Finds the topics (other than those in `skip`) whose stored edges or embedding
+    changed when related edges were recomputed, as put_graph_topic /
+    delete_graph_topic topic_updates.
+    """
+    updates = {}
+    for topic_id, entry in updated_data.items():
+        if topic_id in skip:
+            continue
+        fields = {}
+        edges = [edge for edge in updated_edges if edge.get('from') == topic_id]
+        if edges != [edge for edge in existing_edges if edge.get('from') == topic_id]:
+            fields['edges'] = edges
+        if entry.get('embedding') and 'embedding' not in existing_data.get(topic_id, {}):
+            fields['embedding'] = entry['embedding']
+        if fields:
+            updates[topic_id] = fields
+    return updates
+
+
+@bp.route('/api/remove-topic', methods=['POST'])
 def remove_topic():
     """
     Removes a topic from an existing course knowledge graph.
@@ -467,8 +930,8 @@ def remove_topic():
         
         logger.info(f"Removing topic '{topic_id}' from course {course_id}")
         
-        # Step 1: Get existing knowledge graph from Firestore
-        course_data = firestore_service.get_course_data(course_id)
+        # Step 1: Get existing knowledge graph from Firestore (uncached: the edit is written back)
+        course_data = firestore_service.get_course_data(course_id, fresh=True)
         
         if not course_data.exists:
             return jsonify({
@@ -483,27 +946,30 @@ def remove_topic():
                 "error": "Course must be in ACTIVE state to remove topics"
             }), 400
         
-        existing_nodes = json.loads(data_dict.get('kg_nodes', '[]'))
-        existing_edges = json.loads(data_dict.get('kg_edges', '[]'))
-        existing_data = json.loads(data_dict.get('kg_data', '{}'))
+        existing_nodes, existing_edges, existing_data = firestore_service.get_knowledge_graph(
+            course_id, course_data, include_embeddings=True
+        )
         
         logger.info(f"Current graph has {len(existing_nodes)} nodes, {len(existing_edges)} edges")
         
-        # Step 2: Remove the topic using kg_service
+        # Step 2: Remove the topic using kg_service (validates the topic exists, updates related edges)
         updated_nodes_json, updated_edges_json, updated_data_json = kg_service.remove_topic_from_graph(
             topic_id=topic_id,
             existing_nodes=existing_nodes,
             existing_edges=existing_edges,
             existing_data=existing_data
         )
+        updated_edges = json.loads(updated_edges_json)
+        updated_data = json.loads(updated_data_json)
         
-        # Step 3: Update Firestore with new graph data
+        # Step 3: Delete that topic's record (and rewrite topics whose related edges changed)
         logger.info("Updating Firestore with new graph data...")
-        firestore_service.db.collection(firestore_service.COURSES_COLLECTION).document(course_id).update({
-            'kg_nodes': updated_nodes_json,
-            'kg_edges': updated_edges_json,
-            'kg_data': updated_data_json
-        })
+        firestore_service.delete_graph_topic(
+            course_id,
+            topic_id,
+            topic_updates=_changed_topic_records(existing_edges, existing_data, updated_edges, updated_data),
+            expected_version=data_dict.get('kg_version', 0)
+        )
         
         logger.info(f"Successfully removed topic '{topic_id}' from course {course_id}")
         
@@ -512,7 +978,7 @@ def remove_topic():
             "message": f"Topic '{topic_id}' removed successfully",
             "nodes": updated_nodes_json,
             "edges": updated_edges_json,
-            "data": updated_data_json
+            "data": json.dumps(_client_graph_data(updated_data))
         })
         
     except ValueError as ve:
@@ -521,6 +987,8 @@ def remove_topic():
             "error": "Invalid request",
             "message": str(ve)
         }), 400
+    except GraphVersionConflict:
+        raise  # answered by graph_version_conflict
     except Exception as e:
         logger.error(f"Failed to remove topic: {e}", exc_info=True)
         return jsonify({
@@ -529,7 +997,7 @@ def remove_topic():
         }), 500
 
 
-@app.route('/api/log-node-click', methods=['POST'])
+@bp.route('/api/log-node-click', methods=['POST'])
 def log_node_click():
     """
     Logs when a student clicks on a knowledge graph node.
@@ -573,7 +1041,7 @@ def log_node_click():
         }), 500
 
 
-@app.route('/api/analytics/<course_id>', methods=['GET'])
+@bp.route('/api/analytics/<course_id>', methods=['GET'])
 def get_analytics(course_id):
     """
     Retrieves the latest analytics report for a course.
@@ -583,6 +1051,13 @@ def get_analytics(course_id):
     try:
         from .services import analytics_reporting_service
         
+        # The report version lives on the (cached) course document; check it is current
+        course_data = firestore_service.get_course_data(course_id, validate='report')
+        course = (course_data.to_dict() if course_data.exists else None) or {}
+        etag, last_modified = _version_validators(course, 'report')
+        if _is_not_modified(etag, last_modified):
+            return _not_modified(etag, last_modified)
+        
         report = analytics_reporting_service.get_analytics_report(course_id)
         
         if not report:
@@ -590,7 +1065,7 @@ def get_analytics(course_id):
                 "message": "No analytics report available yet. Run analytics first."
             }), 404
         
-        return jsonify(report)
+        return _versioned(jsonify(report), etag, last_modified)
     except Exception as e:
         logger.error(f"Failed to get analytics report: {e}", exc_info=True)
         return jsonify({
@@ -599,7 +1074,7 @@ def get_analytics(course_id):
         }), 500
 
 
-@app.route('/api/analytics/run', methods=['POST'])
+@bp.route('/api/analytics/run', methods=['POST'])
 def run_analytics():
     """
     Triggers analytics processing for a course (professor-only).
@@ -644,7 +1119,7 @@ def run_analytics():
         }), 500
 
 
-@app.route('/api/add-topic', methods=['POST'])
+@bp.route('/api/add-topic', methods=['POST'])
 def add_topic():
     """
     Adds a new topic to an existing course knowledge graph.
@@ -672,8 +1147,8 @@ def add_topic():
         
         logger.info(f"Adding topic '{topic_name}' to course {course_id}")
         
-        # Step 1: Get existing knowledge graph from Firestore
-        course_data = firestore_service.get_course_data(course_id)
+        # Step 1: Get existing knowledge graph from Firestore (uncached: the edit is written back)
+        course_data = firestore_service.get_course_data(course_id, fresh=True)
         
         if not course_data.exists:
             return jsonify({
@@ -689,9 +1164,9 @@ def add_topic():
             }), 400
         
         corpus_id = data_dict.get('corpus_id')
-        existing_nodes = json.loads(data_dict.get('kg_nodes', '[]'))
-        existing_edges = json.loads(data_dict.get('kg_edges', '[]'))
-        existing_data = json.loads(data_dict.get('kg_data', '{}'))
+        existing_nodes, existing_edges, existing_data = firestore_service.get_knowledge_graph(
+            course_id, course_data, include_embeddings=True
+        )
         
         if not corpus_id:
             return jsonify({
@@ -700,23 +1175,46 @@ def add_topic():
         
         logger.info(f"Current graph has {len(existing_nodes)} nodes, {len(existing_edges)} edges")
         
-        # Step 2: Add the new topic using kg_service
-        updated_nodes_json, updated_edges_json, updated_data_json = kg_service.add_topic_to_graph(
+        # Courses initialized before the source index existed get one built (and saved) now
+        source_index = data_dict.get('source_index')
+        new_source_index = None
+        if not source_index:
+            source_index = new_source_index = kg_service.build_source_index(
+                indexed_files=data_dict.get('indexed_files'),
+                nodes=existing_nodes
+            )
+        
+        # Step 2: Create the new topic using kg_service
+        topic_node, topic_edges, topic_data = kg_service.build_topic(
             topic_name=topic_name,
             corpus_id=corpus_id,
             existing_nodes=existing_nodes,
-            existing_edges=existing_edges,
-            existing_data=existing_data,
-            custom_summary=custom_summary  # Pass optional summary
+            custom_summary=custom_summary,  # Pass optional summary
+            source_index=source_index,
+            # Reserved on the course document, so concurrent edits never share an ID
+            topic_id=firestore_service.allocate_topic_ids(course_id, 1)[0]
+        )
+        
+        # Step 3: Link it to similar topics (embeds only the new summary)
+        topic_id = topic_node['id']
+        updated_edges, updated_data = kg_service.refresh_related_edges(
+            existing_edges + topic_edges, {**existing_data, topic_id: topic_data}
         )
         
-        # Step 3: Update Firestore with new graph data
+        # Step 4: Write the new topic's record (and topics whose related edges changed)
         logger.info("Updating Firestore with new graph data...")
-        firestore_service.db.collection(firestore_service.COURSES_COLLECTION).document(course_id).update({
-            'kg_nodes': updated_nodes_json,
-            'kg_edges': updated_edges_json,
-            'kg_data': updated_data_json
-        })
+        firestore_service.put_graph_topic(
+            course_id,
+            topic_node,
+            [edge for edge in updated_edges if edge.get('from') == topic_id],
+            updated_data[topic_id],
+            source_index=new_source_index,
+            topic_updates=_changed_topic_records(existing_edges, existing_data, updated_edges, updated_data, skip=(topic_id,)),
+            expected_version=data_dict.get('kg_version', 0)
+        )
+        updated_nodes_json = json.dumps(existing_nodes + [topic_node])
+        updated_edges_json = json.dumps(updated_edges)
+        updated_data_json = json.dumps(_client_graph_data(updated_data))
         
         logger.info(f"Successfully added topic '{topic_name}' to course {course_id}")
         
@@ -728,9 +1226,166 @@ def add_topic():
             "data": updated_data_json
         })
         
+    except GraphVersionConflict:
+        raise  # answered by graph_version_conflict
     except Exception as e:
         logger.error(f"Failed to add topic: {e}", exc_info=True)
         return jsonify({
             "error": "Failed to add topic",
             "message": str(e)
-        }), 500
\ No newline at end of file
+        }), 500
+
+
+# Topics per /api/add-topics request (all are written in one batch)
+ADD_TOPICS_MAX = 50
+
+
+def _valid_topic_entry(topic) -> bool:
+    """True if an /api/add-topics entry is a name, or an object with a string name and optional string summary."""
+    if isinstance(topic, str):
+        return True
+    return (isinstance(topic, dict) and isinstance(topic.get('name'), str)
+            and isinstance(topic.get('summary'), (str, type(None))))
+
+
+@bp.route('/api/add-topics', methods=['POST'])
+def add_topics():
+    """
+    Adds several topics to an existing course knowledge graph at once.
+    Topics are summarized concurrently and every successful topic is
+    written in a single Firestore batch.
+    
+    Request body:
+        {
+            "course_id": "12345",
+            "topics": [
+                {"name": "New Topic"},
+                {"name": "Another Topic", "summary": "Optional custom summary"}
+            ]
+        }
+    
+    Returns:
+        JSON response with per-topic results and the updated graph data:
+        {"status": "success" | "partial" | "failed",
+         "results": [{"topic_name": ..., "status": "added", "topic_id": "topic_7"},
+                     {"topic_name": ..., "status": "failed", "error": "..."}],
+         "nodes": ..., "edges": ..., "data": ...}
+    """
+    try:
+        data = request.json
+        course_id = data.get('course_id')
+        topics = data.get('topics')
+        
+        if not course_id or not isinstance(topics, list) or not topics:
+            return jsonify({
+                "error": "Missing required fields: course_id and a non-empty topics list"
+            }), 400
+        if len(topics) > ADD_TOPICS_MAX:
+            return jsonify({
+                "error": f"Too many topics: at most {ADD_TOPICS_MAX} per request"
+            }), 400
+        if not all(_valid_topic_entry(topic) for topic in topics):
+            return jsonify({
+                "error": "Each topic must be a name or an object with a string name and optional string summary"
+            }), 400
+        # Plain strings are accepted as topic names
+        topic_specs = [{'name': topic} if isinstance(topic, str) else dict(topic) for topic in topics]
+        
+        logger.info(f"Adding {len(topic_specs)} topics to course {course_id}")
+        
+        # Step 1: Get existing knowledge graph from Firestore (uncached: the edit is written back)
+        course_data = firestore_service.get_course_data(course_id, fresh=True)
+        
+        if not course_data.exists:
+            return jsonify({
+                "error": f"Course {course_id} not found"
+            }), 404
+        
+        data_dict = course_data.to_dict()
+        
+        if data_dict.get('status') != 'ACTIVE':
+            return jsonify({
+                "error": "Course must be in ACTIVE state to add topics"
+            }), 400
+        
+        corpus_id = data_dict.get('corpus_id')
+        if not corpus_id:
+            return jsonify({
+                "error": "Course does not have a corpus_id"
+            }), 400
+        
+        existing_nodes, existing_edges, existing_data = firestore_service.get_knowledge_graph(
+            course_id, course_data, include_embeddings=True
+        )
+        
+        # Every existing topic's related edges may change, so check the worst
+        # case against the single-batch budget before any summarizing
+        existing_topics = sum(1 for node in existing_nodes if node.get('group') == 'topic')
+        if len(topic_specs) + existing_topics + 1 > MAX_BATCH_WRITES:
+            return jsonify({
+                "error": f"Too many topics for one update: at most {max(MAX_BATCH_WRITES - existing_topics - 1, 0)} "
+                         f"can be added to this course at once"
+            }), 400
+        
+        source_index = data_dict.get('source_index')
+        new_source_index = None
+        if not source_index:
+            source_index = new_source_index = kg_service.build_source_index(
+                indexed_files=data_dict.get('indexed_files'),
+                nodes=existing_nodes
+            )
+        
+        # Step 2: Summarize and build every topic concurrently
+        built = kg_service.build_topics(
+            topic_specs, corpus_id, existing_nodes, source_index=source_index,
+            allocate_ids=lambda count: firestore_service.allocate_topic_ids(course_id, count)
+        )
+        
+        results = []
+        new_topics = []
+        for spec, result in zip(topic_specs, built):
+            if isinstance(result, Exception):
+                results.append({"topic_name": spec.get('name'), "status": "failed", "error": str(result)})
+            else:
+                results.append({"topic_name": spec.get('name'), "status": "added", "topic_id": result[0]['id']})
+                new_topics.append(result)
+        
+        updated_nodes = existing_nodes + [node for node, _, _ in new_topics]
+        updated_edges, updated_data = existing_edges, existing_data
+        if new_topics:
+            # Step 3: Link the new topics to similar ones (one embedding request for all)
+            new_ids = tuple(node['id'] for node, _, _ in new_topics)
+            updated_edges, updated_data = kg_service.refresh_related_edges(
+                existing_edges + [edge for _, edges, _ in new_topics for edge in edges],
+                {**existing_data, **{node['id']: topic_data for node, _, topic_data in new_topics}}
+            )
+            
+            # Step 4: One batch write for all new topics (and topics whose related edges changed)
+            firestore_service.put_graph_topics(
+                course_id,
+                [(node, [edge for edge in updated_edges if edge.get('from') == node['id']], updated_data[node['id']])
+                 for node, _, _ in new_topics],
+                source_index=new_source_index,
+                topic_updates=_changed_topic_records(existing_edges, existing_data, updated_edges, updated_data, skip=new_ids),
+                expected_version=data_dict.get('kg_version', 0)
+            )
+        
+        added = len(new_topics)
+        logger.info(f"Added {added}/{len(topic_specs)} topics to course {course_id}")
+        
+        return jsonify({
+            "status": "success" if added == len(topic_specs) else ("partial" if added else "failed"),
+            "results": results,
+            "nodes": json.dumps(updated_nodes),
+            "edges": json.dumps(updated_edges),
+            "data": json.dumps(_client_graph_data(updated_data))
+        })
+        
+    except GraphVersionConflict:
+        raise  # answered by graph_version_conflict
+    except Exception as e:
+        logger.error(f"Failed to add topics: {e}", exc_info=True)
+        return jsonify({
+            "error": "Failed to add topics",
+            "message": str(e)
+        }), 500
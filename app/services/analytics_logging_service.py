@@ -14,7 +14,12 @@ Dependencies:
 - firestore_service: For database operations
 - gemini_service: For generating embeddings
 """
+import asyncio
+import atexit
 import logging
+import queue
+import threading
+import time
 from google.cloud import firestore
 import sys
 import os
@@ -30,6 +35,11 @@ else:
 
 logger = logging.getLogger(__name__)
 
+# Background logging pipeline configuration
+LOG_QUEUE_SIZE = int(os.environ.get('ANALYTICS_LOG_QUEUE_SIZE', '1000'))
+LOG_WORKER_THREADS = int(os.environ.get('ANALYTICS_LOG_WORKERS', '2'))
+LOG_DRAIN_TIMEOUT_SECONDS = float(os.environ.get('ANALYTICS_LOG_DRAIN_TIMEOUT', '10'))
+
 
 # ============================================================================
 # HELPER FUNCTIONS
@@ -66,11 +76,29 @@ def get_query_vector(query_text: str) -> list:
         return None
 
 
+async def get_query_vector_async(query_text: str) -> list:
+    """
+    Async variant of get_query_vector.
+    
+    Returns:
+        List of floats representing the embedding vector, or None on failure
+    """
+    try:
+        return await gemini_service.get_embedding_async(
+            text=query_text,
+            model_name="text-embedding-004",
+            task_type="RETRIEVAL_QUERY"
+        )
+    except Exception as e:
+        logger.error(f"Failed to generate embedding: {e}", exc_info=True)
+        return None
+
+
 # ============================================================================
 # LOGGING FUNCTIONS
 # ============================================================================
 
-def log_chat_query(course_id: str, query_text: str, answer_text: str = None, sources: list = None) -> str:
+def log_chat_query(course_id: str, query_text: str, answer_text: str = None, sources: list = None, query_vector: list = None, metrics: dict = None, doc_id: str = None) -> str:
     """
     Logs a chat query event with its embedding for later analysis.
     
@@ -82,6 +110,9 @@ def log_chat_query(course_id: str, query_text: str, answer_text: str = None, sou
         query_text: The student's question
         answer_text: Optional - the generated answer
         sources: Optional - list of source files used
+        query_vector: Optional - precomputed query embedding (skips the embedding call)
+        metrics: Optional - per-request latency measurements (e.g. {'ttft_ms': 420.0})
+        doc_id: Optional - pre-allocated Firestore document ID to write to
         
     Returns:
         The Firestore document ID of the logged event (for rating feature)
@@ -97,8 +128,9 @@ def log_chat_query(course_id: str, query_text: str, answer_text: str = None, sou
     try:
         logger.info(f"Logging chat query for course {course_id}: {query_text[:50]}...")
         
-        # Get embedding vector for the query
-        query_vector = get_query_vector(query_text)
+        # Get embedding vector for the query (unless the caller already has one)
+        if query_vector is None:
+            query_vector = get_query_vector(query_text)
         
         # Prepare the log data
         log_data = {
@@ -108,12 +140,16 @@ def log_chat_query(course_id: str, query_text: str, answer_text: str = None, sou
             'answer_text': answer_text,
             'sources': sources or [],
             'query_vector': query_vector,
+            'metrics': metrics or {},
             'timestamp': firestore.SERVER_TIMESTAMP,
             'rating': None  # Will be updated if user rates this answer
         }
+        if doc_id:
+            # A rating from another worker may already be on the pre-allocated document
+            del log_data['rating']
         
         # Save to Firestore
-        doc_id = firestore_service.log_analytics_event(log_data)
+        doc_id = firestore_service.log_analytics_event(log_data, doc_id=doc_id)
         
         logger.info(f"Chat query logged successfully: {doc_id}")
         return doc_id
@@ -171,23 +207,247 @@ def log_kg_node_click(course_id: str, node_id: str, node_label: str, node_type:
         return None
 
 
+async def log_kg_node_click_async(course_id: str, node_id: str, node_label: str, node_type: str = None) -> str:
+    """
+    Async variant of log_kg_node_click using the Firestore AsyncClient.
+    
+    Returns:
+        The Firestore document ID of the logged event, or None on failure
+    """
+    try:
+        return await firestore_service.log_analytics_event_async({
+            'type': 'kg_click',
+            'course_id': course_id,
+            'node_id': node_id,
+            'node_label': node_label,
+            'node_type': node_type,
+            'timestamp': firestore.SERVER_TIMESTAMP
+        })
+    except Exception as e:
+        logger.error(f"Failed to log KG click: {e}", exc_info=True)
+        return None
+
+
+# ============================================================================
+# BACKGROUND LOGGING PIPELINE
+# ============================================================================
+
+_log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_workers = []
+_workers_pid = None
+_workers_lock = threading.Lock()
+
+# doc_id -> rating received before the background write finished (or None)
+_pending_logs = {}
+_pending_lock = threading.Lock()
+
+
+def _ensure_workers() -> None:
+    """Starts the worker threads on first use (and again in forked processes)."""
+    global _workers, _workers_pid
+    with _workers_lock:
+        if _workers_pid == os.getpid() and _workers:
+            return
+        _workers = []
+        for i in range(LOG_WORKER_THREADS):
+            worker = threading.Thread(target=_worker_loop, name=f"analytics-log-{i}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+        if _workers_pid is None:
+            atexit.register(shutdown_logging_pipeline)
+        _workers_pid = os.getpid()
+        logger.info(f"Started {LOG_WORKER_THREADS} analytics logging workers")
+
+
+def _worker_loop() -> None:
+    while True:
+        job = _log_queue.get()
+        try:
+            if job is None:
+                return
+            _write_chat_log(job)
+        finally:
+            _log_queue.task_done()
+
+
+def _write_chat_log(job: dict) -> None:
+    """Writes one queued chat log and applies any rating that arrived early."""
+    log_chat_query(**job)
+
+    with _pending_lock:
+        rating = _pending_logs.pop(job['doc_id'], None)
+    if rating:
+        try:
+            firestore_service.rate_analytics_event(job['doc_id'], rating)
+        except Exception as e:
+            logger.error(f"Failed to apply early rating to {job['doc_id']}: {e}", exc_info=True)
+
+
+def enqueue_chat_query(course_id: str, query_text: str, answer_text: str = None, sources: list = None,
+                       query_vector: list = None, metrics: dict = None) -> str:
+    """
+    Logs a chat query in the background and returns its document ID immediately.
+    
+    The Firestore document ID is allocated up front, so the rating feature
+    works even before the embedding call and Firestore write have finished.
+    If the queue is full, the query is logged synchronously instead of dropped.
+    
+    Args:
+        Same as log_chat_query
+        
+    Returns:
+        The pre-allocated Firestore document ID (None if allocation failed)
+        
+    Example:
+        doc_id = enqueue_chat_query("12345", "What is ML?", answer_text="ML is...")
+    """
+    job = _queue_chat_job(course_id, query_text, answer_text, sources, query_vector, metrics)
+    if job is None:
+        return log_chat_query(course_id, query_text, answer_text, sources, query_vector, metrics)
+    if not job['queued']:
+        logger.warning("Analytics log queue full, logging chat query synchronously")
+        _write_chat_log(job['job'])
+    return job['job']['doc_id']
+
+
+async def enqueue_chat_query_async(course_id: str, query_text: str, answer_text: str = None, sources: list = None,
+                                   query_vector: list = None, metrics: dict = None) -> str:
+    """
+    Async variant of enqueue_chat_query for the ASGI app.
+    
+    The synchronous fallbacks (no document ID, queue full) run in a worker
+    thread so they never block the event loop.
+    
+    Example:
+        doc_id = await enqueue_chat_query_async("12345", "What is ML?", answer_text="ML is...")
+    """
+    job = _queue_chat_job(course_id, query_text, answer_text, sources, query_vector, metrics)
+    if job is None:
+        return await asyncio.to_thread(
+            log_chat_query, course_id, query_text, answer_text, sources, query_vector, metrics
+        )
+    if not job['queued']:
+        logger.warning("Analytics log queue full, logging chat query in a worker thread")
+        await asyncio.to_thread(_write_chat_log, job['job'])
+    return job['job']['doc_id']
+
+
+def _queue_chat_job(course_id: str, query_text: str, answer_text: str, sources: list,
+                    query_vector: list, metrics: dict) -> dict:
+    """
+    Allocates a document ID and queues the chat log for the background workers.
+    
+    Returns:
+        {'job': ..., 'queued': bool} ('queued' is False when the queue is full
+        and the caller must write the job itself), or None if no document ID
+        could be allocated
+    """
+    try:
+        doc_id = firestore_service.new_analytics_doc_id()
+    except Exception as e:
+        logger.error(f"Failed to allocate analytics document ID: {e}")
+        return None
+
+    job = {
+        'course_id': course_id,
+        'query_text': query_text,
+        'answer_text': answer_text,
+        'sources': sources,
+        'query_vector': query_vector,
+        'metrics': metrics,
+        'doc_id': doc_id
+    }
+
+    with _pending_lock:
+        _pending_logs[doc_id] = None
+
+    _ensure_workers()
+    try:
+        _log_queue.put_nowait(job)
+    except queue.Full:
+        return {'job': job, 'queued': False}
+    return {'job': job, 'queued': True}
+
+
+def shutdown_logging_pipeline(timeout: float = LOG_DRAIN_TIMEOUT_SECONDS) -> None:
+    """
+    Drains queued log entries and stops the worker threads.
+    Registered with atexit so queued logs survive a graceful worker shutdown.
+    
+    Args:
+        timeout: Maximum seconds to wait for the queue to drain
+    """
+    global _workers
+    with _workers_lock:
+        workers = _workers if _workers_pid == os.getpid() else []
+        _workers = []
+
+    if not workers:
+        return
+
+    logger.info(f"Draining analytics log queue ({_log_queue.qsize()} pending)...")
+    deadline = time.monotonic() + timeout
+
+    # Sentinels queue up behind pending jobs, so every job is written first
+    for _ in workers:
+        try:
+            _log_queue.put(None, timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Full:
+            break
+    for worker in workers:
+        worker.join(timeout=max(0.0, deadline - time.monotonic()))
+
+    if any(worker.is_alive() for worker in workers):
+        logger.warning(f"Analytics log queue not fully drained ({_log_queue.qsize()} pending)")
+
+
 # ============================================================================
 # RATING FEATURE (STRETCH GOAL)
 # ============================================================================
 
-def rate_answer(doc_id: str, rating: str) -> None:
+def rate_answer(doc_id: str, rating: str, issued: bool = False) -> bool:
     """
     Allows students to rate an answer (stretch goal).
     
     Args:
         doc_id: The Firestore document ID of the chat event
         rating: The rating value (e.g., 'good', 'bad', 'helpful', 'not_helpful')
+        issued: True if doc_id was returned to this client by a chat request;
+                its log may still be queued on another worker, so the rating
+                is stored even before the log exists
+        
+    Returns:
+        True if the rating was recorded, False if there is no such chat event
         
     Example:
         rate_answer(doc_id="xyz123", rating="helpful")
     """
     logger.info(f"Rating answer {doc_id} as: {rating}")
-    firestore_service.rate_analytics_event(doc_id, rating)
+
+    # The chat log may still be queued; apply the rating once it is written
+    with _pending_lock:
+        if doc_id in _pending_logs:
+            _pending_logs[doc_id] = rating
+            return True
+
+    return firestore_service.rate_analytics_event(doc_id, rating, create=issued)
+
+
+async def rate_answer_async(doc_id: str, rating: str, issued: bool = False) -> bool:
+    """
+    Async variant of rate_answer using the Firestore AsyncClient.
+    
+    Example:
+        await rate_answer_async(doc_id="xyz123", rating="helpful")
+    """
+    logger.info(f"Rating answer {doc_id} as: {rating}")
+
+    with _pending_lock:
+        if doc_id in _pending_logs:
+            _pending_logs[doc_id] = rating
+            return True
+
+    return await firestore_service.rate_analytics_event_async(doc_id, rating, create=issued)
 
 
 # ============================================================================
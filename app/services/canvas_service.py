@@ -130,6 +130,23 @@ def get_course_files(course_id: str, token: str, download: bool = True, output_d
         raise Exception(f"Failed to fetch course files: {str(e)}")
 
 
+def download_files(files: list, token: str, course_id: str, output_dir: str = None) -> list:
+    """
+    Downloads already-listed course files (e.g. from a saved manifest) to local storage.
+    
+    Args:
+        files: File objects as returned by get_course_files (each with 'url')
+        token: Canvas API access token
+        course_id: The Canvas course ID
+        output_dir: Directory to save files (default: app/data/courses/{course_id}/)
+        
+    Returns:
+        The same file objects with 'local_path' set (None if a download failed)
+    """
+    _download_files(files, token, course_id, output_dir)
+    return files
+
+
 def _download_files(files: list, token: str, course_id: str, output_dir: str = None) -> None:
     """
     Internal function to download Canvas files to local storage.
@@ -0,0 +1,519 @@
+"""
+Concurrency Helpers
+Shared thread pool for fanning out independent upstream calls.
+
+This module is responsible for:
+- Owning one bounded executor per worker process for request-time fan-out
+- Timing named stages so routes can report per-stage latency
+- Keeping asyncio-native clients bound to the event loop that created them
+- Coalescing identical concurrent calls (single-flight)
+- Rate limiting batch jobs that share an upstream quota
+- Streaming items through staged worker pools (bounded queues between stages)
+
+Upstream calls (Firestore, Vertex AI, Gemini) spend their time waiting on
+the network, so threads overlap them well despite the GIL.
+"""
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Threads shared by every request in this process
+FANOUT_MAX_WORKERS = int(os.environ.get('FANOUT_MAX_WORKERS', '16'))
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+_flight_stats = {}  # name -> {'calls': int, 'saved': int}
+_flight_stats_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Returns the process-wide executor, creating it on first use.
+
+    Threads don't survive fork(), so a worker forked from a process that
+    already had an executor gets a fresh one.
+    """
+    global _executor, _executor_pid
+    if _executor is not None and _executor_pid == os.getpid():
+        return _executor
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=FANOUT_MAX_WORKERS, thread_name_prefix='fanout')
+            _executor_pid = os.getpid()
+            logger.info(f"Started fan-out executor with {FANOUT_MAX_WORKERS} threads")
+        return _executor
+
+
+def submit(fn, *args, **kwargs) -> Future:
+    """
+    Runs fn(*args, **kwargs) on the shared executor.
+
+    Example:
+        future = submit(firestore_service.get_course_data, course_id)
+        course_data = future.result()
+    """
+    return get_executor().submit(fn, *args, **kwargs)
+
+
+def timed(timings: dict, stage: str, fn, *args, **kwargs):
+    """
+    Calls fn and records its wall time in milliseconds under timings[stage].
+
+    The duration is recorded even if fn raises.
+
+    Example:
+        timings = {}
+        vector = timed(timings, 'embed', get_query_vector, query)
+        # timings == {'embed': 84.2}
+    """
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        timings[stage] = round((time.perf_counter() - start) * 1000, 1)
+
+
+async def timed_async(timings: dict, stage: str, awaitable):
+    """
+    Awaits awaitable and records its wall time in milliseconds under timings[stage].
+
+    Example:
+        vector = await timed_async(timings, 'embed', get_query_vector_async(query))
+    """
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        timings[stage] = round((time.perf_counter() - start) * 1000, 1)
+
+
+def loop_local(factory):
+    """
+    Returns a getter that lazily builds one client per running event loop.
+
+    grpc.aio channels are tied to the loop they were first used on, so
+    async Google Cloud clients can't be shared between loops (e.g. across
+    test runs or uvicorn reloads).
+
+    Example:
+        _get_async_db = loop_local(firestore.AsyncClient)
+        doc = await _get_async_db().collection('courses').document(course_id).get()
+    """
+    clients = weakref.WeakKeyDictionary()
+
+    def get():
+        loop = asyncio.get_running_loop()
+        client = clients.get(loop)
+        if client is None:
+            client = factory()
+            clients[loop] = client
+        return client
+
+    return get
+
+
+# ============================================================================
+# RATE LIMITING
+# ============================================================================
+
+class RateLimiter:
+    """
+    Thread-safe token bucket shared by workers calling one upstream API.
+
+    acquire() blocks until a token is available, so a pool of N workers
+    never starts more than `rate` calls per second on average (plus an
+    initial burst of up to `burst` calls).
+
+    Example:
+        limiter = RateLimiter(rate=2, burst=4)
+        limiter.acquire()
+        generate_answer(prompt)
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Takes one token, waiting for it if needed. A rate of 0 or less disables limiting.
+
+        Returns:
+            Seconds spent waiting
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+# ============================================================================
+# SINGLE-FLIGHT COALESCING
+# ============================================================================
+
+def _count_flight(name: str, shared: bool) -> None:
+    """Records one call (and whether it reused an in-flight result)."""
+    with _flight_stats_lock:
+        stats = _flight_stats.setdefault(name, {'calls': 0, 'saved': 0})
+        stats['calls'] += 1
+        if shared:
+            stats['saved'] += 1
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key onto one execution.
+
+    While a call for a key is in flight, later callers with the same key
+    wait for it and receive its result (or exception) instead of running
+    the work again. Nothing is cached once the call completes.
+
+    Example:
+        flight = SingleFlight('generate')
+        answer, shared = flight.do(key, generate_answer, query)
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight = {}  # key -> Future
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs) -> tuple:
+        """
+        Runs fn in the calling thread, or waits for the in-flight call with the same key.
+
+        Returns:
+            Tuple of (result, shared) where shared is True if the result
+            came from another caller's execution
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+        _count_flight(self.name, not leader)
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._forget(key, future)
+
+    def submit(self, key, fn, *args, **kwargs) -> tuple:
+        """
+        Starts fn on the shared executor, or joins the in-flight call with the same key.
+
+        Returns:
+            Tuple of (Future, shared)
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            shared = future is not None
+            if not shared:
+                future = submit(fn, *args, **kwargs)
+                self._inflight[key] = future
+        _count_flight(self.name, shared)
+
+        if not shared:
+            future.add_done_callback(lambda done: self._forget(key, done))
+        return future, shared
+
+    def _forget(self, key, future) -> None:
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+
+class AsyncSingleFlight:
+    """
+    asyncio counterpart of SingleFlight for the ASGI serving mode.
+
+    The shared work runs in its own task and waiters are shielded from it,
+    so one client disconnecting doesn't cancel the others' answer.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight = {}  # key -> Task
+
+    async def do(self, key, coro_fn, *args, **kwargs) -> tuple:
+        """
+        Awaits coro_fn(*args, **kwargs), or the in-flight call with the same key.
+
+        Returns:
+            Tuple of (result, shared)
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if not shared:
+            task = asyncio.ensure_future(coro_fn(*args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        _count_flight(self.name, shared)
+        return await asyncio.shield(task), shared
+
+    def _forget(self, key, task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Retrieve the exception so asyncio doesn't warn when every waiter left
+        if not task.cancelled():
+            task.exception()
+
+
+def get_singleflight_stats() -> dict:
+    """
+    Returns per-flight call counts and how many upstream calls were saved.
+
+    Example:
+        get_singleflight_stats()
+        # {'chat_generate': {'calls': 40, 'saved': 31}}
+    """
+    with _flight_stats_lock:
+        return {name: dict(stats) for name, stats in _flight_stats.items()}
+
+
+def reset_singleflight_stats() -> None:
+    """Resets the single-flight counters (used by tests)."""
+    with _flight_stats_lock:
+        _flight_stats.clear()
+
+
+# ============================================================================
+# STAGED PIPELINES
+# ============================================================================
+
+# Items waiting between two stages; a full queue blocks the stage before it
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', '4'))
+
+_PIPELINE_END = object()
+
+
+class PipelineStage:
+    """
+    One stage of run_pipeline: fn(item) run by `workers` threads.
+
+    fn works on the item in place; an exception drops the item from the
+    later stages. Items for which when(item) is false pass through
+    without taking a worker (e.g. work already done by an earlier run).
+
+    With batched=True, fn always gets a list of items instead (even with
+    batch_size 1): everything already waiting for the stage, up to
+    batch_size (a worker never waits to fill a batch). An exception then
+    drops the whole batch.
+
+    Example:
+        PipelineStage('upload', upload_one, workers=4, when=lambda f: not f.get('gcs_uri'))
+        PipelineStage('import', import_many, workers=2, batched=True, batch_size=25)
+    """
+
+    def __init__(self, name: str, fn, workers: int = 1, when=None, batched: bool = False, batch_size: int = 1):
+        if batch_size > 1 and not batched:
+            raise ValueError(f"Pipeline stage '{name}': batch_size needs batched=True")
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.when = when
+        self.batched = batched
+        self.batch_size = max(1, batch_size)
+
+
+def run_pipeline(items: list, stages: list, queue_size: int = None, on_done=None) -> tuple[dict, dict]:
+    """
+    Streams items through stages, each on its own worker threads.
+
+    An item enters the next stage as soon as it leaves the previous one,
+    so different items overlap across stages (one downloading while
+    another uploads). Stages are connected by bounded queues: a slow stage
+    fills its input queue and the stage before it waits (backpressure),
+    so no stage runs more than queue_size items (or the next stage's
+    batch_size, if larger) ahead.
+
+    on_done runs in the calling thread as each item leaves the last
+    stage. If it raises, the pipeline stops taking new work and the
+    exception propagates once the workers have finished their current item.
+
+    Args:
+        items: Items to process (modified in place by the stage functions)
+        stages: PipelineStage list, in order
+        queue_size: Items buffered between two stages (default: PIPELINE_QUEUE_SIZE)
+        on_done: Optional function (position, item) for items that passed every stage
+
+    Returns:
+        Tuple of (errors, stats):
+        - errors: {position: exception} for items a stage failed on
+        - stats: {stage name: {'workers', 'items', 'skipped', 'failed',
+          'busy_seconds', 'wall_seconds', 'items_per_second'}}
+
+    Example:
+        errors, stats = run_pipeline(files, [PipelineStage('download', download_one, workers=4),
+                                             PipelineStage('upload', upload_one, workers=2)])
+        # stats['upload'] == {'workers': 2, 'items': 12, 'skipped': 0, 'failed': 0,
+        #                     'busy_seconds': 9.8, 'wall_seconds': 5.2, 'items_per_second': 2.31}
+    """
+    if not stages:
+        raise ValueError("A pipeline needs at least one stage")
+    queue_size = PIPELINE_QUEUE_SIZE if queue_size is None else queue_size
+    abort = threading.Event()
+    lock = threading.Lock()
+    # Each stage's input queue (room for a full batch), plus an unbounded
+    # output queue drained by the caller
+    queues = [queue.Queue(maxsize=max(1, queue_size, stage.batch_size)) for stage in stages] + [queue.Queue()]
+    remaining = [stage.workers for stage in stages]
+    errors = {}
+    stats = {stage.name: {'workers': stage.workers, 'items': 0, 'skipped': 0, 'failed': 0,
+                          'busy_seconds': 0.0, 'started': None, 'finished': None} for stage in stages}
+
+    def put(target, entry):
+        while not abort.is_set():
+            try:
+                target.put(entry, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def get(source):
+        while not abort.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _PIPELINE_END
+
+    def feed():
+        for entry in enumerate(items):
+            put(queues[0], entry)
+        for _ in range(stages[0].workers):
+            put(queues[0], _PIPELINE_END)
+
+    def work(index):
+        stage, stage_stats = stages[index], stats[stages[index].name]
+
+        def wanted(entry):
+            if stage.when is None or stage.when(entry[1]):
+                return True
+            with lock:
+                stage_stats['skipped'] += 1
+            put(queues[index + 1], entry)
+            return False
+
+        ended = False
+        while not ended:
+            entry = get(queues[index])
+            if entry is _PIPELINE_END:
+                break
+            if not wanted(entry):
+                continue
+            batch = [entry]
+            while len(batch) < stage.batch_size:
+                try:
+                    entry = queues[index].get_nowait()
+                except queue.Empty:
+                    break
+                if entry is _PIPELINE_END:
+                    ended = True
+                    break
+                if wanted(entry):
+                    batch.append(entry)
+
+            started = time.perf_counter()
+            try:
+                if stage.batched:
+                    stage.fn([item for _, item in batch])
+                else:
+                    stage.fn(batch[0][1])
+                failed = None
+            except Exception as e:
+                logger.error(f"Pipeline stage '{stage.name}' failed on item(s) {[position for position, _ in batch]}: {e}")
+                failed = e
+            finished = time.perf_counter()
+
+            with lock:
+                stage_stats['busy_seconds'] += finished - started
+                stage_stats['started'] = min(stage_stats['started'] or started, started)
+                stage_stats['finished'] = max(stage_stats['finished'] or finished, finished)
+                if failed is None:
+                    stage_stats['items'] += len(batch)
+                else:
+                    stage_stats['failed'] += len(batch)
+                    errors.update((position, failed) for position, _ in batch)
+            if failed is None:
+                for entry in batch:
+                    put(queues[index + 1], entry)
+
+        # The last worker out tells every worker of the next stage there's nothing more
+        with lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last:
+            for _ in range(stages[index + 1].workers if index + 1 < len(stages) else 1):
+                put(queues[index + 1], _PIPELINE_END)
+
+    threads = [threading.Thread(target=feed, name='pipeline-feed', daemon=True)]
+    for index, stage in enumerate(stages):
+        threads.extend(threading.Thread(target=work, args=(index,), name=f'pipeline-{stage.name}-{i}', daemon=True)
+                       for i in range(stage.workers))
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            entry = get(queues[-1])
+            if entry is _PIPELINE_END:
+                break
+            if on_done:
+                on_done(*entry)
+    except BaseException:
+        abort.set()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+
+    for stage_stats in stats.values():
+        started, finished = stage_stats.pop('started'), stage_stats.pop('finished')
+        wall = (finished - started) if started is not None else 0.0
+        stage_stats['busy_seconds'] = round(stage_stats['busy_seconds'], 3)
+        stage_stats['wall_seconds'] = round(wall, 3)
+        stage_stats['items_per_second'] = round(stage_stats['items'] / wall, 2) if wall > 0 else None
+    return errors, stats
+
+
+def shutdown(wait: bool = True) -> None:
+    """Stops the shared executor (a later submit starts a new one)."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
@@ -0,0 +1,640 @@
+"""
+Course Initialization Service
+Runs the RAG + KG pipeline that sets up a course, as a background job.
+
+This service is responsible for:
+- Streaming course files through Canvas download, GCS upload, RAG corpus
+  import and summarization, with the stages overlapping
+- Building and storing the knowledge graph
+- Checkpointing each stage so a failed run resumes where it stopped
+- Re-syncing an ACTIVE course with only the Canvas files that changed
+- Reporting stage and progress to the job queue
+
+/api/initialize-course enqueues an INIT_JOB_KIND job and /api/sync-course
+a SYNC_JOB_KIND job; workers (in the web process or app.commands.job_worker)
+run them through run_initialization_job and run_sync_job.
+
+Dependencies:
+- canvas_service, gcs_service, rag_service, gemini_service, kg_service
+- firestore_service: For course state and graph storage
+- job_queue_service: For running as a job
+- concurrency: For the staged ingest pipeline
+"""
+import json
+import logging
+import os
+import shutil
+import sys
+
+# Handle imports for both module use and standalone testing
+if __name__ == "__main__":
+    # Running as standalone script
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+    from app.services import (canvas_service, concurrency, firestore_service, gcs_service, gemini_service,
+                              job_queue_service, kg_service, rag_service, semantic_cache_service)
+else:
+    # Imported as a module
+    from . import (canvas_service, concurrency, firestore_service, gcs_service, gemini_service,
+                   job_queue_service, kg_service, rag_service, semantic_cache_service)
+
+logger = logging.getLogger(__name__)
+
+# Get Canvas API token from environment
+CANVAS_TOKEN = os.environ.get('CANVAS_API_TOKEN')
+
+INIT_JOB_KIND = 'initialize_course'
+SYNC_JOB_KIND = 'sync_course'
+
+
+def _course_job_key(course_id: str) -> str:
+    """Dedupe key shared by a course's init and sync jobs, so only one runs at a time."""
+    return f"course_{course_id}"
+
+# Pipeline stages and their share of the total run time, in order.
+# Used to turn per-stage progress into overall progress for the ETA.
+# Download, upload, import and summarize overlap (see _ingest_files), so
+# they share one 'ingest' stage whose progress is the share of files done.
+STAGES = (
+    ('ingest', 0.65),
+    ('build_graph', 0.30),
+    ('finalize', 0.05),
+)
+
+# Concurrent files per ingest stage; queues between stages hold at most
+# PIPELINE_QUEUE_SIZE files (see concurrency.run_pipeline)
+INGEST_DOWNLOAD_WORKERS = int(os.environ.get('INGEST_DOWNLOAD_WORKERS', '4'))
+INGEST_UPLOAD_WORKERS = int(os.environ.get('INGEST_UPLOAD_WORKERS', '4'))
+# One import worker by default: a corpus runs one import operation at a time
+# (rag_service.RAG_IMPORT_MAX_OPERATIONS), and each operation takes a whole batch
+INGEST_IMPORT_WORKERS = int(os.environ.get('INGEST_IMPORT_WORKERS', '1'))
+INGEST_SUMMARIZE_WORKERS = int(os.environ.get('INGEST_SUMMARIZE_WORKERS', '2'))
+
+# A sync writes only the topics it changed, guarded by kg_version; when a
+# topic edit lands meanwhile, the topics are refreshed again on the new graph
+SYNC_GRAPH_WRITE_ATTEMPTS = 3
+
+# Same for a sync, which only handles the files that changed
+SYNC_STAGES = (
+    ('diff', 0.05),
+    ('download', 0.15),
+    ('upload', 0.10),
+    ('import', 0.25),
+    ('refresh_topics', 0.40),
+    ('finalize', 0.05),
+)
+
+
+def _stage_progress(stage: str, fraction: float = 0.0, stages: tuple = STAGES) -> float:
+    """Overall progress (0-1) at `fraction` of the way through a stage."""
+    done = 0.0
+    for name, weight in stages:
+        if name == stage:
+            return done + weight * max(0.0, min(fraction, 1.0))
+        done += weight
+    return done
+
+
+def _checkpoint(course_id: str, stage: str, fields: dict) -> None:
+    firestore_service.save_init_checkpoint(course_id, stage, fields)
+
+
+def _remove_local_files(course_id: str) -> None:
+    """Deletes the course's downloaded files (GCS copies are kept for source downloads)."""
+    local_dir = os.path.join('app', 'data', 'courses', course_id)
+    if os.path.exists(local_dir):
+        shutil.rmtree(local_dir)
+        logger.info(f"Deleted local directory: {local_dir}")
+
+
+def _ingest_files(course_id: str, corpus_id: str, files: list, uploads: dict, imported: dict, file_summaries: dict, report) -> dict:
+    """
+    Streams files through download -> upload -> import -> summarize.
+
+    Each stage has its own worker pool (INGEST_*_WORKERS) and a bounded
+    queue in front of it, so a file moves on as soon as its previous
+    stage is done and a slow stage holds back the ones before it. The
+    import stage takes every uploaded file that is waiting (up to
+    RAG_IMPORT_BATCH_SIZE) into one import operation. Work
+    recorded in the checkpoints is skipped per file and stage, and every
+    finished step is checkpointed as it happens. Per-stage throughput is
+    written to the course's init logs.
+
+    Args:
+        course_id: The Canvas course ID
+        corpus_id: The RAG corpus to import into
+        files: Manifest file objects ('gcs_uri' set for files already uploaded)
+        uploads: Checkpointed {file_id: gcs_uri}
+        imported: Checkpointed {file_id: True} of imported files
+        file_summaries: Checkpointed {file_id: summary}; new summaries are added to it
+        report: Function (stage, progress, message) for progress updates
+
+    Returns:
+        Per-stage stats from concurrency.run_pipeline
+
+    Raises:
+        RuntimeError: If a stage failed on some files (after all other files are done)
+    """
+    # The services log and skip files they couldn't process; raising here
+    # records the file as failed, so the run fails and its retry resumes with it
+    def download(file):
+        canvas_service.download_files([file], CANVAS_TOKEN, course_id)
+        if not file.get('local_path'):
+            raise RuntimeError("download failed")
+
+    def upload(file):
+        gcs_service.upload_course_files(
+            [file], course_id,
+            on_uploaded=lambda uploaded: _checkpoint(course_id, 'uploads', {uploaded['id']: uploaded['gcs_uri']})
+        )
+        if not file.get('gcs_uri'):
+            raise RuntimeError("upload to GCS failed")
+
+    def import_files(batch):
+        def imported_file(done):
+            imported[done['id']] = True
+            _checkpoint(course_id, 'corpus', {'imported': {done['id']: True}})
+
+        rag_service.import_corpus_files(corpus_id, batch, on_imported=imported_file)
+        missing = [f.get('display_name') for f in batch if f['id'] not in imported]
+        if missing:
+            # The whole batch counts as failed; its imported files are checkpointed and skipped on retry
+            raise RuntimeError(f"corpus import failed for {', '.join(missing)}")
+
+    def summarize(file):
+        if not file.get('local_path'):
+            raise RuntimeError("no local copy to summarize")
+        file_summaries[file['id']] = gemini_service.summarize_file(file_path=file['local_path'])
+        _checkpoint(course_id, 'summaries', {file['id']: file_summaries[file['id']]})
+
+    # Local copies are only needed to upload or summarize a file
+    stages = [
+        concurrency.PipelineStage('download', download, INGEST_DOWNLOAD_WORKERS,
+                                  when=lambda f: f['id'] not in uploads or f['id'] not in file_summaries),
+        concurrency.PipelineStage('upload', upload, INGEST_UPLOAD_WORKERS,
+                                  when=lambda f: not f.get('gcs_uri')),
+        # Uploaded files waiting for import go into one import operation
+        concurrency.PipelineStage('import', import_files, INGEST_IMPORT_WORKERS,
+                                  when=lambda f: f.get('gcs_uri') and f['id'] not in imported,
+                                  batched=True, batch_size=rag_service.RAG_IMPORT_BATCH_SIZE),
+        concurrency.PipelineStage('summarize', summarize, INGEST_SUMMARIZE_WORKERS,
+                                  when=lambda f: f['id'] not in file_summaries),
+    ]
+
+    done = 0
+
+    def file_done(position, file):
+        nonlocal done
+        done += 1
+        report('ingest', _stage_progress('ingest', done / len(files)),
+               f"Processed {file.get('display_name')} ({done}/{len(files)} files)")
+
+    report('ingest', _stage_progress('ingest'), f"Processing {len(files)} files...")
+    errors, stats = concurrency.run_pipeline(files, stages, on_done=file_done)
+
+    for name, stage_stats in stats.items():
+        message = (f"{name}: {stage_stats['items']} files in {stage_stats['wall_seconds']:.1f}s "
+                   f"({stage_stats['items_per_second'] or 0:.2f} files/s, {stage_stats['workers']} workers, "
+                   f"{stage_stats['skipped']} skipped, {stage_stats['failed']} failed)")
+        logger.info(f"Course {course_id} ingest {message}")
+        firestore_service.add_init_log(course_id, message)
+
+    if errors:
+        failed = "; ".join(f"{files[position].get('display_name')}: {error}" for position, error in sorted(errors.items())[:3])
+        raise RuntimeError(f"{len(errors)} of {len(files)} files failed to ingest ({failed})")
+    return stats
+
+
+def run_initialization(course_id: str, topics: str = None, summary_mode: str = None, report=None) -> dict:
+    """
+    Runs the whole initialization pipeline for a course.
+
+    Pipeline:
+    1. List course files in Canvas and create the RAG corpus
+    2-4. Stream the files through download, GCS upload, corpus import and
+       summarization (see _ingest_files), then extract topics if none were given
+    5. Build knowledge graph using RAG context
+    6. Clean up local files, store the graph and set status: ACTIVE
+
+    Every stage checkpoints its output (see firestore_service.save_init_checkpoint):
+    the file manifest, gcs_uri per file, corpus_id and imported files,
+    per-file summaries, the topic list and per-topic summaries. A run
+    after a failure picks up at the first incomplete stage and item: it
+    keeps the corpus, and only downloads, uploads, imports and summarizes
+    what is still missing. Checkpoints are cleared once the course is ACTIVE.
+
+    Args:
+        course_id: The Canvas course ID (its document must exist, see create_course_doc)
+        topics: Optional comma-separated topics (auto-extracted when empty)
+        summary_mode: Optional 'per_topic' or 'batched'
+        report: Optional function (stage, progress, message) for progress updates
+
+    Returns:
+        Dictionary with corpus_id, files_count, uploaded_count, topic_count,
+        resumed_from (checkpoints that were reused) and ingest (per-stage
+        throughput, see concurrency.run_pipeline)
+
+    Raises:
+        PermanentJobError: If the course has no files
+        RuntimeError: If some files failed to ingest (the retry resumes with them)
+
+    Example:
+        result = run_initialization('12345')
+        # {'corpus_id': 'projects/.../ragCorpora/...', 'files_count': 12, 'uploaded_count': 12,
+        #  'topic_count': 9, 'resumed_from': ['manifest', 'uploads'], 'ingest': {'download': {...}, ...}}
+    """
+    report = report or (lambda stage, progress, message=None: None)
+    checkpoints = firestore_service.get_init_checkpoints(course_id)
+    if checkpoints:
+        logger.info(f"Resuming initialization of course {course_id} from checkpoints: {sorted(checkpoints)}")
+
+    uploads = checkpoints.get('uploads', {})
+    corpus_checkpoint = checkpoints.get('corpus', {})
+    imported = corpus_checkpoint.get('imported', {})
+    file_summaries = checkpoints.get('summaries', {})
+
+    # Step 1: List course files in Canvas
+    manifest = checkpoints.get('manifest')
+    if manifest:
+        report('ingest', _stage_progress('ingest'), f"Resuming with the {len(manifest['files'])} files found earlier...")
+        files, indexed_files_map = manifest['files'], manifest['indexed_files']
+    else:
+        report('ingest', _stage_progress('ingest'), "Fetching course files from Canvas...")
+        files, indexed_files_map = canvas_service.get_course_files(
+            course_id=course_id,
+            token=CANVAS_TOKEN,
+            download=False
+        )
+        if not files:
+            raise job_queue_service.PermanentJobError("No course files found")
+        _checkpoint(course_id, 'manifest', {'files': files, 'indexed_files': indexed_files_map})
+    logger.info(f"Retrieved {len(files)} files from Canvas")
+
+    # The corpus is created up front so each file is imported as soon as it's uploaded
+    corpus_id = corpus_checkpoint.get('corpus_id')
+    if not corpus_id:
+        report('ingest', _stage_progress('ingest'), "Creating RAG corpus...")
+        corpus_id = rag_service.create_corpus(files, corpus_name_suffix=f"Course {course_id}")
+        _checkpoint(course_id, 'corpus', {'corpus_id': corpus_id})
+    logger.info(f"Using corpus: {corpus_id}")
+
+    # Steps 2-4: Stream each file through download -> upload -> import -> summarize
+    for file in files:
+        if file['id'] in uploads:
+            file['gcs_uri'] = uploads[file['id']]
+    ingest_stats = _ingest_files(course_id, corpus_id, files, uploads, imported, file_summaries, report)
+
+    # Update indexed_files_map with GCS URIs
+    for file in files:
+        file_id = str(file.get('id'))
+        if file_id in indexed_files_map and file.get('gcs_uri'):
+            indexed_files_map[file_id]['gcs_uri'] = file.get('gcs_uri')
+            indexed_files_map[file_id]['display_name'] = file.get('display_name')
+
+    successful_uploads = sum(1 for f in files if f.get('gcs_uri'))
+    logger.info(f"Uploaded {successful_uploads}/{len(files)} files to GCS")
+
+    # Extract topics if none were provided (summaries in file order)
+    file_to_summary = {
+        file.get("display_name") or f"file_{file.get('id')}": file_summaries[file['id']]
+        for file in files if file['id'] in file_summaries
+    }
+
+    if 'topics' in checkpoints:
+        topics = checkpoints['topics']['topics']
+    else:
+        if not topics or not any(t.strip() for t in topics.split(",")):
+            logger.info("No topics provided, auto-extracting topics from files")
+            topics = kg_service.extract_topics_from_summaries(list(file_to_summary.values()))
+            logger.info(f"Auto-extracted topics: {topics}")
+        else:
+            topics = topics.split(",")
+        # Stripped the way build_knowledge_graph names them, so topic summaries match on resume
+        topics = [str(t).strip() for t in topics if str(t).strip()]
+        _checkpoint(course_id, 'topics', {'topics': topics})
+
+    # Step 5: Build knowledge graph, reusing topic summaries from an interrupted build
+    known_summaries = {entry['topic']: (entry['summary'], entry['sources'])
+                       for entry in checkpoints.get('graph', {}).values()}
+    report('build_graph', _stage_progress('build_graph'),
+           f"Building knowledge graph for {len(topics)} topics ({len(known_summaries)} already summarized)...")
+
+    def save_topic_summary(topic, result):
+        summary, source_names = result
+        _checkpoint(course_id, 'graph', {
+            f"topic_{topics.index(topic) + 1}": {'topic': topic, 'summary': summary, 'sources': source_names}
+        })
+
+    source_index = kg_service.build_source_index(files=files, indexed_files=indexed_files_map)
+    kg_nodes, kg_edges, kg_data = kg_service.build_knowledge_graph(
+        topic_list=topics,
+        corpus_id=corpus_id,
+        files=files,
+        source_index=source_index,
+        summary_mode=summary_mode,
+        known_summaries=known_summaries,
+        on_summary=save_topic_summary
+    )
+
+    # Step 6: Clean up local files (GCS files are kept for source downloads),
+    # then store the graph before the course becomes ACTIVE
+    report('finalize', _stage_progress('finalize'), "Saving course...")
+    _remove_local_files(course_id)
+
+    firestore_service.update_knowledge_graph(course_id, kg_nodes, kg_edges, kg_data, source_index=source_index)
+    firestore_service.finalize_course_doc(course_id, {
+        'corpus_id': corpus_id,
+        'indexed_files': indexed_files_map
+    })
+    firestore_service.clear_init_checkpoints(course_id)
+
+    # Answers cached against the previous corpus may no longer apply
+    semantic_cache_service.invalidate_course(course_id)
+    logger.info(f"Course {course_id} initialization complete!")
+
+    return {
+        'corpus_id': corpus_id,
+        'files_count': len(files),
+        'uploaded_count': successful_uploads,
+        'topic_count': len(topics),
+        'resumed_from': sorted(checkpoints),
+        'ingest': ingest_stats
+    }
+
+
+def enqueue_initialization(course_id: str, topics: str = None, summary_mode: str = None, resume: bool = True) -> str:
+    """
+    Marks the course GENERATING and queues its initialization.
+
+    Args:
+        course_id: The Canvas course ID
+        topics: Optional comma-separated topics
+        summary_mode: Optional 'per_topic' or 'batched'
+        resume: Continue from the checkpoints of an earlier failed run (default),
+                or discard them and start over
+
+    Returns:
+        The job ID to poll with job_queue_service.get_job_status; the
+        existing job's ID if the course is already being initialized
+
+    Raises:
+        JobConflictError: If a sync of the course is queued or running
+    """
+    # Resetting the course or its checkpoints under a running job would corrupt it
+    active_job_id = job_queue_service.find_active_job(INIT_JOB_KIND, _course_job_key(course_id))
+    if active_job_id:
+        return active_job_id
+    if not resume:
+        firestore_service.clear_init_checkpoints(course_id)
+    firestore_service.create_course_doc(course_id)
+    return job_queue_service.enqueue_job(INIT_JOB_KIND, {
+        'course_id': course_id,
+        'topics': topics,
+        'summary_mode': summary_mode
+    }, dedupe_key=_course_job_key(course_id))
+
+
+def run_initialization_job(payload: dict, job) -> dict:
+    """Job handler: runs run_initialization with the job's progress reporting."""
+    logger.info(f"Starting initialization for course {payload['course_id']} (attempt {job.attempt})")
+    return run_initialization(
+        payload['course_id'],
+        topics=payload.get('topics'),
+        summary_mode=payload.get('summary_mode'),
+        report=job.report
+    )
+
+
+def _mark_initialization_failed(payload: dict, error: str) -> None:
+    """Job failure hook: shows the error on the course once no retries are left."""
+    firestore_service.mark_course_error(payload['course_id'], error)
+
+
+def diff_course_files(indexed_files: dict, current_files: dict) -> dict:
+    """
+    Compares a course's stored indexed_files with a fresh Canvas listing.
+
+    A file is changed when its hash (Canvas md5, or uuid) or its display
+    name differs; the display name decides its GCS path and corpus name.
+
+    Args:
+        indexed_files: The course's stored indexed_files map
+        current_files: indexed_files map of the current listing (with 'display_name')
+
+    Returns:
+        Dict of 'new', 'changed', 'removed' and 'unchanged' lists of file IDs
+
+    Example:
+        diff_course_files({'1': {'hash': 'a'}, '2': {'hash': 'b'}}, {'1': {'hash': 'a'}, '3': {'hash': 'c'}})
+        # {'new': ['3'], 'changed': [], 'removed': ['2'], 'unchanged': ['1']}
+    """
+    diff = {'new': [], 'changed': [], 'removed': [], 'unchanged': []}
+    for file_id, entry in current_files.items():
+        stored = indexed_files.get(file_id)
+        if stored is None:
+            diff['new'].append(file_id)
+        elif stored.get('hash') != entry.get('hash') or \
+                (stored.get('display_name') and stored['display_name'] != entry.get('display_name')):
+            diff['changed'].append(file_id)
+        else:
+            diff['unchanged'].append(file_id)
+    diff['removed'] = [file_id for file_id in indexed_files if file_id not in current_files]
+    return diff
+
+
+def run_sync(course_id: str, summary_mode: str = None, report=None) -> dict:
+    """
+    Re-syncs an ACTIVE course with its current Canvas files.
+
+    Pipeline:
+    1. List course files in Canvas and diff them against indexed_files
+    2. Download and upload only the new and changed files
+    3. Replace their entries in the RAG corpus; delete removed files
+       from the corpus and GCS
+    4. Re-summarize only the topics linked to a changed or removed file,
+       or that now retrieve a new file (see kg_service.sync_graph_files)
+    5. Store the changed topics, file nodes and new indexed_files in one write
+
+    The course stays ACTIVE throughout. Step 5 only writes the topic records
+    the sync changed and only if kg_version is still the one step 4 read, so
+    a topic added or removed meanwhile isn't lost: steps 4-5 run again on
+    the current graph instead. The run is safe to retry: the diff
+    is taken against indexed_files, which is only written at the end, and
+    corpus entries are replaced rather than added. A file that fails to
+    upload or import keeps its old indexed_files entry, so the next sync
+    tries it again.
+
+    Args:
+        course_id: The Canvas course ID
+        summary_mode: Optional 'per_topic' or 'batched'
+        report: Optional function (stage, progress, message) for progress updates
+
+    Returns:
+        Dictionary with the 'new', 'changed', 'removed' and 'unchanged' file
+        counts, 'failed' file IDs and 'refreshed_topics' topic IDs
+
+    Raises:
+        PermanentJobError: If the course isn't ACTIVE
+        GraphVersionConflict: If the graph kept changing for SYNC_GRAPH_WRITE_ATTEMPTS attempts
+
+    Example:
+        result = run_sync('12345')
+        # {'new': 1, 'changed': 0, 'removed': 0, 'unchanged': 24, 'failed': [],
+        #  'refreshed_topics': ['topic_3']}
+    """
+    report = report or (lambda stage, progress, message=None: None)
+
+    def progress(stage, fraction=0.0):
+        return _stage_progress(stage, fraction, SYNC_STAGES)
+
+    # Read past the course cache: the sync writes back what it read
+    course_doc = firestore_service.get_course_data(course_id, fresh=True)
+    course = (course_doc.to_dict() if course_doc.exists else None) or {}
+    corpus_id = course.get('corpus_id')
+    if course.get('status') != 'ACTIVE' or not corpus_id:
+        raise job_queue_service.PermanentJobError("Course must be initialized before it can be synced")
+    stored = course.get('indexed_files') or {}
+
+    # Step 1: Diff the Canvas listing against the files indexed last time
+    report('diff', progress('diff'), "Comparing course files with Canvas...")
+    files, current = canvas_service.get_course_files(course_id=course_id, token=CANVAS_TOKEN, download=False)
+    files_by_id = {f['id']: f for f in files}
+    for file_id, entry in current.items():
+        entry['display_name'] = files_by_id[file_id].get('display_name')
+    diff = diff_course_files(stored, current)
+    counts = {key: len(file_ids) for key, file_ids in diff.items()}
+    logger.info(f"Course {course_id} sync: {counts}")
+
+    if not (diff['new'] or diff['changed'] or diff['removed']):
+        report('finalize', progress('finalize', 1.0), "Course files are up to date")
+        return {**counts, 'failed': [], 'refreshed_topics': []}
+
+    # Step 2: Download and upload only the new and changed files
+    to_fetch = [files_by_id[file_id] for file_id in diff['new'] + diff['changed']]
+    try:
+        report('download', progress('download'), f"Downloading {len(to_fetch)} new or changed files...")
+        canvas_service.download_files(to_fetch, CANVAS_TOKEN, course_id)
+        report('upload', progress('upload'), f"Uploading {len(to_fetch)} files to Google Cloud Storage...")
+        gcs_service.upload_course_files(to_fetch, course_id)
+    finally:
+        _remove_local_files(course_id)
+    uploaded = [f for f in to_fetch if f.get('gcs_uri')]
+
+    # Step 3: Replace the corpus entries of uploaded files (also any left by
+    # an interrupted sync), then drop removed and renamed files
+    report('import', progress('import'), f"Importing {len(uploaded)} files into the RAG corpus...")
+    removed_uris = [stored[file_id].get('gcs_uri') for file_id in diff['removed']]
+    renamed_uris = [stored[f['id']].get('gcs_uri') for f in uploaded
+                    if f['id'] in stored and stored[f['id']].get('gcs_uri') != f['gcs_uri']]
+    rag_service.delete_corpus_files(corpus_id, [f['gcs_uri'] for f in uploaded] + removed_uris + renamed_uris)
+    for gcs_uri in removed_uris + renamed_uris:
+        if gcs_uri:
+            gcs_service.delete_file(gcs_uri)
+    imported = set()
+    rag_service.import_corpus_files(corpus_id, uploaded, on_imported=lambda file: imported.add(file['id']))
+
+    # Unchanged and failed files keep their stored entry (failed ones are retried next sync)
+    indexed_files = {}
+    for file_id, entry in current.items():
+        if file_id in imported:
+            indexed_files[file_id] = {**entry, 'gcs_uri': files_by_id[file_id]['gcs_uri']}
+        elif file_id in stored:
+            indexed_files[file_id] = {**stored[file_id], 'url': entry.get('url')}
+    failed = sorted(set(diff['new'] + diff['changed']) - imported)
+
+    graph_files = [files_by_id[file_id] for file_id in indexed_files]
+    source_index = kg_service.build_source_index(files=graph_files, indexed_files=indexed_files)
+    for attempt in range(1, SYNC_GRAPH_WRITE_ATTEMPTS + 1):
+        # Step 4: Re-summarize only the topics affected by the changed files
+        report('refresh_topics', progress('refresh_topics'), "Updating topics that use the changed files...")
+        graph_doc = firestore_service.get_course_data(course_id, fresh=True)
+        nodes, edges, kg_data = firestore_service.get_knowledge_graph(course_id, graph_doc, include_embeddings=True)
+        kg_nodes, kg_edges, kg_data_json, refreshed_topics = kg_service.sync_graph_files(
+            nodes, edges, kg_data, graph_files,
+            stale_file_ids=set(diff['removed']) | (set(diff['changed']) & imported),
+            new_file_ids=set(diff['new']) & imported,
+            corpus_id=corpus_id,
+            source_index=source_index,
+            summary_mode=summary_mode
+        )
+
+        # Step 5: Store only what the sync changed, unless the graph was edited meanwhile
+        report('finalize', progress('finalize'), "Saving course...")
+        topics, topic_updates = _synced_topic_writes(
+            edges, kg_data, json.loads(kg_nodes), json.loads(kg_edges), json.loads(kg_data_json), refreshed_topics
+        )
+        try:
+            firestore_service.put_graph_topics(
+                course_id, topics, source_index=source_index, topic_updates=topic_updates,
+                expected_version=((graph_doc.to_dict() if graph_doc.exists else None) or {}).get('kg_version', 0),
+                file_nodes=[node for node in json.loads(kg_nodes) if node.get('group') != 'topic'],
+                indexed_files=indexed_files
+            )
+            break
+        except firestore_service.GraphVersionConflict:
+            if attempt == SYNC_GRAPH_WRITE_ATTEMPTS:
+                raise
+            logger.warning(f"Graph of course {course_id} was edited during the sync, refreshing topics again")
+
+    # Cached answers may cite changed or removed files
+    semantic_cache_service.invalidate_course(course_id)
+    logger.info(f"Course {course_id} sync complete ({len(refreshed_topics)} topics refreshed)")
+
+    return {**counts, 'failed': failed, 'refreshed_topics': refreshed_topics}
+
+
+def _synced_topic_writes(old_edges: list, old_data: dict, nodes: list, edges: list, data: dict, refreshed: list) -> tuple:
+    """
+    Turns a synced graph into put_graph_topics writes: full records for the
+    refreshed topics, and edge/embedding updates for other topics whose
+    file or related edges changed.
+
+    Returns:
+        Tuple of (topics, topic_updates) for firestore_service.put_graph_topics
+    """
+    topic_nodes = {node['id']: node for node in nodes if node.get('group') == 'topic'}
+    topics, topic_updates = [], {}
+    for topic_id, node in topic_nodes.items():
+        topic_edges = [edge for edge in edges if edge.get('from') == topic_id]
+        if topic_id in refreshed:
+            topics.append((node, topic_edges, data.get(topic_id, {})))
+            continue
+        fields = {}
+        if topic_edges != [edge for edge in old_edges if edge.get('from') == topic_id]:
+            fields['edges'] = topic_edges
+        if data.get(topic_id, {}).get('embedding') and 'embedding' not in old_data.get(topic_id, {}):
+            fields['embedding'] = data[topic_id]['embedding']
+        if fields:
+            topic_updates[topic_id] = fields
+    return topics, topic_updates
+
+
+def enqueue_sync(course_id: str, summary_mode: str = None) -> str:
+    """
+    Queues a sync of an ACTIVE course with its current Canvas files.
+
+    Args:
+        course_id: The Canvas course ID
+        summary_mode: Optional 'per_topic' or 'batched'
+
+    Returns:
+        The job ID to poll with job_queue_service.get_job_status; the
+        existing job's ID if a sync is already queued or running
+
+    Raises:
+        JobConflictError: If the course is being initialized
+    """
+    return job_queue_service.enqueue_job(SYNC_JOB_KIND, {
+        'course_id': course_id,
+        'summary_mode': summary_mode
+    }, dedupe_key=_course_job_key(course_id))
+
+
+def run_sync_job(payload: dict, job) -> dict:
+    """Job handler: runs run_sync with the job's progress reporting."""
+    logger.info(f"Starting sync for course {payload['course_id']} (attempt {job.attempt})")
+    return run_sync(payload['course_id'], summary_mode=payload.get('summary_mode'), report=job.report)
+
+
+job_queue_service.register_handler(INIT_JOB_KIND, run_initialization_job, on_failure=_mark_initialization_failed)
+# A failed sync leaves the course ACTIVE with its previous files
+job_queue_service.register_handler(SYNC_JOB_KIND, run_sync_job)
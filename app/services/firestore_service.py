@@ -2,10 +2,24 @@
 Firestore Service
 Handles all Cloud Firestore operations for course data persistence.
 """
+from google.api_core import exceptions as google_exceptions
 from google.cloud import firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
+from collections import OrderedDict
+import json
 import os
 import logging
+import sys
+import threading
+import time
+import uuid
+
+# Handle imports for both module use and standalone testing
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+    from app.services import concurrency
+else:
+    from . import concurrency
 
 logger = logging.getLogger(__name__)
 
@@ -26,9 +40,39 @@ except Exception as e:
     logger.error(f"Failed to initialize Firestore: {e}")
     db = None
 
+# asyncio-native client for the ASGI serving mode (see app/asgi.py)
+_get_async_db = concurrency.loop_local(
+    lambda: firestore.AsyncClient(project=PROJECT_ID) if PROJECT_ID else firestore.AsyncClient()
+)
+
 COURSES_COLLECTION = 'courses'
+# Per-topic graph records: courses/{course_id}/kg_topics_{kg_generation}/{topic_id}
+# (courses/{course_id}/kg_topics/{topic_id} for courses without a kg_generation)
+KG_TOPICS_COLLECTION = 'kg_topics'
+# Initialization progress: courses/{course_id}/init_checkpoints/{stage}
+INIT_CHECKPOINTS_COLLECTION = 'init_checkpoints'
 ANALYTICS_COLLECTION = 'course_analytics'
 REPORTS_COLLECTION = 'analytics_reports'
+# Background jobs (see job_queue_service)
+JOBS_COLLECTION = 'jobs'
+JOB_LOCKS_COLLECTION = 'job_locks'
+
+# Course document cache configuration (per worker process)
+COURSE_CACHE_TTL_SECONDS = float(os.environ.get('COURSE_CACHE_TTL_SECONDS', '30'))
+COURSE_CACHE_MAX_ENTRIES = int(os.environ.get('COURSE_CACHE_MAX_ENTRIES', '256'))
+# Keep cached courses fresh with on_snapshot listeners instead of the TTL
+COURSE_CACHE_LISTENERS = os.environ.get('COURSE_CACHE_LISTENERS', 'false').lower() == 'true'
+
+_course_cache = OrderedDict()  # course_id -> (fetched_at, DocumentSnapshot)
+_course_generations = {}  # course_id -> bumped on every invalidation
+_course_watches = {}  # course_id -> on_snapshot Watch
+_course_cache_lock = threading.Lock()
+_course_cache_stats = {'hits': 0, 'misses': 0}
+_topic_records_cache = OrderedDict()  # course_id -> ((kg_version, kg_updated_at), records)
+_graph_json_cache = OrderedDict()  # course_id -> ((kg_version, kg_updated_at), serialized graph bytes)
+
+# Firestore allows at most 500 writes per batch
+MAX_BATCH_WRITES = 450
 
 
 def _ensure_db():
@@ -40,6 +84,129 @@ def _ensure_db():
         )
 
 
+def _get_course_snapshot(course_id: str):
+    """
+    Read-through cache for course documents.
+    
+    Snapshots are reused until they are older than COURSE_CACHE_TTL_SECONDS,
+    or indefinitely while an on_snapshot listener keeps them current.
+    Every write in this module invalidates the cached copy.
+    """
+    snapshot, generation = _lookup_course_snapshot(course_id)
+    if snapshot is not None:
+        return snapshot
+
+    snapshot = db.collection(COURSES_COLLECTION).document(course_id).get()
+    _remember_course_snapshot(course_id, snapshot, generation)
+    return snapshot
+
+
+def _lookup_course_snapshot(course_id: str) -> tuple:
+    """
+    Returns (cached snapshot, None) on a hit, or (None, generation) on a miss.
+    The generation must be passed to _remember_course_snapshot with the
+    freshly read snapshot.
+    """
+    with _course_cache_lock:
+        entry = _course_cache.get(course_id)
+        if entry is not None:
+            fetched_at, snapshot = entry
+            if course_id in _course_watches or time.monotonic() - fetched_at < COURSE_CACHE_TTL_SECONDS:
+                _course_cache.move_to_end(course_id)
+                _course_cache_stats['hits'] += 1
+                return snapshot, None
+        _course_cache_stats['misses'] += 1
+        return None, _course_generations.get(course_id, 0)
+
+
+def _remember_course_snapshot(course_id: str, snapshot, generation: int) -> None:
+    """Caches a snapshot read after a miss, unless the course was written meanwhile."""
+    with _course_cache_lock:
+        # Skip storing if the document was written while we were reading it
+        if _course_generations.get(course_id, 0) == generation and COURSE_CACHE_TTL_SECONDS > 0:
+            _store_course_snapshot(course_id, snapshot)
+
+    if COURSE_CACHE_LISTENERS:
+        _watch_course(course_id)
+
+
+def _store_course_snapshot(course_id: str, snapshot) -> None:
+    """Stores a snapshot and evicts the least recently used courses (lock held)."""
+    _course_cache[course_id] = (time.monotonic(), snapshot)
+    _course_cache.move_to_end(course_id)
+    while len(_course_cache) > COURSE_CACHE_MAX_ENTRIES:
+        evicted_id, _ = _course_cache.popitem(last=False)
+        watch = _course_watches.pop(evicted_id, None)
+        if watch is not None:
+            watch.unsubscribe()
+
+
+def _watch_course(course_id: str) -> None:
+    """Registers an on_snapshot listener that keeps the cached document current."""
+    with _course_cache_lock:
+        if course_id in _course_watches or course_id not in _course_cache:
+            return
+
+    def on_snapshot(doc_snapshots, changes, read_time):
+        with _course_cache_lock:
+            if course_id not in _course_watches:
+                return
+            if doc_snapshots:
+                _store_course_snapshot(course_id, doc_snapshots[0])
+            else:
+                _course_cache.pop(course_id, None)
+
+    try:
+        watch = db.collection(COURSES_COLLECTION).document(course_id).on_snapshot(on_snapshot)
+    except Exception as e:
+        logger.warning(f"Could not watch course {course_id}, falling back to TTL: {e}")
+        return
+
+    with _course_cache_lock:
+        if course_id in _course_watches or course_id not in _course_cache:
+            watch.unsubscribe()
+        else:
+            _course_watches[course_id] = watch
+
+
+def invalidate_course_cache(course_id: str = None) -> None:
+    """
+    Drops the cached course document for one course, or for every course
+    if course_id is None. Listeners stay registered and repopulate the cache.
+    
+    Args:
+        course_id: The Canvas course ID (optional)
+    """
+    with _course_cache_lock:
+        if course_id is None:
+            for cached_id in list(_course_cache):
+                _course_generations[cached_id] = _course_generations.get(cached_id, 0) + 1
+            _course_cache.clear()
+            _topic_records_cache.clear()
+            _graph_json_cache.clear()
+        else:
+            _course_generations[course_id] = _course_generations.get(course_id, 0) + 1
+            _course_cache.pop(course_id, None)
+            _topic_records_cache.pop(course_id, None)
+            _graph_json_cache.pop(course_id, None)
+
+
+def get_course_cache_stats() -> dict:
+    """
+    Returns hit/miss counters for the course document cache of this worker.
+    
+    Example:
+        get_course_cache_stats()  # {'hits': 120, 'misses': 6, 'entries': 3, 'listeners': 0}
+    """
+    with _course_cache_lock:
+        return {
+            'hits': _course_cache_stats['hits'],
+            'misses': _course_cache_stats['misses'],
+            'entries': len(_course_cache),
+            'listeners': len(_course_watches)
+        }
+
+
 def get_course_state(course_id: str) -> str:
     """
     Returns the current state of the course.
@@ -52,7 +219,7 @@ def get_course_state(course_id: str) -> str:
     """
     _ensure_db()
     try:
-        doc = db.collection(COURSES_COLLECTION).document(course_id).get()
+        doc = _get_course_snapshot(course_id)
         
         if not doc.exists:
             return 'NEEDS_INIT'
@@ -85,6 +252,7 @@ def create_course_doc(course_id: str) -> None:
         'status': 'GENERATING',
         'init_logs': []  # Initialize empty logs array
     })
+    invalidate_course_cache(course_id)
 
 
 def add_init_log(course_id: str, message: str, level: str = 'info') -> None:
@@ -107,6 +275,7 @@ def add_init_log(course_id: str, message: str, level: str = 'info') -> None:
     db.collection(COURSES_COLLECTION).document(course_id).update({
         'init_logs': ArrayUnion([log_entry])
     })
+    invalidate_course_cache(course_id)
 
 
 def get_init_logs(course_id: str) -> list:
@@ -126,32 +295,108 @@ def get_init_logs(course_id: str) -> list:
     return []
 
 
+def _version_field_paths(kind: str) -> list:
+    """Course fields that identify the current graph ('kg'), analytics report ('report') or semantic cache."""
+    return [f'{kind}_version', f'{kind}_updated_at']
+
+
+def _same_version(snapshot, current, field_paths: list) -> bool:
+    """True if a cached snapshot has the same version fields as a freshly read (masked) one."""
+    if snapshot.exists != current.exists:
+        return False
+    cached = (snapshot.to_dict() if snapshot.exists else None) or {}
+    latest = (current.to_dict() if current.exists else None) or {}
+    return all(cached.get(field) == latest.get(field) for field in field_paths)
+
+
+def _fresh_course_generation(course_id: str) -> int:
+    with _course_cache_lock:
+        return _course_generations.get(course_id, 0)
+
+
 # returns the google.cloud.firestore.document.DocumentSnapshot class
-def get_course_data(course_id: str):
+def get_course_data(course_id: str, fresh: bool = False, validate: str = None):
     """
     Fetches the complete course document.
+    Served from the per-worker course cache when a fresh copy is available.
     
     Args:
         course_id: The Canvas course ID
+        fresh: Read past the cache (for callers that write based on what they
+               read, such as topic edits); the cache is refreshed with the result
+        validate: Optional 'kg', 'report' or 'semantic_cache': check a cached copy
+                  against the stored version fields (a read of just those fields)
+                  and re-read the document if another worker changed them. Used by
+                  routes that answer 304 Not Modified from the version.
         
     Returns:
         DocumentSnapshot containing all course data
     """
     _ensure_db()
-    return db.collection(COURSES_COLLECTION).document(course_id).get()
+    doc_ref = db.collection(COURSES_COLLECTION).document(course_id)
+    if not fresh:
+        snapshot, generation = _lookup_course_snapshot(course_id)
+        if snapshot is None:
+            snapshot = doc_ref.get()
+            _remember_course_snapshot(course_id, snapshot, generation)
+            return snapshot
+        # Listeners keep the cached copy current already
+        if not validate or course_id in _course_watches:
+            return snapshot
+        field_paths = _version_field_paths(validate)
+        if _same_version(snapshot, doc_ref.get(field_paths=field_paths), field_paths):
+            return snapshot
+
+    generation = _fresh_course_generation(course_id)
+    snapshot = doc_ref.get()
+    _remember_course_snapshot(course_id, snapshot, generation)
+    return snapshot
+
+
+async def get_course_data_async(course_id: str, fresh: bool = False, validate: str = None):
+    """
+    Async variant of get_course_data using the Firestore AsyncClient.
+    Shares the per-worker course cache with the sync functions.
+    
+    Args:
+        course_id: The Canvas course ID
+        fresh: Read past the cache (see get_course_data)
+        validate: Optional 'kg' or 'report' version check of a cached copy (see get_course_data)
+        
+    Returns:
+        DocumentSnapshot containing all course data
+    """
+    doc_ref = _get_async_db().collection(COURSES_COLLECTION).document(course_id)
+    if not fresh:
+        snapshot, generation = _lookup_course_snapshot(course_id)
+        if snapshot is None:
+            snapshot = await doc_ref.get()
+            _remember_course_snapshot(course_id, snapshot, generation)
+            return snapshot
+        if not validate or course_id in _course_watches:
+            return snapshot
+        field_paths = _version_field_paths(validate)
+        if _same_version(snapshot, await doc_ref.get(field_paths=field_paths), field_paths):
+            return snapshot
+
+    generation = _fresh_course_generation(course_id)
+    snapshot = await doc_ref.get()
+    _remember_course_snapshot(course_id, snapshot, generation)
+    return snapshot
 
 
 
 
 # call with dictionary of:
-# corpus_id, indexed_files, kg_nodes, kg_edges, kg_data
+# corpus_id, indexed_files (the graph itself is written with update_knowledge_graph)
 def finalize_course_doc(course_id: str, data: dict) -> None:
     """
     Updates the course document with all RAG/KG data and sets status to ACTIVE.
     
     Args:
         course_id: The Canvas course ID
-        data: Dictionary containing corpus_id, indexed_files, kg_nodes, kg_edges, kg_data
+        data: Dictionary containing corpus_id and indexed_files
+              (kg_nodes, kg_edges, kg_data only for the single-document graph layout)
     """
     _ensure_db()
     db.collection(COURSES_COLLECTION).document(course_id).update({
@@ -162,39 +407,729 @@ def finalize_course_doc(course_id: str, data: dict) -> None:
         'kg_edges': data.get('kg_edges'),
         'kg_data': data.get('kg_data')
     })
+    invalidate_course_cache(course_id)
+
+
+def mark_course_error(course_id: str, error_message: str) -> None:
+    """
+    Marks a course as failed during initialization.
+    
+    Args:
+        course_id: The Canvas course ID
+        error_message: Description of the failure shown to the professor
+    """
+    _ensure_db()
+    db.collection(COURSES_COLLECTION).document(course_id).update({
+        'status': 'ERROR',
+        'error_message': error_message
+    })
+    invalidate_course_cache(course_id)
+
+# ============================================================================
+# INITIALIZATION CHECKPOINTS
+# ============================================================================
+# course_init_service records each stage's output in the course's
+# init_checkpoints subcollection (one document per stage), so a failed
+# initialization resumes where it stopped. Per-item fields are keyed by
+# Canvas file ID. The checkpoints are cleared once the course is ACTIVE.
+
+def _checkpoints_ref(course_id: str):
+    return db.collection(COURSES_COLLECTION).document(course_id).collection(INIT_CHECKPOINTS_COLLECTION)
+
+
+def get_init_checkpoints(course_id: str) -> dict:
+    """
+    Reads every initialization checkpoint of a course.
+    
+    Args:
+        course_id: The Canvas course ID
+        
+    Returns:
+        Dictionary mapping stage name to its checkpoint fields (empty if none)
+        
+    Example:
+        get_init_checkpoints('12345')
+        # {'manifest': {'files': [...], 'indexed_files': {...}},
+        #  'uploads': {'456': 'gs://bucket/courses/12345/Chapter1.pdf'}}
+    """
+    _ensure_db()
+    return {doc.id: doc.to_dict() or {} for doc in _checkpoints_ref(course_id).stream()}
+
+
+def save_init_checkpoint(course_id: str, stage: str, fields: dict) -> None:
+    """
+    Merges fields into a stage's checkpoint (nested maps are merged, not replaced).
+    
+    Args:
+        course_id: The Canvas course ID
+        stage: Checkpoint name, e.g. 'uploads'
+        fields: Fields to merge, e.g. {'456': 'gs://bucket/courses/12345/Chapter1.pdf'}
+    """
+    _ensure_db()
+    _checkpoints_ref(course_id).document(stage).set(fields, merge=True)
 
-def update_knowledge_graph(course_id: str, kg_nodes: list, kg_edges: list, kg_data: dict) -> None:
+
+def clear_init_checkpoints(course_id: str) -> None:
+    """Deletes all initialization checkpoints of a course."""
+    _ensure_db()
+    batch = db.batch()
+    for doc_ref in _checkpoints_ref(course_id).list_documents():
+        batch.delete(doc_ref)
+    batch.commit()
+
+
+# ============================================================================
+# KNOWLEDGE GRAPH STORAGE
+# ============================================================================
+#
+# Each topic is its own document in the course's kg_topics subcollection:
+#     {'position': 3, 'node': {...}, 'edges': [{'from': 'topic_3', ...}], 'data': {'summary': ..., 'sources': [...]},
+#      'embedding': [...]}
+# The course document keeps the file nodes (kg_files, JSON string) and a
+# kg_version counter (with kg_updated_at) bumped by every graph write, so
+# editing one topic writes one small document and large courses stay under
+# the 1 MiB limit. The version also validates HTTP caches of the graph.
+# Courses written before this layout keep kg_nodes/kg_edges/kg_data on the
+# course document and are converted on their first edit.
+# The summary embedding (used for related-topic edges) is kept next to the
+# topic data and only returned to callers that ask for it.
+
+class GraphVersionConflict(Exception):
+    """A conditional graph write found that kg_version moved since the caller read the graph."""
+
+
+def _graph_version_fields() -> dict:
+    """Course document fields that mark a new graph version."""
+    return {'kg_version': firestore.Increment(1), 'kg_updated_at': firestore.SERVER_TIMESTAMP}
+
+
+def _topic_position(topic_id: str) -> int:
+    """Sort key for topic records: the number in 'topic_<n>'."""
+    suffix = topic_id.rsplit('_', 1)[-1]
+    return int(suffix) if suffix.isdigit() else 0
+
+
+def _topic_record(topic_node: dict, topic_edges: list, topic_data: dict) -> dict:
+    """Builds the stored record of one topic, with its embedding beside the data."""
+    record = {
+        'position': _topic_position(topic_node['id']),
+        'node': topic_node,
+        'edges': topic_edges,
+        'data': {key: value for key, value in topic_data.items() if key != 'embedding'}
+    }
+    if topic_data.get('embedding'):
+        record['embedding'] = topic_data['embedding']
+    return record
+
+
+def _split_graph(nodes: list, edges: list, data: dict) -> tuple:
+    """
+    Splits a full graph into file nodes and per-topic records.
+    Edges are stored with the topic they start from (or touch, for file-to-topic edges).
+    """
+    topic_ids = {node['id'] for node in nodes if node.get('group') == 'topic'}
+    file_nodes = [node for node in nodes if node.get('group') != 'topic']
+    records = {
+        node['id']: _topic_record(node, [], data.get(node['id'], {}))
+        for node in nodes if node.get('group') == 'topic'
+    }
+    for edge in edges:
+        owner = edge.get('from') if edge.get('from') in topic_ids else edge.get('to')
+        if owner in records:
+            records[owner]['edges'].append(edge)
+    return file_nodes, records
+
+
+def _assemble_graph(file_nodes: list, records: list, include_embeddings: bool = False) -> tuple:
+    """Joins file nodes and topic records back into (nodes, edges, data), files first, topics in order."""
+    records = sorted(records, key=lambda record: record.get('position', 0))
+    nodes = list(file_nodes) + [record['node'] for record in records]
+    edges = [edge for record in records for edge in record.get('edges', [])]
+    data = {}
+    for record in records:
+        data[record['node']['id']] = record.get('data', {})
+        if include_embeddings and record.get('embedding'):
+            data[record['node']['id']] = {**data[record['node']['id']], 'embedding': record['embedding']}
+    return nodes, edges, data
+
+
+def _legacy_graph(course: dict, include_embeddings: bool = False) -> tuple:
+    """Reads a graph stored in the single-document layout."""
+    data = json.loads(course.get('kg_data') or '{}')
+    if not include_embeddings:
+        data = {topic_id: {key: value for key, value in entry.items() if key != 'embedding'}
+                for topic_id, entry in data.items()}
+    return json.loads(course.get('kg_nodes') or '[]'), json.loads(course.get('kg_edges') or '[]'), data
+
+
+def _topic_generation(course: dict):
+    """The kg_generation whose topic records the course document points to (None: the original collection)."""
+    generation = course.get('kg_generation')
+    return generation if isinstance(generation, str) else None
+
+
+def _topics_collection(generation: str = None) -> str:
+    return f"{KG_TOPICS_COLLECTION}_{generation}" if generation else KG_TOPICS_COLLECTION
+
+
+def _topics_ref(course_id: str, generation: str = None):
+    return db.collection(COURSES_COLLECTION).document(course_id).collection(_topics_collection(generation))
+
+
+def _graph_cache_key(course: dict) -> tuple:
+    """
+    Identifies a graph version for the per-worker caches.
+
+    kg_version alone isn't enough: re-initializing a course recreates its
+    document, so the counter starts over and an old graph could otherwise
+    match. kg_updated_at is set by the same writes and never repeats.
+    """
+    return course.get('kg_version', 0), course.get('kg_updated_at')
+
+
+def _cached_topic_records(course_id: str, version_key: tuple):
+    """Returns the cached topic records for this graph version, or None."""
+    with _course_cache_lock:
+        entry = _topic_records_cache.get(course_id)
+        if entry is not None and entry[0] == version_key:
+            _topic_records_cache.move_to_end(course_id)
+            return entry[1]
+    return None
+
+
+def _remember_topic_records(course_id: str, version_key: tuple, records: list) -> None:
+    with _course_cache_lock:
+        _topic_records_cache[course_id] = (version_key, records)
+        _topic_records_cache.move_to_end(course_id)
+        while len(_topic_records_cache) > COURSE_CACHE_MAX_ENTRIES:
+            _topic_records_cache.popitem(last=False)
+
+
+def _serialize_graph(nodes: list, edges: list, data: dict) -> bytes:
+    """Encodes a graph as the compact JSON object {"nodes":[...],"edges":[...],"data":{...}}."""
+    return json.dumps({'nodes': nodes, 'edges': edges, 'data': data}, separators=(',', ':')).encode('utf-8')
+
+
+def _legacy_graph_json(course: dict) -> bytes:
+    """Splices the JSON strings stored on a single-document course into one object, without decoding them."""
+    return b''.join([
+        b'{"nodes":', (course.get('kg_nodes') or '[]').encode('utf-8'),
+        b',"edges":', (course.get('kg_edges') or '[]').encode('utf-8'),
+        b',"data":', (course.get('kg_data') or '{}').encode('utf-8'),
+        b'}'
+    ])
+
+
+def _cached_graph_json(course_id: str, version_key: tuple):
+    """Returns the serialized graph cached for this version, or None."""
+    with _course_cache_lock:
+        entry = _graph_json_cache.get(course_id)
+        if entry is not None and entry[0] == version_key:
+            _graph_json_cache.move_to_end(course_id)
+            return entry[1]
+    return None
+
+
+def _remember_graph_json(course_id: str, version_key: tuple, body: bytes) -> None:
+    with _course_cache_lock:
+        _graph_json_cache[course_id] = (version_key, body)
+        _graph_json_cache.move_to_end(course_id)
+        while len(_graph_json_cache) > COURSE_CACHE_MAX_ENTRIES:
+            _graph_json_cache.popitem(last=False)
+
+
+def get_knowledge_graph(course_id: str, course_doc=None, include_embeddings: bool = False) -> tuple:
     """
-    Updates only the knowledge graph portion of a course document.
-    Does NOT overwrite corpus_id, indexed_files, or status.
+    Reads a course's knowledge graph, whichever layout it is stored in.
+
+    Topic records are cached per worker and reused while the course's
+    kg_version and kg_updated_at are unchanged, so only the (cached) course
+    document is read when nothing was edited.
 
     Args:
         course_id: The Canvas course ID
-        kg_nodes: Updated list of node dicts
-        kg_edges: Updated list of edge dicts
-        kg_data:  Updated dict keyed by topic_id
+        course_doc: The course DocumentSnapshot if the caller already has it
+        include_embeddings: Add each topic's summary embedding to its data
+                            (needed to update related edges, never sent to clients)
+
+    Returns:
+        Tuple of (nodes, edges, data) as lists/dicts, in display order
+
+    Example:
+        nodes, edges, data = get_knowledge_graph('12345')
+        # nodes = [{'id': '101', 'group': 'file_pdf', ...}, {'id': 'topic_1', 'group': 'topic', ...}]
+    """
+    _ensure_db()
+    if course_doc is None:
+        course_doc = _get_course_snapshot(course_id)
+    course = (course_doc.to_dict() if course_doc.exists else None) or {}
+
+    if course.get('kg_storage') != 'topics':
+        return _legacy_graph(course, include_embeddings)
+
+    version_key = _graph_cache_key(course)
+    records = _cached_topic_records(course_id, version_key)
+    if records is None:
+        records = [doc.to_dict() for doc in _topics_ref(course_id, _topic_generation(course)).stream()]
+        _remember_topic_records(course_id, version_key, records)
+    return _assemble_graph(json.loads(course.get('kg_files') or '[]'), records, include_embeddings)
+
+
+async def get_knowledge_graph_async(course_id: str, course_doc=None) -> tuple:
+    """
+    Async variant of get_knowledge_graph using the Firestore AsyncClient.
+    Shares the topic record cache with the sync function.
+    """
+    if course_doc is None:
+        course_doc = await get_course_data_async(course_id)
+    course = (course_doc.to_dict() if course_doc.exists else None) or {}
+
+    if course.get('kg_storage') != 'topics':
+        return _legacy_graph(course)
+
+    version_key = _graph_cache_key(course)
+    records = _cached_topic_records(course_id, version_key)
+    if records is None:
+        topics_ref = (_get_async_db().collection(COURSES_COLLECTION).document(course_id)
+                      .collection(_topics_collection(_topic_generation(course))))
+        records = [doc.to_dict() for doc in await topics_ref.get()]
+        _remember_topic_records(course_id, version_key, records)
+    return _assemble_graph(json.loads(course.get('kg_files') or '[]'), records)
+
+
+def get_knowledge_graph_json(course_id: str, course_doc=None) -> bytes:
+    """
+    Returns a course's knowledge graph as ready-to-send JSON bytes:
+    {"nodes": [...], "edges": [...], "data": {...}} (no embeddings).
+
+    Single-document courses splice their stored JSON strings together
+    without decoding them. Per-topic courses are serialized once per
+    kg_version and the bytes are reused by later requests.
+
+    Args:
+        course_id: The Canvas course ID
+        course_doc: The course DocumentSnapshot if the caller already has it
+
+    Returns:
+        UTF-8 encoded JSON object
+
+    Example:
+        body = get_knowledge_graph_json('12345')
+        # b'{"nodes":[{"id":"101",...}],"edges":[...],"data":{"topic_1":{...}}}'
     """
     _ensure_db()
+    if course_doc is None:
+        course_doc = _get_course_snapshot(course_id)
+    course = (course_doc.to_dict() if course_doc.exists else None) or {}
+
+    if course.get('kg_storage') != 'topics':
+        return _legacy_graph_json(course)
+
+    version_key = _graph_cache_key(course)
+    body = _cached_graph_json(course_id, version_key)
+    if body is None:
+        body = _serialize_graph(*get_knowledge_graph(course_id, course_doc))
+        _remember_graph_json(course_id, version_key, body)
+    return body
+
+
+async def get_knowledge_graph_json_async(course_id: str, course_doc=None) -> bytes:
+    """
+    Async variant of get_knowledge_graph_json. Shares the serialized graph
+    cache with the sync function.
+    """
+    if course_doc is None:
+        course_doc = await get_course_data_async(course_id)
+    course = (course_doc.to_dict() if course_doc.exists else None) or {}
+
+    if course.get('kg_storage') != 'topics':
+        return _legacy_graph_json(course)
+
+    version_key = _graph_cache_key(course)
+    body = _cached_graph_json(course_id, version_key)
+    if body is None:
+        body = _serialize_graph(*await get_knowledge_graph_async(course_id, course_doc))
+        _remember_graph_json(course_id, version_key, body)
+    return body
+
 
+def get_graph_topic(course_id: str, topic_id: str, course_doc=None) -> tuple:
+    """
+    Reads one topic of a course's knowledge graph with the file nodes it links to.
+
+    Uses the cached topic records when they're current, otherwise reads
+    only that topic's record, so opening a topic never loads the whole graph.
+
+    Args:
+        course_id: The Canvas course ID
+        topic_id: The topic to read (e.g., 'topic_3')
+        course_doc: The course DocumentSnapshot if the caller already has it
+
+    Returns:
+        Tuple of (nodes, edges, data) for the topic's subgraph; ([], [], {}) if the topic doesn't exist
+
+    Example:
+        nodes, edges, data = get_graph_topic('12345', 'topic_3')
+        # nodes = [{'id': 'topic_3', 'group': 'topic', ...}, {'id': '101', 'group': 'file_pdf', ...}]
+        # data = {'topic_3': {'summary': ..., 'sources': [...]}}
+    """
+    _ensure_db()
+    if course_doc is None:
+        course_doc = _get_course_snapshot(course_id)
+    course = (course_doc.to_dict() if course_doc.exists else None) or {}
+
+    if course.get('kg_storage') != 'topics':
+        nodes, edges, data = _legacy_graph(course)
+        file_nodes = [node for node in nodes if node.get('group') != 'topic']
+        topic_node = next((node for node in nodes if node.get('id') == topic_id and node.get('group') == 'topic'), None)
+        record = topic_node and {
+            'node': topic_node,
+            'edges': [edge for edge in edges if topic_id in (edge.get('from'), edge.get('to'))],
+            'data': data.get(topic_id, {})
+        }
+    else:
+        file_nodes = json.loads(course.get('kg_files') or '[]')
+        records = _cached_topic_records(course_id, _graph_cache_key(course))
+        if records is not None:
+            record = next((r for r in records if r['node']['id'] == topic_id), None)
+        else:
+            snapshot = _topics_ref(course_id, _topic_generation(course)).document(topic_id).get()
+            record = snapshot.to_dict() if snapshot.exists else None
+
+    if not record:
+        return [], [], {}
+    linked = {edge.get('to') for edge in record.get('edges', [])} | {edge.get('from') for edge in record.get('edges', [])}
+    nodes = [record['node']] + [node for node in file_nodes if node.get('id') in linked]
+    return nodes, list(record.get('edges', [])), {topic_id: record.get('data', {})}
+
+
+def update_knowledge_graph(course_id: str, kg_nodes: str, kg_edges: str, kg_data: str, source_index: dict = None) -> str:
+    """
+    Replaces the whole knowledge graph of a course (used at initialization
+    and to convert older courses). Does NOT overwrite corpus_id,
+    indexed_files, or status. Single-topic edits should use
+    put_graph_topic / delete_graph_topic instead.
+
+    A graph can need more writes than one batch allows, so the topic
+    records are first written under a new kg_generation that readers don't
+    see yet. A single course update then switches kg_generation (and bumps
+    kg_version), and the replaced generation's records are deleted after
+    that. Readers see either the old graph or the new one, never a mix.
+
+    Args:
+        course_id: The Canvas course ID
+        kg_nodes: Updated node list (JSON string, as returned by kg_service)
+        kg_edges: Updated edge list (JSON string)
+        kg_data:  Updated dict keyed by topic_id (JSON string)
+        source_index: Optional source index to store as well (see kg_service.build_source_index)
+
+    Returns:
+        The new kg_generation
+    """
+    _ensure_db()
+
+    file_nodes, records = _split_graph(json.loads(kg_nodes), json.loads(kg_edges), json.loads(kg_data))
+    generation = uuid.uuid4().hex[:12]
+
+    # Step 1: Write the new generation's records (not read by anyone until step 2)
+    topics_ref = _topics_ref(course_id, generation)
+    writes = list(records.items())
+    for start in range(0, len(writes), MAX_BATCH_WRITES):
+        batch = db.batch()
+        for topic_id, record in writes[start:start + MAX_BATCH_WRITES]:
+            batch.set(topics_ref.document(topic_id), record)
+        batch.commit()
+
+    # Step 2: Switch the course to it in one update
     update_payload = {
-        'kg_nodes': kg_nodes,
-        'kg_edges': kg_edges,
-        'kg_data':  kg_data
+        **_graph_version_fields(),
+        'kg_storage': 'topics',
+        'kg_generation': generation,
+        'kg_files': json.dumps(file_nodes),
+        'kg_nodes': firestore.DELETE_FIELD,
+        'kg_edges': firestore.DELETE_FIELD,
+        'kg_data': firestore.DELETE_FIELD
     }
+    if source_index is not None:
+        update_payload['source_index'] = source_index
+    course_ref = db.collection(COURSES_COLLECTION).document(course_id)
+
+    @firestore.transactional
+    def _switch(transaction):
+        # Read in the transaction, so two replacements can't both delete the same old generation
+        snapshot = course_ref.get(transaction=transaction)
+        course = (snapshot.to_dict() if snapshot.exists else None) or {}
+        transaction.update(course_ref, update_payload)
+        return course.get('kg_storage') == 'topics', _topic_generation(course)
+
+    had_topics, old_generation = _switch(db.transaction())
+    invalidate_course_cache(course_id)
+
+    # Step 3: Delete the replaced generation's records
+    if had_topics:
+        old_refs = list(_topics_ref(course_id, old_generation).list_documents())
+        for start in range(0, len(old_refs), MAX_BATCH_WRITES):
+            batch = db.batch()
+            for doc_ref in old_refs[start:start + MAX_BATCH_WRITES]:
+                batch.delete(doc_ref)
+            batch.commit()
+
+    logger.info(f"Updated knowledge graph for course {course_id} ({len(records)} topic records, generation {generation})")
+    return generation
+
+
+def _ensure_topic_storage(course_id: str) -> tuple:
+    """
+    Converts a course stored in the single-document layout to per-topic records.
+
+    Returns:
+        Tuple of (converted, generation): True if it converted the course
+        (which bumps kg_version once), and the kg_generation to write topics to
+    """
+    # Read past the cache: converting from a stale copy could undo another worker's edit
+    course = db.collection(COURSES_COLLECTION).document(course_id).get().to_dict() or {}
+    if course.get('kg_storage') == 'topics':
+        return False, _topic_generation(course)
+    logger.info(f"Converting knowledge graph of course {course_id} to per-topic records")
+    generation = update_knowledge_graph(
+        course_id,
+        course.get('kg_nodes') or '[]',
+        course.get('kg_edges') or '[]',
+        course.get('kg_data') or '{}'
+    )
+    return True, generation
+
+
+def _commit_graph_write(course_id: str, add_writes, expected_version: int = None) -> None:
+    """
+    Commits one graph write. add_writes(writer) adds its operations to a
+    WriteBatch, or to a Transaction (same set/update/delete calls).
+    
+    With expected_version, the write runs in a transaction that first re-reads
+    the course's kg_version, so an edit computed from an older graph can't
+    overwrite a newer one.
+    
+    Raises:
+        GraphVersionConflict: If kg_version is no longer expected_version
+    """
+    if expected_version is None:
+        batch = db.batch()
+        add_writes(batch)
+        batch.commit()
+        return
+
+    course_ref = db.collection(COURSES_COLLECTION).document(course_id)
+
+    @firestore.transactional
+    def _write(transaction):
+        snapshot = course_ref.get(transaction=transaction)
+        current = ((snapshot.to_dict() if snapshot.exists else None) or {}).get('kg_version', 0)
+        if current != expected_version:
+            raise GraphVersionConflict(
+                f"Knowledge graph of course {course_id} changed (version {current}, expected {expected_version})"
+            )
+        add_writes(transaction)
+
+    try:
+        _write(db.transaction())
+    except GraphVersionConflict:
+        invalidate_course_cache(course_id)
+        raise
+
+
+def allocate_topic_ids(course_id: str, count: int) -> list:
+    """
+    Reserves `count` new 'topic_<n>' IDs for a course.
+
+    IDs come from a kg_next_topic counter on the course document, advanced
+    in a transaction, so editors on different workers never get the same ID
+    (and an edit can't overwrite another's new topic). Courses without the
+    counter (older or re-initialized ones) start after their highest stored
+    topic. IDs of topics that end up not being written are skipped.
+
+    Args:
+        course_id: The Canvas course ID
+        count: How many IDs to reserve
 
-    db.collection(COURSES_COLLECTION).document(course_id).update(update_payload)
+    Returns:
+        List of topic IDs, e.g. ['topic_12', 'topic_13']
+    """
+    _ensure_db()
+    if count <= 0:
+        return []
+    course_ref = db.collection(COURSES_COLLECTION).document(course_id)
+
+    @firestore.transactional
+    def _allocate(transaction):
+        snapshot = course_ref.get(transaction=transaction)
+        course = (snapshot.to_dict() if snapshot.exists else None) or {}
+        start = course.get('kg_next_topic')
+        if not isinstance(start, int):
+            if course.get('kg_storage') == 'topics':
+                topics_ref = _topics_ref(course_id, _topic_generation(course))
+                topic_ids = [doc_ref.id for doc_ref in topics_ref.list_documents()]
+            else:
+                topic_ids = [node.get('id', '') for node in json.loads(course.get('kg_nodes') or '[]')
+                             if node.get('group') == 'topic']
+            start = max((_topic_position(topic_id) for topic_id in topic_ids), default=0) + 1
+        transaction.update(course_ref, {'kg_next_topic': start + count})
+        return start
+
+    start = _allocate(db.transaction())
+    invalidate_course_cache(course_id)
+    return [f"topic_{number}" for number in range(start, start + count)]
+
+
+def _update_topic_records(batch, course_id: str, generation: str, topic_updates: dict) -> None:
+    """Adds partial updates of other topics' records (edges and/or embedding) to a batch."""
+    for topic_id, fields in (topic_updates or {}).items():
+        batch.update(_topics_ref(course_id, generation).document(topic_id), fields)
+
+
+def put_graph_topic(course_id: str, topic_node: dict, topic_edges: list, topic_data: dict, source_index: dict = None, topic_updates: dict = None,
+                    expected_version: int = None) -> None:
+    """
+    Adds or replaces one topic of a course's knowledge graph.
+    Writes only that topic's record (plus any topic_updates) and bumps
+    kg_version on the course, in one batch.
+
+    Args:
+        course_id: The Canvas course ID
+        topic_node: The topic node ({'id': 'topic_4', 'label': ..., 'group': 'topic'})
+        topic_edges: Edges from this topic
+        topic_data: The topic's {'summary', 'sources'} entry (and optional 'embedding')
+        source_index: Optional source index to store as well
+        topic_updates: Optional {topic_id: {'edges': [...], 'embedding': [...]}} for other
+                       topics whose related edges changed
+        expected_version: Optional kg_version the edit was computed from (see put_graph_topics)
+    """
+    put_graph_topics(course_id, [(topic_node, topic_edges, topic_data)],
+                     source_index=source_index, topic_updates=topic_updates,
+                     expected_version=expected_version)
+
+
+def put_graph_topics(course_id: str, topics: list, source_index: dict = None, topic_updates: dict = None,
+                     expected_version: int = None, file_nodes: list = None, indexed_files: dict = None) -> None:
+    """
+    Adds or replaces several topics of a course's knowledge graph in one
+    batch write (one kg_version bump), so readers never see half of them.
+
+    Args:
+        course_id: The Canvas course ID
+        topics: List of (topic_node, topic_edges, topic_data) tuples
+        source_index: Optional source index to store as well
+        topic_updates: Optional {topic_id: {'edges': [...], 'embedding': [...]}} for other
+                       topics whose related edges changed
+        expected_version: Optional kg_version of the graph the edit was computed
+                          from; the write is skipped if another edit landed since
+        file_nodes: Optional file nodes to store as the graph's kg_files
+        indexed_files: Optional indexed_files map to store (with synced_at) after a sync;
+                       part of the same versioned write, so the graph ETag covers it
+
+    Raises:
+        ValueError: If the write wouldn't fit in one batch (MAX_BATCH_WRITES)
+        GraphVersionConflict: If kg_version is no longer expected_version
+    """
+    _ensure_db()
+    if len(topics) + len(topic_updates or {}) + 1 > MAX_BATCH_WRITES:
+        raise ValueError(f"Too many topic writes for one batch (max {MAX_BATCH_WRITES - 1})")
+    converted, generation = _ensure_topic_storage(course_id)
+    if converted and expected_version is not None:
+        expected_version += 1
+
+    course_update = _graph_version_fields()
+    if source_index is not None:
+        course_update['source_index'] = source_index
+    if file_nodes is not None:
+        course_update['kg_files'] = json.dumps(file_nodes)
+    if indexed_files is not None:
+        course_update['indexed_files'] = indexed_files
+        course_update['synced_at'] = firestore.SERVER_TIMESTAMP
+
+    def add_writes(batch):
+        for topic_node, topic_edges, topic_data in topics:
+            batch.set(_topics_ref(course_id, generation).document(topic_node['id']),
+                      _topic_record(topic_node, topic_edges, topic_data))
+        _update_topic_records(batch, course_id, generation, topic_updates)
+        batch.update(db.collection(COURSES_COLLECTION).document(course_id), course_update)
 
-    logger.info(f"Updated knowledge graph for course {course_id}")
+    _commit_graph_write(course_id, add_writes, expected_version)
+    invalidate_course_cache(course_id)
 
+    logger.info(f"Stored {len(topics)} topic(s) for course {course_id}: {', '.join(node['id'] for node, _, _ in topics)}")
+
+
+def delete_graph_topic(course_id: str, topic_id: str, topic_updates: dict = None, expected_version: int = None) -> None:
+    """
+    Removes one topic (and the edges stored with it) from a course's knowledge graph.
 
+    Args:
+        course_id: The Canvas course ID
+        topic_id: ID of the topic to remove (e.g., 'topic_1')
+        topic_updates: Optional {topic_id: {'edges': [...], 'embedding': [...]}} for other
+                       topics whose related edges changed
+        expected_version: Optional kg_version the edit was computed from (see put_graph_topics)
 
-def log_analytics_event(data: dict) -> str:
+    Raises:
+        GraphVersionConflict: If kg_version is no longer expected_version
+    """
+    _ensure_db()
+    converted, generation = _ensure_topic_storage(course_id)
+    if converted and expected_version is not None:
+        expected_version += 1
+
+    def add_writes(batch):
+        batch.delete(_topics_ref(course_id, generation).document(topic_id))
+        _update_topic_records(batch, course_id, generation, topic_updates)
+        batch.update(db.collection(COURSES_COLLECTION).document(course_id), _graph_version_fields())
+
+    _commit_graph_write(course_id, add_writes, expected_version)
+    invalidate_course_cache(course_id)
+
+    logger.info(f"Deleted topic {topic_id} from course {course_id}")
+
+
+def invalidate_semantic_cache(course_id: str) -> None:
+    """
+    Marks every chat answer logged so far as unusable for the semantic cache
+    of a course, e.g. after its corpus changed.
+    
+    Bumps semantic_cache_version and sets semantic_cache_updated_at; workers
+    check these before each lookup (get_course_data(validate='semantic_cache'))
+    and rebuild their index from the chat events logged after that time.
+    
+    Args:
+        course_id: The Canvas course ID
+    """
+    _ensure_db()
+    db.collection(COURSES_COLLECTION).document(course_id).update({
+        'semantic_cache_version': firestore.Increment(1),
+        'semantic_cache_updated_at': firestore.SERVER_TIMESTAMP
+    })
+    invalidate_course_cache(course_id)
+    logger.info(f"Invalidated semantic cache answers of course {course_id}")
+
+
+def new_analytics_doc_id() -> str:
+    """
+    Allocates a document ID in the analytics collection without writing.
+    IDs are generated client-side, so this makes no network call.
+    
+    Returns:
+        A document ID that can later be passed to log_analytics_event
+    """
+    _ensure_db()
+    return db.collection(ANALYTICS_COLLECTION).document().id
+
+
+def log_analytics_event(data: dict, doc_id: str = None) -> str:
     """
     Logs an analytics event (chat query or KG click) to Firestore.
     
     Args:
         data: Pre-formatted dictionary containing event data.
               Must include: type, course_id, timestamp, and type-specific fields
+        doc_id: Optional - pre-allocated document ID (see new_analytics_doc_id)
               
     Returns:
         The document ID of the newly created log entry
@@ -211,9 +1146,35 @@ def log_analytics_event(data: dict) -> str:
     """
     _ensure_db()
     
-    # Create a new document with auto-generated ID
-    doc_ref = db.collection(ANALYTICS_COLLECTION).document()
-    doc_ref.set(data)
+    # Create a new document with auto-generated ID unless one was pre-allocated.
+    # A pre-allocated document may already hold a rating written by another
+    # worker, so merge into it instead of replacing it.
+    if doc_id:
+        doc_ref = db.collection(ANALYTICS_COLLECTION).document(doc_id)
+        doc_ref.set(data, merge=True)
+    else:
+        doc_ref = db.collection(ANALYTICS_COLLECTION).document()
+        doc_ref.set(data)
+    
+    logger.info(f"Logged analytics event: {data.get('type')} for course {data.get('course_id')}")
+    
+    return doc_ref.id
+
+
+async def log_analytics_event_async(data: dict, doc_id: str = None) -> str:
+    """
+    Async variant of log_analytics_event using the Firestore AsyncClient.
+    
+    Args:
+        data: Pre-formatted dictionary containing event data
+        doc_id: Optional - pre-allocated document ID (see new_analytics_doc_id)
+        
+    Returns:
+        The document ID of the newly created log entry
+    """
+    collection = _get_async_db().collection(ANALYTICS_COLLECTION)
+    doc_ref = collection.document(doc_id) if doc_id else collection.document()
+    await doc_ref.set(data, merge=bool(doc_id))
     
     logger.info(f"Logged analytics event: {data.get('type')} for course {data.get('course_id')}")
     
@@ -320,8 +1281,16 @@ def save_analytics_report(course_id: str, report_data: dict) -> None:
     """
     _ensure_db()
     
-    # Set (overwrite) the report document
-    db.collection(REPORTS_COLLECTION).document(course_id).set(report_data)
+    # Set (overwrite) the report document and bump the report version on the
+    # course, which validates HTTP caches of the report
+    batch = db.batch()
+    batch.set(db.collection(REPORTS_COLLECTION).document(course_id), report_data)
+    batch.set(db.collection(COURSES_COLLECTION).document(course_id), {
+        'report_version': firestore.Increment(1),
+        'report_updated_at': firestore.SERVER_TIMESTAMP
+    }, merge=True)
+    batch.commit()
+    invalidate_course_cache(course_id)
     
     logger.info(f"Saved analytics report for course {course_id}")
 
@@ -348,28 +1317,215 @@ def get_analytics_report(course_id: str) -> dict:
         return {}
 
 
-def rate_analytics_event(doc_id: str, rating: str = None) -> None:
+def rate_analytics_event(doc_id: str, rating: str = None, create: bool = False) -> bool:
     """
     Updates the rating field of an analytics event.
     
+    Only existing events are rated, unless create is set: a chat log whose
+    ID was issued to this client may still be queued on another worker, so
+    its rating is merged in and log_analytics_event merges around it.
+    
     Args:
         doc_id: The Firestore document ID of the analytics event
         rating: The rating value (e.g., 'helpful', 'not_helpful')
                 If None, removes the rating field from the document
+        create: Write the rating even if the event isn't stored yet
+    
+    Returns:
+        True if the rating was written, False if there is no such event
     """
     _ensure_db()
+    doc_ref = db.collection(ANALYTICS_COLLECTION).document(doc_id)
+    fields = {'rating': firestore.DELETE_FIELD if rating is None else rating}
+    
+    if create:
+        doc_ref.set(fields, merge=True)
+    else:
+        try:
+            doc_ref.update(fields)
+        except google_exceptions.NotFound:
+            logger.warning(f"Not rating unknown analytics event {doc_id}")
+            return False
     
     if rating is None:
-        # Remove the rating field
-        db.collection(ANALYTICS_COLLECTION).document(doc_id).update({
-            'rating': firestore.DELETE_FIELD
-        })
         logger.info(f"Removed rating for analytics event {doc_id}")
     else:
-        db.collection(ANALYTICS_COLLECTION).document(doc_id).update({
-            'rating': rating
-        })
         logger.info(f"Updated rating for analytics event {doc_id}: {rating}")
+    return True
+
+
+async def rate_analytics_event_async(doc_id: str, rating: str = None, create: bool = False) -> bool:
+    """
+    Async variant of rate_analytics_event using the Firestore AsyncClient.
+    
+    Args:
+        doc_id: The Firestore document ID of the analytics event
+        rating: The rating value, or None to remove the rating field
+        create: Write the rating even if the event isn't stored yet
+    
+    Returns:
+        True if the rating was written, False if there is no such event
+    """
+    doc_ref = _get_async_db().collection(ANALYTICS_COLLECTION).document(doc_id)
+    fields = {'rating': firestore.DELETE_FIELD if rating is None else rating}
+    if create:
+        await doc_ref.set(fields, merge=True)
+    else:
+        try:
+            await doc_ref.update(fields)
+        except google_exceptions.NotFound:
+            logger.warning(f"Not rating unknown analytics event {doc_id}")
+            return False
+    logger.info(f"Updated rating for analytics event {doc_id}: {rating}")
+    return True
+
+# ============================================================================
+# BACKGROUND JOBS
+# ============================================================================
+# Job documents are written by job_queue_service. A job can be claimed while
+# its available_at (epoch seconds) is in the past: queued jobs are available
+# from when they were enqueued (or their retry time), running jobs once their
+# worker's lease expires. Finished jobs have no available_at, so the claim
+# query needs only the built-in single-field index.
+
+def create_job(job: dict, dedupe_key: str = None, is_active=None) -> dict:
+    """
+    Stores a new job document under its 'id'.
+    
+    With a dedupe_key, a job_locks document records which job holds the
+    key; the job is only created (and takes the key) if the holder is no
+    longer active, checked in the same transaction.
+    
+    Args:
+        job: Job fields as built by job_queue_service.enqueue_job
+        dedupe_key: Optional key allowing one active job at a time
+        is_active: Function (job dict) -> whether the holder still blocks the key
+    
+    Returns:
+        The active job holding dedupe_key (nothing is created), or None once the job is stored
+    """
+    _ensure_db()
+    job_ref = db.collection(JOBS_COLLECTION).document(job['id'])
+    if dedupe_key is None:
+        job_ref.set(job)
+        return None
+    lock_ref = db.collection(JOB_LOCKS_COLLECTION).document(dedupe_key)
+
+    @firestore.transactional
+    def _create(transaction):
+        lock = lock_ref.get(transaction=transaction)
+        holder_id = lock.get('job_id') if lock.exists else None
+        if holder_id:
+            holder = db.collection(JOBS_COLLECTION).document(holder_id).get(transaction=transaction)
+            holder = holder.to_dict() if holder.exists else None
+            if holder and (is_active is None or is_active(holder)):
+                return holder
+        transaction.set(job_ref, job)
+        transaction.set(lock_ref, {'job_id': job['id']})
+        return None
+
+    return _create(db.transaction())
+
+
+def get_keyed_job(dedupe_key: str, is_active=None) -> dict:
+    """
+    Reads the job holding a dedupe key (see create_job).
+    
+    Returns:
+        The holder's fields, or None if no job holds the key or it is no longer active
+    """
+    _ensure_db()
+    lock = db.collection(JOB_LOCKS_COLLECTION).document(dedupe_key).get()
+    holder_id = lock.get('job_id') if lock.exists else None
+    holder = get_job(holder_id) if holder_id else None
+    if holder and (is_active is None or is_active(holder)):
+        return holder
+    return None
+
+
+def get_job(job_id: str) -> dict:
+    """
+    Reads a job document.
+    
+    Returns:
+        The job fields, or None if there is no such job
+    """
+    _ensure_db()
+    snapshot = db.collection(JOBS_COLLECTION).document(job_id).get()
+    return snapshot.to_dict() if snapshot.exists else None
+
+
+def claim_job(worker_id: str, now: float, claim_fields, candidates: int = 5) -> dict:
+    """
+    Atomically takes the oldest available job for a worker.
+    
+    Each candidate is re-read inside a transaction, so two workers racing
+    for the same job can't both claim it.
+    
+    Args:
+        worker_id: The claiming worker
+        now: Current time (epoch seconds)
+        claim_fields: Function (job dict) -> fields to write when claiming it,
+                      or None to skip the job
+        candidates: How many available jobs to try before giving up
+    
+    Returns:
+        The claimed job with claim_fields applied, or None if none was available
+    """
+    _ensure_db()
+    query = db.collection(JOBS_COLLECTION) \
+        .where(filter=FieldFilter('available_at', '<=', now)) \
+        .order_by('available_at') \
+        .limit(candidates)
+
+    @firestore.transactional
+    def _claim(transaction, job_ref):
+        snapshot = job_ref.get(transaction=transaction)
+        job = snapshot.to_dict() if snapshot.exists else None
+        if not job or job.get('available_at') is None or job['available_at'] > now:
+            return None
+        fields = claim_fields(job)
+        if fields is None:
+            return None
+        transaction.update(job_ref, fields)
+        return dict(job, **fields)
+
+    for snapshot in query.stream():
+        job = _claim(db.transaction(), snapshot.reference)
+        if job is not None:
+            return job
+    return None
+
+
+def update_job(job_id: str, fields: dict, worker_id: str = None) -> bool:
+    """
+    Updates a job document.
+    
+    Args:
+        job_id: The job to update
+        fields: Fields to write (None values delete the field)
+        worker_id: If given, only update while this worker still holds the job
+    
+    Returns:
+        False if the job was claimed by another worker meanwhile, else True
+    """
+    _ensure_db()
+    job_ref = db.collection(JOBS_COLLECTION).document(job_id)
+    fields = {key: firestore.DELETE_FIELD if value is None else value for key, value in fields.items()}
+    if worker_id is None:
+        job_ref.update(fields)
+        return True
+
+    @firestore.transactional
+    def _update(transaction):
+        snapshot = job_ref.get(transaction=transaction)
+        if not snapshot.exists or snapshot.get('worker_id') != worker_id:
+            return False
+        transaction.update(job_ref, fields)
+        return True
+
+    return _update(db.transaction())
+
 
 if __name__ == "__main__":
     # Test Firestore credentials and connection
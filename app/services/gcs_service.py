@@ -59,7 +59,7 @@ def ensure_bucket_exists(bucket_name: str = BUCKET_NAME) -> storage.Bucket:
         return bucket
 
 
-def upload_course_files(files: List[Dict], course_id: str, bucket_name: str = BUCKET_NAME) -> List[Dict]:
+def upload_course_files(files: List[Dict], course_id: str, bucket_name: str = BUCKET_NAME, on_uploaded=None) -> List[Dict]:
     """
     Uploads course files to Google Cloud Storage and updates file objects with GCS URIs.
     Files are organized in the bucket as: courses/{course_id}/{filename}
@@ -68,6 +68,7 @@ def upload_course_files(files: List[Dict], course_id: str, bucket_name: str = BU
         files: List of file objects with 'local_path' property
         course_id: Canvas course ID for organizing files
         bucket_name: GCS bucket name (default from env)
+        on_uploaded: Optional function (file) called after each successful upload
         
     Returns:
         Updated list of file objects with 'gcs_uri' property added
@@ -119,6 +120,9 @@ def upload_course_files(files: List[Dict], course_id: str, bucket_name: str = BU
             logger.error(f"Failed to upload {file.get('display_name')}: {str(e)}")
             file['gcs_uri'] = None
             continue
+        
+        if on_uploaded:
+            on_uploaded(file)
     
     logger.info(f"Successfully uploaded {upload_count}/{len(files)} files to GCS")
     
@@ -209,6 +213,33 @@ def delete_course_files(course_id: str, bucket_name: str = BUCKET_NAME) -> int:
     return delete_count
 
 
+def delete_file(gcs_uri: str) -> bool:
+    """
+    Deletes a single file from GCS (e.g. a course file removed from Canvas).
+
+    Args:
+        gcs_uri: GCS URI (e.g., 'gs://bucket/courses/12345/Week 1.pdf')
+
+    Returns:
+        True if the file was deleted, False if it didn't exist or couldn't be deleted
+    """
+    if not gcs_uri.startswith('gs://'):
+        raise ValueError(f"Invalid GCS URI: {gcs_uri}")
+
+    parts = gcs_uri[5:].split('/', 1)
+    bucket_name = parts[0]
+    blob_path = parts[1] if len(parts) > 1 else ''
+
+    try:
+        client = get_storage_client()
+        client.bucket(bucket_name).blob(blob_path).delete()
+        logger.info(f"Deleted: {gcs_uri}")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to delete {gcs_uri}: {str(e)}")
+        return False
+
+
 def get_file_info(gcs_uri: str) -> Optional[Dict]:
     """
     Gets metadata for a file in GCS.
@@ -10,12 +10,13 @@ This service provides functions to:
 
 This service handles all LLM prompting and response formatting.
 """
-from vertexai.generative_models import GenerativeModel
 from google.generativeai import GenerativeModel
+from vertexai.language_models import TextEmbeddingModel, TextEmbeddingInput
 import mimetypes
 import os
 import logging
-from typing import List, Tuple
+import threading
+from typing import Iterator, List, Tuple
 import vertexai
 import sys
 
@@ -24,7 +25,7 @@ root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__fil
 if root_dir not in sys.path:
     sys.path.insert(0, root_dir)
 
-from app.services.rag_service import retrieve_context
+from app.services.rag_service import retrieve_context, retrieve_context_async
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +33,7 @@ logger = logging.getLogger(__name__)
 project_id = os.environ.get('GOOGLE_CLOUD_PROJECT')
 location = os.environ.get('GOOGLE_CLOUD_LOCATION')
 DEFAULT_MODEL = os.environ.get('GEMINI_LLM_MODEL', 'gemini-2.5-flash-lite')
+DEFAULT_EMBEDDING_MODEL = os.environ.get('GEMINI_EMBEDDING_MODEL', 'text-embedding-004')
 
 if project_id:
     vertexai.init(project=project_id, location=location)
@@ -40,7 +42,143 @@ else:
     logger.warning("GOOGLE_CLOUD_PROJECT not set - Gemini service not initialized")
 
 
-def get_embedding(text: str, model_name: str = "text-embedding-004", task_type: str = "RETRIEVAL_QUERY") -> list:
+# ============================================================================
+# MODEL CLIENT REGISTRY
+# ============================================================================
+
+# Long-lived clients keyed by (kind, model_name). Both client types are safe
+# to share across request threads; gRPC channels are not safe across fork(),
+# so the registry is dropped when a forked worker first touches it.
+_model_clients = {}
+_model_clients_lock = threading.Lock()
+_model_clients_pid = os.getpid()
+
+
+def _get_model_client(kind: str, model_name: str, factory):
+    """Returns the registered client for (kind, model_name), creating it once."""
+    global _model_clients_pid
+    key = (kind, model_name)
+
+    client = _model_clients.get(key)
+    if client is not None and _model_clients_pid == os.getpid():
+        return client
+
+    with _model_clients_lock:
+        if _model_clients_pid != os.getpid():
+            _model_clients.clear()
+            _model_clients_pid = os.getpid()
+        client = _model_clients.get(key)
+        if client is None:
+            logger.info(f"Creating {kind} client for model {model_name}")
+            client = factory(model_name)
+            _model_clients[key] = client
+        return client
+
+
+def get_generative_model(model_name: str = DEFAULT_MODEL) -> GenerativeModel:
+    """
+    Returns the shared GenerativeModel client for a model name.
+    
+    Args:
+        model_name: Gemini model to use (default: GEMINI_LLM_MODEL)
+        
+    Returns:
+        GenerativeModel instance reused by every caller in this process
+    """
+    return _get_model_client('generative', model_name, GenerativeModel)
+
+
+def get_embedding_model(model_name: str = DEFAULT_EMBEDDING_MODEL) -> TextEmbeddingModel:
+    """
+    Returns the shared TextEmbeddingModel client for a model name.
+    
+    TextEmbeddingModel.from_pretrained makes a metadata request to Vertex AI,
+    so reusing the client removes a network round trip from every embedding.
+    
+    Args:
+        model_name: Embedding model to use (default: GEMINI_EMBEDDING_MODEL)
+        
+    Returns:
+        TextEmbeddingModel instance reused by every caller in this process
+    """
+    return _get_model_client('embedding', model_name, TextEmbeddingModel.from_pretrained)
+
+
+def warm_model_clients(model_names: List[str] = None, embedding_model_names: List[str] = None) -> None:
+    """
+    Creates the model clients ahead of the first request.
+    
+    Failures are logged and left for the first real call to retry, so a
+    slow or unavailable Vertex AI endpoint never blocks worker start.
+    
+    Args:
+        model_names: Generative models to warm (default: [DEFAULT_MODEL])
+        embedding_model_names: Embedding models to warm (default: [DEFAULT_EMBEDDING_MODEL])
+        
+    Example:
+        warm_model_clients()
+    """
+    if not project_id:
+        logger.warning("GOOGLE_CLOUD_PROJECT not set - skipping model client warm-up")
+        return
+
+    for model_name in model_names or [DEFAULT_MODEL]:
+        try:
+            get_generative_model(model_name)
+        except Exception as e:
+            logger.error(f"Failed to warm generative model {model_name}: {e}")
+
+    for model_name in embedding_model_names or [DEFAULT_EMBEDDING_MODEL]:
+        try:
+            get_embedding_model(model_name)
+        except Exception as e:
+            logger.error(f"Failed to warm embedding model {model_name}: {e}")
+
+
+def clear_model_clients() -> None:
+    """Drops every registered client (used by tests and after config changes)."""
+    with _model_clients_lock:
+        _model_clients.clear()
+
+
+# ============================================================================
+# TOKEN USAGE
+# ============================================================================
+
+# Per-process totals from generation responses, used by benchmarks
+_token_usage = {'calls': 0, 'prompt_tokens': 0, 'output_tokens': 0}
+_token_usage_lock = threading.Lock()
+
+
+def _record_usage(response) -> None:
+    """Adds a generation response's token counts to the process totals."""
+    usage = getattr(response, 'usage_metadata', None)
+    with _token_usage_lock:
+        _token_usage['calls'] += 1
+        if usage is not None:
+            _token_usage['prompt_tokens'] += getattr(usage, 'prompt_token_count', 0) or 0
+            _token_usage['output_tokens'] += getattr(usage, 'candidates_token_count', 0) or 0
+
+
+def get_token_usage() -> dict:
+    """
+    Returns generation calls and token totals for this process.
+
+    Example:
+        get_token_usage()  # {'calls': 9, 'prompt_tokens': 31240, 'output_tokens': 1820}
+    """
+    with _token_usage_lock:
+        return dict(_token_usage)
+
+
+def reset_token_usage() -> None:
+    """Resets the token usage totals."""
+    with _token_usage_lock:
+        for key in _token_usage:
+            _token_usage[key] = 0
+
+
+def get_embedding(text: str, model_name: str = DEFAULT_EMBEDDING_MODEL, task_type: str = "RETRIEVAL_QUERY") -> list:
     """
     Generates an embedding vector for text using Vertex AI's text-embedding model.
     
@@ -62,12 +200,9 @@ def get_embedding(text: str, model_name: str = "text-embedding-004", task_type:
         # Returns: [0.123, -0.456, 0.789, ...] (768 dimensions)
     """
     try:
-        from vertexai.language_models import TextEmbeddingModel, TextEmbeddingInput
-        
         logger.info(f"Generating embedding for text: {text[:50]}... (task_type: {task_type})")
         
-        # Initialize the embedding model
-        model = TextEmbeddingModel.from_pretrained(model_name)
+        model = get_embedding_model(model_name)
         
         # Create embedding input with task type
         embedding_input = TextEmbeddingInput(
@@ -88,6 +223,67 @@ def get_embedding(text: str, model_name: str = "text-embedding-004", task_type:
         logger.error(f"Failed to generate embedding: {e}", exc_info=True)
         raise
 
+
+# Vertex AI accepts up to 250 texts per embedding request
+EMBEDDING_BATCH_SIZE = 250
+
+
+def get_embeddings(texts: List[str], model_name: str = DEFAULT_EMBEDDING_MODEL, task_type: str = "SEMANTIC_SIMILARITY") -> List[list]:
+    """
+    Embeds several texts with as few requests as possible.
+    
+    Args:
+        texts: The texts to embed
+        model_name: The embedding model to use (default: text-embedding-004)
+        task_type: The task type for the embeddings (see get_embedding)
+        
+    Returns:
+        List of embedding vectors, aligned with texts
+        
+    Example:
+        vectors = get_embeddings(["Recursion is...", "Sorting is..."])
+        # Returns: [[0.012, ...], [-0.031, ...]] (one request)
+    """
+    if not texts:
+        return []
+
+    try:
+        logger.info(f"Generating {len(texts)} embeddings (task_type: {task_type})")
+        model = get_embedding_model(model_name)
+
+        vectors = []
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            batch = texts[start:start + EMBEDDING_BATCH_SIZE]
+            embeddings = model.get_embeddings([TextEmbeddingInput(text=text, task_type=task_type) for text in batch])
+            vectors.extend(embedding.values for embedding in embeddings)
+        return vectors
+
+    except Exception as e:
+        logger.error(f"Failed to generate embeddings: {e}", exc_info=True)
+        raise
+
+
+async def get_embedding_async(text: str, model_name: str = DEFAULT_EMBEDDING_MODEL, task_type: str = "RETRIEVAL_QUERY") -> list:
+    """
+    Async variant of get_embedding using TextEmbeddingModel.get_embeddings_async.
+    
+    Args:
+        text: The text to embed
+        model_name: The embedding model to use (default: text-embedding-004)
+        task_type: The task type for the embedding (see get_embedding)
+        
+    Returns:
+        List of floats representing the embedding vector
+    """
+    try:
+        model = get_embedding_model(model_name)
+        embeddings = await model.get_embeddings_async([TextEmbeddingInput(text=text, task_type=task_type)])
+        return embeddings[0].values
+        
+    except Exception as e:
+        logger.error(f"Failed to generate embedding: {e}", exc_info=True)
+        raise
+
 SUMMARIZE_PROMPT = """
     Summarize this file in one paragraph, specifically the topics that are covered, both broad and specific.
     Someone reading the summary should understand what subjects are discussed in the file and what the learning objectives likely are. Don't get too detailed.
@@ -125,7 +321,7 @@ def summarize_file(file_path: str, prompt: str = SUMMARIZE_PROMPT, model_name: s
     }
 
     try:
-        model = GenerativeModel(model_name)
+        model = get_generative_model(model_name)
 
         response = model.generate_content(
             [file_part, prompt]
@@ -138,13 +334,15 @@ def summarize_file(file_path: str, prompt: str = SUMMARIZE_PROMPT, model_name: s
         raise
 
 
-def generate_answer(query: str, model_name: str = DEFAULT_MODEL) -> str:
+def generate_answer(query: str, model_name: str = DEFAULT_MODEL, response_mime_type: str = None) -> str:
     """
     Generates a direct answer to a query using Gemini (no RAG context).
     
     Args:
         query: The user's question or prompt
         model_name: Gemini model to use (default: gemini-2.5-flash-lite)
+        response_mime_type: Optional output format, e.g. 'application/json'
+                            for structured responses
         
     Returns:
         Generated answer text
@@ -161,8 +359,12 @@ def generate_answer(query: str, model_name: str = DEFAULT_MODEL) -> str:
     try:
         logger.info(f"Generating direct answer for: {query[:100]}...")
         
-        model = GenerativeModel(model_name)
-        response = model.generate_content(query)
+        model = get_generative_model(model_name)
+        if response_mime_type:
+            response = model.generate_content(query, generation_config={'response_mime_type': response_mime_type})
+        else:
+            response = model.generate_content(query)
+        _record_usage(response)
         
         answer_text = response.text
         logger.info(f"Generated answer ({len(answer_text)} characters)")
@@ -173,12 +375,72 @@ def generate_answer(query: str, model_name: str = DEFAULT_MODEL) -> str:
         logger.error(f"Failed to generate answer: {str(e)}")
         raise
 
+NO_CONTEXT_ANSWER = "I don't have enough information in the course materials to answer this question."
+
+
+def _build_context_prompt(query: str, context_texts: List[str]) -> str:
+    """Builds the teaching-assistant prompt from retrieved context chunks."""
+    combined_context = "\n\n".join(context_texts)
+    
+    return f"""You are a helpful teaching assistant for a course. Answer the student's in a helpful manner and use the sources provided when relevant.
+
+Course Materials Context:
+{combined_context}
+
+Student Question: {query}
+
+Instructions:
+1. Try your best to answer based on the provided context above
+2. Be clear, concise, and educational without giving away answers to explicit homework questions
+3. If the context doesn't contain enough information to fully answer the question, say so
+4. Cite specific sources when possible (e.g., "According to Chapter 1...")
+5. Use a friendly, professional teaching tone
+
+Answer:"""
+
+
+def retrieve_answer_context(
+    query: str,
+    corpus_id: str,
+    top_k: int = 10,
+    threshold: float = 0.4
+) -> Tuple[List[str], List[dict]]:
+    """
+    Retrieves the context chunks and sources used to answer a question.
+    
+    Uses the same defaults as generate_answer_with_context, so callers can
+    run retrieval ahead of time (e.g. concurrently with other work) and
+    pass the result in through the context argument.
+    
+    Args:
+        query: The user's question
+        corpus_id: RAG corpus resource name to retrieve context from
+        top_k: Number of context chunks to retrieve (default: 10)
+        threshold: Similarity threshold for retrieval (default: 0.4)
+        
+    Returns:
+        Tuple of (list of context texts, list of sources)
+    """
+    return retrieve_context(corpus_id, query, top_k, threshold)
+
+
+async def retrieve_answer_context_async(
+    query: str,
+    corpus_id: str,
+    top_k: int = 10,
+    threshold: float = 0.4
+) -> Tuple[List[str], List[dict]]:
+    """Async variant of retrieve_answer_context."""
+    return await retrieve_context_async(corpus_id, query, top_k, threshold)
+
+
 def generate_answer_with_context(
     query: str,
     corpus_id: str,
     top_k: int = 10,
     threshold: float = 0.4,
-    model_name: str = DEFAULT_MODEL
+    model_name: str = DEFAULT_MODEL,
+    context: Tuple[List[str], List[dict]] = None
 ) -> Tuple[str, List[str]]:
     """
     Generates an answer using context retrieved from RAG corpus.
@@ -195,6 +457,8 @@ def generate_answer_with_context(
         top_k: Number of context chunks to retrieve (default: 10)
         threshold: Similarity threshold for retrieval (default: 0.5)
         model_name: Gemini model to use (default: gemini-2.5-flash-lite)
+        context: Optional (context_texts, sources) from retrieve_answer_context;
+                 skips retrieval when given
         
     Returns:
         Tuple of (answer_text, list of source names)
@@ -216,37 +480,24 @@ def generate_answer_with_context(
     try:
         logger.info(f"Generating RAG-enhanced answer for: {query[:100]}...")
         
-        # Step 1: Retrieve context from RAG corpus
-        context_texts, source_names = retrieve_context(corpus_id, query, top_k, threshold)
+        # Step 1: Retrieve context from RAG corpus (unless the caller already did)
+        if context is None:
+            context = retrieve_answer_context(query, corpus_id, top_k, threshold)
+        context_texts, source_names = context
 
         if not context_texts:
             logger.warning("No context retrieved from RAG corpus")
-            return ("I don't have enough information in the course materials to answer this question.", [])
+            return (NO_CONTEXT_ANSWER, [])
         
         logger.info(f"Retrieved {len(context_texts)} context chunks from {len(source_names)} sources")
         
         # Step 2: Construct prompt with context
-        combined_context = "\n\n".join(context_texts)
-        
-        prompt = f"""You are a helpful teaching assistant for a course. Answer the student's in a helpful manner and use the sources provided when relevant.
-
-Course Materials Context:
-{combined_context}
-
-Student Question: {query}
-
-Instructions:
-1. Try your best to answer based on the provided context above
-2. Be clear, concise, and educational without giving away answers to explicit homework questions
-3. If the context doesn't contain enough information to fully answer the question, say so
-4. Cite specific sources when possible (e.g., "According to Chapter 1...")
-5. Use a friendly, professional teaching tone
-
-Answer:"""
+        prompt = _build_context_prompt(query, context_texts)
 
         # Step 3: Generate answer with Gemini
-        model = GenerativeModel(model_name)
+        model = get_generative_model(model_name)
         response = model.generate_content(prompt)
+        _record_usage(response)
         answer_text = response.text
         
         logger.info(f"Generated answer with {len(source_names)} citations")
@@ -258,6 +509,125 @@ Answer:"""
         raise
 
 
+async def generate_answer_with_context_async(
+    query: str,
+    corpus_id: str,
+    top_k: int = 10,
+    threshold: float = 0.4,
+    model_name: str = DEFAULT_MODEL,
+    context: Tuple[List[str], List[dict]] = None
+) -> Tuple[str, List[dict]]:
+    """
+    Async variant of generate_answer_with_context.
+    
+    Uses the async RAG client for retrieval and generate_content_async for
+    the answer, so an event loop can hold many requests waiting on Gemini.
+    
+    Args:
+        query: The user's question
+        corpus_id: RAG corpus resource name to retrieve context from
+        top_k: Number of context chunks to retrieve (default: 10)
+        threshold: Similarity threshold for retrieval (default: 0.4)
+        model_name: Gemini model to use (default: gemini-2.5-flash-lite)
+        context: Optional (context_texts, sources) from retrieve_answer_context_async
+        
+    Returns:
+        Tuple of (answer_text, list of sources)
+    """
+    if not project_id:
+        raise ValueError("GOOGLE_CLOUD_PROJECT environment variable not set")
+    
+    try:
+        if context is None:
+            context = await retrieve_answer_context_async(query, corpus_id, top_k, threshold)
+        context_texts, source_names = context
+
+        if not context_texts:
+            logger.warning("No context retrieved from RAG corpus")
+            return (NO_CONTEXT_ANSWER, [])
+        
+        prompt = _build_context_prompt(query, context_texts)
+        response = await get_generative_model(model_name).generate_content_async(prompt)
+        
+        logger.info(f"Generated answer with {len(source_names)} citations")
+        return (response.text, source_names)
+        
+    except Exception as e:
+        logger.error(f"Failed to generate RAG-enhanced answer: {str(e)}")
+        raise
+
+
+def generate_answer_with_context_stream(
+    query: str,
+    corpus_id: str,
+    top_k: int = 10,
+    threshold: float = 0.4,
+    model_name: str = DEFAULT_MODEL,
+    context: Tuple[List[str], List[dict]] = None
+) -> Tuple[Iterator[str], List[dict]]:
+    """
+    Streaming variant of generate_answer_with_context.
+    
+    Retrieval runs before this function returns, so the sources are known
+    up front; the answer text is produced lazily as Gemini streams it.
+    
+    Args:
+        query: The user's question
+        corpus_id: RAG corpus resource name to retrieve context from
+        top_k: Number of context chunks to retrieve (default: 10)
+        threshold: Similarity threshold for retrieval (default: 0.4)
+        model_name: Gemini model to use (default: gemini-2.5-flash-lite)
+        context: Optional (context_texts, sources) from retrieve_answer_context;
+                 skips retrieval when given
+        
+    Returns:
+        Tuple of (iterator of answer text chunks, list of sources)
+        
+    Raises:
+        Exception: If retrieval fails (generation errors surface while iterating)
+        
+    Example:
+        chunks, sources = generate_answer_with_context_stream("What is recursion?", corpus_id)
+        for chunk in chunks:
+            print(chunk, end="")
+    """
+    if not project_id:
+        raise ValueError("GOOGLE_CLOUD_PROJECT environment variable not set")
+    
+    logger.info(f"Streaming RAG-enhanced answer for: {query[:100]}...")
+    
+    try:
+        if context is None:
+            context = retrieve_answer_context(query, corpus_id, top_k, threshold)
+        context_texts, source_names = context
+    except Exception as e:
+        logger.error(f"Failed to retrieve context for streamed answer: {str(e)}")
+        raise
+    
+    if not context_texts:
+        logger.warning("No context retrieved from RAG corpus")
+        return (iter([NO_CONTEXT_ANSWER]), [])
+    
+    prompt = _build_context_prompt(query, context_texts)
+    
+    def _chunks():
+        try:
+            model = get_generative_model(model_name)
+            for chunk in model.generate_content(prompt, stream=True):
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. the final finish-reason chunk)
+                    continue
+                if text:
+                    yield text
+        except Exception as e:
+            logger.error(f"Failed to stream RAG-enhanced answer: {str(e)}")
+            raise
+    
+    return (_chunks(), source_names)
+
+
 def generate_suggested_questions(topic: str, count: int = 3, model_name: str = DEFAULT_MODEL) -> List[str]:
     """
     Generates AI-suggested follow-up questions for a given topic.
@@ -283,7 +653,7 @@ def generate_suggested_questions(topic: str, count: int = 3, model_name: str = D
     try:
         logger.info(f"Generating {count} suggested questions for topic: {topic}")
         
-        model = GenerativeModel(model_name)
+        model = get_generative_model(model_name)
         
         prompt = f"""Generate {count} thoughtful follow-up questions that a student might have about the topic: "{topic}"
 
@@ -348,7 +718,7 @@ if __name__ == "__main__":
     
     try:
         # Import firestore service to get course data
-        from app.services.firestore_service import get_course_data
+        from app.services.firestore_service import get_course_data, get_knowledge_graph
         
         # Get course data for 13299557
         course_id = "13299557"
@@ -363,8 +733,7 @@ if __name__ == "__main__":
         
         course_data = course_doc.to_dict()
         corpus_id = course_data.get('corpus_id')
-        kg_nodes = json.loads(course_data.get('kg_nodes', '[]'))
-        kg_data = json.loads(course_data.get('kg_data', '{}'))
+        kg_nodes, _, kg_data = get_knowledge_graph(course_id, course_doc)
         
         print(f"\n📚 Course Info:")
         print(f"   Corpus ID: {corpus_id}")
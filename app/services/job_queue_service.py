@@ -0,0 +1,586 @@
+"""
+Job Queue Service
+Durable background jobs for work too long for an HTTP request.
+
+This service is responsible for:
+- Storing jobs durably so they survive restarts and can be shared by containers
+- Handing each job to exactly one worker at a time (leases)
+- Retrying failed jobs and reclaiming jobs from workers that died
+- Tracking stage, progress and ETA for status endpoints
+
+Backends (JOB_QUEUE_BACKEND):
+- firestore: jobs collection, shared by every container (production)
+- sqlite: a local database file (development, single machine)
+
+A job is available to workers while its available_at time is in the past.
+A worker that claims a job holds it for JOB_LEASE_SECONDS and renews the
+lease while it runs. If the worker dies the lease runs out and another
+worker picks the job up again.
+
+Jobs enqueued with a dedupe_key (e.g. one per course) are exclusive: while
+one is queued or running, enqueueing the same kind returns it and another
+kind raises JobConflictError.
+
+Dependencies:
+- firestore_service: For the Firestore backend
+"""
+import json
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import closing
+
+# Handle imports for both module use and standalone testing
+if __name__ == "__main__":
+    # Running as standalone script
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+    from app.services import firestore_service
+else:
+    # Imported as a module
+    from . import firestore_service
+
+logger = logging.getLogger(__name__)
+
+# Queue configuration
+JOB_QUEUE_BACKEND = os.environ.get('JOB_QUEUE_BACKEND', 'firestore').lower()
+JOB_QUEUE_SQLITE_PATH = os.environ.get('JOB_QUEUE_SQLITE_PATH', os.path.join('app', 'data', 'jobs.sqlite3'))
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', '120'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_BASE_SECONDS = float(os.environ.get('JOB_RETRY_BASE_SECONDS', '30'))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', '2'))
+# Progress is written at most this often (stage changes are always written)
+JOB_PROGRESS_MIN_INTERVAL = float(os.environ.get('JOB_PROGRESS_MIN_INTERVAL', '1'))
+
+# Job statuses
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+_handlers = {}  # kind -> (handler, on_failure)
+_worker_threads = {}  # pid -> background worker thread
+_worker_lock = threading.Lock()
+
+
+class LeaseLostError(Exception):
+    """Raised in a running job when another worker has taken it over."""
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler for failures that retrying won't fix."""
+
+
+class JobConflictError(Exception):
+    """Raised when a job of another kind is queued or running under the same dedupe_key."""
+
+    def __init__(self, message: str, job: dict = None):
+        super().__init__(message)
+        self.job = job
+
+
+def _is_active(job: dict) -> bool:
+    return job.get('status') in (QUEUED, RUNNING)
+
+
+# ============================================================================
+# STORAGE BACKENDS
+# ============================================================================
+
+class _SqliteJobStore:
+    """Jobs in a local SQLite file. Safe for several processes on one machine."""
+
+    COLUMNS = ('id', 'kind', 'payload', 'status', 'stage', 'progress', 'message', 'result', 'error',
+               'attempts', 'max_attempts', 'worker_id', 'available_at', 'created_at', 'started_at',
+               'updated_at', 'finished_at', 'dedupe_key')
+    JSON_COLUMNS = ('payload', 'result')
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, kind TEXT, payload TEXT, status TEXT, stage TEXT, progress REAL, '
+                'message TEXT, result TEXT, error TEXT, attempts INTEGER, max_attempts INTEGER, '
+                'worker_id TEXT, available_at REAL, created_at REAL, started_at REAL, updated_at REAL, '
+                'finished_at REAL, dedupe_key TEXT)'
+            )
+            # Databases created before dedupe keys existed
+            if 'dedupe_key' not in {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}:
+                conn.execute('ALTER TABLE jobs ADD COLUMN dedupe_key TEXT')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_available_at ON jobs (available_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_dedupe_key ON jobs (dedupe_key)')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _row_to_job(self, row) -> dict:
+        job = dict(row)
+        for column in self.JSON_COLUMNS:
+            job[column] = json.loads(job[column]) if job[column] is not None else None
+        return job
+
+    def _encode(self, fields: dict) -> dict:
+        return {key: json.dumps(value) if key in self.JSON_COLUMNS and value is not None else value
+                for key, value in fields.items()}
+
+    def _find_active(self, conn, dedupe_key: str) -> dict:
+        row = conn.execute(
+            'SELECT * FROM jobs WHERE dedupe_key = ? AND status IN (?, ?) ORDER BY created_at LIMIT 1',
+            (dedupe_key, QUEUED, RUNNING)
+        ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def create(self, job: dict, dedupe_key: str = None) -> dict:
+        fields = self._encode(job)
+        columns = [column for column in self.COLUMNS if column in fields]
+        conn = self._connect()
+        try:
+            # IMMEDIATE: no other process can create a job for the key between the check and the insert
+            conn.execute('BEGIN IMMEDIATE')
+            existing = self._find_active(conn, dedupe_key) if dedupe_key else None
+            if existing is None:
+                conn.execute(
+                    f"INSERT INTO jobs ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                    [fields[column] for column in columns]
+                )
+            conn.execute('COMMIT')
+            return existing
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def get(self, job_id: str) -> dict:
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def get_active(self, dedupe_key: str) -> dict:
+        with closing(self._connect()) as conn:
+            return self._find_active(conn, dedupe_key)
+
+    def claim(self, worker_id: str, now: float, claim_fields) -> dict:
+        conn = self._connect()
+        try:
+            # IMMEDIATE takes the write lock up front, so no other process can claim in between
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(
+                'SELECT * FROM jobs WHERE available_at <= ? ORDER BY available_at LIMIT 5', (now,)
+            ).fetchall()
+            for row in rows:
+                job = self._row_to_job(row)
+                fields = claim_fields(job)
+                if fields is None:
+                    continue
+                self._update(conn, job['id'], fields)
+                conn.execute('COMMIT')
+                return dict(job, **fields)
+            conn.execute('COMMIT')
+            return None
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def _update(self, conn, job_id: str, fields: dict, worker_id: str = None) -> bool:
+        fields = self._encode(fields)
+        sql = f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in fields)} WHERE id = ?"
+        params = list(fields.values()) + [job_id]
+        if worker_id is not None:
+            sql += ' AND worker_id = ?'
+            params.append(worker_id)
+        return conn.execute(sql, params).rowcount > 0
+
+    def update(self, job_id: str, fields: dict, worker_id: str = None) -> bool:
+        with closing(self._connect()) as conn:
+            return self._update(conn, job_id, fields, worker_id)
+
+
+class _FirestoreJobStore:
+    """Jobs in the Firestore jobs collection, shared by every container."""
+
+    def create(self, job: dict, dedupe_key: str = None) -> dict:
+        return firestore_service.create_job(job, dedupe_key=dedupe_key, is_active=_is_active)
+
+    def get(self, job_id: str) -> dict:
+        return firestore_service.get_job(job_id)
+
+    def get_active(self, dedupe_key: str) -> dict:
+        return firestore_service.get_keyed_job(dedupe_key, is_active=_is_active)
+
+    def claim(self, worker_id: str, now: float, claim_fields) -> dict:
+        return firestore_service.claim_job(worker_id, now, claim_fields)
+
+    def update(self, job_id: str, fields: dict, worker_id: str = None) -> bool:
+        return firestore_service.update_job(job_id, fields, worker_id=worker_id)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _get_store():
+    """Returns the configured job store, creating it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if JOB_QUEUE_BACKEND == 'sqlite':
+                    _store = _SqliteJobStore(JOB_QUEUE_SQLITE_PATH)
+                elif JOB_QUEUE_BACKEND == 'firestore':
+                    _store = _FirestoreJobStore()
+                else:
+                    raise ValueError(f"Unknown JOB_QUEUE_BACKEND: {JOB_QUEUE_BACKEND}")
+                logger.info(f"Job queue using the {JOB_QUEUE_BACKEND} backend")
+    return _store
+
+
+# ============================================================================
+# QUEUE OPERATIONS
+# ============================================================================
+
+def _reuse_active_job(kind: str, dedupe_key: str, active: dict) -> str:
+    """Returns the active job's ID if it's the same kind, else raises JobConflictError."""
+    if active.get('kind') != kind:
+        raise JobConflictError(
+            f"A {active.get('kind')} job ({active['id']}) is already {active.get('status')} for {dedupe_key}", active
+        )
+    logger.info(f"Reusing {active.get('status')} {kind} job {active['id']} for {dedupe_key}")
+    return active['id']
+
+
+def find_active_job(kind: str, dedupe_key: str) -> str:
+    """
+    Checks for a queued or running job under a dedupe key.
+
+    Lets callers skip side effects (like resetting a course) that must not
+    happen while another job for the same key is in progress.
+
+    Returns:
+        The active job's ID if it's of this kind, None if there is no active job
+
+    Raises:
+        JobConflictError: If the active job is of another kind
+    """
+    active = _get_store().get_active(dedupe_key)
+    return _reuse_active_job(kind, dedupe_key, active) if active else None
+
+
+def enqueue_job(kind: str, payload: dict, max_attempts: int = None, dedupe_key: str = None) -> str:
+    """
+    Adds a job to the queue.
+
+    Args:
+        kind: Job type, matching a handler registered with register_handler
+        payload: JSON-serializable job arguments
+        max_attempts: Attempts before the job fails for good (default: JOB_MAX_ATTEMPTS)
+        dedupe_key: Optional key allowing one queued or running job at a time;
+                    checked and claimed atomically with creating the job
+
+    Returns:
+        The new job ID, or the ID of the active job of this kind for dedupe_key
+
+    Raises:
+        JobConflictError: If a job of another kind is active for dedupe_key
+
+    Example:
+        job_id = enqueue_job('initialize_course', {'course_id': '12345'}, dedupe_key='course_12345')
+        # 'b3f1c2...'
+    """
+    now = time.time()
+    job = {
+        'id': uuid.uuid4().hex,
+        'kind': kind,
+        'payload': payload,
+        'status': QUEUED,
+        'stage': None,
+        'progress': 0.0,
+        'attempts': 0,
+        'max_attempts': max_attempts or JOB_MAX_ATTEMPTS,
+        'available_at': now,
+        'created_at': now,
+        'updated_at': now
+    }
+    if dedupe_key:
+        job['dedupe_key'] = dedupe_key
+    active = _get_store().create(job, dedupe_key=dedupe_key)
+    if active is not None:
+        return _reuse_active_job(kind, dedupe_key, active)
+    logger.info(f"Enqueued {kind} job {job['id']}")
+    return job['id']
+
+
+def get_job(job_id: str) -> dict:
+    """Returns the stored job, or None if it doesn't exist."""
+    return _get_store().get(job_id)
+
+
+def _estimate_eta(job: dict, now: float):
+    """Seconds left for a running job, extrapolated from its progress so far."""
+    progress = job.get('progress') or 0.0
+    started_at = job.get('started_at')
+    if job.get('status') != RUNNING or not started_at or progress <= 0:
+        return None
+    elapsed = max(now - started_at, 0.0)
+    return round(elapsed * (1 - min(progress, 1.0)) / progress, 1)
+
+
+def get_job_status(job_id: str) -> dict:
+    """
+    Returns the client-facing status of a job.
+
+    Returns:
+        Dictionary with status, stage, progress (0-1), eta_seconds and
+        result or error, or None if the job doesn't exist
+
+    Example:
+        get_job_status('b3f1c2...')
+        # {'job_id': 'b3f1c2...', 'kind': 'initialize_course', 'status': 'running',
+        #  'stage': 'summarize', 'progress': 0.42, 'eta_seconds': 96.3, ...}
+    """
+    job = get_job(job_id)
+    if job is None:
+        return None
+    return {
+        'job_id': job['id'],
+        'kind': job.get('kind'),
+        'status': job.get('status'),
+        'stage': job.get('stage'),
+        'progress': round(job.get('progress') or 0.0, 3),
+        'message': job.get('message'),
+        'eta_seconds': _estimate_eta(job, time.time()),
+        'attempts': job.get('attempts', 0),
+        'max_attempts': job.get('max_attempts'),
+        'result': job.get('result'),
+        'error': job.get('error'),
+        'created_at': job.get('created_at'),
+        'started_at': job.get('started_at'),
+        'finished_at': job.get('finished_at')
+    }
+
+
+def claim_job(worker_id: str) -> dict:
+    """
+    Takes the next available job, or returns None if there isn't one.
+
+    A job whose lease ran out while it had no attempts left is marked
+    failed here instead of being claimed again.
+    """
+    now = time.time()
+    exhausted = []
+
+    def claim_fields(job):
+        if job.get('attempts', 0) >= job.get('max_attempts', JOB_MAX_ATTEMPTS):
+            exhausted.append(job)
+            return None
+        return {
+            'status': RUNNING,
+            'worker_id': worker_id,
+            'attempts': job.get('attempts', 0) + 1,
+            'available_at': now + JOB_LEASE_SECONDS,
+            'started_at': now,
+            'updated_at': now
+        }
+
+    job = _get_store().claim(worker_id, now, claim_fields)
+    for dead in exhausted:
+        _finish_failed(dead, f"Worker {dead.get('worker_id')} stopped responding")
+    return job
+
+
+def _finish_failed(job: dict, error: str) -> None:
+    """Marks a job failed for good and runs its kind's failure hook."""
+    now = time.time()
+    _get_store().update(job['id'], {
+        'status': FAILED, 'error': error, 'available_at': None, 'finished_at': now, 'updated_at': now
+    })
+    logger.error(f"Job {job['id']} ({job.get('kind')}) failed: {error}")
+    _, on_failure = _handlers.get(job.get('kind'), (None, None))
+    if on_failure:
+        try:
+            on_failure(job.get('payload') or {}, error)
+        except Exception as e:
+            logger.error(f"Failure hook for job {job['id']} failed: {e}", exc_info=True)
+
+
+# ============================================================================
+# WORKERS
+# ============================================================================
+
+class JobContext:
+    """
+    Handed to a job handler to report progress.
+
+    Reporting also renews the lease. A background heartbeat renews it too,
+    so stages that report rarely don't lose the job. Once the heartbeat
+    finds the lease lost, lease_lost is set and the next report raises
+    LeaseLostError, so handlers stop at their next stage or file.
+    """
+
+    def __init__(self, job: dict, worker_id: str):
+        self.job_id = job['id']
+        self.kind = job.get('kind')
+        self.attempt = job.get('attempts', 1)
+        self.max_attempts = job.get('max_attempts', JOB_MAX_ATTEMPTS)
+        self.worker_id = worker_id
+        self.stage = job.get('stage')
+        self.lease_lost = False
+        self._last_report = 0.0
+
+    def report(self, stage: str, progress: float, message: str = None) -> None:
+        """
+        Records the current stage and overall progress (0-1).
+
+        Raises:
+            LeaseLostError: If another worker has taken over the job
+        """
+        self.check_lease()
+        now = time.time()
+        if stage == self.stage and now - self._last_report < JOB_PROGRESS_MIN_INTERVAL:
+            return
+        self.stage = stage
+        self._last_report = now
+        fields = {'stage': stage, 'progress': max(0.0, min(progress, 1.0)),
+                  'available_at': now + JOB_LEASE_SECONDS, 'updated_at': now}
+        if message is not None:
+            fields['message'] = message
+        self._write(fields)
+
+    def check_lease(self) -> None:
+        """Raises LeaseLostError if the heartbeat found the job taken over."""
+        if self.lease_lost:
+            raise LeaseLostError(f"Job {self.job_id} was taken over by another worker")
+
+    def heartbeat(self) -> None:
+        """Renews the lease without changing progress."""
+        now = time.time()
+        self._write({'available_at': now + JOB_LEASE_SECONDS, 'updated_at': now})
+
+    def _write(self, fields: dict) -> None:
+        if self.lease_lost or not _get_store().update(self.job_id, fields, worker_id=self.worker_id):
+            self.lease_lost = True
+            raise LeaseLostError(f"Job {self.job_id} was taken over by another worker")
+
+
+def register_handler(kind: str, handler, on_failure=None) -> None:
+    """
+    Registers the function that runs jobs of a kind.
+
+    Args:
+        kind: Job type
+        handler: Function (payload, JobContext) -> JSON-serializable result
+        on_failure: Optional function (payload, error message) called once
+                    when a job has failed its last attempt
+    """
+    _handlers[kind] = (handler, on_failure)
+
+
+def _keep_lease(context: JobContext, stop: threading.Event) -> None:
+    """Renews a running job's lease until stop is set."""
+    while not stop.wait(JOB_LEASE_SECONDS / 3):
+        try:
+            context.heartbeat()
+        except LeaseLostError:
+            logger.warning(f"Lost the lease on job {context.job_id}")
+            return
+        except Exception as e:
+            logger.warning(f"Heartbeat for job {context.job_id} failed: {e}")
+
+
+def run_job(job: dict, worker_id: str) -> None:
+    """
+    Runs one claimed job with its handler and records the outcome.
+
+    Failed attempts are retried with exponential backoff until the job
+    runs out of attempts.
+    """
+    context = JobContext(job, worker_id)
+    handler, _ = _handlers.get(job.get('kind'), (None, None))
+    if handler is None:
+        _finish_failed(job, f"No handler for job kind {job.get('kind')}")
+        return
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_keep_lease, args=(context, stop), name=f"job-lease-{job['id'][:8]}", daemon=True)
+    heartbeat.start()
+    started = time.perf_counter()
+    try:
+        result = handler(job.get('payload') or {}, context)
+    except LeaseLostError as e:
+        logger.warning(str(e))
+        return
+    except Exception as e:
+        logger.error(f"Job {job['id']} attempt {context.attempt} failed: {e}", exc_info=True)
+        if isinstance(e, PermanentJobError) or context.attempt >= context.max_attempts:
+            _finish_failed(job, str(e))
+        else:
+            now = time.time()
+            _get_store().update(job['id'], {
+                'status': QUEUED, 'error': str(e), 'worker_id': None,
+                'available_at': now + JOB_RETRY_BASE_SECONDS * (2 ** (context.attempt - 1)), 'updated_at': now
+            }, worker_id=worker_id)
+        return
+    finally:
+        stop.set()
+
+    now = time.time()
+    _get_store().update(job['id'], {
+        'status': SUCCEEDED, 'progress': 1.0, 'result': result, 'error': None,
+        'available_at': None, 'finished_at': now, 'updated_at': now
+    }, worker_id=worker_id)
+    logger.info(f"Job {job['id']} ({job.get('kind')}) succeeded in {time.perf_counter() - started:.1f}s")
+
+
+def run_worker(stop: threading.Event = None, worker_id: str = None, poll_seconds: float = None) -> None:
+    """
+    Claims and runs jobs until stop is set.
+
+    Args:
+        stop: Event that ends the loop (default: run forever)
+        worker_id: Name recorded on claimed jobs (default: host:pid:thread)
+        poll_seconds: Wait between claims while the queue is empty
+    """
+    stop = stop or threading.Event()
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    poll_seconds = JOB_POLL_SECONDS if poll_seconds is None else poll_seconds
+    logger.info(f"Job worker {worker_id} started")
+    while not stop.is_set():
+        try:
+            job = claim_job(worker_id)
+        except Exception as e:
+            logger.error(f"Failed to claim a job: {e}", exc_info=True)
+            job = None
+        if job is None:
+            stop.wait(poll_seconds)
+            continue
+        logger.info(f"Worker {worker_id} running {job.get('kind')} job {job['id']} (attempt {job['attempts']})")
+        run_job(job, worker_id)
+
+
+def start_background_worker() -> threading.Thread:
+    """
+    Starts one daemon worker thread in this process, once per process.
+
+    Used by the web app when JOB_WORKER_IN_PROCESS is enabled; dedicated
+    workers run app.commands.job_worker instead.
+    """
+    with _worker_lock:
+        thread = _worker_threads.get(os.getpid())
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(target=run_worker, name='job-worker', daemon=True)
+            thread.start()
+            _worker_threads[os.getpid()] = thread
+        return thread
@@ -4,15 +4,20 @@ Handles all networkx graph construction and topic summarization.
 """
 import sys
 import networkx as nx
+import numpy as np
 import json
 import logging
+import math
 import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 if root_dir not in sys.path:
     sys.path.insert(0, root_dir)
-from app.services import gemini_service
+from app.services import gemini_service, concurrency
 
 logger = logging.getLogger(__name__)
 
@@ -21,7 +26,43 @@ SUMMARY_QUERY_TEMPLATE = (
     "Write a 1-paragraph summary for the topic. Make clear what likely are the learning objectives and what student should focus on during the course: {topic}. Go straight to the summary, no intro or outro."
 )
 
+# Topic summaries are generated in parallel; the rate limit is shared by
+# every graph build in this worker so concurrent initializations can't
+# exceed the Gemini quota together
+SUMMARY_MAX_WORKERS = int(os.environ.get('KG_SUMMARY_WORKERS', '4'))
+SUMMARY_RATE_PER_SECOND = float(os.environ.get('KG_SUMMARY_RATE_PER_SECOND', '2'))
+SUMMARY_MAX_ATTEMPTS = int(os.environ.get('KG_SUMMARY_MAX_ATTEMPTS', '3'))
+SUMMARY_RETRY_BASE_SECONDS = float(os.environ.get('KG_SUMMARY_RETRY_BASE_SECONDS', '1.0'))
+# 'per_topic' = one retrieval + generation per topic; 'batched' = one
+# generation for all topics (falls back to per_topic if it can't be parsed)
+SUMMARY_MODE = os.environ.get('KG_SUMMARY_MODE', 'per_topic')
+
+_summary_limiter = concurrency.RateLimiter(SUMMARY_RATE_PER_SECOND, burst=SUMMARY_MAX_WORKERS)
+
+# Server-side layout: nodes get x/y in vis-network canvas units so the
+# views can render without running physics in the browser
+LAYOUT_NODE_SPACING = float(os.environ.get('KG_LAYOUT_NODE_SPACING', '120'))
+LAYOUT_SEED = 42
+
+# Topic-to-topic "related" edges: each topic links to its RELATED_TOP_K most
+# similar topics (by summary embedding) with cosine similarity >= RELATED_THRESHOLD
+RELATED_TOP_K = int(os.environ.get('KG_RELATED_TOP_K', '2'))
+RELATED_THRESHOLD = float(os.environ.get('KG_RELATED_THRESHOLD', '0.75'))
+
 NUM_TOPICS = 9
+
+BATCH_SUMMARY_PROMPT = """You are preparing a knowledge graph for a course. Below are numbered excerpts from the course materials, followed by a list of topics with the excerpts relevant to each.
+
+For each topic, write a 1-paragraph summary. Make clear what likely are the learning objectives and what student should focus on during the course. Base each summary on that topic's excerpts. Go straight to the summary, no intro or outro.
+
+Return ONLY JSON in this format, with one entry per topic, using the topic names exactly as given:
+{{"summaries": [{{"topic": "<topic name>", "summary": "<summary>"}}]}}
+
+Excerpts:
+{excerpts}
+
+Topics:
+{topics}"""
 def extract_topics_from_summaries(summaries: List[str], num_topics=NUM_TOPICS) -> List[str]:
     """
     Uses Gemini to extract main course topics from syllabus text.
@@ -52,41 +93,524 @@ Summaries: {all_summaries}"""
         raise
 
 
-def add_topic_to_graph(topic_name: str, corpus_id: str, existing_nodes: list, existing_edges: list, existing_data: dict, custom_summary: str = None) -> tuple[str, str, str]:
+def _summarize_topic(topic: str, corpus_id: str) -> tuple:
     """
-    Adds a new topic to an existing knowledge graph.
+    Generates one topic summary, retrying transient failures with exponential backoff.
+
+    Returns:
+        Tuple of (summary, source_names) from generate_answer_with_context
+    """
+    attempt = 1
+    while True:
+        _summary_limiter.acquire()
+        try:
+            return gemini_service.generate_answer_with_context(
+                query=SUMMARY_QUERY_TEMPLATE.format(topic=topic),
+                corpus_id=corpus_id,
+            )
+        except ValueError:
+            # Configuration errors won't succeed on retry
+            raise
+        except Exception as e:
+            if attempt >= SUMMARY_MAX_ATTEMPTS:
+                raise
+            delay = SUMMARY_RETRY_BASE_SECONDS * (2 ** (attempt - 1)) * (1 + random.random() / 2)
+            logger.warning(f"Summary for topic '{topic}' failed (attempt {attempt}/{SUMMARY_MAX_ATTEMPTS}), retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+            attempt += 1
+
+
+def summarize_topics(topics: List[str], corpus_id: str, mode: str = None, on_result=None) -> list:
+    """
+    Generates summaries for several topics.
+
+    In 'per_topic' mode each topic gets its own retrieval and generation,
+    run in parallel on a bounded worker pool (KG_SUMMARY_WORKERS) behind the
+    shared rate limiter, so wall time scales with the slowest topic rather
+    than the sum. Each topic is retried on its own; one failing topic
+    doesn't affect the others.
+
+    In 'batched' mode all topics share one generation call (see
+    _summarize_topics_batched); topics it can't summarize fall back to
+    per-topic calls.
+
+    Args:
+        topics: Topic names to summarize
+        corpus_id: The RAG corpus ID to query
+        mode: 'per_topic' or 'batched' (default: KG_SUMMARY_MODE)
+        on_result: Optional function (position, (summary, source_names)) called
+                   as each topic is summarized successfully (from worker threads)
+
+    Returns:
+        List aligned with `topics`: (summary, source_names) for each topic,
+        or the exception raised by its last attempt
+
+    Example:
+        results = summarize_topics(['Recursion', 'Sorting'], corpus_id)
+        # [('Recursion is...', [{'filename': 'Lecture3.pdf', ...}]), TimeoutError(...)]
+    """
+    if not topics:
+        return []
+
+    mode = mode or SUMMARY_MODE
+    if mode == 'batched' and len(topics) > 1:
+        results = _summarize_topics_batched(topics, corpus_id)
+        for position, result in enumerate(results):
+            if not isinstance(result, Exception):
+                _notify_result(on_result, position, result)
+        return results
+
+    def summarize(position, topic):
+        result = _summarize_topic(topic, corpus_id)
+        _notify_result(on_result, position, result)
+        return result
+
+    started = time.perf_counter()
+    results = _run_bounded(summarize, list(enumerate(topics)))
+    logger.info(f"Summarized {len(topics)} topics in {time.perf_counter() - started:.1f}s")
+    return results
+
+
+def _notify_result(on_result, position: int, result: tuple) -> None:
+    """Passes a finished summary to the caller's callback; a failing callback doesn't fail the topic."""
+    if on_result is None:
+        return
+    try:
+        on_result(position, result)
+    except Exception as e:
+        logger.warning(f"Summary callback for topic {position} failed: {e}")
+
+
+def _run_bounded(fn, calls: list) -> list:
+    """Runs fn(*args) for each args tuple on a bounded pool; returns results or exceptions in order."""
+    workers = max(1, min(SUMMARY_MAX_WORKERS, len(calls)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='kg-summary') as pool:
+        futures = [pool.submit(fn, *args) for args in calls]
+
+    results = []
+    for future in futures:
+        error = future.exception()
+        results.append(error if error is not None else future.result())
+    return results
+
+
+def _parse_batched_summaries(response_text: str, topics: List[str]) -> dict:
+    """
+    Parses the batched summary JSON into {topic: summary}.
+    Tolerates a Markdown code fence around the JSON; entries for unknown
+    topics are ignored.
+    """
+    text = response_text.strip()
+    if text.startswith('```'):
+        text = text.split('\n', 1)[1] if '\n' in text else ''
+        text = text.rsplit('```', 1)[0]
+    entries = json.loads(text)
+    if isinstance(entries, dict):
+        entries = entries.get('summaries', [])
+
+    by_key = {topic.strip().casefold(): topic for topic in topics}
+    summaries = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        topic = by_key.get(str(entry.get('topic', '')).strip().casefold())
+        summary = entry.get('summary')
+        if topic and isinstance(summary, str) and summary.strip():
+            summaries[topic] = summary.strip()
+    return summaries
+
+
+def _summarize_topics_batched(topics: List[str], corpus_id: str) -> list:
+    """
+    Summarizes all topics with one generation call.
+
+    1. Retrieves context for every topic in parallel
+    2. Numbers the unique chunks once (topics often retrieve the same ones)
+    3. Asks Gemini for every summary in a single JSON response
+    4. Falls back to per-topic calls for topics whose retrieval failed or
+       that are missing from the response (or all of them if it can't be parsed)
+    """
+    started = time.perf_counter()
+    retrievals = _run_bounded(
+        gemini_service.retrieve_answer_context,
+        [(SUMMARY_QUERY_TEMPLATE.format(topic=topic), corpus_id) for topic in topics]
+    )
+
+    results = [None] * len(topics)
+    chunk_numbers = {}  # chunk text -> excerpt number
+    topic_lines = []
+    batch_indexes = []
+    for i, (topic, retrieval) in enumerate(zip(topics, retrievals)):
+        if isinstance(retrieval, Exception):
+            continue
+        context_texts, source_names = retrieval
+        if not context_texts:
+            # Same answer the per-topic path gives when nothing is retrieved
+            results[i] = (gemini_service.NO_CONTEXT_ANSWER, [])
+            continue
+        numbers = [chunk_numbers.setdefault(text, len(chunk_numbers) + 1) for text in context_texts]
+        topic_lines.append(f"- {topic} (excerpts {', '.join(str(n) for n in numbers)})")
+        batch_indexes.append(i)
+
+    if batch_indexes:
+        excerpts = "\n\n".join(f"[{number}] {text}" for text, number in chunk_numbers.items())
+        prompt = BATCH_SUMMARY_PROMPT.format(excerpts=excerpts, topics="\n".join(topic_lines))
+        try:
+            _summary_limiter.acquire()
+            response_text = gemini_service.generate_answer(prompt, response_mime_type='application/json')
+            summaries = _parse_batched_summaries(response_text, [topics[i] for i in batch_indexes])
+        except Exception as e:
+            logger.warning(f"Batched topic summaries failed, falling back to per-topic calls: {e}")
+            summaries = {}
+        for i in batch_indexes:
+            if topics[i] in summaries:
+                results[i] = (summaries[topics[i]], retrievals[i][1])
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        logger.info(f"Summarizing {len(missing)} of {len(topics)} topics per topic")
+        fallback = summarize_topics([topics[i] for i in missing], corpus_id, mode='per_topic')
+        for i, result in zip(missing, fallback):
+            results[i] = result
+
+    logger.info(f"Summarized {len(topics)} topics in batched mode ({len(chunk_numbers)} unique chunks) "
+                f"in {time.perf_counter() - started:.1f}s")
+    return results
+
+
+def compute_layout(G: nx.Graph, fixed_positions: dict = None) -> dict:
+    """
+    Computes node positions with a force-directed (spring) layout.
+
+    With fixed_positions, those nodes stay exactly where they are and only
+    the remaining nodes are placed, so editing a graph never moves nodes
+    the client has already drawn.
+
+    Args:
+        G: The graph to lay out
+        fixed_positions: Optional {node_id: (x, y)} in canvas units for nodes that must not move
+
+    Returns:
+        Dict of {node_id: (x, y)} in canvas units
+
+    Example:
+        positions = compute_layout(G)
+        # {'101': (-412.3, 88.0), 'topic_1': (35.9, -120.4), ...}
+    """
+    if G.number_of_nodes() == 0:
+        return {}
+
+    fixed = {node: position for node, position in (fixed_positions or {}).items() if node in G}
+    if not fixed:
+        # Spread grows with the square root of the node count so nodes keep their spacing
+        scale = LAYOUT_NODE_SPACING * max(1.0, math.sqrt(G.number_of_nodes()))
+        layout = nx.spring_layout(G, seed=LAYOUT_SEED, scale=scale)
+    else:
+        # Lay out in the unit space spring_layout expects, then map back
+        scale = max(max(abs(x), abs(y)) for x, y in fixed.values()) or LAYOUT_NODE_SPACING
+        initial = {node: (x / scale, y / scale) for node, (x, y) in fixed.items()}
+        layout = nx.spring_layout(G, pos=initial, fixed=list(initial), seed=LAYOUT_SEED)
+        layout = {node: (x * scale, y * scale) for node, (x, y) in layout.items()}
+
+    positions = {node: (round(float(x), 1), round(float(y), 1)) for node, (x, y) in layout.items()}
+    # Fixed nodes keep their stored coordinates exactly (no rounding drift)
+    positions.update(fixed)
+    return positions
+
+
+def _position_new_nodes(existing_nodes: list, new_nodes: list, new_edges: list) -> None:
+    """
+    Sets x/y on new_nodes around an already laid-out graph, keeping every
+    existing node in place. Does nothing if the existing graph has no layout
+    (the views then fall back to browser physics).
+    """
+    if not existing_nodes or not all('x' in node and 'y' in node for node in existing_nodes):
+        return
+
+    G = nx.Graph()
+    G.add_nodes_from(node['id'] for node in existing_nodes + new_nodes)
+    G.add_edges_from((edge['from'], edge['to']) for edge in new_edges if edge['from'] in G and edge['to'] in G)
+    positions = compute_layout(G, {node['id']: (node['x'], node['y']) for node in existing_nodes})
+    for node in new_nodes:
+        node['x'], node['y'] = positions[node['id']]
+
+
+FILE_NODE_GROUPS = ('file_pdf', 'file')
+
+
+def _source_basename(name: str) -> str:
+    """Case-insensitive file name key (last path segment) for the source index."""
+    return name.rstrip('/').split('/')[-1].casefold()
+
+
+def build_source_index(files: list = None, indexed_files: dict = None, nodes: list = None) -> dict:
+    """
+    Builds the lookup table used to link retrieved sources to file nodes.
+
+    Retrieved sources carry the GCS URI the file was imported from and its
+    file name; Canvas files carry their ID. The index maps each of these to
+    the file node ID, so resolving a source is a dictionary lookup instead
+    of a scan over every file name.
+
+    Args:
+        files: File objects from Canvas (with 'gcs_uri' once uploaded)
+        indexed_files: The course's indexed_files map (file_id -> {'gcs_uri', 'display_name', ...})
+        nodes: Existing graph nodes; file nodes are indexed by ID and label
+
+    Returns:
+        Dict of {'uri': {gcs_uri: node_id}, 'name': {basename: node_id}, 'id': {file_id: node_id}}
+
+    Example:
+        index = build_source_index(files=[{'id': '101', 'display_name': 'Week 1.pdf',
+                                           'gcs_uri': 'gs://bucket/courses/1/Week 1.pdf'}])
+        # {'uri': {'gs://bucket/courses/1/Week 1.pdf': '101'},
+        #  'name': {'week 1.pdf': '101'}, 'id': {'101': '101'}}
+    """
+    index = {'uri': {}, 'name': {}, 'id': {}}
+
+    def add(file_id, name=None, gcs_uri=None):
+        file_id = str(file_id or '')
+        if not file_id:
+            return
+        index['id'][file_id] = file_id
+        if gcs_uri:
+            index['uri'][gcs_uri] = file_id
+            index['name'].setdefault(_source_basename(gcs_uri), file_id)
+        if name:
+            index['name'].setdefault(_source_basename(name), file_id)
+
+    for node in nodes or []:
+        if node.get('group') in FILE_NODE_GROUPS:
+            add(node.get('id'), node.get('label'))
+
+    for file_id, entry in (indexed_files or {}).items():
+        if isinstance(entry, dict):
+            add(file_id, entry.get('display_name'), entry.get('gcs_uri'))
+
+    for file_obj in files or []:
+        if isinstance(file_obj, dict):
+            add(file_obj.get('id'), file_obj.get('name') or file_obj.get('display_name'), file_obj.get('gcs_uri'))
+        else:
+            add(getattr(file_obj, 'id', None),
+                getattr(file_obj, 'name', None) or getattr(file_obj, 'display_name', None),
+                getattr(file_obj, 'gcs_uri', None))
+
+    return index
+
+
+def resolve_source(source, source_index: dict):
+    """
+    Returns the file node ID for a retrieved source, or None if it isn't a course file.
+
+    Tries the exact GCS URI first, then the file name, then a Canvas file ID.
+    """
+    if isinstance(source, dict):
+        uri = source.get('source_uri') or ''
+        name = source.get('filename') or ''
+        file_id = source.get('file_id') or source.get('id')
+    else:
+        uri, name, file_id = '', source or '', None
+
+    if uri and uri in source_index['uri']:
+        return source_index['uri'][uri]
+    for candidate in (uri, name):
+        if candidate:
+            node_id = source_index['name'].get(_source_basename(candidate))
+            if node_id:
+                return node_id
+    if file_id is not None:
+        return source_index['id'].get(str(file_id))
+    return None
+
+
+def _match_source_files(source_names: list, source_index: dict) -> List[str]:
+    """Maps retrieved source names to unique file node IDs, in source order."""
+    source_files = []
+    for source in source_names:
+        file_id = resolve_source(source, source_index)
+        if file_id and file_id not in source_files:
+            source_files.append(file_id)
+    return source_files
+
+
+def _embeddable_summary(entry: dict):
+    """Returns the summary text worth embedding, or None for failed or empty topics."""
+    summary = (entry.get('summary') or '').strip()
+    if not summary or summary.startswith('Error retrieving information for'):
+        return None
+    return summary
+
+
+def embed_topic_summaries(kg_data: dict) -> dict:
+    """
+    Adds an 'embedding' to every topic entry that doesn't have one yet,
+    with a single batched embedding request.
+
+    Embeddings are kept with the topic data, so editing one topic only
+    embeds that topic. Entries are copied, never modified in place.
+
+    Args:
+        kg_data: Dict of {topic_id: {'summary', 'sources', ...}}
+
+    Returns:
+        New kg_data dict with embeddings added
+
+    Example:
+        kg_data = embed_topic_summaries({'topic_1': {'summary': 'Recursion is...', 'sources': []}})
+        # {'topic_1': {'summary': 'Recursion is...', 'sources': [], 'embedding': [0.012, ...]}}
+    """
+    missing = [(topic_id, _embeddable_summary(entry)) for topic_id, entry in kg_data.items()
+               if 'embedding' not in entry and _embeddable_summary(entry)]
+    if not missing:
+        return dict(kg_data)
+
+    try:
+        vectors = gemini_service.get_embeddings([summary for _, summary in missing])
+    except Exception as e:
+        # Related edges are optional; the graph is still usable without them
+        logger.warning(f"Could not embed topic summaries, skipping related edges: {e}")
+        return dict(kg_data)
+
+    updated = dict(kg_data)
+    for (topic_id, _), vector in zip(missing, vectors):
+        updated[topic_id] = {**kg_data[topic_id], 'embedding': list(vector)}
+    logger.info(f"Embedded {len(missing)} topic summaries in one request")
+    return updated
+
+
+def compute_related_edges(kg_data: dict, top_k: int = None, threshold: float = None) -> list:
+    """
+    Links topics whose summaries are semantically similar.
+
+    Computes the full cosine similarity matrix of the topic embeddings in
+    one NumPy operation. Two topics are related if either is among the
+    other's top_k most similar topics and their similarity is >= threshold.
+    Topics without an embedding are skipped.
+
+    Args:
+        kg_data: Dict of {topic_id: {..., 'embedding': [...]}} (see embed_topic_summaries)
+        top_k: Related topics per topic (default: KG_RELATED_TOP_K)
+        threshold: Minimum cosine similarity (default: KG_RELATED_THRESHOLD)
+
+    Returns:
+        List of {'from', 'to', 'type': 'related', 'similarity'} edges; 'from'
+        is the later topic so each edge is stored with the newer topic
+
+    Example:
+        edges = compute_related_edges(kg_data)
+        # [{'from': 'topic_4', 'to': 'topic_2', 'type': 'related', 'similarity': 0.83}]
+    """
+    top_k = RELATED_TOP_K if top_k is None else top_k
+    threshold = RELATED_THRESHOLD if threshold is None else threshold
+
+    topic_ids = [topic_id for topic_id, entry in kg_data.items() if entry.get('embedding')]
+    if top_k <= 0 or len(topic_ids) < 2:
+        return []
+
+    vectors = np.array([kg_data[topic_id]['embedding'] for topic_id in topic_ids], dtype=float)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1.0, norms)
+    similarity = vectors @ vectors.T
+    np.fill_diagonal(similarity, -np.inf)
+
+    # Each topic's top_k neighbours above the threshold, kept symmetric
+    k = min(top_k, len(topic_ids) - 1)
+    neighbours = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+    related = np.zeros(similarity.shape, dtype=bool)
+    related[np.arange(len(topic_ids))[:, None], neighbours] = True
+    related &= similarity >= threshold
+    related |= related.T
+
+    edges = []
+    for i, j in zip(*np.nonzero(np.triu(related, k=1))):
+        earlier, later = sorted((topic_ids[i], topic_ids[j]), key=_topic_number)
+        edges.append({'from': later, 'to': earlier, 'type': 'related',
+                      'similarity': round(float(similarity[i, j]), 3)})
+    edges.sort(key=lambda edge: (_topic_number(edge['from']), _topic_number(edge['to'])))
+    return edges
+
+
+def refresh_related_edges(edges: list, kg_data: dict) -> tuple[list, dict]:
+    """
+    Recomputes the related edges after topics were added or removed.
+
+    Only topics without an embedding are embedded (one request); the
+    similarity matrix is recomputed from the stored embeddings, so an edit
+    costs at most one embedding call however large the graph is.
+
+    Args:
+        edges: Current edge list (file edges are kept as they are)
+        kg_data: Current kg_data dict
+
+    Returns:
+        Tuple of (updated_edges, updated_kg_data)
+    """
+    kg_data = embed_topic_summaries(kg_data)
+    updated_edges = [edge for edge in edges if edge.get('type') != 'related']
+    updated_edges.extend(compute_related_edges(kg_data))
+    return updated_edges, kg_data
+
+
+def _topic_number(topic_id: str) -> int:
+    """Sort key for topic IDs: the number in 'topic_<n>'."""
+    suffix = topic_id.rsplit('_', 1)[-1]
+    return int(suffix) if suffix.isdigit() else 0
+
+
+def _next_topic_number(existing_nodes: list) -> int:
+    """Returns the number for the next 'topic_<n>' ID in a graph."""
+    existing_topic_ids = [node['id'] for node in existing_nodes if node.get('group') == 'topic' and node['id'].startswith('topic_')]
+    topic_numbers = [int(tid.split('_')[1]) for tid in existing_topic_ids if '_' in tid and tid.split('_')[1].isdigit()]
+    return max(topic_numbers) + 1 if topic_numbers else 1
+
+
+def _topic_parts(topic_id: str, topic_name: str, summary: str, source_names: list, source_index: dict) -> tuple[dict, list, dict]:
+    """Builds a topic's (node, edges, data) from its summary and retrieved sources."""
+    topic_node = {
+        'id': topic_id,
+        'label': topic_name,
+        'group': 'topic'
+    }
+    # Create edges from topic to relevant files
+    topic_edges = [{'from': topic_id, 'to': file_id} for file_id in _match_source_files(source_names, source_index)]
+    topic_data = {
+        'summary': summary,
+        'sources': source_names
+    }
+    return topic_node, topic_edges, topic_data
+
+
+def build_topic(topic_name: str, corpus_id: str, existing_nodes: list, custom_summary: str = None, source_index: dict = None,
+                topic_id: str = None) -> tuple[dict, list, dict]:
+    """
+    Creates a new topic for an existing knowledge graph without touching the rest of it.
     
     Args:
         topic_name: Name of the new topic to add
         corpus_id: The RAG corpus ID to query for topic summary and sources
-        existing_nodes: Current list of graph nodes
-        existing_edges: Current list of graph edges
-        existing_data: Current kg_data dictionary
+        existing_nodes: Current list of graph nodes (used for placement, and for
+                        the next topic ID if topic_id isn't given)
         custom_summary: Optional custom summary to use instead of generating one via RAG
+        source_index: The course's stored source index (see build_source_index);
+                      built from existing_nodes if not given
+        topic_id: Optional ID reserved with firestore_service.allocate_topic_ids
+                  (needed when other editors may add topics at the same time)
         
     Returns:
-        Tuple of (updated_nodes_json, updated_edges_json, updated_data_json)
+        Tuple of (topic_node, topic_edges, topic_data)
+        
+    Example:
+        node, edges, data = build_topic('Recursion', corpus_id, nodes)
+        # node = {'id': 'topic_10', 'label': 'Recursion', 'group': 'topic'}
+        # edges = [{'from': 'topic_10', 'to': '101'}]
     """
     logger.info(f"Adding new topic to graph: {topic_name}")
     
-    # Find the next topic ID number
-    existing_topic_ids = [node['id'] for node in existing_nodes if node.get('group') == 'topic' and node['id'].startswith('topic_')]
-    topic_numbers = [int(tid.split('_')[1]) for tid in existing_topic_ids if '_' in tid and tid.split('_')[1].isdigit()]
-    next_number = max(topic_numbers) + 1 if topic_numbers else 1
-    new_topic_id = f"topic_{next_number}"
-    
-    # Create topic node
-    new_topic_node = {
-        'id': new_topic_id,
-        'label': topic_name,
-        'group': 'topic'
-    }
+    new_topic_id = topic_id or f"topic_{_next_topic_number(existing_nodes)}"
     
-    # Create a mapping of file names to file IDs
-    file_name_to_id = {}
-    for node in existing_nodes:
-        if node.get('group') in ['file_pdf', 'file']:
-            file_name_to_id[node.get('label')] = node.get('id')
+    # Index file nodes for source-to-file resolution
+    if source_index is None:
+        source_index = build_source_index(nodes=existing_nodes)
     
     # Query RAG corpus for this topic (or use custom summary)
     try:
@@ -94,61 +618,124 @@ def add_topic_to_graph(topic_name: str, corpus_id: str, existing_nodes: list, ex
             # Use the provided custom summary
             summary = custom_summary
             source_names = []
-            source_files = []
             logger.info(f"Using custom summary for topic '{topic_name}'")
         else:
-            # Use gemini_service to get summary and sources
-            summary, source_names = gemini_service.generate_answer_with_context(
-                query=SUMMARY_QUERY_TEMPLATE.format(topic=topic_name),
-                corpus_id=corpus_id,
-            )
-            
-            # Extract unique source file IDs
-            source_files = []
-            for source in source_names:
-                # Handle both old string format and new dict format
-                if isinstance(source, dict):
-                    source_name = source.get('filename', '')
-                else:
-                    source_name = source
-                
-                # Match source name to file IDs
-                for file_name, fid in file_name_to_id.items():
-                    if file_name in source_name or source_name in file_name:
-                        if fid not in source_files:
-                            source_files.append(fid)
-                        break
+            # Same summarization engine (rate limit and retries) as build_knowledge_graph
+            result = summarize_topics([topic_name], corpus_id)[0]
+            if isinstance(result, Exception):
+                raise result
+            summary, source_names = result
         
-        # Store topic data
-        topic_data = {
-            'summary': summary,
-            'sources': source_names
-        }
-        
-        # Create edges from topic to relevant files
-        new_edges = []
-        for file_id in source_files:
-            edge = {
-                'from': new_topic_id,
-                'to': file_id
-            }
-            new_edges.append(edge)
-        
-        logger.info(f"Created topic '{topic_name}' with {len(source_files)} connected sources")
+        new_topic_node, new_edges, topic_data = _topic_parts(new_topic_id, topic_name, summary, source_names, source_index)
+        logger.info(f"Created topic '{topic_name}' with {len(new_edges)} connected sources")
         
     except Exception as e:
         logger.error(f"Error querying RAG for topic {topic_name}: {e}")
         # If RAG query fails, still create the topic node but with empty data
-        topic_data = {
-            'summary': f"Error retrieving information for {topic_name}.",
-            'sources': []
-        }
-        new_edges = []
+        new_topic_node, new_edges, topic_data = _topic_parts(
+            new_topic_id, topic_name, f"Error retrieving information for {topic_name}.", [], source_index
+        )
+    
+    # Place the topic next to its sources without moving the rest of the graph
+    _position_new_nodes(existing_nodes, [new_topic_node], new_edges)
+    
+    return (new_topic_node, new_edges, topic_data)
+
+
+def build_topics(topic_specs: list, corpus_id: str, existing_nodes: list, source_index: dict = None,
+                 allocate_ids=None) -> list:
+    """
+    Creates several new topics for an existing knowledge graph at once.
+
+    Topics without a custom summary are summarized concurrently through
+    summarize_topics (same rate limit and retries as a graph build). Unlike
+    build_topic, a topic whose summary can't be generated is reported as a
+    failure instead of being created with an error summary.
+
+    Args:
+        topic_specs: List of {'name': str, 'summary': optional custom summary}
+        corpus_id: The RAG corpus ID to query for topic summaries and sources
+        existing_nodes: Current list of graph nodes (used for topic IDs and placement)
+        source_index: The course's stored source index (built from existing_nodes if not given)
+        allocate_ids: Optional function (count) -> list of topic IDs, called once with the
+                      number of topics that were summarized (e.g. firestore_service.allocate_topic_ids);
+                      IDs continue from existing_nodes if not given
+
+    Returns:
+        List aligned with topic_specs holding (topic_node, topic_edges, topic_data)
+        tuples or the Exception that topic failed with
+
+    Example:
+        results = build_topics([{'name': 'Recursion'}, {'name': 'Heaps', 'summary': 'Heaps are...'}],
+                               corpus_id, nodes)
+        # [({'id': 'topic_10', ...}, [...], {...}), ({'id': 'topic_11', ...}, [], {...})]
+    """
+    if source_index is None:
+        source_index = build_source_index(nodes=existing_nodes)
+
+    names = [(spec.get('name') or '').strip() for spec in topic_specs]
+    to_summarize = [i for i, spec in enumerate(topic_specs) if names[i] and not spec.get('summary')]
+    summaries = dict(zip(to_summarize, summarize_topics([names[i] for i in to_summarize], corpus_id)))
+
+    results = []
+    for i, spec in enumerate(topic_specs):
+        name = names[i]
+        if not name:
+            results.append(ValueError("Missing topic name"))
+            continue
+        result = (spec['summary'], []) if spec.get('summary') else summaries[i]
+        if isinstance(result, Exception):
+            logger.error(f"Error summarizing topic {name}: {result}")
+        results.append(result)
+
+    # Only topics that will be written get an ID
+    count = sum(1 for result in results if not isinstance(result, Exception))
+    if allocate_ids is not None:
+        topic_ids = iter(allocate_ids(count))
+    else:
+        next_number = _next_topic_number(existing_nodes)
+        topic_ids = iter(f"topic_{number}" for number in range(next_number, next_number + count))
+    results = [
+        result if isinstance(result, Exception)
+        else _topic_parts(next(topic_ids), names[i], result[0], result[1], source_index)
+        for i, result in enumerate(results)
+    ]
+
+    # Place all new topics at once, keeping the existing graph in place
+    built = [result for result in results if not isinstance(result, Exception)]
+    _position_new_nodes(existing_nodes, [node for node, _, _ in built], [edge for _, edges, _ in built for edge in edges])
+
+    logger.info(f"Built {len(built)}/{len(topic_specs)} new topics")
+    return results
+
+
+def add_topic_to_graph(topic_name: str, corpus_id: str, existing_nodes: list, existing_edges: list, existing_data: dict, custom_summary: str = None, source_index: dict = None) -> tuple[str, str, str]:
+    """
+    Adds a new topic to an existing knowledge graph.
+    
+    Args:
+        topic_name: Name of the new topic to add
+        corpus_id: The RAG corpus ID to query for topic summary and sources
+        existing_nodes: Current list of graph nodes
+        existing_edges: Current list of graph edges
+        existing_data: Current kg_data dictionary
+        custom_summary: Optional custom summary to use instead of generating one via RAG
+        source_index: The course's stored source index (see build_source_index);
+                      built from existing_nodes if not given
+        
+    Returns:
+        Tuple of (updated_nodes_json, updated_edges_json, updated_data_json)
+    """
+    new_topic_node, new_edges, topic_data = build_topic(
+        topic_name, corpus_id, existing_nodes, custom_summary=custom_summary, source_index=source_index
+    )
+    new_topic_id = new_topic_node['id']
     
     # Update the graph structures
     updated_nodes = existing_nodes + [new_topic_node]
-    updated_edges = existing_edges + new_edges
-    updated_data = {**existing_data, new_topic_id: topic_data}
+    updated_edges, updated_data = refresh_related_edges(
+        existing_edges + new_edges, {**existing_data, new_topic_id: topic_data}
+    )
     
     # Serialize to JSON strings
     nodes_json = json.dumps(updated_nodes)
@@ -207,24 +794,226 @@ def remove_topic_from_graph(topic_id: str, existing_nodes: list, existing_edges:
     
     logger.info(f"Removed {nodes_removed} node(s) and {edges_removed} edge(s)")
     
+    # Topics that were related to the removed one may now relate to others
+    updated_edges, updated_data = refresh_related_edges(updated_edges, updated_data)
+    
     # Serialize to JSON strings
     nodes_json = json.dumps(updated_nodes)
     edges_json = json.dumps(updated_edges)
     data_json = json.dumps(updated_data)
     
     logger.info(f"Successfully removed topic '{topic_node.get('label')}' (ID: {topic_id})")
-    
+
     return (nodes_json, edges_json, data_json)
 
 
-def build_knowledge_graph(topic_list: list, corpus_id: str, files: list) -> tuple[str, str, str]:
+def topics_retrieving_files(topic_nodes: list, corpus_id: str, file_ids: set, source_index: dict) -> set:
+    """
+    Returns the IDs of the topics whose summary retrieval now returns any of file_ids.
+
+    Runs only the retrieval step of each topic's summary query (in
+    parallel, no generation), so newly imported files can be matched to
+    the topics they belong to without re-summarizing every topic.
+    """
+    if not topic_nodes or not file_ids:
+        return set()
+    retrievals = _run_bounded(
+        gemini_service.retrieve_answer_context,
+        [(SUMMARY_QUERY_TEMPLATE.format(topic=node['label']), corpus_id) for node in topic_nodes]
+    )
+    matched = set()
+    for node, retrieval in zip(topic_nodes, retrievals):
+        if isinstance(retrieval, Exception):
+            logger.warning(f"Retrieval failed for topic {node['label']}: {retrieval}")
+            continue
+        if file_ids.intersection(_match_source_files(retrieval[1], source_index)):
+            matched.add(node['id'])
+    return matched
+
+
+def sync_graph_files(existing_nodes: list, existing_edges: list, existing_data: dict, files: list, stale_file_ids: set, new_file_ids: set, corpus_id: str, source_index: dict, summary_mode: str = None) -> tuple[str, str, str, list]:
+    """
+    Brings a knowledge graph up to date with a changed set of course files.
+
+    File nodes are added, relabeled or removed to match files. Only the
+    topics affected by the change are summarized again:
+    - topics linked to a stale file (changed or removed)
+    - topics whose retrieval now returns a new file
+    Every other topic keeps its summary, sources and embedding. A topic
+    whose new summary fails keeps its old one (minus edges to removed files).
+
+    Args:
+        existing_nodes: Current list of graph nodes
+        existing_edges: Current list of graph edges
+        existing_data: Current kg_data dictionary (with embeddings)
+        files: The course's current file objects
+        stale_file_ids: IDs of files whose content changed or that were removed
+        new_file_ids: IDs of files that were added
+        corpus_id: The RAG corpus ID (already holding the new and changed files)
+        source_index: Source index built for the current files
+        summary_mode: 'per_topic' or 'batched' (default: KG_SUMMARY_MODE)
+
+    Returns:
+        Tuple of (updated_nodes_json, updated_edges_json, updated_data_json, refreshed_topic_ids)
+
+    Example:
+        nodes, edges, data, refreshed = sync_graph_files(nodes, edges, data, files, {'101'}, {'205'},
+                                                         corpus_id, source_index)
+        # refreshed = ['topic_2', 'topic_7']
+    """
+    current_files = {str(f.get('id')): f for f in files if f.get('id')}
+    file_ids = {node['id'] for node in existing_nodes if node.get('group') in FILE_NODE_GROUPS}
+    topic_nodes = [node for node in existing_nodes if node.get('group') == 'topic']
+
+    # Step 1: Find the affected topics (before edges to removed files are dropped)
+    affected = {edge['from'] for edge in existing_edges
+                if edge.get('type') != 'related' and edge.get('to') in stale_file_ids}
+    affected |= topics_retrieving_files([node for node in topic_nodes if node['id'] not in affected],
+                                        corpus_id, set(new_file_ids), source_index)
+    refreshed = sorted((node for node in topic_nodes if node['id'] in affected), key=lambda node: _topic_number(node['id']))
+
+    # Step 2: Match file nodes to the current files
+    updated_nodes = []
+    for node in existing_nodes:
+        if node.get('group') in FILE_NODE_GROUPS:
+            if node['id'] not in current_files:
+                continue
+            file_obj = current_files[node['id']]
+            node = {**node, 'label': file_obj.get('name') or file_obj.get('display_name') or node.get('label')}
+        updated_nodes.append(node)
+    new_file_nodes = [
+        {'id': file_id, 'label': f.get('name') or f.get('display_name', 'Unknown File'), 'group': 'file_pdf'}
+        for file_id, f in current_files.items() if file_id not in file_ids
+    ]
+    updated_edges = [edge for edge in existing_edges
+                     if edge.get('from') in current_files or edge.get('to') in current_files or edge.get('type') == 'related']
+    updated_data = dict(existing_data)
+
+    # Step 3: Summarize the affected topics again and relink them to their sources
+    results = summarize_topics([node['label'] for node in refreshed], corpus_id, mode=summary_mode)
+    refreshed_ids = []
+    for node, result in zip(refreshed, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error refreshing topic {node['label']}: {result}")
+            continue
+        _, topic_edges, topic_data = _topic_parts(node['id'], node['label'], result[0], result[1], source_index)
+        updated_edges = [edge for edge in updated_edges
+                         if edge.get('from') != node['id'] or edge.get('type') == 'related'] + topic_edges
+        updated_data[node['id']] = topic_data
+        refreshed_ids.append(node['id'])
+
+    # Step 4: Place new files next to their topics, then relink similar topics
+    _position_new_nodes(updated_nodes, new_file_nodes, updated_edges)
+    updated_nodes = [node for node in updated_nodes if node.get('group') in FILE_NODE_GROUPS] + new_file_nodes + \
+                    [node for node in updated_nodes if node.get('group') not in FILE_NODE_GROUPS]
+    updated_edges, updated_data = refresh_related_edges(updated_edges, updated_data)
+
+    logger.info(f"Synced graph files: +{len(new_file_nodes)} files, {len(stale_file_ids)} stale, "
+                f"{len(refreshed_ids)}/{len(refreshed)} topics refreshed")
+
+    return (json.dumps(updated_nodes), json.dumps(updated_edges), json.dumps(updated_data), refreshed_ids)
+
+
+def graph_skeleton(nodes: list, edges: list, data: dict) -> dict:
+    """
+    Reduces a knowledge graph to what a view needs for its first paint:
+    topic nodes with counts and the topic-to-topic edges. Summaries,
+    sources and file nodes are left for topic_detail.
+
+    Args:
+        nodes: Graph nodes
+        edges: Graph edges
+        data: kg_data dict
+
+    Returns:
+        Dict with 'topics' (topic nodes plus 'file_count' and 'source_count'),
+        'edges' (related edges only) and graph-wide 'counts'
+
+    Example:
+        skeleton = graph_skeleton(nodes, edges, data)
+        # {'topics': [{'id': 'topic_1', 'label': 'Recursion', 'group': 'topic', 'x': 12.0, 'y': -4.5,
+        #              'file_count': 3, 'source_count': 5}, ...],
+        #  'edges': [{'from': 'topic_4', 'to': 'topic_1', 'type': 'related', 'similarity': 0.81}],
+        #  'counts': {'topics': 9, 'files': 40, 'edges': 52}}
+    """
+    file_ids = {node['id'] for node in nodes if node.get('group') in FILE_NODE_GROUPS}
+    file_counts = {}
+    for edge in edges:
+        for end, other in ((edge.get('from'), edge.get('to')), (edge.get('to'), edge.get('from'))):
+            if other in file_ids:
+                file_counts[end] = file_counts.get(end, 0) + 1
+
+    topics = [
+        {**node,
+         'file_count': file_counts.get(node['id'], 0),
+         'source_count': len(data.get(node['id'], {}).get('sources') or [])}
+        for node in nodes if node.get('group') == 'topic'
+    ]
+    return {
+        'topics': topics,
+        'edges': [edge for edge in edges if edge.get('type') == 'related'],
+        'counts': {'topics': len(topics), 'files': len(file_ids), 'edges': len(edges)}
+    }
+
+
+def topic_detail(topic_id: str, nodes: list, edges: list, data: dict, indexed_files: dict = None) -> dict:
+    """
+    Collects everything a view shows when a topic is opened.
+
+    Args:
+        topic_id: The topic to describe
+        nodes: Graph nodes (the whole graph or the topic's subgraph)
+        edges: Graph edges
+        data: kg_data dict
+        indexed_files: The course's indexed_files map, used to add download info to file nodes
+
+    Returns:
+        Dict with 'topic', 'summary', 'sources', 'files' (file nodes with
+        'gcs_uri' and 'display_name') and 'edges' (topic-to-file edges)
+
+    Raises:
+        ValueError: If the topic isn't in the graph
+    """
+    topic_node = next((node for node in nodes if node.get('id') == topic_id and node.get('group') == 'topic'), None)
+    if not topic_node:
+        raise ValueError(f"Topic {topic_id} not found in graph")
+
+    file_nodes = {node['id']: node for node in nodes if node.get('group') in FILE_NODE_GROUPS}
+    file_edges = [edge for edge in edges
+                  if topic_id in (edge.get('from'), edge.get('to'))
+                  and (edge.get('from') in file_nodes or edge.get('to') in file_nodes)]
+
+    files = []
+    for edge in file_edges:
+        file_id = edge['to'] if edge.get('to') in file_nodes else edge['from']
+        entry = (indexed_files or {}).get(file_id) or {}
+        files.append({**file_nodes[file_id], 'gcs_uri': entry.get('gcs_uri'), 'display_name': entry.get('display_name')})
+
+    topic_data = data.get(topic_id, {})
+    return {
+        'topic': topic_node,
+        'summary': topic_data.get('summary'),
+        'sources': topic_data.get('sources') or [],
+        'files': files,
+        'edges': file_edges
+    }
+
+
+def build_knowledge_graph(topic_list: list, corpus_id: str, files: list, source_index: dict = None, summary_mode: str = None, known_summaries: dict = None, on_summary=None) -> tuple[str, str, str]:
     """
     Builds the complete knowledge graph with topics, files, and connections.
+    Every node gets x/y coordinates from a server-side spring layout.
     
     Args:
         topic_list: List of topic strings from professor input (or newline-separated string)
         corpus_id: The RAG corpus ID to query for topic summaries
         files: List of file objects from Canvas
+        source_index: Optional index from build_source_index (built from files if not given)
+        summary_mode: 'per_topic' or 'batched' (default: KG_SUMMARY_MODE)
+        known_summaries: Optional {topic: (summary, source_names)} from an earlier,
+                         interrupted build; these topics aren't summarized again
+        on_summary: Optional function (topic, (summary, source_names)) called as
+                    each new topic summary is generated
         
     Returns:
         Tuple of (nodes_json, edges_json, data_json) as serialized JSON strings
@@ -246,8 +1035,9 @@ def build_knowledge_graph(topic_list: list, corpus_id: str, files: list) -> tupl
 
     
     
-    # Create a mapping of file names to file IDs for edge creation
-    file_name_to_id = {}
+    # Index files by GCS URI, name and ID for edge creation
+    if source_index is None:
+        source_index = build_source_index(files=files)
     
     # Step 1: Create File Nodes
     for file_obj in files:
@@ -272,14 +1062,23 @@ def build_knowledge_graph(topic_list: list, corpus_id: str, files: list) -> tupl
         # Add to networkx graph
         G.add_node(file_id, **file_node)
         nodes.append(file_node)
-        
-        # Store mapping for edge creation
-        file_name_to_id[file_name] = file_id
     
     # Step 2: Create Topic Nodes and Query RAG
-    # Use RAG service to retrieve context for each topic
+    # Summaries are generated in parallel; results come back in topic order
+    # so node and edge ordering doesn't depend on which call finished first
+    known_summaries = known_summaries or {}
+    summaries = [known_summaries.get(topic) for topic in topics]
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+    if len(missing) < len(topics):
+        logger.info(f"Reusing {len(topics) - len(missing)} topic summaries from an earlier build")
+    fresh = summarize_topics(
+        [topics[i] for i in missing], corpus_id, mode=summary_mode,
+        on_result=(lambda position, result: on_summary(topics[missing[position]], result)) if on_summary else None
+    )
+    for i, result in zip(missing, fresh):
+        summaries[i] = result
     
-    for i, topic in enumerate(topics):
+    for i, (topic, result) in enumerate(zip(topics, summaries)):
         topic_id = f"topic_{i+1}"
         
         logger.info(f"Processing topic {i+1}/{len(topics)}: {topic}")
@@ -295,55 +1094,48 @@ def build_knowledge_graph(topic_list: list, corpus_id: str, files: list) -> tupl
         G.add_node(topic_id, **topic_node)
         nodes.append(topic_node)
         
-        # Query RAG corpus for this topic using rag_service
-        try:
-            # Use rag_service to retrieve context
-            summary, source_names = gemini_service.generate_answer_with_context(
-                query=SUMMARY_QUERY_TEMPLATE.format(topic=topic),
-                corpus_id=corpus_id,
-            )
-            
-            # Extract unique source file IDs
-            source_files = []
-            for source in source_names:
-                # Handle both old string format and new dict format
-                if isinstance(source, dict):
-                    source_name = source.get('filename', '')
-                else:
-                    source_name = source
-                
-                # Match source name to file IDs
-                for file_name, fid in file_name_to_id.items():
-                    if file_name in source_name or source_name in file_name:
-                        if fid not in source_files:
-                            source_files.append(fid)
-                        break
-            
-            # Store topic data
-            kg_data[topic_id] = {
-                'summary': summary,
-                'sources': source_names  # Keep the full source objects (with filename and source_uri)
-            }
-            
-            # Create edges from topic to relevant files
-            for file_id in source_files:
-                edge = {
-                    'from': topic_id,
-                    'to': file_id
-                }
-                # Add to networkx graph
-                G.add_edge(topic_id, file_id)
-                edges.append(edge)
-                
-        except Exception as e:
-            logger.error(f"Error processing topic {topic}: {e}")
+        if isinstance(result, Exception):
+            logger.error(f"Error processing topic {topic}: {result}")
             # If RAG query fails, still create the topic node but with empty data
             kg_data[topic_id] = {
                 'summary': f"Error retrieving information for {topic}.",
                 'sources': []
             }
+            continue
+        
+        summary, source_names = result
+        
+        # Extract unique source file IDs
+        source_files = _match_source_files(source_names, source_index)
+        
+        # Store topic data
+        kg_data[topic_id] = {
+            'summary': summary,
+            'sources': source_names  # Keep the full source objects (with filename and source_uri)
+        }
+        
+        # Create edges from topic to relevant files
+        for file_id in source_files:
+            edge = {
+                'from': topic_id,
+                'to': file_id
+            }
+            # Add to networkx graph
+            G.add_edge(topic_id, file_id)
+            edges.append(edge)
+    
+    # Step 3: Link similar topics (one batched embedding request)
+    kg_data = embed_topic_summaries(kg_data)
+    for edge in compute_related_edges(kg_data):
+        G.add_edge(edge['from'], edge['to'])
+        edges.append(edge)
+    
+    # Step 4: Lay out the graph so the views can skip browser physics
+    positions = compute_layout(G)
+    for node in nodes:
+        node['x'], node['y'] = positions[node['id']]
     
-    # Step 3: Serialize to JSON strings
+    # Step 5: Serialize to JSON strings
     nodes_json = json.dumps(nodes)
     edges_json = json.dumps(edges)
     data_json = json.dumps(kg_data)
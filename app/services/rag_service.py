@@ -10,13 +10,27 @@ This service provides functions to:
 Note: This service does NOT generate answers. It only retrieves context.
 Answer generation should be handled by a separate LLM service.
 """
+import asyncio
 import vertexai
 from vertexai.preview import rag
 from vertexai.generative_models import GenerativeModel
+from google.cloud import aiplatform_v1beta1
+from google.api_core import exceptions as google_exceptions
 import os
 import logging
 import re
-from typing import List, Tuple, Dict
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Tuple, Dict, Optional
+import sys
+
+# Handle imports for both module use and standalone testing
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+    from app.services import concurrency
+else:
+    from . import concurrency
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +44,289 @@ if project_id:
 else:
     logger.warning("GOOGLE_CLOUD_PROJECT not set - Vertex AI not initialized")
 
+# asyncio-native RAG client for the ASGI serving mode (see app/asgi.py)
+_get_async_rag_client = concurrency.loop_local(
+    lambda: aiplatform_v1beta1.VertexRagServiceAsyncClient(
+        client_options={"api_endpoint": f"{location}-aiplatform.googleapis.com"}
+    )
+)
+
+# Retrieval cache configuration (per process)
+RETRIEVAL_CACHE_TTL_SECONDS = float(os.environ.get('RAG_CACHE_TTL_SECONDS', '600'))
+RETRIEVAL_CACHE_MAX_BYTES = int(os.environ.get('RAG_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.environ.get('RAG_CACHE_MAX_ENTRIES', '2048'))
+
+# Corpus import configuration (the import API takes at most 25 GCS paths per request)
+RAG_IMPORT_BATCH_SIZE = int(os.environ.get('RAG_IMPORT_BATCH_SIZE', '25'))
+# Import operations running at once on one corpus, across all threads of the
+# process; RAG Engine rejects an import while another operation runs on the corpus
+RAG_IMPORT_MAX_OPERATIONS = int(os.environ.get('RAG_IMPORT_MAX_OPERATIONS', '1'))
+RAG_IMPORT_TIMEOUT_SECONDS = float(os.environ.get('RAG_IMPORT_TIMEOUT_SECONDS', '1800'))
+# Imports rejected that way (e.g. by another process) are retried with backoff
+RAG_IMPORT_BUSY_RETRIES = int(os.environ.get('RAG_IMPORT_BUSY_RETRIES', '5'))
+RAG_IMPORT_BUSY_WAIT_SECONDS = float(os.environ.get('RAG_IMPORT_BUSY_WAIT_SECONDS', '10'))
+
+_import_slots = {}  # corpus_name -> BoundedSemaphore shared by every import into that corpus
+_import_slots_lock = threading.Lock()
+
+# Context packing configuration
+CONTEXT_MAX_TOKENS = int(os.environ.get('RAG_CONTEXT_MAX_TOKENS', '4096'))
+CONTEXT_DUPLICATE_THRESHOLD = float(os.environ.get('RAG_CONTEXT_DUPLICATE_THRESHOLD', '0.8'))
+CONTEXT_MERGE_MIN_OVERLAP_CHARS = 40
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes query text so trivially different phrasings share a cache key.
+    Lowercases, collapses whitespace and strips trailing punctuation.
+
+    Example:
+        normalize_query("  What is   ML? ")  # "what is ml"
+    """
+    normalized = re.sub(r'\s+', ' ', (query or '').strip().lower())
+    return normalized.rstrip('?!. ')
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for budgeting (about 4 characters per token for English)."""
+    return (len(text) + 3) // 4
+
+
+def _merge_overlap(first: str, second: str) -> Optional[str]:
+    """
+    Joins two chunks when the end of `first` repeats the start of `second`
+    (the chunk_overlap region written at import time). Returns None if they
+    don't overlap.
+    """
+    anchor = second[:CONTEXT_MERGE_MIN_OVERLAP_CHARS]
+    if len(anchor) < CONTEXT_MERGE_MIN_OVERLAP_CHARS:
+        return None
+    # The overlap can only start within the tail of the first chunk
+    search_from = max(0, len(first) - len(second))
+    position = first.find(anchor, search_from)
+    while position != -1:
+        if second.startswith(first[position:]):
+            return first + second[len(first) - position:]
+        position = first.find(anchor, position + 1)
+    return None
+
+
+def _shingles(text: str) -> set:
+    """Word 5-grams used for near-duplicate detection."""
+    words = re.findall(r'\w+', text.lower())
+    if len(words) < 5:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + 5]) for i in range(len(words) - 4)}
+
+
+def pack_context(chunks: List[Dict], max_tokens: int = None) -> List[str]:
+    """
+    Packs retrieved chunks into the context texts sent to the LLM.
+
+    1. Merges chunks from the same source whose text overlaps (the corpus
+       is imported with chunk_overlap, so neighbouring chunks repeat text)
+    2. Drops near-duplicates (mostly contained in an already kept chunk)
+    3. Keeps chunks nearest first until the token budget is used up
+
+    Args:
+        chunks: List of {'text', 'source_uri', 'distance'} dicts as retrieved
+        max_tokens: Token budget for all context (default: RAG_CONTEXT_MAX_TOKENS,
+                    0 disables the budget)
+
+    Returns:
+        List of context texts ordered by retrieval distance
+
+    Example:
+        texts = pack_context([
+            {'text': 'Recursion is when a function calls itself...', 'source_uri': 'gs://b/a.pdf', 'distance': 0.1},
+            {'text': '...calls itself. A base case stops it.', 'source_uri': 'gs://b/a.pdf', 'distance': 0.2},
+        ])
+        # ['Recursion is when a function calls itself... A base case stops it.']
+    """
+    max_tokens = CONTEXT_MAX_TOKENS if max_tokens is None else max_tokens
+    pending = sorted(
+        ({'text': (chunk.get('text') or '').strip(), 'source_uri': chunk.get('source_uri'),
+          'distance': chunk.get('distance') if chunk.get('distance') is not None else 1.0}
+         for chunk in chunks),
+        key=lambda chunk: chunk['distance']
+    )
+    pending = [chunk for chunk in pending if chunk['text']]
+
+    # Step 1: merge overlapping chunks from the same source (order-independent)
+    merged = True
+    while merged:
+        merged = False
+        for i, first in enumerate(pending):
+            for j, second in enumerate(pending):
+                if i == j or first['source_uri'] != second['source_uri']:
+                    continue
+                text = _merge_overlap(first['text'], second['text'])
+                if text is not None:
+                    first['text'] = text
+                    first['distance'] = min(first['distance'], second['distance'])
+                    del pending[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    pending.sort(key=lambda chunk: chunk['distance'])
+
+    # Step 2: drop chunks that are mostly contained in a nearer kept chunk
+    kept = []
+    kept_shingles = []
+    for chunk in pending:
+        shingles = _shingles(chunk['text'])
+        if any(shingles and len(shingles & other) / len(shingles) >= CONTEXT_DUPLICATE_THRESHOLD
+               for other in kept_shingles):
+            continue
+        kept.append(chunk['text'])
+        kept_shingles.append(shingles)
+
+    # Step 3: enforce the token budget, nearest chunks first
+    if not max_tokens:
+        return kept
+    packed = []
+    used = 0
+    for text in kept:
+        tokens = estimate_tokens(text)
+        if used + tokens <= max_tokens:
+            packed.append(text)
+            used += tokens
+        elif not packed:
+            # Always keep (a prefix of) the best chunk
+            packed.append(text[:max_tokens * 4])
+            break
+    return packed
+
+
+class _RetrievalCache:
+    """
+    Thread-safe LRU cache for retrieval results with a TTL and a byte budget.
+
+    Entries are keyed by (corpus_id, normalized query, top_k, threshold).
+    Least recently used entries are evicted once either the entry count or
+    the approximate byte size of the cached results exceeds its limit.
+    """
+
+    def __init__(self, ttl_seconds: float, max_bytes: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.miss_seconds = 0.0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size: int) -> None:
+        if self.ttl_seconds <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, size, value)
+            self._bytes += size
+            while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def record_miss_latency(self, seconds: float) -> None:
+        with self._lock:
+            self.miss_seconds += seconds
+
+    def invalidate_corpus(self, corpus_id: str) -> int:
+        with self._lock:
+            stale_keys = [key for key in self._entries if key[0] == corpus_id]
+            for key in stale_keys:
+                self._remove(key)
+            return len(stale_keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = self.expirations = 0
+            self.miss_seconds = 0.0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            avg_miss_seconds = self.miss_seconds / self.misses if self.misses else 0.0
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'avg_miss_latency_ms': avg_miss_seconds * 1000,
+                'estimated_saved_ms': self.hits * avg_miss_seconds * 1000
+            }
+
+    def _remove(self, key) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+_retrieval_cache = _RetrievalCache(
+    ttl_seconds=RETRIEVAL_CACHE_TTL_SECONDS,
+    max_bytes=RETRIEVAL_CACHE_MAX_BYTES,
+    max_entries=RETRIEVAL_CACHE_MAX_ENTRIES
+)
+
+
+def _estimate_result_size(context_texts: List[str], sources: List[Dict]) -> int:
+    """Approximates the memory held by a cached retrieval result in bytes."""
+    size = sum(len(text.encode('utf-8')) for text in context_texts)
+    for source in sources:
+        size += len(source.get('filename', '')) + len(source.get('source_uri', '')) + 64
+    return size
+
+
+def get_retrieval_cache_stats() -> Dict:
+    """
+    Returns hit/miss counters for the retrieval cache of this process.
+
+    Example:
+        stats = get_retrieval_cache_stats()
+        # {'hits': 42, 'misses': 8, 'hit_rate': 0.84, ..., 'estimated_saved_ms': 21000.0}
+    """
+    return _retrieval_cache.stats()
+
+
+def invalidate_retrieval_cache(corpus_id: Optional[str] = None) -> None:
+    """
+    Drops cached retrieval results for one corpus, or for every corpus if
+    corpus_id is None. Called whenever files are imported into a corpus.
+    """
+    if corpus_id is None:
+        _retrieval_cache.clear()
+        logger.info("Cleared retrieval cache")
+    else:
+        removed = _retrieval_cache.invalidate_corpus(corpus_id)
+        logger.info(f"Invalidated {removed} cached retrieval results for corpus {corpus_id}")
+
 
 def create_and_provision_corpus(files: List[Dict], corpus_name_suffix: str = "") -> str:
     """
@@ -56,64 +353,235 @@ def create_and_provision_corpus(files: List[Dict], corpus_name_suffix: str = "")
         # Step 3: Create RAG corpus from GCS files
         corpus_name = create_and_provision_corpus(files, f"Course {course_id}")
     """
+    corpus_name = create_corpus(files, corpus_name_suffix)
+    import_corpus_files(corpus_name, files)
+    return corpus_name
+
+
+def create_corpus(files: List[Dict], corpus_name_suffix: str = "") -> str:
+    """
+    Creates an empty RAG corpus for a set of course files.
+    
+    Args:
+        files: The files the corpus is for (used for its display name)
+        corpus_name_suffix: Optional suffix for corpus display name
+        
+    Returns:
+        The corpus resource name (string) e.g., "projects/.../ragCorpora/..."
+    """
     if not project_id:
         raise ValueError("GOOGLE_CLOUD_PROJECT environment variable not set")
     
+    logger.info("Creating new RAG corpus...")
+    corpus_display_name = f"Canvas Course Corpus - {len(files)} files"
+    if corpus_name_suffix:
+        corpus_display_name += f" ({corpus_name_suffix})"
+    
     try:
-        # Create a new RAG corpus
-        logger.info("Creating new RAG corpus...")
-        corpus_display_name = f"Canvas Course Corpus - {len(files)} files"
-        if corpus_name_suffix:
-            corpus_display_name += f" ({corpus_name_suffix})"
-        
         corpus = rag.create_corpus(display_name=corpus_display_name)
-        corpus_name = corpus.name
-        logger.info(f"Created corpus: {corpus_name}")
-        
-        # Upload each file to the corpus from GCS
-        upload_count = 0
-        for file in files:
+    except Exception as e:
+        logger.error(f"Failed to create corpus: {str(e)}")
+        raise
+    logger.info(f"Created corpus: {corpus.name}")
+    return corpus.name
+
+
+def _corpus_import_slots(corpus_name: str) -> threading.BoundedSemaphore:
+    """The semaphore limiting a corpus to RAG_IMPORT_MAX_OPERATIONS imports in this process."""
+    with _import_slots_lock:
+        slots = _import_slots.get(corpus_name)
+        if slots is None:
+            slots = _import_slots[corpus_name] = threading.BoundedSemaphore(max(1, RAG_IMPORT_MAX_OPERATIONS))
+        return slots
+
+
+def _corpus_busy(error: BaseException) -> bool:
+    """
+    Whether an import was rejected because another operation is running on the corpus.
+
+    rag.import_files_async re-raises submit errors as
+    RuntimeError("Failed in importing the RagFiles due to: ", e) from e,
+    so the cause is checked as well as the error itself.
+    """
+    return any(
+        isinstance(candidate, google_exceptions.FailedPrecondition)
+        or 'other operations running' in str(candidate).lower()
+        for candidate in (error, error.__cause__) if candidate is not None
+    )
+
+
+def _import_batch_outcomes(corpus_name: str, batches: List[List[Dict]]) -> list:
+    """
+    Starts one async import operation per batch, then waits on all of them together.
+
+    At most RAG_IMPORT_MAX_OPERATIONS operations run at once on the corpus,
+    counting those started by other threads (e.g. concurrent ingest
+    workers). An operation the corpus rejects because another one is
+    running is retried up to RAG_IMPORT_BUSY_RETRIES times with exponential
+    backoff.
+
+    Returns:
+        List aligned with batches holding each operation's ImportRagFilesResponse
+        or the Exception it failed with
+    """
+    slots = _corpus_import_slots(corpus_name)
+
+    async def run_batch(batch):
+        for attempt in range(RAG_IMPORT_BUSY_RETRIES + 1):
+            # Waited for in a thread so the other batches' operations keep running
+            await asyncio.to_thread(slots.acquire)
             try:
-                gcs_uri = file.get('gcs_uri')
-                file_id = file.get('id')
-                display_name = file.get('display_name', 'unknown')
-                
-                # Skip files that weren't uploaded to GCS
-                if not gcs_uri:
-                    logger.warning(f"No GCS URI for file: {display_name} (ID: {file_id}), skipping")
-                    continue
-                
-                # Validate GCS URI format
-                if not gcs_uri.startswith('gs://'):
-                    logger.warning(f"Invalid GCS URI for file {display_name}: {gcs_uri}, skipping")
-                    continue
-                
-                logger.info(f"Importing file from GCS: {display_name} (ID: {file_id})")
-                logger.info(f"  GCS URI: {gcs_uri}")
-                
-                # Import file to RAG corpus from GCS
-                # Note: Vertex AI RAG automatically indexes the content
-                rag.import_files(
+                operation = await rag.import_files_async(
                     corpus_name=corpus_name,
-                    paths=[gcs_uri],  # Use GCS URI instead of local path
+                    paths=[file['gcs_uri'] for file in batch],
                     chunk_size=512,  # Optimal chunk size for retrieval
                     chunk_overlap=100  # Overlap for context continuity
                 )
-                
-                upload_count += 1
-                logger.info(f"✅ Successfully imported: {display_name}")
-                
+                logger.info(f"Started import of {len(batch)} files: {operation.operation.name}")
+                return await operation.result(timeout=RAG_IMPORT_TIMEOUT_SECONDS)
             except Exception as e:
-                logger.error(f"Failed to import file {file.get('display_name')}: {str(e)}")
-                # Continue with other files even if one fails
+                if attempt == RAG_IMPORT_BUSY_RETRIES or not _corpus_busy(e):
+                    raise
+                delay = RAG_IMPORT_BUSY_WAIT_SECONDS * (2 ** attempt)
+                logger.warning(f"Corpus {corpus_name} is busy, retrying import of {len(batch)} files in {delay:.0f}s: {e}")
+            finally:
+                slots.release()
+            await asyncio.sleep(delay)
+
+    async def run():
+        return await asyncio.gather(*(run_batch(batch) for batch in batches), return_exceptions=True)
+
+    return asyncio.run(run())
+
+
+def _imported_file_names(corpus_name: str) -> set:
+    """Names of the files currently in a corpus (the GCS object names they were imported from)."""
+    return {rag_file.display_name for rag_file in rag.list_files(corpus_name=corpus_name)}
+
+
+def import_corpus_files(corpus_name: str, files: List[Dict], on_imported=None) -> int:
+    """
+    Imports course files into a RAG corpus from Google Cloud Storage.
+
+    Files are imported in batches of RAG_IMPORT_BATCH_SIZE GCS paths, one
+    async import operation per batch, at most RAG_IMPORT_MAX_OPERATIONS
+    running on the corpus at once (see _import_batch_outcomes).
+    Each file's outcome comes from its operation's result. When an
+    operation reports failed files, the corpus file list shows which ones
+    made it in. A file that fails to import is logged and skipped (not
+    passed to on_imported), so callers can tell which files are missing.
+
+    Args:
+        corpus_name: The corpus resource name
+        files: File objects with 'gcs_uri' (files without one are skipped)
+        on_imported: Optional function (file) called after each successful import
+
+    Returns:
+        Number of files imported
+
+    Example:
+        imported = import_corpus_files(corpus_name, files)
+        # 12
+    """
+    valid_files = []
+    for file in files:
+        gcs_uri = file.get('gcs_uri')
+        display_name = file.get('display_name', 'unknown')
+
+        # Skip files that weren't uploaded to GCS
+        if not gcs_uri:
+            logger.warning(f"No GCS URI for file: {display_name} (ID: {file.get('id')}), skipping")
+            continue
+
+        # Validate GCS URI format
+        if not gcs_uri.startswith('gs://'):
+            logger.warning(f"Invalid GCS URI for file {display_name}: {gcs_uri}, skipping")
+            continue
+
+        valid_files.append(file)
+
+    if not valid_files:
+        return 0
+
+    batch_size = max(1, RAG_IMPORT_BATCH_SIZE)
+    batches = [valid_files[i:i + batch_size] for i in range(0, len(valid_files), batch_size)]
+    logger.info(f"Importing {len(valid_files)} files into {corpus_name} in {len(batches)} operation(s)...")
+    started = time.perf_counter()
+    outcomes = _import_batch_outcomes(corpus_name, batches)
+
+    corpus_file_names = None
+    upload_count = 0
+    for batch, outcome in zip(batches, outcomes):
+        if isinstance(outcome, BaseException):
+            logger.error(f"Failed to import {', '.join(f.get('display_name', 'unknown') for f in batch)}: {outcome}")
+            continue
+
+        if outcome.failed_rag_files_count:
+            # The response only counts failures; the corpus shows which files are in
+            logger.warning(f"{outcome.failed_rag_files_count} of {len(batch)} files failed to import"
+                           f"{f' (details: {outcome.partial_failures_gcs_path})' if outcome.partial_failures_gcs_path else ''}")
+            if corpus_file_names is None:
+                corpus_file_names = _imported_file_names(corpus_name)
+            succeeded = [f['gcs_uri'].rsplit('/', 1)[-1] in corpus_file_names for f in batch]
+        else:
+            succeeded = [True] * len(batch)
+
+        for file, ok in zip(batch, succeeded):
+            if not ok:
+                logger.error(f"Failed to import file {file.get('display_name')}")
                 continue
-        
-        logger.info(f"Corpus provisioning complete: {corpus_name} ({upload_count}/{len(files)} files uploaded)")
-        return corpus_name
-        
-    except Exception as e:
-        logger.error(f"Failed to create and provision corpus: {str(e)}")
-        raise
+            upload_count += 1
+            logger.info(f"✅ Successfully imported: {file.get('display_name')}")
+            if on_imported:
+                on_imported(file)
+
+    # Any results cached for this corpus predate the import
+    invalidate_retrieval_cache(corpus_name)
+
+    logger.info(f"Corpus provisioning complete: {corpus_name} ({upload_count}/{len(files)} files uploaded "
+                f"in {time.perf_counter() - started:.1f}s)")
+    return upload_count
+
+
+def delete_corpus_files(corpus_name: str, gcs_uris: List[str]) -> int:
+    """
+    Removes the files imported from the given GCS URIs from a RAG corpus.
+
+    RAG Engine names an imported file after the GCS object, so corpus files
+    are matched on that name (unique within a course's GCS folder). URIs
+    that were never imported are ignored.
+
+    Args:
+        corpus_name: The corpus resource name
+        gcs_uris: GCS URIs the files were imported from
+
+    Returns:
+        Number of corpus files deleted
+
+    Example:
+        deleted = delete_corpus_files(corpus_name, ['gs://bucket/courses/1/Week 1.pdf'])
+        # 1
+    """
+    file_names = {uri.rstrip('/').rsplit('/', 1)[-1] for uri in gcs_uris if uri}
+    if not file_names:
+        return 0
+
+    delete_count = 0
+    for rag_file in rag.list_files(corpus_name=corpus_name):
+        if rag_file.display_name not in file_names:
+            continue
+        try:
+            rag.delete_file(name=rag_file.name)
+            delete_count += 1
+            logger.info(f"Deleted corpus file: {rag_file.display_name}")
+        except Exception as e:
+            logger.error(f"Failed to delete corpus file {rag_file.display_name}: {str(e)}")
+
+    # Cached results may cite the deleted files
+    invalidate_retrieval_cache(corpus_name)
+
+    logger.info(f"Deleted {delete_count} files from corpus {corpus_name}")
+    return delete_count
 
 
 def retrieve_context(corpus_id: str, query: str, top_k: int = 10, threshold: float = 0.5) -> Tuple[List[str], Dict]:
@@ -121,6 +589,9 @@ def retrieve_context(corpus_id: str, query: str, top_k: int = 10, threshold: flo
     Retrieves relevant context chunks from the RAG corpus using vector similarity search.
     Does NOT generate answers - only returns raw context for use by other services.
     
+    Results are served from a per-process LRU cache when the same corpus sees
+    the same normalized query with the same top_k and threshold again.
+    
     Args:
         corpus_id: The RAG corpus resource name
         query: The search query text
@@ -129,7 +600,8 @@ def retrieve_context(corpus_id: str, query: str, top_k: int = 10, threshold: flo
         
     Returns:
         Tuple of (context_texts, source_names):
-        - context_texts: List of relevant text chunks from the corpus
+        - context_texts: Relevant text chunks from the corpus, packed by
+          pack_context (overlaps merged, duplicates dropped, token budget)
         - source_names: List of unique source file names
         
     Raises:
@@ -143,9 +615,15 @@ def retrieve_context(corpus_id: str, query: str, top_k: int = 10, threshold: flo
     if not project_id:
         raise ValueError("GOOGLE_CLOUD_PROJECT environment variable not set")
     
+    cache_key = _retrieval_cache_key(corpus_id, query, top_k, threshold)
+    cached = _get_cached_retrieval(cache_key, query)
+    if cached is not None:
+        return cached
+
     try:
         logger.info(f"Retrieving context from RAG corpus: {query[:100]}...")
-        
+        started = time.perf_counter()
+
         # Retrieve relevant contexts from the corpus using vector search
         response = rag.retrieval_query(
             rag_resources=[
@@ -157,36 +635,121 @@ def retrieve_context(corpus_id: str, query: str, top_k: int = 10, threshold: flo
             similarity_top_k=top_k,
             vector_distance_threshold=threshold,
         )
-        
-        # Extract context text chunks
-        contexts = response.contexts.contexts
-        context_texts = [context.text for context in contexts]
-        
-        # Extract unique source files from source URI
-        source_names = set()
-        sources = []
-        for context in contexts:
-            if hasattr(context, 'source_uri') and context.source_uri:
-                # Source is in format like "gs://bucket/corpus/file.pdf"
-                source_path = context.source_uri
-                filename = source_path.split('/')[-1] if '/' in source_path else source_path
-                if filename and filename not in source_names:
-                    source_names.add(filename)
-                    sources.append({
-                        'filename': filename,
-                        'source_uri': context.source_uri,
-                        'distance': context.distance
-                    })
-        
-        logger.info(f"Retrieved {len(context_texts)} context chunks from {len(sources)} sources")
-        
-        return (context_texts, sources)
-        
+
+        return _store_retrieval(cache_key, response.contexts.contexts, started)
+
+    except Exception as e:
+        logger.error(f"Failed to retrieve context from RAG corpus: {str(e)}")
+        raise
+
+
+async def retrieve_context_async(corpus_id: str, query: str, top_k: int = 10, threshold: float = 0.5) -> Tuple[List[str], Dict]:
+    """
+    Async variant of retrieve_context using the Vertex RAG async gRPC client.
+    Shares the retrieval cache with retrieve_context.
+
+    Args:
+        corpus_id: The RAG corpus resource name
+        query: The search query text
+        top_k: Number of most relevant chunks to retrieve (default: 10)
+        threshold: Similarity threshold for filtering results (default: 0.5)
+
+    Returns:
+        Tuple of (context_texts, sources), as retrieve_context
+    """
+    if not project_id:
+        raise ValueError("GOOGLE_CLOUD_PROJECT environment variable not set")
+
+    cache_key = _retrieval_cache_key(corpus_id, query, top_k, threshold)
+    cached = _get_cached_retrieval(cache_key, query)
+    if cached is not None:
+        return cached
+
+    try:
+        logger.info(f"Retrieving context from RAG corpus (async): {query[:100]}...")
+        started = time.perf_counter()
+
+        request = aiplatform_v1beta1.RetrieveContextsRequest(
+            parent=f"projects/{project_id}/locations/{location}",
+            vertex_rag_store=aiplatform_v1beta1.RetrieveContextsRequest.VertexRagStore(
+                rag_resources=[
+                    aiplatform_v1beta1.RetrieveContextsRequest.VertexRagStore.RagResource(rag_corpus=corpus_id)
+                ]
+            ),
+            query=aiplatform_v1beta1.RagQuery(
+                text=query,
+                rag_retrieval_config=aiplatform_v1beta1.RagRetrievalConfig(
+                    top_k=top_k,
+                    filter=aiplatform_v1beta1.RagRetrievalConfig.Filter(vector_distance_threshold=threshold),
+                ),
+            ),
+        )
+        response = await _get_async_rag_client().retrieve_contexts(request=request)
+
+        return _store_retrieval(cache_key, response.contexts.contexts, started)
+
     except Exception as e:
         logger.error(f"Failed to retrieve context from RAG corpus: {str(e)}")
         raise
 
 
+def _retrieval_cache_key(corpus_id: str, query: str, top_k: int, threshold: float) -> tuple:
+    """Builds the retrieval cache key for a query."""
+    return (corpus_id, normalize_query(query), top_k, float(threshold))
+
+
+def _get_cached_retrieval(cache_key: tuple, query: str) -> Optional[Tuple[List[str], List[Dict]]]:
+    """Returns a copy of a cached retrieval result, or None on a miss."""
+    cached = _retrieval_cache.get(cache_key)
+    if cached is None:
+        return None
+    context_texts, sources = cached
+    logger.info(f"Retrieval cache hit for query: {query[:100]}...")
+    # Hand out copies so callers can't mutate the cached result
+    return (list(context_texts), [dict(source) for source in sources])
+
+
+def _store_retrieval(cache_key: tuple, contexts, started: float) -> Tuple[List[str], List[Dict]]:
+    """Packs retrieved contexts, extracts unique sources and caches the result."""
+    # Merge overlapping chunks, drop duplicates and apply the token budget
+    chunks = [
+        {'text': context.text, 'source_uri': getattr(context, 'source_uri', None), 'distance': getattr(context, 'distance', None)}
+        for context in contexts
+    ]
+    context_texts = pack_context(chunks)
+    raw_chars = sum(len(chunk['text'] or '') for chunk in chunks)
+    packed_chars = sum(len(text) for text in context_texts)
+    if packed_chars < raw_chars:
+        logger.info(f"Packed {len(chunks)} chunks into {len(context_texts)} ({raw_chars} -> {packed_chars} chars)")
+
+    # Extract unique source files from source URI
+    source_names = set()
+    sources = []
+    for context in contexts:
+        if hasattr(context, 'source_uri') and context.source_uri:
+            # Source is in format like "gs://bucket/corpus/file.pdf"
+            source_path = context.source_uri
+            filename = source_path.split('/')[-1] if '/' in source_path else source_path
+            if filename and filename not in source_names:
+                source_names.add(filename)
+                sources.append({
+                    'filename': filename,
+                    'source_uri': context.source_uri,
+                    'distance': context.distance
+                })
+
+    logger.info(f"Retrieved {len(chunks)} context chunks from {len(sources)} sources")
+
+    _retrieval_cache.record_miss_latency(time.perf_counter() - started)
+    _retrieval_cache.put(
+        cache_key,
+        (tuple(context_texts), tuple(dict(source) for source in sources)),
+        _estimate_result_size(context_texts, sources)
+    )
+
+    return (context_texts, sources)
+
+
 if __name__ == "__main__":
     # Load environment variables from root .env file
     from dotenv import load_dotenv
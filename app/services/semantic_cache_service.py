@@ -0,0 +1,304 @@
+"""
+Semantic Cache Service
+Answers repeated student questions from previously logged chat queries.
+
+This service is responsible for:
+- Loading logged chat query embeddings and answers per course
+- Finding the nearest previous question with a vectorized cosine search
+- Returning the stored answer and sources when the match is close enough
+
+Every chat query is already embedded and stored by analytics_logging_service,
+so the cache reuses that data instead of keeping a separate index.
+
+Invalidation is shared by all workers: invalidate_course stores a marker on
+the course document, every lookup checks it, and indexes are rebuilt only
+from chat events logged after the latest marker.
+
+Dependencies:
+- firestore_service: For reading logged chat events and the invalidation marker
+- concurrency: One index load per course at a time
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+import sys
+
+import numpy as np
+
+# Handle imports for both module use and standalone testing
+if __name__ == "__main__":
+    # Running as standalone script
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+    from app.services import firestore_service, concurrency
+else:
+    # Imported as a module
+    from . import firestore_service, concurrency
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE_ENABLED', 'true').lower() == 'true'
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', '0.95'))
+SEMANTIC_CACHE_REFRESH_SECONDS = float(os.environ.get('SEMANTIC_CACHE_REFRESH_SECONDS', '900'))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get('SEMANTIC_CACHE_MAX_ENTRIES', '5000'))
+SEMANTIC_CACHE_MAX_COURSES = int(os.environ.get('SEMANTIC_CACHE_MAX_COURSES', '64'))
+
+
+# ============================================================================
+# PER-COURSE INDEX
+# ============================================================================
+
+class _CourseIndex:
+    """
+    In-memory matrix of unit-normalized query embeddings for one course,
+    with the stored answer and sources for each row.
+    """
+
+    def __init__(self, max_entries: int, marker: tuple = (None, None)):
+        self.max_entries = max_entries
+        self.marker = marker  # the course's invalidation marker when loaded
+        self.matrix = None  # float32 array of shape (capacity, dims)
+        self.size = 0
+        self.entries = []  # (answer_text, sources, doc_id) per row
+        self.loaded_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, vector, answer_text: str, sources: list, doc_id: str = None) -> None:
+        row = _normalize(vector)
+        if row is None:
+            return
+        with self.lock:
+            if self.matrix is None:
+                self.matrix = np.zeros((64, row.shape[0]), dtype=np.float32)
+            elif row.shape[0] != self.matrix.shape[1]:
+                return
+            if self.size == self.max_entries:
+                # Drop the oldest half rather than shifting on every insert
+                keep = self.max_entries // 2
+                self.matrix[:keep] = self.matrix[self.size - keep:self.size]
+                self.entries = self.entries[self.size - keep:]
+                self.size = keep
+            if self.size == self.matrix.shape[0]:
+                capacity = min(self.matrix.shape[0] * 2, self.max_entries)
+                grown = np.zeros((capacity, self.matrix.shape[1]), dtype=np.float32)
+                grown[:self.size] = self.matrix[:self.size]
+                self.matrix = grown
+            self.matrix[self.size] = row
+            self.entries.append((answer_text, sources, doc_id))
+            self.size += 1
+
+    def nearest(self, vector):
+        query = _normalize(vector)
+        with self.lock:
+            if query is None or self.size == 0 or query.shape[0] != self.matrix.shape[1]:
+                return None
+            similarities = self.matrix[:self.size] @ query
+            best = int(np.argmax(similarities))
+            return float(similarities[best]), self.entries[best]
+
+
+_course_indexes = OrderedDict()  # course_id -> _CourseIndex
+_indexes_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+# Concurrent lookups on a cold course share one Firestore scan
+_index_loads = concurrency.SingleFlight('semantic_cache_load')
+
+
+def _normalize(vector):
+    """Converts an embedding to a unit-length float32 array (None if unusable)."""
+    if vector is None:
+        return None
+    row = np.asarray(vector, dtype=np.float32)
+    if row.ndim != 1 or row.size == 0:
+        return None
+    norm = np.linalg.norm(row)
+    if norm == 0:
+        return None
+    return row / norm
+
+
+def _is_cacheable(answer_text: str, sources: list) -> bool:
+    """Only answers grounded in course sources are worth serving again."""
+    return bool(answer_text) and bool(sources)
+
+
+def _invalidation_marker(course_id: str) -> tuple:
+    """
+    The course's (semantic_cache_version, semantic_cache_updated_at), checked
+    against the stored fields on every call (see invalidate_course).
+    """
+    course_data = firestore_service.get_course_data(course_id, validate='semantic_cache')
+    course = (course_data.to_dict() if course_data.exists else None) or {}
+    version = course.get('semantic_cache_version')
+    invalidated_at = course.get('semantic_cache_updated_at')
+    return (version if isinstance(version, int) else None,
+            invalidated_at if isinstance(invalidated_at, datetime) else None)
+
+
+def _load_course_index(course_id: str, marker: tuple) -> _CourseIndex:
+    """Builds a course index from the chat events logged since the course's last invalidation."""
+    index = _CourseIndex(SEMANTIC_CACHE_MAX_ENTRIES, marker)
+    invalidated_at = marker[1]
+    events = firestore_service.get_analytics_events(course_id, event_type='chat')
+
+    for event in events[-SEMANTIC_CACHE_MAX_ENTRIES:]:
+        # Answers logged before the invalidation may cite outdated materials
+        if invalidated_at is not None:
+            logged_at = event.get('timestamp')
+            if not isinstance(logged_at, datetime) or logged_at <= invalidated_at:
+                continue
+        # Don't hand out answers students told us were unhelpful
+        if event.get('rating') == 'not_helpful':
+            continue
+        if not _is_cacheable(event.get('answer_text'), event.get('sources')):
+            continue
+        index.add(event.get('query_vector'), event['answer_text'], event['sources'], event.get('doc_id'))
+
+    logger.info(f"Loaded semantic cache for course {course_id}: {index.size} answers")
+    return index
+
+
+def _get_course_index(course_id: str) -> _CourseIndex:
+    """
+    Returns the cached index for a course, loading it when it is missing,
+    older than SEMANTIC_CACHE_REFRESH_SECONDS or built before the course's
+    latest invalidation.
+    """
+    marker = _invalidation_marker(course_id)
+    with _indexes_lock:
+        index = _course_indexes.get(course_id)
+        if (index is not None and index.marker == marker
+                and time.monotonic() - index.loaded_at < SEMANTIC_CACHE_REFRESH_SECONDS):
+            _course_indexes.move_to_end(course_id)
+            return index
+
+    try:
+        index, _ = _index_loads.do((course_id, marker), _load_course_index, course_id, marker)
+    except Exception as e:
+        # Start empty rather than retrying the full load on every request
+        logger.error(f"Failed to load semantic cache for course {course_id}: {e}")
+        index = _CourseIndex(SEMANTIC_CACHE_MAX_ENTRIES, marker)
+
+    with _indexes_lock:
+        _course_indexes[course_id] = index
+        _course_indexes.move_to_end(course_id)
+        while len(_course_indexes) > SEMANTIC_CACHE_MAX_COURSES:
+            _course_indexes.popitem(last=False)
+    return index
+
+
+# ============================================================================
+# PUBLIC API
+# ============================================================================
+
+def lookup(course_id: str, query_vector: list, threshold: float = None) -> dict:
+    """
+    Finds a previously answered question that is semantically equivalent.
+
+    Args:
+        course_id: The Canvas course ID
+        query_vector: Embedding of the incoming question (RETRIEVAL_QUERY task type)
+        threshold: Minimum cosine similarity for a hit (default: SEMANTIC_CACHE_THRESHOLD)
+
+    Returns:
+        Dictionary with answer, sources, similarity and doc_id of the matched
+        question, or None on a miss. Never raises; failures count as misses.
+
+    Example:
+        hit = lookup("12345", vector)
+        # {'answer': 'Supervised learning is...', 'sources': [...], 'similarity': 0.97, 'doc_id': 'abc'}
+    """
+    if not SEMANTIC_CACHE_ENABLED or not course_id or query_vector is None:
+        return None
+
+    threshold = SEMANTIC_CACHE_THRESHOLD if threshold is None else threshold
+
+    try:
+        match = _get_course_index(course_id).nearest(query_vector)
+    except Exception as e:
+        logger.error(f"Semantic cache lookup failed for course {course_id}: {e}")
+        match = None
+
+    if match is None or match[0] < threshold:
+        with _indexes_lock:
+            _stats['misses'] += 1
+        return None
+
+    similarity, (answer_text, sources, doc_id) = match
+    with _indexes_lock:
+        _stats['hits'] += 1
+    logger.info(f"Semantic cache hit for course {course_id} (similarity {similarity:.3f}, doc {doc_id})")
+    return {
+        'answer': answer_text,
+        'sources': [dict(source) if isinstance(source, dict) else source for source in sources],
+        'similarity': similarity,
+        'doc_id': doc_id
+    }
+
+
+def add_entry(course_id: str, query_vector: list, answer_text: str, sources: list, doc_id: str = None) -> None:
+    """
+    Adds a freshly generated answer to an already loaded course index so the
+    next equivalent question can be served without waiting for a refresh.
+
+    Args:
+        course_id: The Canvas course ID
+        query_vector: Embedding of the question
+        answer_text: The generated answer
+        sources: The source list returned with the answer
+        doc_id: Optional analytics document ID of the logged question
+    """
+    if not SEMANTIC_CACHE_ENABLED or not _is_cacheable(answer_text, sources):
+        return
+
+    with _indexes_lock:
+        index = _course_indexes.get(course_id)
+
+    # Unloaded courses pick the answer up from Firestore on first lookup
+    if index is not None:
+        index.add(query_vector, answer_text, sources, doc_id)
+
+
+def invalidate_course(course_id: str) -> None:
+    """
+    Stops serving the answers cached so far for a course, e.g. after its
+    corpus is rebuilt and they may no longer match the materials.
+
+    The marker stored on the course document makes every worker rebuild
+    its index on its next lookup, without the answers logged until now.
+    """
+    try:
+        firestore_service.invalidate_semantic_cache(course_id)
+    except Exception as e:
+        logger.error(f"Failed to store semantic cache invalidation for course {course_id}: {e}")
+    with _indexes_lock:
+        _course_indexes.pop(course_id, None)
+    logger.info(f"Invalidated semantic cache for course {course_id}")
+
+
+def clear() -> None:
+    """Drops every cached course index and resets the counters."""
+    with _indexes_lock:
+        _course_indexes.clear()
+        _stats['hits'] = 0
+        _stats['misses'] = 0
+
+
+def get_stats() -> dict:
+    """
+    Returns hit/miss counters and the number of cached answers in this process.
+
+    Example:
+        get_stats()  # {'hits': 12, 'misses': 30, 'courses': 2, 'entries': 410}
+    """
+    with _indexes_lock:
+        return {
+            'hits': _stats['hits'],
+            'misses': _stats['misses'],
+            'courses': len(_course_indexes),
+            'entries': sum(index.size for index in _course_indexes.values())
+        }
@@ -149,6 +149,9 @@ async function startAutoGeneration() {
             throw new Error(result.error || 'Generation failed');
         }
         
+        // Initialization runs as a background job; wait for it to finish
+        await waitForJob(result.status_url, addLogLine);
+        
         // Course initialization successful - redirect to launch endpoint
         window.location.href = `/launch?course_id=${COURSE_ID}&user_id=${'12'}&role=${USER_ROLES || ''}`;
         
@@ -167,6 +170,31 @@ async function startAutoGeneration() {
     }
 }
 
+// Poll a background job until it finishes, logging each new stage with progress and ETA
+async function waitForJob(statusUrl, onStage, intervalMs = 2000) {
+    let lastStage = null;
+    while (true) {
+        const response = await fetch(statusUrl);
+        const job = await response.json();
+        if (!response.ok) {
+            throw new Error(job.error || 'Could not read job status');
+        }
+        
+        if (job.status === 'succeeded') {
+            return job.result;
+        }
+        if (job.status === 'failed') {
+            throw new Error(job.error || 'Generation failed');
+        }
+        if (job.stage && job.stage !== lastStage) {
+            lastStage = job.stage;
+            const eta = job.eta_seconds != null ? ` (about ${Math.ceil(job.eta_seconds)}s left)` : '';
+            onStage(`${job.message || job.stage} ${Math.round(job.progress * 100)}%${eta}`);
+        }
+        await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+}
+
 // Convert knowledge graph API response to topics editor format
 function convertGraphToTopics(apiResponse) {
     const nodes = apiResponse.kg_nodes || [];
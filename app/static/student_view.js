@@ -8,6 +8,7 @@ let knowledgeGraph = null;
 let currentTopic = null;
 let chatMessages = [];
 let network = null; // vis-network instance
+let graphData = null; // vis.DataSet nodes/edges shown by the network
 let currentView = 'graph'; // 'cards' or 'graph' - default to graph
 let isChatExpanded = false;
 
@@ -175,19 +176,21 @@ async function loadKnowledgeGraph() {
     showLoading('Loading knowledge graph...');
 
     try {
-        const response = await fetch(`/api/get-graph?course_id=${COURSE_ID}`);
+        // Only topics are needed to draw the page; each topic's summary,
+        // sources and files are fetched when it is opened (loadTopicDetail)
+        const response = await fetch(`/api/graph-skeleton?course_id=${COURSE_ID}`);
         if (!response.ok) {
             throw new Error(`Failed to load graph: ${response.statusText}`);
         }
 
         const data = await response.json();
         
-        // Parse the JSON strings into objects
         knowledgeGraph = {
-            kg_nodes: JSON.parse(data.nodes),
-            kg_edges: JSON.parse(data.edges),
-            kg_data: JSON.parse(data.data),
-            indexed_files: data.indexed_files || {}  // File metadata with gcs_uri
+            kg_nodes: data.topics,
+            kg_edges: data.edges,
+            kg_data: {},
+            indexed_files: {},  // File metadata with gcs_uri, filled in per topic
+            loaded_topics: new Set()
         };
 
         console.log('Knowledge graph loaded:', knowledgeGraph);
@@ -203,6 +206,34 @@ async function loadKnowledgeGraph() {
     }
 }
 
+async function loadTopicDetail(topicId) {
+    if (knowledgeGraph.loaded_topics.has(topicId)) return;
+
+    const response = await fetch(`/api/topic-detail?course_id=${COURSE_ID}&topic_id=${encodeURIComponent(topicId)}`);
+    if (!response.ok) {
+        throw new Error(`Failed to load topic: ${response.statusText}`);
+    }
+    const detail = await response.json();
+
+    knowledgeGraph.kg_data[topicId] = { summary: detail.summary, sources: detail.sources };
+    knowledgeGraph.loaded_topics.add(topicId);
+
+    // Add the topic's files to the graph (files shared with other topics are only added once)
+    const knownIds = new Set(knowledgeGraph.kg_nodes.map(node => node.id));
+    const newFiles = detail.files.filter(file => !knownIds.has(file.id));
+    detail.files.forEach(file => {
+        knowledgeGraph.indexed_files[file.id] = { gcs_uri: file.gcs_uri, display_name: file.display_name };
+    });
+    knowledgeGraph.kg_nodes.push(...newFiles);
+    knowledgeGraph.kg_edges.push(...detail.edges);
+
+    if (graphData) {
+        const preLaidOut = newFiles.every(node => typeof node.x === 'number' && typeof node.y === 'number');
+        graphData.nodes.add(newFiles.map(node => toVisNode(node, preLaidOut)));
+        graphData.edges.add(detail.edges.map(toVisEdge));
+    }
+}
+
 // ===========================
 // VIEW SWITCHING
 // ===========================
@@ -251,10 +282,8 @@ function renderTopicCards() {
         const card = document.createElement('div');
         card.className = 'topic-card';
         
-        // Count connections (related resources)
-        const connections = knowledgeGraph.kg_edges.filter(
-            edge => edge.from === topic.id || edge.to === topic.id
-        ).length;
+        // Count connections (related resources), known from the skeleton before files are loaded
+        const connections = topic.file_count;
 
         card.innerHTML = `
             <div class="topic-icon">
@@ -328,60 +357,57 @@ function collapseChat() {
 // GRAPH VISUALIZATION
 // ===========================
 
-function renderGraph() {
-    if (!knowledgeGraph || !knowledgeGraph.kg_nodes || !knowledgeGraph.kg_edges) {
-        console.warn('No graph data to render');
-        return;
-    }
-
-    // Prepare nodes for vis-network
-    const nodes = knowledgeGraph.kg_nodes.map(node => {
-        const isTopicNode = node.group === 'topic';
-        
-        return {
-            id: node.id,
-            label: node.label,
-            title: node.label, // Tooltip
-            group: node.group,
-            // Swap colors: topics darker/richer, sources lavender with grey text
-            color: isTopicNode ? {
-                background: '#7c3aed',  // Rich purple for topics
-                border: '#6d28d9',
-                highlight: {
-                    background: '#8b5cf6',
-                    border: '#7c3aed'
-                }
-            } : {
-                background: '#d4c5f9',  // Light lavender for sources
-                border: '#c4b5fd',
-                highlight: {
-                    background: '#e9d5ff',
-                    border: '#d8b4fe'
-                }
-            },
-            font: {
-                color: isTopicNode ? '#ffffff' : '#4b5563',  // White for topics, grey for sources
-                // Topics bigger, sources slightly bigger too
-                size: isTopicNode ? 20 : 15,
-                face: 'Arial',
-                bold: isTopicNode ? true : false
-            },
-            shape: isTopicNode ? 'box' : 'ellipse',
-            // Topics larger, sources slightly bigger
-            size: isTopicNode ? 30 : 20,
-            borderWidth: 2,
-            shadow: true,
-            margin: isTopicNode ? 18 : 8
-        };
-    });
+function toVisNode(node, preLaidOut) {
+    const isTopicNode = node.group === 'topic';
+    
+    return {
+        id: node.id,
+        label: node.label,
+        title: node.label, // Tooltip
+        group: node.group,
+        x: preLaidOut ? node.x : undefined,
+        y: preLaidOut ? node.y : undefined,
+        // Swap colors: topics darker/richer, sources lavender with grey text
+        color: isTopicNode ? {
+            background: '#7c3aed',  // Rich purple for topics
+            border: '#6d28d9',
+            highlight: {
+                background: '#8b5cf6',
+                border: '#7c3aed'
+            }
+        } : {
+            background: '#d4c5f9',  // Light lavender for sources
+            border: '#c4b5fd',
+            highlight: {
+                background: '#e9d5ff',
+                border: '#d8b4fe'
+            }
+        },
+        font: {
+            color: isTopicNode ? '#ffffff' : '#4b5563',  // White for topics, grey for sources
+            // Topics bigger, sources slightly bigger too
+            size: isTopicNode ? 20 : 15,
+            face: 'Arial',
+            bold: isTopicNode ? true : false
+        },
+        shape: isTopicNode ? 'box' : 'ellipse',
+        // Topics larger, sources slightly bigger
+        size: isTopicNode ? 30 : 20,
+        borderWidth: 2,
+        shadow: true,
+        margin: isTopicNode ? 18 : 8
+    };
+}
 
-    // Prepare edges for vis-network - flexible, flowing curves
-    const edges = knowledgeGraph.kg_edges.map(edge => ({
+// Flexible, flowing curves; topic-to-topic "related" edges are undirected and drawn dashed
+function toVisEdge(edge) {
+    return {
         from: edge.from,
         to: edge.to,
+        dashes: edge.type === 'related',
         arrows: {
             to: {
-                enabled: true,
+                enabled: edge.type !== 'related',
                 scaleFactor: 0.8,  // Smaller arrow heads
                 type: 'arrow'
             }
@@ -397,10 +423,25 @@ function renderGraph() {
             roundness: 0.5
         },
         length: 200  // Longer edges to increase spacing between nodes
-    }));
+    };
+}
 
-    // Create network
-    const data = {
+function renderGraph() {
+    if (!knowledgeGraph || !knowledgeGraph.kg_nodes || !knowledgeGraph.kg_edges) {
+        console.warn('No graph data to render');
+        return;
+    }
+
+    // Graphs laid out on the server come with x/y on every node; draw them as-is without physics
+    const preLaidOut = knowledgeGraph.kg_nodes.length > 0 &&
+        knowledgeGraph.kg_nodes.every(node => typeof node.x === 'number' && typeof node.y === 'number');
+
+    // Prepare nodes and edges for vis-network
+    const nodes = knowledgeGraph.kg_nodes.map(node => toVisNode(node, preLaidOut));
+    const edges = knowledgeGraph.kg_edges.map(toVisEdge);
+
+    // Create network (the data sets grow as topics are opened, see loadTopicDetail)
+    graphData = {
         nodes: new vis.DataSet(nodes),
         edges: new vis.DataSet(edges)
     };
@@ -412,7 +453,7 @@ function renderGraph() {
             randomSeed: 2  // Consistent layout on each load
         },
         physics: {
-            enabled: true,
+            enabled: !preLaidOut,
             barnesHut: {
                 gravitationalConstant: -1200,  // Reduced repulsion (was -2000)
                 centralGravity: 0.05,
@@ -469,7 +510,7 @@ function renderGraph() {
     };
 
     // Initialize network
-    network = new vis.Network(networkCanvas, data, options);
+    network = new vis.Network(networkCanvas, graphData, options);
 
     // Track dragging to prevent opening modal on drag
     let isDragging = false;
@@ -521,10 +562,14 @@ function renderGraph() {
         }
     });
 
-    // Fit graph after stabilization
-    network.once('stabilizationIterationsDone', function() {
+    if (preLaidOut) {
         network.fit();
-    });
+    } else {
+        // Fit graph after stabilization
+        network.once('stabilizationIterationsDone', function() {
+            network.fit();
+        });
+    }
 }
 
 // ===========================
@@ -534,6 +579,12 @@ function renderGraph() {
 async function openTopicModal(topic) {
     currentTopic = topic;
 
+    try {
+        await loadTopicDetail(topic.id);
+    } catch (error) {
+        console.error('Error loading topic details:', error);
+    }
+
     // Get topic data
     const topicData = knowledgeGraph.kg_data && knowledgeGraph.kg_data[topic.id] 
         ? knowledgeGraph.kg_data[topic.id] 
@@ -663,7 +714,7 @@ async function sendMessage() {
     typingIndicator.classList.remove('hidden');
 
     try {
-        const response = await fetch('/api/chat', {
+        const response = await fetch('/api/chat/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -678,12 +729,12 @@ async function sendMessage() {
             throw new Error(`Chat request failed: ${response.statusText}`);
         }
 
-        const data = await response.json();
+        const data = await readChatStream(response);
 
         // Add bot response
         addMessage({
             role: 'assistant',
-            content: data.answer || data.response || 'I received your question but had trouble generating an answer.',
+            content: data.answer || 'I received your question but had trouble generating an answer.',
             sources: data.sources || [],
             log_doc_id: data.log_doc_id  // Include log_doc_id for rating
         });
@@ -703,6 +754,69 @@ async function sendMessage() {
     }
 }
 
+/**
+ * Reads the server-sent events from /api/chat/stream, showing the answer
+ * as it arrives. Resolves with {answer, sources, log_doc_id} once done.
+ */
+async function readChatStream(response) {
+    const result = { answer: '', sources: [], log_doc_id: null };
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    // Temporary bubble that shows the partial answer
+    const liveDiv = document.createElement('div');
+    liveDiv.className = 'message bot-message';
+    const liveContent = document.createElement('div');
+    liveContent.className = 'message-content';
+    const liveText = document.createElement('div');
+    liveContent.appendChild(liveText);
+    liveDiv.appendChild(liveContent);
+
+    try {
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let eventName = 'message';
+                let payload = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) eventName = line.slice(7);
+                    else if (line.startsWith('data: ')) payload += line.slice(6);
+                });
+                const eventData = payload ? JSON.parse(payload) : {};
+
+                if (eventName === 'sources') {
+                    result.sources = eventData.sources || [];
+                } else if (eventName === 'token') {
+                    if (!result.answer) {
+                        typingIndicator.classList.add('hidden');
+                        chatMessagesContainer.appendChild(liveDiv);
+                    }
+                    result.answer += eventData.text;
+                    liveText.innerHTML = renderMarkdownWithMath(result.answer);
+                    chatMessagesContainer.scrollTop = chatMessagesContainer.scrollHeight;
+                } else if (eventName === 'done') {
+                    result.log_doc_id = eventData.log_doc_id;
+                } else if (eventName === 'error') {
+                    throw new Error(eventData.error);
+                }
+            }
+        }
+    } finally {
+        // The finished message is re-rendered with sources and rating buttons
+        liveDiv.remove();
+    }
+
+    return result;
+}
+
 // Modal chat functionality
 async function sendModalMessage() {
     if (!modalChatInput || !modalSendBtn) return;
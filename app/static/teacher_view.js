@@ -194,18 +194,18 @@ async function loadKnowledgeGraph() {
     showLoading('Loading knowledge graph...');
 
     try {
-        const response = await fetch(`/api/get-graph?course_id=${COURSE_ID}`);
+        // format=raw: the graph parts are plain JSON, parsed once by response.json()
+        const response = await fetch(`/api/get-graph?course_id=${COURSE_ID}&format=raw`);
         if (!response.ok) {
             throw new Error(`Failed to load graph: ${response.statusText}`);
         }
 
         const data = await response.json();
         
-        // Parse the JSON strings into objects
         knowledgeGraph = {
-            kg_nodes: JSON.parse(data.nodes),
-            kg_edges: JSON.parse(data.edges),
-            kg_data: JSON.parse(data.data)
+            kg_nodes: data.nodes,
+            kg_edges: data.edges,
+            kg_data: data.data
         };
 
         console.log('Knowledge graph loaded:', knowledgeGraph);
@@ -271,7 +271,7 @@ function renderTopicCards() {
         
         // Count connections (related resources)
         const connections = knowledgeGraph.kg_edges.filter(
-            edge => edge.from === topic.id || edge.to === topic.id
+            edge => edge.type !== 'related' && (edge.from === topic.id || edge.to === topic.id)
         ).length;
 
         card.innerHTML = `
@@ -387,6 +387,10 @@ function renderGraph() {
         return;
     }
 
+    // Graphs laid out on the server come with x/y on every node; draw them as-is without physics
+    const preLaidOut = knowledgeGraph.kg_nodes.length > 0 &&
+        knowledgeGraph.kg_nodes.every(node => typeof node.x === 'number' && typeof node.y === 'number');
+
     // Prepare nodes for vis-network
     const nodes = knowledgeGraph.kg_nodes.map(node => {
         const isTopicNode = node.group === 'topic';
@@ -396,6 +400,8 @@ function renderGraph() {
             label: node.label,
             title: node.label, // Tooltip
             group: node.group,
+            x: preLaidOut ? node.x : undefined,
+            y: preLaidOut ? node.y : undefined,
             color: isTopicNode ? {
                 background: '#6366f1',
                 border: '#4f46e5',
@@ -426,12 +432,14 @@ function renderGraph() {
     });
 
     // Prepare edges for vis-network - flexible, flowing curves
+    // Topic-to-topic "related" edges are undirected and drawn dashed
     const edges = knowledgeGraph.kg_edges.map(edge => ({
         from: edge.from,
         to: edge.to,
+        dashes: edge.type === 'related',
         arrows: {
             to: {
-                enabled: true,
+                enabled: edge.type !== 'related',
                 scaleFactor: 0.8,  // Smaller arrow heads
                 type: 'arrow'
             }
@@ -462,7 +470,7 @@ function renderGraph() {
             randomSeed: 2  // Consistent layout on each load
         },
         physics: {
-            enabled: true,
+            enabled: !preLaidOut,
             barnesHut: {
                 gravitationalConstant: -2000,  // Much stronger repulsion for wider spread
                 centralGravity: 0.05,  // Very weak center pull - allows horizontal spread
@@ -548,10 +556,14 @@ function renderGraph() {
         }
     });
 
-    // Fit graph after stabilization
-    network.once('stabilizationIterationsDone', function() {
+    if (preLaidOut) {
         network.fit();
-    });
+    } else {
+        // Fit graph after stabilization
+        network.once('stabilizationIterationsDone', function() {
+            network.fit();
+        });
+    }
 }
 
 // ===========================
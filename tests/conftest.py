@@ -1,4 +1,11 @@
+import os
 import pytest
+
+# Keep the app factory from contacting Vertex AI while tests run
+os.environ.setdefault('MODEL_WARMUP', 'false')
+# ...or from polling the job queue
+os.environ.setdefault('JOB_WORKER_IN_PROCESS', 'false')
+
 from app import create_app
 
 @pytest.fixture
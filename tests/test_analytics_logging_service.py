@@ -1,3 +1,6 @@
+import asyncio
+import queue
+import threading
 import unittest
 from unittest.mock import patch, MagicMock
 import sys
@@ -42,6 +45,23 @@ class TestAnalyticsLoggingService(unittest.TestCase):
         self.assertEqual(call_args['query_vector'], [0.1, 0.2, 0.3])
 
 
+    @patch('app.services.analytics_logging_service.firestore_service')
+    @patch('app.services.analytics_logging_service.gemini_service')
+    def test_log_chat_query_with_precomputed_vector(self, mock_gemini_service, mock_firestore_service):
+        """Test log_chat_query reuses a vector the caller already computed"""
+        mock_firestore_service.log_analytics_event.return_value = "doc_id_789"
+
+        doc_id = analytics_logging_service.log_chat_query(
+            course_id="course1",
+            query_text="What is a test?",
+            query_vector=[0.4, 0.5]
+        )
+
+        self.assertEqual(doc_id, "doc_id_789")
+        mock_gemini_service.get_embedding.assert_not_called()
+        call_args = mock_firestore_service.log_analytics_event.call_args[0][0]
+        self.assertEqual(call_args['query_vector'], [0.4, 0.5])
+
     @patch('app.services.analytics_logging_service.firestore_service')
     def test_log_kg_node_click(self, mock_firestore_service):
         """Test log_kg_node_click function"""
@@ -62,5 +82,68 @@ class TestAnalyticsLoggingService(unittest.TestCase):
         self.assertEqual(call_args['course_id'], 'course1')
         self.assertEqual(call_args['node_id'], 'node1')
 
+    @patch('app.services.analytics_logging_service.firestore_service')
+    @patch('app.services.analytics_logging_service.gemini_service')
+    def test_enqueue_chat_query(self, mock_gemini_service, mock_firestore_service):
+        """Test enqueue_chat_query returns a pre-allocated ID and writes in the background"""
+        mock_firestore_service.new_analytics_doc_id.return_value = "doc_pre_1"
+        mock_firestore_service.log_analytics_event.return_value = "doc_pre_1"
+        mock_gemini_service.get_embedding.return_value = [0.1, 0.2]
+
+        doc_id = analytics_logging_service.enqueue_chat_query(
+            course_id="course1",
+            query_text="What is a test?",
+            answer_text="An answer."
+        )
+        # A rating that arrives before the write lands must not be lost
+        analytics_logging_service.rate_answer(doc_id, "helpful")
+        analytics_logging_service.shutdown_logging_pipeline(timeout=5)
+
+        self.assertEqual(doc_id, "doc_pre_1")
+        call_args = mock_firestore_service.log_analytics_event.call_args
+        self.assertEqual(call_args.kwargs['doc_id'], "doc_pre_1")
+        self.assertEqual(call_args[0][0]['query_text'], "What is a test?")
+        mock_firestore_service.rate_analytics_event.assert_called_once_with("doc_pre_1", "helpful")
+
+    @patch('app.services.analytics_logging_service.log_chat_query')
+    @patch('app.services.analytics_logging_service.firestore_service')
+    def test_enqueue_chat_query_falls_back_to_sync(self, mock_firestore_service, mock_log_chat_query):
+        """Test logging still happens synchronously when no ID can be allocated"""
+        mock_firestore_service.new_analytics_doc_id.side_effect = RuntimeError("Firestore not initialized")
+        mock_log_chat_query.return_value = None
+
+        doc_id = analytics_logging_service.enqueue_chat_query(course_id="course1", query_text="Hi")
+
+        self.assertIsNone(doc_id)
+        mock_log_chat_query.assert_called_once()
+
+    @patch('app.services.analytics_logging_service._ensure_workers')
+    @patch('app.services.analytics_logging_service._write_chat_log')
+    @patch('app.services.analytics_logging_service._log_queue')
+    @patch('app.services.analytics_logging_service.firestore_service')
+    def test_enqueue_chat_query_async_offloads_full_queue(self, mock_firestore_service, mock_log_queue, mock_write_chat_log, mock_ensure_workers):
+        """Test a full queue is written from a worker thread, not on the event loop"""
+        mock_firestore_service.new_analytics_doc_id.return_value = "doc_pre_2"
+        mock_log_queue.put_nowait.side_effect = queue.Full
+        loop_thread = threading.get_ident()
+        write_threads = []
+        mock_write_chat_log.side_effect = lambda job: write_threads.append(threading.get_ident())
+
+        doc_id = asyncio.run(analytics_logging_service.enqueue_chat_query_async(course_id="course1", query_text="Hi"))
+
+        self.assertEqual(doc_id, "doc_pre_2")
+        self.assertEqual(mock_write_chat_log.call_args[0][0]['doc_id'], "doc_pre_2")
+        self.assertNotEqual(write_threads, [loop_thread])
+
+    @patch('app.services.analytics_logging_service.firestore_service')
+    @patch('app.services.analytics_logging_service.gemini_service')
+    def test_log_chat_query_keeps_early_rating(self, mock_gemini_service, mock_firestore_service):
+        """Test a pre-allocated log doesn't overwrite a rating that landed first"""
+        mock_firestore_service.log_analytics_event.return_value = "doc_pre_3"
+
+        analytics_logging_service.log_chat_query("course1", "Hi", query_vector=[0.1], doc_id="doc_pre_3")
+
+        self.assertNotIn('rating', mock_firestore_service.log_analytics_event.call_args[0][0])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,159 @@
+import json
+from unittest.mock import patch, AsyncMock, MagicMock
+
+from starlette.testclient import TestClient
+
+from app import asgi
+
+client = TestClient(asgi.app)
+
+@patch('app.asgi.analytics_logging_service')
+@patch('app.asgi.semantic_cache_service')
+@patch('app.asgi.firestore_service')
+@patch('app.asgi.gemini_service')
+def test_async_chat(mock_gemini_service, mock_firestore_service, mock_semantic_cache, mock_analytics):
+    """Test the async chat endpoint retrieves, generates and reports stage timings"""
+    course_data = MagicMock()
+    course_data.to_dict.return_value = {'corpus_id': 'test_corpus'}
+    mock_firestore_service.get_course_data_async = AsyncMock(return_value=course_data)
+    mock_analytics.get_query_vector_async = AsyncMock(return_value=[0.1, 0.2])
+    mock_analytics.enqueue_chat_query_async = AsyncMock(return_value='log_1')
+    mock_semantic_cache.lookup.return_value = None
+    sources = [{'filename': 'a.pdf', 'distance': 0.1}]
+    mock_gemini_service.retrieve_answer_context_async = AsyncMock(return_value=(["Context."], sources))
+    mock_gemini_service.generate_answer_with_context_async = AsyncMock(return_value=("Test answer", sources))
+
+    response = client.post('/api/chat', json={'course_id': '123', 'query': 'What is a test?'})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data['answer'] == 'Test answer'
+    assert data['sources'] == sources
+    assert data['log_doc_id'] == 'log_1'
+    mock_gemini_service.retrieve_answer_context_async.assert_awaited_once_with('What is a test?', 'test_corpus')
+    assert mock_gemini_service.generate_answer_with_context_async.call_args.kwargs['context'] == (["Context."], sources)
+    assert 'generate;dur=' in response.headers['Server-Timing']
+
+@patch('app.asgi.analytics_logging_service')
+@patch('app.asgi.semantic_cache_service')
+@patch('app.asgi.firestore_service')
+@patch('app.asgi.gemini_service')
+def test_async_chat_semantic_cache_hit(mock_gemini_service, mock_firestore_service, mock_semantic_cache, mock_analytics):
+    """Test a cached answer is served without starting retrieval or generation"""
+    mock_firestore_service.get_course_data_async = AsyncMock()
+    mock_analytics.get_query_vector_async = AsyncMock(return_value=[0.1, 0.2])
+    mock_analytics.enqueue_chat_query_async = AsyncMock(return_value='log_1')
+    mock_semantic_cache.lookup.return_value = {'answer': 'Cached answer', 'sources': [], 'similarity': 0.99, 'doc_id': 'old'}
+    mock_gemini_service.retrieve_answer_context_async = AsyncMock()
+    mock_gemini_service.generate_answer_with_context_async = AsyncMock()
+
+    response = client.post('/api/chat', json={'course_id': '123', 'query': 'What is a test?'})
+
+    assert response.status_code == 200
+    assert response.json()['cached'] is True
+    mock_firestore_service.get_course_data_async.assert_not_awaited()
+    mock_gemini_service.retrieve_answer_context_async.assert_not_awaited()
+    mock_gemini_service.generate_answer_with_context_async.assert_not_awaited()
+
+@patch('app.asgi.firestore_service')
+def test_async_get_graph(mock_firestore_service):
+    """Test the async graph endpoint returns the stored graph"""
+    course_data = MagicMock()
+    course_data.get.side_effect = lambda key: {'indexed_files': {}}[key]
+    mock_firestore_service.get_course_data_async = AsyncMock(return_value=course_data)
+    mock_firestore_service.get_knowledge_graph_async = AsyncMock(return_value=([], [], {}))
+
+    response = client.get('/api/get-graph?course_id=123')
+
+    assert response.status_code == 200
+    assert response.json() == {'nodes': '[]', 'edges': '[]', 'data': '{}', 'indexed_files': {}}
+    mock_firestore_service.get_course_data_async.assert_awaited_once_with('123', validate='kg')
+    mock_firestore_service.get_knowledge_graph_async.assert_awaited_once_with('123', course_data)
+
+@patch('app.asgi.firestore_service')
+def test_async_get_graph_not_modified(mock_firestore_service):
+    """Test the async graph endpoint answers a current ETag with 304 without reading the graph"""
+    course_data = MagicMock()
+    course_data.to_dict.return_value = {'kg_version': 2}
+    mock_firestore_service.get_course_data_async = AsyncMock(return_value=course_data)
+    mock_firestore_service.get_knowledge_graph_async = AsyncMock(return_value=([], [], {}))
+
+    response = client.get('/api/get-graph?course_id=123', headers={'If-None-Match': 'W/"kg-2-0"'})
+
+    assert response.status_code == 304
+    assert response.headers['ETag'] == 'W/"kg-2-0"'
+    mock_firestore_service.get_knowledge_graph_async.assert_not_awaited()
+
+@patch('app.asgi.firestore_service')
+def test_async_get_graph_errors(mock_firestore_service):
+    """Test the async graph endpoint answers 400, 404 and 500 like the Flask route"""
+    course_data = MagicMock(exists=False)
+    mock_firestore_service.get_course_data_async = AsyncMock(return_value=course_data)
+
+    assert client.get('/api/get-graph').status_code == 400
+    assert client.get('/api/get-graph?course_id=missing').status_code == 404
+
+    mock_firestore_service.get_course_data_async = AsyncMock(side_effect=RuntimeError("Firestore down"))
+    response = client.get('/api/get-graph?course_id=123')
+
+    assert response.status_code == 500
+    assert response.json()['message'] == 'Firestore down'
+
+@patch('app.routes.firestore_service')
+@patch('app.asgi.firestore_service')
+def test_async_get_graph_matches_flask(mock_firestore_service, mock_routes_firestore):
+    """Test both serving modes send the same body and validators, and honour If-Modified-Since"""
+    from datetime import datetime, timezone
+    course_data = MagicMock()
+    updated_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    course_data.to_dict.return_value = {'kg_version': 3, 'kg_updated_at': updated_at}
+    course_data.get.side_effect = lambda key: {'indexed_files': {'1': {'gcs_uri': 'gs://b/a.pdf'}}}[key]
+    graph = ([{'id': 'topic_1'}], [], {'topic_1': {'summary': 's'}})
+    mock_firestore_service.get_course_data_async = AsyncMock(return_value=course_data)
+    mock_firestore_service.get_knowledge_graph_async = AsyncMock(return_value=graph)
+    mock_routes_firestore.get_course_data.return_value = course_data
+    mock_routes_firestore.get_knowledge_graph.return_value = graph
+
+    async_response = client.get('/api/get-graph?course_id=123', headers={'Accept-Encoding': 'identity'})
+    flask_response = asgi.flask_app.test_client().get('/api/get-graph?course_id=123', headers={'Accept-Encoding': 'identity'})
+
+    assert async_response.content == flask_response.data
+    for header in ('ETag', 'Last-Modified', 'Cache-Control'):
+        assert async_response.headers[header] == flask_response.headers[header]
+    response = client.get('/api/get-graph?course_id=123',
+                          headers={'If-Modified-Since': async_response.headers['Last-Modified']})
+    assert response.status_code == 304
+
+@patch('app.asgi.analytics_logging_service')
+@patch('app.asgi.semantic_cache_service')
+def test_async_rate_answer(mock_semantic_cache, mock_analytics):
+    """Test the async rating endpoint validates input, rejects unknown answers and trusts IDs issued to the session"""
+    session_client = TestClient(asgi.app)
+    mock_analytics.rate_answer_async = AsyncMock(return_value=False)
+
+    assert session_client.post('/api/rate-answer', json={'log_doc_id': 'abc'}).status_code == 400
+    assert session_client.post('/api/rate-answer', json={'log_doc_id': 'abc', 'rating': 'meh'}).status_code == 400
+
+    response = session_client.post('/api/rate-answer', json={'log_doc_id': 'abc', 'rating': 'helpful'})
+
+    assert response.status_code == 404
+    mock_analytics.rate_answer_async.assert_awaited_once_with('abc', 'helpful', issued=False)
+
+    # A chat answer's log ID is remembered in the (Flask-compatible) session cookie
+    mock_analytics.get_query_vector_async = AsyncMock(return_value=[0.1, 0.2])
+    mock_analytics.enqueue_chat_query_async = AsyncMock(return_value='log_9')
+    mock_semantic_cache.lookup.return_value = {'answer': 'Cached answer', 'sources': [], 'similarity': 0.99, 'doc_id': 'old'}
+    session_client.post('/api/chat', json={'course_id': '123', 'query': 'What is a test?'})
+    mock_analytics.rate_answer_async = AsyncMock(return_value=True)
+
+    response = session_client.post('/api/rate-answer', json={'log_doc_id': 'log_9', 'rating': 'helpful'})
+
+    assert response.status_code == 200
+    mock_analytics.rate_answer_async.assert_awaited_once_with('log_9', 'helpful', issued=True)
+
+def test_flask_routes_are_mounted():
+    """Test routes without an async implementation fall through to Flask"""
+    response = client.get('/health')
+
+    assert response.status_code == 200
+    assert json.loads(response.content)['status'] == 'healthy'
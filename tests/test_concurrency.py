@@ -0,0 +1,224 @@
+import asyncio
+import unittest
+import sys
+import os
+import threading
+import time
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import concurrency
+
+class TestConcurrency(unittest.TestCase):
+    """Test suite for the shared fan-out helpers"""
+
+    def test_submit_runs_on_shared_executor(self):
+        """Test submitted calls run off the calling thread on one executor"""
+        future = concurrency.submit(lambda x: (x * 2, threading.current_thread().name), 21)
+
+        value, thread_name = future.result(timeout=5)
+
+        self.assertEqual(value, 42)
+        self.assertTrue(thread_name.startswith('fanout'))
+        self.assertIs(concurrency.get_executor(), concurrency.get_executor())
+
+    def test_timed_records_duration_even_on_error(self):
+        """Test timed stores the stage duration whether or not the call fails"""
+        timings = {}
+
+        self.assertEqual(concurrency.timed(timings, 'ok', lambda: 'done'), 'done')
+        with self.assertRaises(ValueError):
+            concurrency.timed(timings, 'boom', lambda: (_ for _ in ()).throw(ValueError("boom")))
+
+        self.assertIn('ok', timings)
+        self.assertIn('boom', timings)
+        self.assertGreaterEqual(timings['ok'], 0)
+
+    def test_rate_limiter_spaces_calls_after_burst(self):
+        """Test the token bucket allows a burst and then waits for refills"""
+        limiter = concurrency.RateLimiter(rate=20, burst=2)
+
+        waits = [limiter.acquire() for _ in range(4)]
+
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertGreater(waits[2], 0)
+        self.assertEqual(concurrency.RateLimiter(rate=0).acquire(), 0.0)
+
+    def test_single_flight_coalesces_concurrent_calls(self):
+        """Test concurrent calls with one key share a single execution"""
+        concurrency.reset_singleflight_stats()
+        flight = concurrency.SingleFlight('test_flight')
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def work(value):
+            calls.append(value)
+            started.set()
+            release.wait(timeout=5)
+            return value * 2
+
+        leader_result = []
+        leader = threading.Thread(target=lambda: leader_result.append(flight.do('key', work, 21)))
+        leader.start()
+        started.wait(timeout=5)
+
+        follower_future, shared = flight.submit('key', work, 99)
+        release.set()
+        leader.join(timeout=5)
+
+        self.assertTrue(shared)
+        self.assertEqual(follower_future.result(timeout=5), 42)
+        self.assertEqual(leader_result, [(42, False)])
+        self.assertEqual(calls, [21])
+        self.assertEqual(concurrency.get_singleflight_stats()['test_flight'], {'calls': 2, 'saved': 1})
+
+        # Finished calls are not cached
+        self.assertEqual(flight.do('key', work, 5), (10, False))
+
+    def test_single_flight_shares_errors(self):
+        """Test waiting callers receive the leader's exception"""
+        flight = concurrency.SingleFlight('test_errors')
+
+        with self.assertRaises(ValueError):
+            flight.do('key', lambda: (_ for _ in ()).throw(ValueError("boom")))
+
+    def test_async_single_flight(self):
+        """Test concurrent coroutines with one key share a single execution"""
+        flight = concurrency.AsyncSingleFlight('test_async_flight')
+        calls = []
+
+        async def work(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return value * 2
+
+        async def run():
+            return await asyncio.gather(flight.do('key', work, 21), flight.do('key', work, 99), flight.do('other', work, 1))
+
+        results = asyncio.run(run())
+
+        self.assertEqual(results, [(42, False), (42, True), (2, False)])
+        self.assertEqual(calls, [21, 1])
+
+    def test_pipeline_overlaps_stages(self):
+        """Test an item enters the next stage while later items are still in the first one"""
+        second_item_started = threading.Event()
+        overlapped = []
+
+        def first(item):
+            if item['n'] == 1:
+                second_item_started.set()
+
+        def second(item):
+            if item['n'] == 0:
+                overlapped.append(second_item_started.wait(timeout=5))
+            item['done'] = True
+
+        items = [{'n': n} for n in range(3)]
+        done = []
+        errors, stats = concurrency.run_pipeline(
+            items, [concurrency.PipelineStage('first', first), concurrency.PipelineStage('second', second)],
+            on_done=lambda position, item: done.append(position)
+        )
+
+        self.assertEqual(overlapped, [True])
+        self.assertEqual(errors, {})
+        self.assertEqual(sorted(done), [0, 1, 2])
+        self.assertTrue(all(item['done'] for item in items))
+        self.assertEqual(stats['second']['items'], 3)
+
+    def test_pipeline_applies_backpressure(self):
+        """Test a blocked stage stops the stage before it once the queue between them is full"""
+        release = threading.Event()
+        started = []
+
+        def slow(item):
+            release.wait(timeout=5)
+
+        def fast(item):
+            started.append(item)
+
+        result = {}
+        runner = threading.Thread(target=lambda: result.update(zip(('errors', 'stats'), concurrency.run_pipeline(
+            list(range(10)),
+            [concurrency.PipelineStage('fast', fast), concurrency.PipelineStage('slow', slow)],
+            queue_size=1
+        ))))
+        runner.start()
+        time.sleep(0.3)
+
+        # One item in the slow stage, one queued for it, one waiting to be queued
+        self.assertEqual(len(started), 3)
+        release.set()
+        runner.join(timeout=5)
+        self.assertEqual(len(started), 10)
+        self.assertEqual(result['stats']['slow']['items'], 10)
+
+    def test_pipeline_skips_and_records_failures(self):
+        """Test skipped items pass through and failed items leave the pipeline with their error"""
+        def check(item):
+            if item == 2:
+                raise ValueError('bad item')
+
+        done = []
+        errors, stats = concurrency.run_pipeline(
+            [1, 2, 3],
+            [concurrency.PipelineStage('skip_odd', check, when=lambda item: item % 2 == 0, workers=2),
+             concurrency.PipelineStage('noop', lambda item: None)],
+            on_done=lambda position, item: done.append(item)
+        )
+
+        self.assertEqual(sorted(done), [1, 3])
+        self.assertEqual(list(errors), [1])
+        self.assertIsInstance(errors[1], ValueError)
+        self.assertEqual((stats['skip_odd']['skipped'], stats['skip_odd']['failed']), (2, 1))
+
+    def test_pipeline_batches_waiting_items(self):
+        """Test a batching stage takes the items already waiting for it, up to its batch size"""
+        batches = []
+
+        def second(items):
+            batches.append(list(items))
+            if len(batches) == 1:
+                time.sleep(0.2)  # the other items queue up meanwhile
+
+        errors, stats = concurrency.run_pipeline(
+            list(range(7)),
+            [concurrency.PipelineStage('first', lambda item: None, workers=7),
+             concurrency.PipelineStage('second', second, batched=True, batch_size=4)],
+        )
+
+        self.assertEqual(errors, {})
+        self.assertEqual(sorted(item for batch in batches for item in batch), list(range(7)))
+        self.assertTrue(all(len(batch) <= 4 for batch in batches))
+        self.assertIn(4, [len(batch) for batch in batches])
+        self.assertEqual(stats['second']['items'], 7)
+
+    def test_pipeline_batched_stage_always_gets_lists(self):
+        """Test a batched stage receives lists even with batch size 1, and batch_size requires batched"""
+        batches = []
+
+        errors, _ = concurrency.run_pipeline(
+            ['a', 'b'], [concurrency.PipelineStage('import', batches.append, batched=True, batch_size=1)]
+        )
+
+        self.assertEqual(errors, {})
+        self.assertEqual(sorted(batches), [['a'], ['b']])
+        with self.assertRaises(ValueError):
+            concurrency.PipelineStage('import', batches.append, batch_size=4)
+
+    def test_pipeline_stops_when_on_done_raises(self):
+        """Test an error from on_done stops the pipeline and reaches the caller"""
+        processed = []
+
+        def stop(position, item):
+            raise RuntimeError('lease lost')
+
+        with self.assertRaises(RuntimeError):
+            concurrency.run_pipeline(list(range(50)), [concurrency.PipelineStage('work', processed.append)],
+                                     queue_size=1, on_done=stop)
+        self.assertLess(len(processed), 50)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,360 @@
+import unittest
+from unittest.mock import patch, Mock
+import sys
+import os
+import json
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import course_init_service, firestore_service, job_queue_service
+
+class TestCourseInitService(unittest.TestCase):
+    """Test suite for the course initialization pipeline"""
+
+    def _upload(self, files, course_id, on_uploaded=None):
+        for file in files:
+            file['gcs_uri'] = f"gs://b/{file['display_name']}"
+            on_uploaded(file)
+        return files
+
+    @patch('app.services.course_init_service.semantic_cache_service')
+    @patch('app.services.course_init_service.firestore_service')
+    @patch('app.services.course_init_service.kg_service')
+    @patch('app.services.course_init_service.gemini_service')
+    @patch('app.services.course_init_service.rag_service')
+    @patch('app.services.course_init_service.gcs_service')
+    @patch('app.services.course_init_service.canvas_service')
+    def test_run_initialization_checkpoints_every_stage(self, mock_canvas, mock_gcs, mock_rag, mock_gemini,
+                                                        mock_kg, mock_firestore, mock_cache):
+        """Test a fresh run reports monotonic progress, checkpoints each stage and clears them at the end"""
+        mock_firestore.get_init_checkpoints.return_value = {}
+        mock_canvas.get_course_files.return_value = ([{'id': '1', 'display_name': 'a.pdf'}], {'1': {}})
+        mock_canvas.download_files.side_effect = lambda files, token, course_id: [f.update(local_path='/tmp/a.pdf') for f in files]
+        mock_gcs.upload_course_files.side_effect = self._upload
+        mock_rag.create_corpus.return_value = 'corpus_1'
+        mock_rag.import_corpus_files.side_effect = lambda corpus_id, files, on_imported: [on_imported(f) for f in files]
+        mock_rag.RAG_IMPORT_BATCH_SIZE = 25
+        mock_gemini.summarize_file.return_value = 'About recursion'
+        mock_kg.extract_topics_from_summaries.return_value = ['Recursion']
+        mock_kg.build_knowledge_graph.return_value = ([{'id': 'topic_1', 'group': 'topic'}], [], {})
+        report = Mock()
+
+        result = course_init_service.run_initialization('123', report=report)
+
+        ingest = result.pop('ingest')
+        self.assertEqual(result, {'corpus_id': 'corpus_1', 'files_count': 1, 'uploaded_count': 1,
+                                  'topic_count': 1, 'resumed_from': []})
+        self.assertEqual([stats['items'] for stats in ingest.values()], [1, 1, 1, 1])
+        self.assertEqual(mock_firestore.add_init_log.call_count, 4)
+        self.assertEqual([c.args[0] for c in report.call_args_list],
+                         ['ingest', 'ingest', 'ingest', 'ingest', 'build_graph', 'finalize'])
+        progress = [c.args[1] for c in report.call_args_list]
+        self.assertEqual(progress, sorted(progress))
+        saved = [(c.args[1], c.args[2]) for c in mock_firestore.save_init_checkpoint.call_args_list]
+        self.assertEqual([stage for stage, _ in saved], ['manifest', 'corpus', 'uploads', 'corpus', 'summaries', 'topics'])
+        self.assertEqual(saved[2][1], {'1': 'gs://b/a.pdf'})
+        self.assertEqual(saved[3][1], {'imported': {'1': True}})
+        self.assertEqual(mock_firestore.finalize_course_doc.call_args.args[1]['indexed_files'], {'1': {'gcs_uri': 'gs://b/a.pdf', 'display_name': 'a.pdf'}})
+        mock_firestore.clear_init_checkpoints.assert_called_once_with('123')
+        mock_cache.invalidate_course.assert_called_once_with('123')
+
+    @patch('app.services.course_init_service.semantic_cache_service')
+    @patch('app.services.course_init_service.firestore_service')
+    @patch('app.services.course_init_service.kg_service')
+    @patch('app.services.course_init_service.gemini_service')
+    @patch('app.services.course_init_service.rag_service')
+    @patch('app.services.course_init_service.gcs_service')
+    @patch('app.services.course_init_service.canvas_service')
+    def test_run_initialization_resumes_at_first_incomplete_item(self, mock_canvas, mock_gcs, mock_rag, mock_gemini,
+                                                                 mock_kg, mock_firestore, mock_cache):
+        """Test a retry keeps the corpus and only redoes the file and topic that didn't finish"""
+        mock_firestore.get_init_checkpoints.return_value = {
+            'manifest': {'files': [{'id': '1', 'display_name': 'a.pdf'}, {'id': '2', 'display_name': 'b.pdf'}],
+                         'indexed_files': {'1': {}, '2': {}}},
+            'uploads': {'1': 'gs://b/a.pdf'},
+            'corpus': {'corpus_id': 'corpus_1', 'imported': {'1': True}},
+            'summaries': {'1': 'About recursion'},
+            'topics': {'topics': ['Recursion', 'Sorting']},
+            'graph': {'topic_1': {'topic': 'Recursion', 'summary': 'Recursion is...', 'sources': []}},
+        }
+        mock_canvas.download_files.side_effect = lambda files, token, course_id: [f.update(local_path='/tmp/x') for f in files]
+        mock_gcs.upload_course_files.side_effect = self._upload
+        mock_rag.import_corpus_files.side_effect = lambda corpus_id, files, on_imported: [on_imported(f) for f in files]
+        mock_rag.RAG_IMPORT_BATCH_SIZE = 25
+        mock_gemini.summarize_file.return_value = 'About sorting'
+        mock_kg.build_knowledge_graph.return_value = ([], [], {})
+
+        result = course_init_service.run_initialization('123')
+
+        mock_canvas.get_course_files.assert_not_called()
+        self.assertEqual([f['id'] for f in mock_canvas.download_files.call_args.args[0]], ['2'])
+        self.assertEqual([f['id'] for f in mock_gcs.upload_course_files.call_args.args[0]], ['2'])
+        mock_rag.create_corpus.assert_not_called()
+        self.assertEqual([f['id'] for f in mock_rag.import_corpus_files.call_args.args[1]], ['2'])
+        mock_gemini.summarize_file.assert_called_once_with(file_path='/tmp/x')
+        mock_kg.extract_topics_from_summaries.assert_not_called()
+        build_kwargs = mock_kg.build_knowledge_graph.call_args.kwargs
+        self.assertEqual(build_kwargs['topic_list'], ['Recursion', 'Sorting'])
+        self.assertEqual(build_kwargs['known_summaries'], {'Recursion': ('Recursion is...', [])})
+        build_kwargs['on_summary']('Sorting', ('Sorting is...', []))
+        mock_firestore.save_init_checkpoint.assert_called_with(
+            '123', 'graph', {'topic_2': {'topic': 'Sorting', 'summary': 'Sorting is...', 'sources': []}}
+        )
+        self.assertEqual(result['corpus_id'], 'corpus_1')
+        self.assertIn('manifest', result['resumed_from'])
+
+    @patch('app.services.course_init_service.firestore_service')
+    @patch('app.services.course_init_service.gemini_service')
+    @patch('app.services.course_init_service.rag_service')
+    @patch('app.services.course_init_service.gcs_service')
+    @patch('app.services.course_init_service.canvas_service')
+    def test_ingest_failures_fail_the_run_after_other_files(self, mock_canvas, mock_gcs, mock_rag, mock_gemini,
+                                                            mock_firestore):
+        """Test a file that fails to summarize fails the run only once the other files are checkpointed"""
+        mock_firestore.get_init_checkpoints.return_value = {}
+        mock_canvas.get_course_files.return_value = (
+            [{'id': '1', 'display_name': 'a.pdf'}, {'id': '2', 'display_name': 'b.pdf'}], {'1': {}, '2': {}}
+        )
+        mock_canvas.download_files.side_effect = lambda files, token, course_id: [f.update(local_path=f"/tmp/{f['id']}") for f in files]
+        mock_gcs.upload_course_files.side_effect = self._upload
+        mock_rag.import_corpus_files.side_effect = lambda corpus_id, files, on_imported: [on_imported(f) for f in files]
+        mock_rag.RAG_IMPORT_BATCH_SIZE = 25
+        mock_gemini.summarize_file.side_effect = lambda file_path: 'About b' if file_path == '/tmp/2' else 1 / 0
+
+        with self.assertRaisesRegex(RuntimeError, '1 of 2 files failed'):
+            course_init_service.run_initialization('123')
+
+        mock_firestore.save_init_checkpoint.assert_any_call('123', 'summaries', {'2': 'About b'})
+        mock_firestore.save_init_checkpoint.assert_any_call('123', 'corpus', {'imported': {'1': True}})
+        mock_firestore.finalize_course_doc.assert_not_called()
+
+    @patch('app.services.course_init_service.firestore_service')
+    @patch('app.services.course_init_service.gemini_service')
+    @patch('app.services.course_init_service.rag_service')
+    @patch('app.services.course_init_service.gcs_service')
+    @patch('app.services.course_init_service.canvas_service')
+    def test_skipped_downloads_and_imports_fail_the_run(self, mock_canvas, mock_gcs, mock_rag, mock_gemini,
+                                                        mock_firestore):
+        """Test files the services skip (no local copy, no import outcome) fail the run instead of finalizing it"""
+        mock_firestore.get_init_checkpoints.return_value = {}
+        mock_canvas.get_course_files.return_value = (
+            [{'id': '1', 'display_name': 'a.pdf'}, {'id': '2', 'display_name': 'b.pdf'},
+             {'id': '3', 'display_name': 'c.pdf'}], {'1': {}, '2': {}, '3': {}}
+        )
+        # Canvas couldn't download a.pdf and the corpus import dropped b.pdf; both only log
+        mock_canvas.download_files.side_effect = lambda files, token, course_id: [
+            f.update(local_path=f"/tmp/{f['id']}") for f in files if f['id'] != '1'
+        ]
+        mock_gcs.upload_course_files.side_effect = self._upload
+        mock_rag.import_corpus_files.side_effect = lambda corpus_id, files, on_imported: [
+            on_imported(f) for f in files if f['id'] != '2'
+        ]
+        mock_rag.RAG_IMPORT_BATCH_SIZE = 1
+        mock_gemini.summarize_file.return_value = 'About c'
+
+        with self.assertRaisesRegex(RuntimeError, '2 of 3 files failed'):
+            course_init_service.run_initialization('123')
+
+        self.assertEqual([f['id'] for call in mock_gcs.upload_course_files.call_args_list for f in call.args[0]], ['2', '3'])
+        mock_firestore.save_init_checkpoint.assert_any_call('123', 'summaries', {'3': 'About c'})
+        mock_firestore.finalize_course_doc.assert_not_called()
+        mock_firestore.clear_init_checkpoints.assert_not_called()
+
+    @patch('app.services.course_init_service.firestore_service')
+    @patch('app.services.course_init_service.gemini_service')
+    @patch('app.services.course_init_service.rag_service')
+    @patch('app.services.course_init_service.gcs_service')
+    @patch('app.services.course_init_service.canvas_service')
+    def test_failed_upload_keeps_checkpoints_for_the_retry(self, mock_canvas, mock_gcs, mock_rag, mock_gemini,
+                                                           mock_firestore):
+        """Test a file left without a gcs_uri by the upload fails the run and is never imported"""
+        mock_firestore.get_init_checkpoints.return_value = {}
+        mock_canvas.get_course_files.return_value = (
+            [{'id': '1', 'display_name': 'a.pdf'}, {'id': '2', 'display_name': 'b.pdf'}], {'1': {}, '2': {}}
+        )
+        mock_canvas.download_files.side_effect = lambda files, token, course_id: [f.update(local_path=f"/tmp/{f['id']}") for f in files]
+        # gcs_service logs the failed upload of a.pdf and leaves its gcs_uri unset
+        mock_gcs.upload_course_files.side_effect = lambda files, course_id, on_uploaded: [
+            self._upload([f], course_id, on_uploaded) for f in files if f['id'] != '1'
+        ]
+        mock_rag.import_corpus_files.side_effect = lambda corpus_id, files, on_imported: [on_imported(f) for f in files]
+        mock_rag.RAG_IMPORT_BATCH_SIZE = 25
+        mock_gemini.summarize_file.return_value = 'About b'
+
+        with self.assertRaisesRegex(RuntimeError, '1 of 2 files failed to ingest \\(a.pdf: upload'):
+            course_init_service.run_initialization('123')
+
+        self.assertEqual([f['id'] for call in mock_rag.import_corpus_files.call_args_list for f in call.args[1]], ['2'])
+        mock_firestore.save_init_checkpoint.assert_any_call('123', 'uploads', {'2': 'gs://b/b.pdf'})
+        mock_firestore.update_knowledge_graph.assert_not_called()
+        mock_firestore.finalize_course_doc.assert_not_called()
+        mock_firestore.clear_init_checkpoints.assert_not_called()
+
+    @patch('app.services.course_init_service.firestore_service')
+    @patch('app.services.course_init_service.canvas_service')
+    def test_course_without_files_fails_permanently(self, mock_canvas, mock_firestore):
+        """Test a course with no files raises an error the queue won't retry"""
+        mock_firestore.get_init_checkpoints.return_value = {}
+        mock_canvas.get_course_files.return_value = ([], {})
+
+        with self.assertRaises(job_queue_service.PermanentJobError):
+            course_init_service.run_initialization('123')
+
+    @patch('app.services.course_init_service.job_queue_service')
+    @patch('app.services.course_init_service.firestore_service')
+    def test_enqueue_initialization_marks_course_generating(self, mock_firestore, mock_queue):
+        """Test queuing sets the course to GENERATING before the job exists"""
+        mock_queue.find_active_job.return_value = None
+        mock_queue.enqueue_job.return_value = 'job_1'
+
+        self.assertEqual(course_init_service.enqueue_initialization('123', topics='A, B'), 'job_1')
+
+        mock_firestore.create_course_doc.assert_called_once_with('123')
+        mock_firestore.clear_init_checkpoints.assert_not_called()
+        mock_queue.enqueue_job.assert_called_once_with(
+            course_init_service.INIT_JOB_KIND, {'course_id': '123', 'topics': 'A, B', 'summary_mode': None},
+            dedupe_key='course_123'
+        )
+
+        course_init_service.enqueue_initialization('123', resume=False)
+        mock_firestore.clear_init_checkpoints.assert_called_once_with('123')
+
+    @patch('app.services.course_init_service.job_queue_service')
+    @patch('app.services.course_init_service.firestore_service')
+    def test_enqueue_initialization_reuses_running_job(self, mock_firestore, mock_queue):
+        """Test a second initialize while one is queued or running leaves the course alone"""
+        mock_queue.find_active_job.return_value = 'job_running'
+
+        self.assertEqual(course_init_service.enqueue_initialization('123', resume=False), 'job_running')
+
+        mock_queue.find_active_job.assert_called_once_with(course_init_service.INIT_JOB_KIND, 'course_123')
+        mock_firestore.create_course_doc.assert_not_called()
+        mock_firestore.clear_init_checkpoints.assert_not_called()
+        mock_queue.enqueue_job.assert_not_called()
+
+    def test_diff_course_files(self):
+        """Test files are sorted into new, changed (hash or name), removed and unchanged"""
+        stored = {'1': {'hash': 'a', 'display_name': 'a.pdf'}, '2': {'hash': 'b', 'display_name': 'b.pdf'},
+                  '3': {'hash': 'c', 'display_name': 'c.pdf'}, '4': {'hash': 'd'}}
+        current = {'1': {'hash': 'a', 'display_name': 'a.pdf'}, '2': {'hash': 'B', 'display_name': 'b.pdf'},
+                   '3': {'hash': 'c', 'display_name': 'c2.pdf'}, '5': {'hash': 'e', 'display_name': 'e.pdf'}}
+
+        self.assertEqual(course_init_service.diff_course_files(stored, current),
+                         {'new': ['5'], 'changed': ['2', '3'], 'removed': ['4'], 'unchanged': ['1']})
+
+    @patch('app.services.course_init_service.semantic_cache_service')
+    @patch('app.services.course_init_service.firestore_service')
+    @patch('app.services.course_init_service.kg_service')
+    @patch('app.services.course_init_service.rag_service')
+    @patch('app.services.course_init_service.gcs_service')
+    @patch('app.services.course_init_service.canvas_service')
+    def test_run_sync_processes_only_changed_files(self, mock_canvas, mock_gcs, mock_rag, mock_kg,
+                                                   mock_firestore, mock_cache):
+        """Test a sync re-imports new and changed files, drops removed ones and keeps the rest"""
+        mock_firestore.get_course_data.return_value.to_dict.return_value = {
+            'status': 'ACTIVE', 'corpus_id': 'corpus_1',
+            'indexed_files': {
+                '1': {'hash': 'a', 'url': 'u1', 'gcs_uri': 'gs://b/a.pdf', 'display_name': 'a.pdf'},
+                '2': {'hash': 'b', 'url': 'u2', 'gcs_uri': 'gs://b/b.pdf', 'display_name': 'b.pdf'},
+                '3': {'hash': 'c', 'url': 'u3', 'gcs_uri': 'gs://b/c.pdf', 'display_name': 'c.pdf'},
+            }
+        }
+        mock_canvas.get_course_files.return_value = (
+            [{'id': '1', 'display_name': 'a.pdf'}, {'id': '2', 'display_name': 'b.pdf'},
+             {'id': '4', 'display_name': 'd.pdf'}],
+            {'1': {'hash': 'a', 'url': 'u1'}, '2': {'hash': 'B', 'url': 'u2'}, '4': {'hash': 'd', 'url': 'u4'}}
+        )
+        mock_gcs.upload_course_files.side_effect = lambda files, course_id: [
+            f.update(gcs_uri=f"gs://b/{f['display_name']}") for f in files
+        ]
+        mock_rag.import_corpus_files.side_effect = lambda corpus_id, files, on_imported: [on_imported(f) for f in files]
+        mock_firestore.get_knowledge_graph.return_value = ([], [], {})
+        mock_kg.sync_graph_files.return_value = ('[]', '[]', '{}', ['topic_2'])
+
+        result = course_init_service.run_sync('123')
+
+        self.assertEqual(result, {'new': 1, 'changed': 1, 'removed': 1, 'unchanged': 1,
+                                  'failed': [], 'refreshed_topics': ['topic_2']})
+        self.assertEqual([f['id'] for f in mock_canvas.download_files.call_args.args[0]], ['4', '2'])
+        mock_rag.create_corpus.assert_not_called()
+        self.assertEqual(sorted(mock_rag.delete_corpus_files.call_args.args[1]),
+                         ['gs://b/b.pdf', 'gs://b/c.pdf', 'gs://b/d.pdf'])
+        mock_gcs.delete_file.assert_called_once_with('gs://b/c.pdf')
+        sync_kwargs = mock_kg.sync_graph_files.call_args.kwargs
+        self.assertEqual(sync_kwargs['stale_file_ids'], {'2', '3'})
+        self.assertEqual(sync_kwargs['new_file_ids'], {'4'})
+        indexed = mock_firestore.put_graph_topics.call_args.kwargs['indexed_files']
+        self.assertEqual(sorted(indexed), ['1', '2', '4'])
+        self.assertEqual(indexed['2'], {'hash': 'B', 'url': 'u2', 'display_name': 'b.pdf', 'gcs_uri': 'gs://b/b.pdf'})
+        mock_firestore.put_graph_topics.assert_called_once()
+        mock_firestore.update_knowledge_graph.assert_not_called()
+        mock_firestore.finalize_course_doc.assert_not_called()
+        mock_cache.invalidate_course.assert_called_once_with('123')
+
+    @patch('app.services.course_init_service.semantic_cache_service')
+    @patch('app.services.course_init_service.firestore_service')
+    @patch('app.services.course_init_service.kg_service')
+    @patch('app.services.course_init_service.rag_service')
+    @patch('app.services.course_init_service.gcs_service')
+    @patch('app.services.course_init_service.canvas_service')
+    def test_run_sync_writes_only_changed_topics_and_retries_on_edits(self, mock_canvas, mock_gcs, mock_rag, mock_kg,
+                                                                      mock_firestore, mock_cache):
+        """Test a sync writes only the topics it changed, against the graph version it read"""
+        mock_firestore.GraphVersionConflict = firestore_service.GraphVersionConflict
+        mock_firestore.get_course_data.return_value.to_dict.return_value = {
+            'status': 'ACTIVE', 'corpus_id': 'corpus_1', 'kg_version': 7,
+            'indexed_files': {'1': {'hash': 'a', 'url': 'u1', 'gcs_uri': 'gs://b/a.pdf', 'display_name': 'a.pdf'}}
+        }
+        mock_canvas.get_course_files.return_value = (
+            [{'id': '1', 'display_name': 'a.pdf'}], {'1': {'hash': 'A', 'url': 'u1'}}
+        )
+        mock_gcs.upload_course_files.side_effect = lambda files, course_id: [
+            f.update(gcs_uri=f"gs://b/{f['display_name']}") for f in files
+        ]
+        mock_rag.import_corpus_files.side_effect = lambda corpus_id, files, on_imported: [on_imported(f) for f in files]
+        old_edges = [{'from': 'topic_1', 'to': '1'}, {'from': 'topic_2', 'to': '1'}, {'from': 'topic_3', 'to': '1'}]
+        old_data = {'topic_1': {'summary': 'old'}, 'topic_2': {'summary': 's2'}, 'topic_3': {'summary': 's3'}}
+        mock_firestore.get_knowledge_graph.return_value = ([], old_edges, old_data)
+        nodes = [{'id': '1', 'group': 'file_pdf'}] + [{'id': f'topic_{i}', 'group': 'topic'} for i in (1, 2, 3)]
+        edges = old_edges[:2] + [{'from': 'topic_3', 'to': 'topic_1', 'type': 'related'}]
+        mock_kg.sync_graph_files.return_value = (
+            json.dumps(nodes), json.dumps(edges),
+            json.dumps({**old_data, 'topic_1': {'summary': 'new'}}), ['topic_1']
+        )
+        # A topic edit lands while the first attempt is summarizing
+        mock_firestore.put_graph_topics.side_effect = [firestore_service.GraphVersionConflict('edited'), None]
+
+        course_init_service.run_sync('123')
+
+        self.assertEqual(mock_kg.sync_graph_files.call_count, 2)
+        self.assertEqual(mock_firestore.put_graph_topics.call_count, 2)
+        args, kwargs = mock_firestore.put_graph_topics.call_args
+        self.assertEqual(args[1], [(nodes[1], [old_edges[0]], {'summary': 'new'})])
+        self.assertEqual(kwargs['topic_updates'], {'topic_3': {'edges': [edges[2]]}})
+        self.assertEqual(kwargs['expected_version'], 7)
+        self.assertEqual(kwargs['file_nodes'], [nodes[0]])
+        self.assertEqual(sorted(kwargs['indexed_files']), ['1'])
+        mock_firestore.update_knowledge_graph.assert_not_called()
+
+    @patch('app.services.course_init_service.firestore_service')
+    @patch('app.services.course_init_service.canvas_service')
+    def test_run_sync_without_changes_writes_nothing(self, mock_canvas, mock_firestore):
+        """Test a sync with no Canvas changes stops after the diff"""
+        mock_firestore.get_course_data.return_value.to_dict.return_value = {
+            'status': 'ACTIVE', 'corpus_id': 'corpus_1', 'indexed_files': {'1': {'hash': 'a', 'display_name': 'a.pdf'}}
+        }
+        mock_canvas.get_course_files.return_value = ([{'id': '1', 'display_name': 'a.pdf'}], {'1': {'hash': 'a'}})
+
+        result = course_init_service.run_sync('123')
+
+        self.assertEqual(result['unchanged'], 1)
+        mock_canvas.download_files.assert_not_called()
+        mock_firestore.update_knowledge_graph.assert_not_called()
+
+        mock_firestore.get_course_data.return_value.to_dict.return_value = {'status': 'GENERATING'}
+        with self.assertRaises(job_queue_service.PermanentJobError):
+            course_init_service.run_sync('123')
+
+if __name__ == '__main__':
+    unittest.main()
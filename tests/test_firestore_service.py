@@ -3,7 +3,7 @@ Unit tests for firestore_service.py
 Tests all Firestore operations with mocked Firebase client.
 """
 import unittest
-from unittest.mock import Mock, MagicMock
+from unittest.mock import Mock, MagicMock, patch
 import sys
 import os
 
@@ -31,6 +31,8 @@ class TestFirestoreService(unittest.TestCase):
         
         # Replace the service's db with our mock
         firestore_service.db = self.mock_db
+        firestore_service.invalidate_course_cache()
+        firestore_service._course_cache_stats.update(hits=0, misses=0)
         self.service = firestore_service
     
     
@@ -261,6 +263,397 @@ class TestFirestoreService(unittest.TestCase):
         state = self.service.get_course_state('course_lifecycle')
         self.assertEqual(state, 'ACTIVE')
 
+    
+    
+    # ==================== TEST course document cache ====================
+    
+    def test_get_course_data_is_cached(self):
+        """Test repeated reads of a course are served from the cache"""
+        mock_doc = Mock()
+        mock_doc.exists = True
+        mock_doc.get.return_value = 'ACTIVE'
+        mock_get = self.mock_db.collection.return_value.document.return_value.get
+        mock_get.return_value = mock_doc
+        
+        self.service.get_course_data('course_cached')
+        self.service.get_course_state('course_cached')
+        result = self.service.get_course_data('course_cached')
+        
+        self.assertEqual(result, mock_doc)
+        mock_get.assert_called_once()
+        self.assertEqual(self.service.get_course_cache_stats()['hits'], 2)
+    
+    def test_update_knowledge_graph_invalidates_cache(self):
+        """Test graph writes force the next read to hit Firestore"""
+        mock_get = self.mock_db.collection.return_value.document.return_value.get
+        mock_get.return_value = Mock(exists=True)
+        
+        self.service.get_course_data('course_edit')
+        with patch.object(firestore_service.firestore, 'transactional', side_effect=lambda fn: fn):
+            self.service.update_knowledge_graph('course_edit', '[]', '[]', '{}')
+        self.service.get_course_data('course_edit')
+        
+        cache_reads = [call for call in mock_get.call_args_list if 'transaction' not in call.kwargs]
+        self.assertEqual(len(cache_reads), 2)
+    
+    def test_get_course_data_fresh_reads_past_cache(self):
+        """Test a fresh read goes to Firestore and refreshes the cached copy"""
+        mock_get = self.mock_db.collection.return_value.document.return_value.get
+        stale, current = Mock(exists=True), Mock(exists=True)
+        mock_get.side_effect = [stale, current]
+        
+        self.service.get_course_data('course_fresh')
+        result = self.service.get_course_data('course_fresh', fresh=True)
+        
+        self.assertIs(result, current)
+        self.assertIs(self.service.get_course_data('course_fresh'), current)
+        self.assertEqual(mock_get.call_count, 2)
+    
+    def test_get_course_data_validate_rereads_changed_version(self):
+        """Test a validated read checks only the version fields and re-reads the course if they moved"""
+        mock_get = self.mock_db.collection.return_value.document.return_value.get
+        cached = Mock(exists=True)
+        cached.to_dict.return_value = {'kg_version': 3, 'kg_updated_at': 't3'}
+        same = Mock(exists=True)
+        same.to_dict.return_value = {'kg_version': 3, 'kg_updated_at': 't3'}
+        moved = Mock(exists=True)
+        moved.to_dict.return_value = {'kg_version': 4, 'kg_updated_at': 't4'}
+        current = Mock(exists=True)
+        mock_get.side_effect = [cached, same, moved, current]
+        
+        self.service.get_course_data('course_valid')
+        self.assertIs(self.service.get_course_data('course_valid', validate='kg'), cached)
+        mock_get.assert_called_with(field_paths=['kg_version', 'kg_updated_at'])
+        
+        self.assertIs(self.service.get_course_data('course_valid', validate='kg'), current)
+        self.assertIs(self.service.get_course_data('course_valid'), current)
+        self.assertEqual(mock_get.call_count, 4)
+    
+    def test_get_course_data_cache_expires(self):
+        """Test cached courses are re-read once the TTL has passed"""
+        mock_get = self.mock_db.collection.return_value.document.return_value.get
+        mock_get.return_value = Mock(exists=True)
+        
+        original_ttl = self.service.COURSE_CACHE_TTL_SECONDS
+        self.service.COURSE_CACHE_TTL_SECONDS = 0
+        try:
+            self.service.get_course_data('course_ttl')
+            self.service.get_course_data('course_ttl')
+        finally:
+            self.service.COURSE_CACHE_TTL_SECONDS = original_ttl
+        
+        self.assertEqual(mock_get.call_count, 2)
+    
+    
+    # ==================== TEST per-topic graph storage ====================
+    
+    def _topic_doc(self, record):
+        doc = Mock()
+        doc.to_dict.return_value = record
+        return doc
+    
+    def test_update_knowledge_graph_writes_topic_records(self):
+        """Test a full graph write stores one record per topic and drops the replaced generation"""
+        import json
+        course_ref = self.mock_db.collection.return_value.document.return_value
+        course_ref.get.return_value.to_dict.return_value = {'kg_storage': 'topics', 'kg_generation': 'old'}
+        topics_ref = course_ref.collection.return_value
+        stale_ref = Mock(id='topic_9')
+        topics_ref.list_documents.return_value = [stale_ref]
+        batch = self.mock_db.batch.return_value
+        transaction = self.mock_db.transaction.return_value
+        nodes = [{'id': '101', 'label': 'a.pdf', 'group': 'file_pdf'},
+                 {'id': 'topic_1', 'label': 'One', 'group': 'topic'},
+                 {'id': 'topic_2', 'label': 'Two', 'group': 'topic'}]
+        edges = [{'from': 'topic_1', 'to': '101'}, {'from': 'topic_2', 'to': '101'}]
+        data = {'topic_1': {'summary': 's1'}, 'topic_2': {'summary': 's2'}}
+        
+        with patch.object(firestore_service.firestore, 'transactional', side_effect=lambda fn: fn):
+            generation = self.service.update_knowledge_graph(
+                'course_kg', json.dumps(nodes), json.dumps(edges), json.dumps(data)
+            )
+        
+        records = [call.args[1] for call in batch.set.call_args_list]
+        self.assertEqual([r['node']['id'] for r in records], ['topic_1', 'topic_2'])
+        self.assertEqual(records[0]['edges'], [{'from': 'topic_1', 'to': '101'}])
+        self.assertEqual(records[1]['data'], {'summary': 's2'})
+        batch.delete.assert_called_once_with(stale_ref)
+        batch.update.assert_not_called()
+        course_update = transaction.update.call_args.args[1]
+        self.assertEqual(course_update['kg_storage'], 'topics')
+        self.assertEqual(course_update['kg_generation'], generation)
+        self.assertEqual(json.loads(course_update['kg_files']), nodes[:1])
+        self.assertEqual(batch.commit.call_count, 2)
+        collections = [call.args[0] for call in course_ref.collection.call_args_list]
+        self.assertEqual(collections, [f'kg_topics_{generation}', 'kg_topics_old'])
+    
+    def test_update_knowledge_graph_switches_generation_before_deleting(self):
+        """Test the old records are only deleted once the course points to the new generation"""
+        course_ref = self.mock_db.collection.return_value.document.return_value
+        course_ref.get.return_value.to_dict.return_value = {'kg_storage': 'topics'}
+        course_ref.collection.return_value.list_documents.return_value = [Mock(id='topic_1')]
+        batch = self.mock_db.batch.return_value
+        transaction = self.mock_db.transaction.return_value
+        steps = []
+        batch.commit.side_effect = lambda: steps.append('delete' if batch.delete.called else 'set')
+        transaction.update.side_effect = lambda *args: steps.append('switch')
+        
+        with patch.object(firestore_service.firestore, 'transactional', side_effect=lambda fn: fn):
+            self.service.update_knowledge_graph('course_kg', '[{"id": "topic_1", "group": "topic"}]', '[]', '{}')
+        
+        self.assertEqual(steps, ['set', 'switch', 'delete'])
+        self.assertEqual(course_ref.collection.call_args_list[-1].args, ('kg_topics',))
+    
+    def test_readers_use_the_course_generation(self):
+        """Test topic records are read from the generation the course document names"""
+        course_ref = self.mock_db.collection.return_value.document.return_value
+        course_ref.collection.return_value.stream.return_value = []
+        course_doc = Mock(exists=True)
+        course_doc.to_dict.return_value = {'kg_storage': 'topics', 'kg_version': 7, 'kg_generation': 'abc123', 'kg_files': '[]'}
+        
+        self.service.get_knowledge_graph('course_gen', course_doc)
+        
+        course_ref.collection.assert_called_once_with('kg_topics_abc123')
+    
+    def test_get_knowledge_graph_reuses_records_until_version_changes(self):
+        """Test topic records are read once per graph version and assembled in order"""
+        topics_ref = self.mock_db.collection.return_value.document.return_value.collection.return_value
+        topics_ref.stream.return_value = [
+            self._topic_doc({'position': 2, 'node': {'id': 'topic_2', 'group': 'topic'}, 'edges': [], 'data': {'summary': 's2'}}),
+            self._topic_doc({'position': 1, 'node': {'id': 'topic_1', 'group': 'topic'},
+                             'edges': [{'from': 'topic_1', 'to': '101'}], 'data': {'summary': 's1'}}),
+        ]
+        course_doc = Mock(exists=True)
+        course_doc.to_dict.return_value = {
+            'kg_storage': 'topics', 'kg_version': 1, 'kg_files': '[{"id": "101", "group": "file_pdf"}]'
+        }
+        
+        nodes, edges, data = self.service.get_knowledge_graph('course_kg', course_doc)
+        self.service.get_knowledge_graph('course_kg', course_doc)
+        
+        self.assertEqual([n['id'] for n in nodes], ['101', 'topic_1', 'topic_2'])
+        self.assertEqual(edges, [{'from': 'topic_1', 'to': '101'}])
+        self.assertEqual(list(data), ['topic_1', 'topic_2'])
+        self.assertEqual(topics_ref.stream.call_count, 1)
+        
+        course_doc.to_dict.return_value = dict(course_doc.to_dict.return_value, kg_version=2)
+        self.service.get_knowledge_graph('course_kg', course_doc)
+        self.assertEqual(topics_ref.stream.call_count, 2)
+    
+    def test_get_knowledge_graph_reads_single_document_layout(self):
+        """Test courses stored before per-topic records are still readable"""
+        course_doc = Mock(exists=True)
+        course_doc.to_dict.return_value = {'kg_nodes': '[{"id": "topic_1"}]', 'kg_edges': '[]', 'kg_data': '{}'}
+        
+        self.assertEqual(self.service.get_knowledge_graph('course_old', course_doc), ([{'id': 'topic_1'}], [], {}))
+    
+    def test_get_knowledge_graph_json_splices_and_caches(self):
+        """Test stored JSON strings are passed through and per-topic graphs are serialized once per version"""
+        import json
+        legacy_doc = Mock(exists=True)
+        legacy_doc.to_dict.return_value = {'kg_nodes': '[{"id": "topic_1"}]', 'kg_edges': '[]', 'kg_data': '{"topic_1": {}}'}
+        self.assertEqual(self.service.get_knowledge_graph_json('course_old', legacy_doc),
+                         b'{"nodes":[{"id": "topic_1"}],"edges":[],"data":{"topic_1": {}}}')
+        
+        topics_ref = self.mock_db.collection.return_value.document.return_value.collection.return_value
+        topics_ref.stream.return_value = [
+            self._topic_doc({'position': 1, 'node': {'id': 'topic_1', 'group': 'topic'}, 'edges': [],
+                             'data': {'summary': 's1'}, 'embedding': [0.5]}),
+        ]
+        course_doc = Mock(exists=True)
+        course_doc.to_dict.return_value = {'kg_storage': 'topics', 'kg_version': 3, 'kg_files': '[]'}
+        
+        with patch.object(self.service, '_serialize_graph', wraps=self.service._serialize_graph) as serialize:
+            body = self.service.get_knowledge_graph_json('course_json', course_doc)
+            self.assertIs(self.service.get_knowledge_graph_json('course_json', course_doc), body)
+            self.assertEqual(serialize.call_count, 1)
+            course_doc.to_dict.return_value = dict(course_doc.to_dict.return_value, kg_version=4)
+            self.service.get_knowledge_graph_json('course_json', course_doc)
+            self.assertEqual(serialize.call_count, 2)
+            # A re-initialized course restarts kg_version; the new kg_updated_at still misses the cache
+            course_doc.to_dict.return_value = dict(course_doc.to_dict.return_value, kg_version=3, kg_updated_at='reinit')
+            self.service.get_knowledge_graph_json('course_json', course_doc)
+            self.assertEqual(serialize.call_count, 3)
+            self.assertEqual(topics_ref.stream.call_count, 3)
+        self.assertEqual(json.loads(body), {'nodes': [{'id': 'topic_1', 'group': 'topic'}], 'edges': [],
+                                            'data': {'topic_1': {'summary': 's1'}}})
+    
+    def test_put_graph_topic_writes_only_that_topic(self):
+        """Test adding a topic writes its record and bumps the version, nothing else"""
+        course_ref = self.mock_db.collection.return_value.document.return_value
+        course_ref.get.return_value.to_dict.return_value = {'kg_storage': 'topics'}
+        batch = self.mock_db.batch.return_value
+        node = {'id': 'topic_12', 'label': 'New', 'group': 'topic'}
+        
+        self.service.put_graph_topic('course_kg', node, [{'from': 'topic_12', 'to': '101'}], {'summary': 's'})
+        
+        batch.set.assert_called_once()
+        self.assertEqual(batch.set.call_args.args[1]['position'], 12)
+        self.assertEqual(list(batch.update.call_args.args[1]), ['kg_version', 'kg_updated_at'])
+        course_ref.collection.return_value.list_documents.assert_not_called()
+    
+    def test_invalidate_semantic_cache_bumps_the_course_marker(self):
+        """Test the semantic cache marker is versioned like the graph, so workers can validate it"""
+        course_ref = self.mock_db.collection.return_value.document.return_value
+        
+        self.service.invalidate_semantic_cache('course_1')
+        
+        fields = course_ref.update.call_args.args[0]
+        self.assertEqual(set(fields), set(self.service._version_field_paths('semantic_cache')))
+    
+    def test_rate_analytics_event_only_creates_when_asked(self):
+        """Test ratings update existing events, and only an issued ID may create one"""
+        from google.api_core import exceptions as google_exceptions
+        doc_ref = self.mock_db.collection.return_value.document.return_value
+        doc_ref.update.side_effect = google_exceptions.NotFound('No document to update')
+        
+        self.assertFalse(self.service.rate_analytics_event('forged', 'helpful'))
+        doc_ref.set.assert_not_called()
+        
+        self.assertTrue(self.service.rate_analytics_event('queued', 'helpful', create=True))
+        doc_ref.set.assert_called_once_with({'rating': 'helpful'}, merge=True)
+    
+    def test_put_graph_topics_commits_one_batch(self):
+        """Test several topics are written with a single batch commit and one version bump"""
+        course_ref = self.mock_db.collection.return_value.document.return_value
+        course_ref.get.return_value.to_dict.return_value = {'kg_storage': 'topics'}
+        batch = self.mock_db.batch.return_value
+        topics = [({'id': f'topic_{i}', 'group': 'topic'}, [], {'summary': 's'}) for i in (4, 5, 6)]
+        
+        self.service.put_graph_topics('course_bulk', topics)
+        
+        self.assertEqual(batch.set.call_count, 3)
+        batch.update.assert_called_once()
+        batch.commit.assert_called_once()
+        with self.assertRaises(ValueError):
+            self.service.put_graph_topics('course_bulk', topics * self.service.MAX_BATCH_WRITES)
+        
+        # A sync's indexed_files go into the same versioned course update
+        batch.reset_mock()
+        self.service.put_graph_topics('course_bulk', topics, indexed_files={'1': {'hash': 'a'}})
+        course_update = batch.update.call_args.args[1]
+        self.assertEqual(course_update['indexed_files'], {'1': {'hash': 'a'}})
+        self.assertIn('kg_version', course_update)
+        self.assertIn('synced_at', course_update)
+    
+    def test_put_graph_topics_rejects_stale_version(self):
+        """Test a conditional write is skipped when another edit bumped kg_version first"""
+        course_ref = self.mock_db.collection.return_value.document.return_value
+        course_ref.get.return_value.to_dict.return_value = {'kg_storage': 'topics', 'kg_version': 5}
+        transaction = self.mock_db.transaction.return_value
+        topics = [({'id': 'topic_4', 'group': 'topic'}, [], {'summary': 's'})]
+        
+        with patch.object(firestore_service.firestore, 'transactional', side_effect=lambda fn: fn):
+            with self.assertRaises(self.service.GraphVersionConflict):
+                self.service.put_graph_topics('course_race', topics, expected_version=4)
+            transaction.set.assert_not_called()
+            
+            self.service.put_graph_topics('course_race', topics, expected_version=5)
+        
+        transaction.set.assert_called_once()
+        transaction.update.assert_called_once()
+        self.mock_db.batch.return_value.commit.assert_not_called()
+    
+    def test_allocate_topic_ids_advances_course_counter(self):
+        """Test topic IDs are reserved from the course counter, starting after stored topics when it's missing"""
+        course_ref = self.mock_db.collection.return_value.document.return_value
+        transaction = self.mock_db.transaction.return_value
+        course_ref.get.return_value.to_dict.return_value = {'kg_storage': 'topics'}
+        course_ref.collection.return_value.list_documents.return_value = [Mock(id='topic_2'), Mock(id='topic_9')]
+        
+        with patch.object(firestore_service.firestore, 'transactional', side_effect=lambda fn: fn):
+            self.assertEqual(self.service.allocate_topic_ids('course_ids', 2), ['topic_10', 'topic_11'])
+            transaction.update.assert_called_with(course_ref, {'kg_next_topic': 12})
+            
+            course_ref.get.return_value.to_dict.return_value = {'kg_storage': 'topics', 'kg_next_topic': 12}
+            self.assertEqual(self.service.allocate_topic_ids('course_ids', 1), ['topic_12'])
+            transaction.update.assert_called_with(course_ref, {'kg_next_topic': 13})
+    
+    def test_create_job_with_dedupe_key_respects_active_holder(self):
+        """Test a keyed job is only created once the job holding the key is no longer active"""
+        doc_ref = self.mock_db.collection.return_value.document.return_value
+        transaction = self.mock_db.transaction.return_value
+        holder = Mock(exists=True)
+        holder.get.return_value = 'job_old'
+        holder.to_dict.return_value = {'id': 'job_old', 'status': 'running'}
+        doc_ref.get.return_value = holder
+        is_active = lambda job: job['status'] in ('queued', 'running')
+        
+        with patch.object(firestore_service.firestore, 'transactional', side_effect=lambda fn: fn):
+            active = self.service.create_job({'id': 'job_new'}, dedupe_key='course_1', is_active=is_active)
+            self.assertEqual(active['id'], 'job_old')
+            transaction.set.assert_not_called()
+            
+            holder.to_dict.return_value = {'id': 'job_old', 'status': 'succeeded'}
+            self.assertIsNone(self.service.create_job({'id': 'job_new'}, dedupe_key='course_1', is_active=is_active))
+        
+        transaction.set.assert_any_call(doc_ref, {'id': 'job_new'})
+        transaction.set.assert_any_call(doc_ref, {'job_id': 'job_new'})
+    
+    def test_topic_embeddings_are_stored_beside_data(self):
+        """Test embeddings are kept out of the topic data unless asked for, and related topics update in the same batch"""
+        course_ref = self.mock_db.collection.return_value.document.return_value
+        course_ref.get.return_value.to_dict.return_value = {'kg_storage': 'topics'}
+        batch = self.mock_db.batch.return_value
+        node = {'id': 'topic_3', 'label': 'New', 'group': 'topic'}
+        
+        self.service.put_graph_topic('course_kg', node, [], {'summary': 's', 'embedding': [0.1, 0.2]},
+                                     topic_updates={'topic_1': {'edges': []}})
+        
+        record = batch.set.call_args.args[1]
+        self.assertEqual(record['data'], {'summary': 's'})
+        self.assertEqual(record['embedding'], [0.1, 0.2])
+        batch.update.assert_any_call(course_ref.collection.return_value.document.return_value, {'edges': []})
+        batch.commit.assert_called_once()
+        
+        course_ref.collection.return_value.stream.return_value = [self._topic_doc(record)]
+        course_doc = Mock(exists=True)
+        course_doc.to_dict.return_value = {'kg_storage': 'topics', 'kg_version': 7, 'kg_files': '[]'}
+        _, _, data = self.service.get_knowledge_graph('course_emb', course_doc)
+        self.assertEqual(data, {'topic_3': {'summary': 's'}})
+        _, _, data = self.service.get_knowledge_graph('course_emb', course_doc, include_embeddings=True)
+        self.assertEqual(data['topic_3']['embedding'], [0.1, 0.2])
+    
+    def test_get_graph_topic_reads_one_record(self):
+        """Test reading one topic loads only its record and the files it links to"""
+        topic_ref = self.mock_db.collection.return_value.document.return_value.collection.return_value.document.return_value
+        topic_ref.get.return_value = self._topic_doc({
+            'position': 2, 'node': {'id': 'topic_2', 'group': 'topic'},
+            'edges': [{'from': 'topic_2', 'to': '102'}], 'data': {'summary': 's2'}
+        })
+        topic_ref.get.return_value.exists = True
+        course_doc = Mock(exists=True)
+        course_doc.to_dict.return_value = {
+            'kg_storage': 'topics', 'kg_version': 3,
+            'kg_files': '[{"id": "101", "group": "file_pdf"}, {"id": "102", "group": "file_pdf"}]'
+        }
+        
+        nodes, edges, data = self.service.get_graph_topic('course_one', 'topic_2', course_doc)
+        
+        self.assertEqual([n['id'] for n in nodes], ['topic_2', '102'])
+        self.assertEqual(data, {'topic_2': {'summary': 's2'}})
+        self.mock_db.collection.return_value.document.return_value.collection.return_value.stream.assert_not_called()
+    
+    def test_delete_graph_topic_converts_single_document_layout(self):
+        """Test the first edit of an older course converts it before deleting the topic"""
+        course_ref = self.mock_db.collection.return_value.document.return_value
+        course_ref.get.return_value.to_dict.return_value = {
+            'kg_nodes': '[{"id": "topic_1", "group": "topic"}, {"id": "topic_2", "group": "topic"}]',
+            'kg_edges': '[]', 'kg_data': '{}'
+        }
+        course_ref.collection.return_value.list_documents.return_value = []
+        batch = self.mock_db.batch.return_value
+        
+        with patch.object(firestore_service.firestore, 'transactional', side_effect=lambda fn: fn):
+            self.service.delete_graph_topic('course_old', 'topic_1')
+        
+        self.assertEqual(batch.set.call_count, 2)
+        generation = self.mock_db.transaction.return_value.update.call_args.args[1]['kg_generation']
+        course_ref.collection.assert_called_with(f'kg_topics_{generation}')
+        course_ref.collection.return_value.document.assert_any_call('topic_1')
+        batch.delete.assert_called_once()
+        self.assertEqual(batch.commit.call_count, 2)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -11,6 +11,9 @@ from app.services import gemini_service
 class TestGeminiService(unittest.TestCase):
     """Test suite for Gemini service functions"""
 
+    def setUp(self):
+        gemini_service.clear_model_clients()
+
     @patch('app.services.gemini_service.GenerativeModel')
     def test_generate_answer(self, mock_model):
         """Test generate_answer function"""
@@ -39,6 +42,52 @@ class TestGeminiService(unittest.TestCase):
         self.assertEqual(sources, ["source1.pdf"])
         mock_retrieve_context.assert_called_with("corpus_id", "What is a test?", 10, 0.4)
 
+    @patch('app.services.gemini_service.retrieve_context')
+    @patch('app.services.gemini_service.GenerativeModel')
+    def test_generate_answer_with_context_stream(self, mock_model, mock_retrieve_context):
+        """Test generate_answer_with_context_stream yields text chunks lazily"""
+        mock_retrieve_context.return_value = (["This is context."], [{'filename': 'source1.pdf'}])
+
+        chunk1, chunk2, final_chunk = MagicMock(), MagicMock(), MagicMock()
+        chunk1.text = "Hello "
+        chunk2.text = "world"
+        type(final_chunk).text = property(lambda self: (_ for _ in ()).throw(ValueError("no text")))
+        mock_instance = MagicMock()
+        mock_instance.generate_content.return_value = iter([chunk1, chunk2, final_chunk])
+        mock_model.return_value = mock_instance
+
+        chunks, sources = gemini_service.generate_answer_with_context_stream("What is a test?", "corpus_id")
+
+        self.assertEqual(sources, [{'filename': 'source1.pdf'}])
+        mock_instance.generate_content.assert_not_called()
+        self.assertEqual(list(chunks), ["Hello ", "world"])
+        self.assertTrue(mock_instance.generate_content.call_args.kwargs['stream'])
+
+    @patch('app.services.gemini_service.retrieve_context')
+    @patch('app.services.gemini_service.GenerativeModel')
+    def test_generate_answer_with_precomputed_context(self, mock_model, mock_retrieve_context):
+        """Test a pre-retrieved context skips the retrieval call"""
+        mock_model.return_value.generate_content.return_value.text = "Answer"
+
+        answer, sources = gemini_service.generate_answer_with_context(
+            "What is a test?", "corpus_id", context=(["Context."], ["source1.pdf"])
+        )
+
+        self.assertEqual(answer, "Answer")
+        self.assertEqual(sources, ["source1.pdf"])
+        mock_retrieve_context.assert_not_called()
+        self.assertIn("Context.", mock_model.return_value.generate_content.call_args.args[0])
+
+    @patch('app.services.gemini_service.retrieve_context')
+    def test_generate_answer_with_context_stream_no_context(self, mock_retrieve_context):
+        """Test the stream falls back to a canned answer without context"""
+        mock_retrieve_context.return_value = ([], [])
+
+        chunks, sources = gemini_service.generate_answer_with_context_stream("What is a test?", "corpus_id")
+
+        self.assertEqual(list(chunks), [gemini_service.NO_CONTEXT_ANSWER])
+        self.assertEqual(sources, [])
+
     @patch('builtins.open')
     @patch('app.services.gemini_service.mimetypes.guess_type')
     @patch('app.services.gemini_service.GenerativeModel')
@@ -68,5 +117,43 @@ class TestGeminiService(unittest.TestCase):
         self.assertEqual(questions[0], "Question 1?")
         self.assertEqual(questions[1], "Question 2?")
 
+    @patch('app.services.gemini_service.GenerativeModel')
+    def test_generative_model_is_reused(self, mock_model):
+        """Test generate calls share one client per model name"""
+        mock_model.return_value.generate_content.return_value.text = "Answer"
+
+        gemini_service.generate_answer("First question")
+        gemini_service.generate_answer("Second question")
+        gemini_service.generate_answer("Other model", model_name="gemini-other")
+
+        self.assertEqual(mock_model.call_count, 2)
+        mock_model.assert_any_call(gemini_service.DEFAULT_MODEL)
+        mock_model.assert_any_call("gemini-other")
+
+    @patch('app.services.gemini_service.TextEmbeddingModel')
+    def test_get_embedding_reuses_client(self, mock_embedding_model):
+        """Test get_embedding loads the embedding model only once"""
+        embedding = MagicMock()
+        embedding.values = [0.1, 0.2]
+        mock_embedding_model.from_pretrained.return_value.get_embeddings.return_value = [embedding]
+
+        self.assertEqual(gemini_service.get_embedding("one"), [0.1, 0.2])
+        self.assertEqual(gemini_service.get_embedding("two"), [0.1, 0.2])
+
+        mock_embedding_model.from_pretrained.assert_called_once_with(gemini_service.DEFAULT_EMBEDDING_MODEL)
+
+    @patch('app.services.gemini_service.EMBEDDING_BATCH_SIZE', 2)
+    @patch('app.services.gemini_service.TextEmbeddingModel')
+    def test_get_embeddings_batches_requests(self, mock_embedding_model):
+        """Test get_embeddings sends texts in batches and keeps their order"""
+        get_embeddings = mock_embedding_model.from_pretrained.return_value.get_embeddings
+        get_embeddings.side_effect = lambda inputs: [MagicMock(values=[float(len(i.text))]) for i in inputs]
+
+        vectors = gemini_service.get_embeddings(["a", "bb", "ccc"])
+
+        self.assertEqual(vectors, [[1.0], [2.0], [3.0]])
+        self.assertEqual(get_embeddings.call_count, 2)
+        self.assertEqual(gemini_service.get_embeddings([]), [])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,143 @@
+import unittest
+from unittest.mock import patch, Mock
+import sys
+import os
+import tempfile
+import time
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import job_queue_service
+
+class TestJobQueueService(unittest.TestCase):
+    """Test suite for the durable job queue (SQLite backend)"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        store = job_queue_service._SqliteJobStore(os.path.join(self.tmpdir.name, 'jobs.sqlite3'))
+        self.store_patch = patch.object(job_queue_service, '_store', store)
+        self.store_patch.start()
+        self.handler = Mock(return_value={'ok': True})
+        self.on_failure = Mock()
+        job_queue_service.register_handler('test_job', self.handler, on_failure=self.on_failure)
+
+    def tearDown(self):
+        self.store_patch.stop()
+        job_queue_service._handlers.pop('test_job', None)
+        self.tmpdir.cleanup()
+
+    def test_job_runs_once_and_reports_status(self):
+        """Test a queued job is claimed by one worker, run, and reported as succeeded"""
+        job_id = job_queue_service.enqueue_job('test_job', {'course_id': '123'})
+        self.assertEqual(job_queue_service.get_job_status(job_id)['status'], 'queued')
+
+        job = job_queue_service.claim_job('worker-a')
+        self.assertEqual(job['id'], job_id)
+        self.assertIsNone(job_queue_service.claim_job('worker-b'))
+
+        job_queue_service.run_job(job, 'worker-a')
+
+        self.handler.assert_called_once()
+        self.assertEqual(self.handler.call_args.args[0], {'course_id': '123'})
+        status = job_queue_service.get_job_status(job_id)
+        self.assertEqual(status['status'], 'succeeded')
+        self.assertEqual(status['progress'], 1.0)
+        self.assertEqual(status['result'], {'ok': True})
+        self.assertIsNone(job_queue_service.claim_job('worker-b'))
+
+    def test_progress_reports_stage_and_eta(self):
+        """Test handler progress is stored and turned into an ETA"""
+        job_id = job_queue_service.enqueue_job('test_job', {})
+        job = job_queue_service.claim_job('worker-a')
+        context = job_queue_service.JobContext(job, 'worker-a')
+
+        with patch.object(job_queue_service.time, 'time', return_value=job['started_at'] + 30):
+            context.report('summarize', 0.25, 'Summarizing a.pdf...')
+            status = job_queue_service.get_job_status(job_id)
+
+        self.assertEqual(status['stage'], 'summarize')
+        self.assertEqual(status['message'], 'Summarizing a.pdf...')
+        self.assertEqual(status['eta_seconds'], 90.0)
+
+    def test_failed_attempts_retry_then_fail(self):
+        """Test a failing job is requeued with backoff and fails for good on its last attempt"""
+        self.handler.side_effect = RuntimeError('boom')
+        job_id = job_queue_service.enqueue_job('test_job', {'course_id': '123'}, max_attempts=2)
+
+        job_queue_service.run_job(job_queue_service.claim_job('worker-a'), 'worker-a')
+        status = job_queue_service.get_job_status(job_id)
+        self.assertEqual(status['status'], 'queued')
+        self.assertEqual(status['error'], 'boom')
+        self.assertIsNone(job_queue_service.claim_job('worker-a'))  # waiting out the backoff
+
+        with patch.object(job_queue_service.time, 'time', return_value=time.time() + job_queue_service.JOB_RETRY_BASE_SECONDS + 1):
+            job = job_queue_service.claim_job('worker-b')
+        self.assertEqual(job['attempts'], 2)
+        job_queue_service.run_job(job, 'worker-b')
+
+        self.assertEqual(job_queue_service.get_job_status(job_id)['status'], 'failed')
+        self.on_failure.assert_called_once_with({'course_id': '123'}, 'boom')
+
+    def test_permanent_errors_are_not_retried(self):
+        """Test PermanentJobError fails the job on its first attempt"""
+        self.handler.side_effect = job_queue_service.PermanentJobError('No course files found')
+        job_id = job_queue_service.enqueue_job('test_job', {})
+
+        job_queue_service.run_job(job_queue_service.claim_job('worker-a'), 'worker-a')
+
+        self.assertEqual(job_queue_service.get_job_status(job_id)['status'], 'failed')
+        self.on_failure.assert_called_once()
+
+    def test_expired_lease_is_reclaimed(self):
+        """Test a job whose worker stopped renewing its lease moves to another worker"""
+        job_id = job_queue_service.enqueue_job('test_job', {}, max_attempts=2)
+        stale = job_queue_service.claim_job('worker-a')
+
+        later = time.time() + job_queue_service.JOB_LEASE_SECONDS + 1
+        with patch.object(job_queue_service.time, 'time', return_value=later):
+            job = job_queue_service.claim_job('worker-b')
+        self.assertEqual(job['id'], job_id)
+
+        # The first worker finds out it lost the job when it next reports
+        with self.assertRaises(job_queue_service.LeaseLostError):
+            job_queue_service.JobContext(stale, 'worker-a').report('upload', 0.2)
+
+        # Out of attempts: the next expiry fails the job instead of reclaiming it
+        with patch.object(job_queue_service.time, 'time', return_value=later + job_queue_service.JOB_LEASE_SECONDS + 1):
+            self.assertIsNone(job_queue_service.claim_job('worker-c'))
+        self.assertEqual(job_queue_service.get_job_status(job_id)['status'], 'failed')
+        self.on_failure.assert_called_once()
+
+    def test_dedupe_key_allows_one_active_job(self):
+        """Test jobs sharing a dedupe key are coalesced or rejected until the active one finishes"""
+        job_queue_service.register_handler('other_job', Mock())
+        self.addCleanup(job_queue_service._handlers.pop, 'other_job', None)
+        job_id = job_queue_service.enqueue_job('test_job', {}, dedupe_key='course_123')
+
+        self.assertEqual(job_queue_service.enqueue_job('test_job', {}, dedupe_key='course_123'), job_id)
+        with self.assertRaises(job_queue_service.JobConflictError) as raised:
+            job_queue_service.enqueue_job('other_job', {}, dedupe_key='course_123')
+        self.assertEqual(raised.exception.job['id'], job_id)
+        self.assertEqual(job_queue_service.find_active_job('test_job', 'course_123'), job_id)
+        self.assertIsNone(job_queue_service.find_active_job('test_job', 'course_456'))
+
+        job_queue_service.run_job(job_queue_service.claim_job('worker-a'), 'worker-a')
+        self.assertIsNone(job_queue_service.claim_job('worker-a'))
+
+        self.assertIsNone(job_queue_service.find_active_job('other_job', 'course_123'))
+        self.assertNotEqual(job_queue_service.enqueue_job('other_job', {}, dedupe_key='course_123'), job_id)
+
+    def test_lost_lease_stops_the_next_report(self):
+        """Test a handler stops at its next report once the heartbeat lost the lease"""
+        job_queue_service.enqueue_job('test_job', {})
+        context = job_queue_service.JobContext(job_queue_service.claim_job('worker-a'), 'worker-a')
+        context.report('ingest', 0.1)
+
+        context.lease_lost = True
+        # Even a throttled report of the same stage raises
+        with self.assertRaises(job_queue_service.LeaseLostError):
+            context.report('ingest', 0.2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,8 @@ from unittest.mock import patch, MagicMock
 import sys
 import os
 import json
+import threading
+import time
 
 # Add parent directory to path to import app modules
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -20,6 +22,21 @@ class TestKgService(unittest.TestCase):
         self.sample_topics = ['Cell Mitosis', 'DNA Replication']
         self.corpus_id = 'corpus_id_123'
 
+        # Topic summaries embed as orthogonal (unrelated) vectors unless a test says otherwise
+        self.embedded_count = 0
+        patcher = patch('app.services.kg_service.gemini_service.get_embeddings', side_effect=self._one_hot_embeddings)
+        self.mock_get_embeddings = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _one_hot_embeddings(self, texts):
+        vectors = []
+        for _ in texts:
+            vector = [0.0] * 32
+            vector[self.embedded_count % 32] = 1.0
+            self.embedded_count += 1
+            vectors.append(vector)
+        return vectors
+
     @patch('app.services.kg_service.gemini_service.generate_answer_with_context')
     def test_build_knowledge_graph(self, mock_generate_answer):
         """Test the main build_knowledge_graph function"""
@@ -40,6 +57,209 @@ class TestKgService(unittest.TestCase):
         self.assertIn('topic_2', data)
         self.assertEqual(data['topic_1']['summary'], "This is a summary")
 
+    @patch('app.services.kg_service.gemini_service.generate_answer_with_context')
+    def test_build_knowledge_graph_reuses_known_summaries(self, mock_generate_answer):
+        """Test topics summarized by an interrupted build are reused and new summaries are reported"""
+        mock_generate_answer.return_value = ("New summary", [{'filename': 'Lecture 5.pdf'}])
+        reported = []
+
+        _, _, data_json = kg_service.build_knowledge_graph(
+            self.sample_topics, self.corpus_id, self.sample_files,
+            known_summaries={'Cell Mitosis': ['Stored summary', [{'filename': 'Chapter 3.pdf'}]]},
+            on_summary=lambda topic, result: reported.append((topic, result))
+        )
+
+        data = json.loads(data_json)
+        self.assertEqual(mock_generate_answer.call_count, 1)
+        self.assertIn('DNA Replication', mock_generate_answer.call_args.kwargs['query'])
+        self.assertEqual(data['topic_1']['summary'], 'Stored summary')
+        self.assertEqual(data['topic_2']['summary'], 'New summary')
+        self.assertEqual(reported, [('DNA Replication', ("New summary", [{'filename': 'Lecture 5.pdf'}]))])
+
+    @patch('app.services.kg_service._summary_limiter', kg_service.concurrency.RateLimiter(0))
+    @patch('app.services.kg_service.gemini_service.generate_answer_with_context')
+    def test_build_knowledge_graph_summarizes_in_parallel(self, mock_generate_answer):
+        """Test topics are summarized concurrently but nodes and edges keep topic order"""
+        delays = {'Cell Mitosis': 0.3, 'DNA Replication': 0.05, 'Protein Synthesis': 0.15}
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def generate(query, corpus_id):
+            topic = next(t for t in delays if t in query)
+            with lock:
+                active.append(topic)
+                peak.append(len(active))
+            time.sleep(delays[topic])
+            with lock:
+                active.remove(topic)
+            filename = 'Chapter 3.pdf' if topic == 'Cell Mitosis' else 'Lecture 5.pdf'
+            return (f"Summary of {topic}", [{'filename': filename}])
+
+        mock_generate_answer.side_effect = generate
+
+        started = time.perf_counter()
+        nodes_json, edges_json, data_json = kg_service.build_knowledge_graph(
+            list(delays), self.corpus_id, self.sample_files
+        )
+        elapsed = time.perf_counter() - started
+
+        nodes = json.loads(nodes_json)
+        edges = json.loads(edges_json)
+        data = json.loads(data_json)
+
+        self.assertGreater(max(peak), 1)
+        self.assertLess(elapsed, sum(delays.values()))
+        self.assertEqual([n['label'] for n in nodes if n['group'] == 'topic'], list(delays))
+        self.assertEqual(edges, [
+            {'from': 'topic_1', 'to': '101'},
+            {'from': 'topic_2', 'to': '102'},
+            {'from': 'topic_3', 'to': '102'},
+        ])
+        self.assertEqual(data['topic_3']['summary'], "Summary of Protein Synthesis")
+
+    @patch('app.services.kg_service._summary_limiter', kg_service.concurrency.RateLimiter(0))
+    @patch('app.services.kg_service.time.sleep')
+    @patch('app.services.kg_service.gemini_service.generate_answer_with_context')
+    def test_build_knowledge_graph_retries_each_topic(self, mock_generate_answer, mock_sleep):
+        """Test a transient failure is retried and a persistent one only affects its topic"""
+        calls = {'Cell Mitosis': 0, 'DNA Replication': 0}
+        lock = threading.Lock()
+
+        def generate(query, corpus_id):
+            topic = next(t for t in calls if t in query)
+            with lock:
+                calls[topic] += 1
+                attempt = calls[topic]
+            if topic == 'DNA Replication' or attempt == 1:
+                raise RuntimeError("429 Resource exhausted")
+            return ("Recovered summary", [{'filename': 'Chapter 3.pdf'}])
+
+        mock_generate_answer.side_effect = generate
+
+        nodes_json, edges_json, data_json = kg_service.build_knowledge_graph(
+            self.sample_topics, self.corpus_id, self.sample_files
+        )
+
+        data = json.loads(data_json)
+        self.assertEqual(calls['Cell Mitosis'], 2)
+        self.assertEqual(calls['DNA Replication'], kg_service.SUMMARY_MAX_ATTEMPTS)
+        self.assertEqual(data['topic_1']['summary'], "Recovered summary")
+        self.assertEqual(data['topic_2']['summary'], "Error retrieving information for DNA Replication.")
+        self.assertEqual(json.loads(edges_json), [{'from': 'topic_1', 'to': '101'}])
+        self.assertEqual(len(json.loads(nodes_json)), 4)
+
+    @patch('app.services.kg_service.gemini_service.generate_answer_with_context')
+    def test_build_knowledge_graph_resolves_sources_by_index(self, mock_generate_answer):
+        """Test sources link by exact URI or name, not by substring of another file name"""
+        files = [
+            {'id': '201', 'display_name': 'Notes.pdf', 'gcs_uri': 'gs://bucket/courses/1/Notes.pdf'},
+            {'id': '202', 'display_name': 'Week 2 Notes.pdf', 'gcs_uri': 'gs://bucket/courses/1/Week 2 Notes.pdf'},
+        ]
+        mock_generate_answer.return_value = ("Summary", [
+            {'filename': 'Week 2 Notes.pdf', 'source_uri': 'gs://bucket/courses/1/Week 2 Notes.pdf'},
+            {'filename': 'week 2 notes.pdf'},
+            {'filename': 'Unrelated.pdf', 'source_uri': 'gs://bucket/other/Unrelated.pdf'},
+        ])
+
+        _, edges_json, _ = kg_service.build_knowledge_graph(['Topic'], self.corpus_id, files)
+
+        self.assertEqual(json.loads(edges_json), [{'from': 'topic_1', 'to': '202'}])
+
+    def test_build_source_index(self):
+        """Test the index covers GCS URIs, file names and Canvas file IDs"""
+        index = kg_service.build_source_index(
+            indexed_files={'301': {'gcs_uri': 'gs://bucket/courses/1/Lab 1.pdf', 'display_name': 'Lab 1.pdf'}},
+            nodes=[{'id': '302', 'label': 'Syllabus.pdf', 'group': 'file_pdf'},
+                   {'id': 'topic_1', 'label': 'Topic', 'group': 'topic'}]
+        )
+
+        self.assertEqual(kg_service.resolve_source({'source_uri': 'gs://bucket/courses/1/Lab 1.pdf'}, index), '301')
+        self.assertEqual(kg_service.resolve_source('Syllabus.pdf', index), '302')
+        self.assertEqual(kg_service.resolve_source({'file_id': 301}, index), '301')
+        self.assertIsNone(kg_service.resolve_source('Topic', index))
+
+    @patch('app.services.kg_service._summary_limiter', kg_service.concurrency.RateLimiter(0))
+    @patch('app.services.kg_service.gemini_service.generate_answer')
+    @patch('app.services.kg_service.gemini_service.retrieve_answer_context')
+    def test_batched_summaries_share_one_generation(self, mock_retrieve, mock_generate):
+        """Test batched mode sends shared chunks once and makes a single generation call"""
+        mock_retrieve.side_effect = lambda query, corpus_id: (
+            ["Shared chunk.", f"Chunk for {'mitosis' if 'Mitosis' in query else 'dna'}."],
+            [{'filename': 'Chapter 3.pdf' if 'Mitosis' in query else 'Lecture 5.pdf'}]
+        )
+        mock_generate.return_value = '```json\n' + json.dumps({'summaries': [
+            {'topic': 'dna replication', 'summary': 'DNA summary'},
+            {'topic': 'Cell Mitosis', 'summary': 'Mitosis summary'},
+        ]}) + '\n```'
+
+        nodes_json, edges_json, data_json = kg_service.build_knowledge_graph(
+            self.sample_topics, self.corpus_id, self.sample_files, summary_mode='batched'
+        )
+
+        mock_generate.assert_called_once()
+        prompt = mock_generate.call_args.args[0]
+        self.assertEqual(prompt.count("Shared chunk."), 1)
+        self.assertEqual(mock_generate.call_args.kwargs['response_mime_type'], 'application/json')
+        data = json.loads(data_json)
+        self.assertEqual(data['topic_1']['summary'], 'Mitosis summary')
+        self.assertEqual(data['topic_2']['summary'], 'DNA summary')
+        self.assertEqual(json.loads(edges_json), [{'from': 'topic_1', 'to': '101'}, {'from': 'topic_2', 'to': '102'}])
+
+    @patch('app.services.kg_service._summary_limiter', kg_service.concurrency.RateLimiter(0))
+    @patch('app.services.kg_service.gemini_service.generate_answer_with_context')
+    @patch('app.services.kg_service.gemini_service.generate_answer')
+    @patch('app.services.kg_service.gemini_service.retrieve_answer_context')
+    def test_batched_summaries_fall_back_per_topic(self, mock_retrieve, mock_generate, mock_generate_with_context):
+        """Test topics missing from an unusable batched response are summarized one by one"""
+        mock_retrieve.return_value = (["Chunk."], [{'filename': 'Chapter 3.pdf'}])
+        mock_generate_with_context.return_value = ("Per-topic summary", [{'filename': 'Chapter 3.pdf'}])
+
+        for response in ('not json', json.dumps({'summaries': [{'topic': 'Cell Mitosis', 'summary': 'Batched'}]})):
+            mock_generate.return_value = response
+            mock_generate_with_context.reset_mock()
+
+            results = kg_service.summarize_topics(self.sample_topics, self.corpus_id, mode='batched')
+
+            self.assertEqual(results[1][0], "Per-topic summary")
+            self.assertEqual(results[0][0], "Per-topic summary" if response == 'not json' else "Batched")
+            self.assertEqual(mock_generate_with_context.call_count, 2 if response == 'not json' else 1)
+
+    @patch('app.services.kg_service.gemini_service.generate_answer_with_context')
+    def test_build_knowledge_graph_precomputes_layout(self, mock_generate_answer):
+        """Test every node gets deterministic x/y coordinates"""
+        mock_generate_answer.return_value = ("Summary", [{'filename': 'Chapter 3.pdf'}])
+
+        first = json.loads(kg_service.build_knowledge_graph(self.sample_topics, self.corpus_id, self.sample_files)[0])
+        second = json.loads(kg_service.build_knowledge_graph(self.sample_topics, self.corpus_id, self.sample_files)[0])
+
+        self.assertTrue(all(isinstance(n['x'], float) and isinstance(n['y'], float) for n in first))
+        self.assertEqual(first, second)
+        self.assertEqual(len({(n['x'], n['y']) for n in first}), len(first))
+
+    @patch('app.services.kg_service.gemini_service.generate_answer_with_context')
+    def test_build_topic_places_new_topic_without_moving_others(self, mock_generate_answer):
+        """Test a new topic is positioned while existing nodes keep their coordinates"""
+        mock_generate_answer.return_value = ("Summary", [{'filename': 'Lecture 5.pdf'}])
+        existing_nodes = [
+            {'id': 'topic_1', 'label': 'Old Topic', 'group': 'topic', 'x': -300.0, 'y': 10.0},
+            {'id': '102', 'label': 'Lecture 5.pdf', 'group': 'file_pdf', 'x': 250.0, 'y': -40.0},
+        ]
+        snapshot = json.dumps(existing_nodes)
+
+        node, edges, _ = kg_service.build_topic("New Topic", self.corpus_id, existing_nodes)
+
+        self.assertEqual(json.dumps(existing_nodes), snapshot)
+        self.assertIn('x', node)
+        self.assertLess(abs(node['x'] - 250.0), abs(node['x'] + 300.0))  # pulled towards its source
+
+        unpositioned, _, _ = kg_service.build_topic("Another", self.corpus_id, [{'id': '102', 'label': 'Lecture 5.pdf', 'group': 'file_pdf'}])
+        self.assertNotIn('x', unpositioned)
+
+        reserved, reserved_edges, _ = kg_service.build_topic("Reserved", self.corpus_id, existing_nodes, topic_id='topic_40')
+        self.assertEqual(reserved['id'], 'topic_40')
+        self.assertTrue(all(edge['from'] == 'topic_40' for edge in reserved_edges))
+
     @patch('app.services.kg_service.gemini_service.generate_answer')
     def test_extract_topics_from_summaries(self, mock_generate_answer):
         """Test extract_topics_from_summaries function"""
@@ -104,6 +324,118 @@ class TestKgService(unittest.TestCase):
         self.assertNotIn('topic_1', data)
         self.assertIn('topic_2', data)
 
+    def test_compute_related_edges_uses_top_k_and_threshold(self):
+        """Test related edges link each topic to its most similar topics above the threshold"""
+        kg_data = {
+            'topic_1': {'embedding': [1.0, 0.0, 0.0]},
+            'topic_2': {'embedding': [0.9, 0.1, 0.0]},
+            'topic_3': {'embedding': [0.8, 0.3, 0.0]},
+            'topic_4': {'embedding': [0.0, 0.0, 1.0]},  # unrelated to everything
+            'topic_5': {'summary': 'Error retrieving information for X.'},  # no embedding
+        }
+
+        edges = kg_service.compute_related_edges(kg_data, top_k=1, threshold=0.5)
+
+        self.assertEqual([(e['from'], e['to']) for e in edges], [('topic_2', 'topic_1'), ('topic_3', 'topic_2')])
+        self.assertTrue(all(e['type'] == 'related' and e['similarity'] >= 0.5 for e in edges))
+        self.assertEqual(kg_service.compute_related_edges(kg_data, top_k=1, threshold=0.999), [])
+
+    @patch('app.services.kg_service.RELATED_THRESHOLD', 0.5)
+    @patch('app.services.kg_service.gemini_service.generate_answer_with_context')
+    def test_topic_edits_reuse_stored_embeddings(self, mock_generate_answer):
+        """Test adding or removing a topic embeds at most the new topic and updates related edges"""
+        mock_generate_answer.return_value = ("New summary", [])
+        self.mock_get_embeddings.side_effect = lambda texts: [[1.0, 0.1]] * len(texts)
+        existing_nodes = [
+            {'id': 'topic_1', 'label': 'Recursion', 'group': 'topic'},
+            {'id': 'topic_2', 'label': 'Painting', 'group': 'topic'},
+        ]
+        existing_data = {
+            'topic_1': {'summary': 'Recursion', 'sources': [], 'embedding': [1.0, 0.0]},
+            'topic_2': {'summary': 'Painting', 'sources': [], 'embedding': [0.0, 1.0]},
+        }
+
+        _, edges_json, data_json = kg_service.add_topic_to_graph(
+            "Induction", self.corpus_id, existing_nodes, [], existing_data
+        )
+
+        self.mock_get_embeddings.assert_called_once_with(["New summary"])
+        self.assertEqual(json.loads(edges_json), [
+            {'from': 'topic_3', 'to': 'topic_1', 'type': 'related', 'similarity': 0.995}
+        ])
+        self.assertNotIn('embedding', existing_data.get('topic_3', {}))
+
+        nodes = existing_nodes + [{'id': 'topic_3', 'label': 'Induction', 'group': 'topic'}]
+        _, edges_json, _ = kg_service.remove_topic_from_graph(
+            'topic_1', nodes, json.loads(edges_json), json.loads(data_json)
+        )
+
+        self.assertEqual(self.mock_get_embeddings.call_count, 1)
+        self.assertEqual(json.loads(edges_json), [])
+
+    @patch('app.services.kg_service.gemini_service.retrieve_answer_context')
+    @patch('app.services.kg_service.gemini_service.generate_answer_with_context')
+    def test_sync_graph_files_refreshes_only_affected_topics(self, mock_generate_answer, mock_retrieve):
+        """Test a file sync re-summarizes topics of changed, removed and newly retrieved files only"""
+        mock_generate_answer.side_effect = lambda query, corpus_id: (f"New: {query[-40:]}", [{'filename': 'Week 4.pdf'}])
+        mock_retrieve.side_effect = lambda query, corpus_id: (
+            [], [{'filename': 'Week 4.pdf'}] if 'Sorting' in query else [{'filename': 'Chapter 3.pdf'}]
+        )
+        files = [
+            {'id': '101', 'display_name': 'Chapter 3.pdf'},
+            {'id': '103', 'display_name': 'Lecture 6.pdf'},
+            {'id': '104', 'display_name': 'Week 4.pdf'},
+        ]
+        nodes = [
+            {'id': '101', 'label': 'Chapter 3.pdf', 'group': 'file_pdf'},
+            {'id': '102', 'label': 'Lecture 5.pdf', 'group': 'file_pdf'},
+            {'id': '103', 'label': 'Lecture 6.pdf', 'group': 'file_pdf'},
+            {'id': 'topic_1', 'label': 'Recursion', 'group': 'topic'},
+            {'id': 'topic_2', 'label': 'Heaps', 'group': 'topic'},
+            {'id': 'topic_3', 'label': 'Sorting', 'group': 'topic'},
+            {'id': 'topic_4', 'label': 'Graphs', 'group': 'topic'},
+        ]
+        edges = [{'from': 'topic_1', 'to': '101'}, {'from': 'topic_2', 'to': '102'},
+                 {'from': 'topic_3', 'to': '103'}, {'from': 'topic_4', 'to': '103'}]
+        data = {topic_id: {'summary': 'Old', 'sources': [], 'embedding': [1.0] + [0.0] * 31}
+                for topic_id in ('topic_1', 'topic_2', 'topic_3', 'topic_4')}
+
+        nodes_json, edges_json, data_json, refreshed = kg_service.sync_graph_files(
+            nodes, edges, data, files, stale_file_ids={'101', '102'}, new_file_ids={'104'},
+            corpus_id=self.corpus_id, source_index=kg_service.build_source_index(files=files)
+        )
+
+        self.assertEqual(refreshed, ['topic_1', 'topic_2', 'topic_3'])
+        self.assertEqual(mock_retrieve.call_count, 2)  # topic_3 and topic_4; the others are stale anyway
+        self.assertEqual(self.mock_get_embeddings.call_count, 1)
+        self.assertEqual(len(self.mock_get_embeddings.call_args.args[0]), 3)
+        self.assertEqual([node['id'] for node in json.loads(nodes_json)],
+                         ['101', '103', '104', 'topic_1', 'topic_2', 'topic_3', 'topic_4'])
+        file_edges = sorted((e['from'], e['to']) for e in json.loads(edges_json) if e.get('type') != 'related')
+        self.assertEqual(file_edges, [('topic_1', '104'), ('topic_2', '104'), ('topic_3', '104'), ('topic_4', '103')])
+        updated = json.loads(data_json)
+        self.assertEqual(updated['topic_4']['summary'], 'Old')
+        self.assertTrue(updated['topic_2']['summary'].startswith('New'))
+
+    def test_graph_skeleton_keeps_topics_and_related_edges(self):
+        """Test the skeleton drops files and summaries but keeps counts and related edges"""
+        nodes = [
+            {'id': '101', 'label': 'a.pdf', 'group': 'file_pdf'},
+            {'id': 'topic_1', 'label': 'One', 'group': 'topic', 'x': 1.0, 'y': 2.0},
+            {'id': 'topic_2', 'label': 'Two', 'group': 'topic', 'x': 3.0, 'y': 4.0},
+        ]
+        related = {'from': 'topic_2', 'to': 'topic_1', 'type': 'related', 'similarity': 0.9}
+        edges = [{'from': 'topic_1', 'to': '101'}, related]
+        data = {'topic_1': {'summary': 's', 'sources': [{}, {}]}, 'topic_2': {'summary': 's'}}
+
+        skeleton = kg_service.graph_skeleton(nodes, edges, data)
+
+        self.assertEqual([(t['id'], t['file_count'], t['source_count']) for t in skeleton['topics']],
+                         [('topic_1', 1, 2), ('topic_2', 0, 0)])
+        self.assertEqual(skeleton['edges'], [related])
+        with self.assertRaises(ValueError):
+            kg_service.topic_detail('101', nodes, edges, data)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,6 @@
+import asyncio
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 import sys
 import os
 
@@ -11,14 +12,23 @@ from app.services import rag_service
 class TestRagService(unittest.TestCase):
     """Test suite for RAG service functions"""
 
+    def setUp(self):
+        rag_service.invalidate_retrieval_cache()
+
+    def _import_operation(self, failed=0):
+        operation = MagicMock()
+        operation.result = AsyncMock(return_value=MagicMock(failed_rag_files_count=failed, partial_failures_gcs_path=''))
+        return operation
+
     @patch('app.services.rag_service.rag.create_corpus')
-    @patch('app.services.rag_service.rag.import_files')
-    def test_create_and_provision_corpus(self, mock_import_files, mock_create_corpus):
-        """Test create_and_provision_corpus function"""
+    @patch('app.services.rag_service.rag.import_files_async')
+    def test_create_and_provision_corpus(self, mock_import_files_async, mock_create_corpus):
+        """Test create_and_provision_corpus imports every file in one operation"""
         # Mock the rag.create_corpus call
         mock_corpus = MagicMock()
         mock_corpus.name = "corpora/test_corpus"
         mock_create_corpus.return_value = mock_corpus
+        mock_import_files_async.return_value = self._import_operation()
 
         files_to_upload = [
             {'id': '1', 'display_name': 'file1.pdf', 'gcs_uri': 'gs://bucket/file1.pdf'},
@@ -29,8 +39,78 @@ class TestRagService(unittest.TestCase):
 
         self.assertEqual(corpus_name, "corpora/test_corpus")
         mock_create_corpus.assert_called_once()
-        self.assertEqual(mock_import_files.call_count, 2)
+        mock_import_files_async.assert_called_once()
+        self.assertEqual(mock_import_files_async.call_args.kwargs['paths'], ['gs://bucket/file1.pdf', 'gs://bucket/file2.pdf'])
+
+    @patch('app.services.rag_service.RAG_IMPORT_BATCH_SIZE', 2)
+    @patch('app.services.rag_service.rag.list_files')
+    @patch('app.services.rag_service.rag.import_files_async')
+    def test_import_corpus_files_reports_per_file_outcome(self, mock_import_files_async, mock_list_files):
+        """Test batches run as separate operations and failed files are found from the corpus listing"""
+        operations = {
+            ('gs://b/a.pdf', 'gs://b/b.pdf'): self._import_operation(failed=1),
+            ('gs://b/c.pdf', 'gs://b/d.pdf'): self._import_operation(),
+        }
+        mock_import_files_async.side_effect = lambda corpus_name, paths, **kwargs: operations.get(tuple(paths)) or \
+            (_ for _ in ()).throw(RuntimeError('import rejected'))
+        mock_list_files.return_value = [MagicMock(display_name='a.pdf'), MagicMock(display_name='c.pdf')]
+        files = [{'id': name, 'display_name': f'{name}.pdf', 'gcs_uri': f'gs://b/{name}.pdf'} for name in 'abcde']
+        imported = []
+
+        count = rag_service.import_corpus_files('corpus_1', files, on_imported=lambda f: imported.append(f['id']))
+
+        self.assertEqual(mock_import_files_async.call_count, 3)
+        self.assertEqual(imported, ['a', 'c', 'd'])
+        self.assertEqual(count, 3)
+        mock_list_files.assert_called_once_with(corpus_name='corpus_1')
+
+    @patch('app.services.rag_service.RAG_IMPORT_BUSY_WAIT_SECONDS', 0)
+    @patch('app.services.rag_service.RAG_IMPORT_BATCH_SIZE', 1)
+    @patch('app.services.rag_service.rag.import_files_async')
+    def test_import_runs_one_operation_per_corpus_and_retries_when_busy(self, mock_import_files_async):
+        """Test imports into a corpus never overlap and a rejected import is retried"""
+        from google.api_core import exceptions as google_exceptions
+        running, overlaps, rejected = [], [], []
+
+        async def import_files_async(corpus_name, paths, **kwargs):
+            if paths == ['gs://b/b.pdf'] and not rejected:
+                rejected.append(paths)
+                # How the SDK surfaces the API's rejection
+                e = google_exceptions.FailedPrecondition('Corpus is busy')
+                raise RuntimeError("Failed in importing the RagFiles due to: ", e) from e
+            overlaps.append(len(running))
+            running.append(paths)
+            operation = MagicMock()
+
+            async def result(timeout):
+                await asyncio.sleep(0.01)
+                running.remove(paths)
+                return MagicMock(failed_rag_files_count=0)
+            operation.result = result
+            return operation
+        mock_import_files_async.side_effect = import_files_async
+        files = [{'id': name, 'display_name': f'{name}.pdf', 'gcs_uri': f'gs://b/{name}.pdf'} for name in 'abc']
+        imported = []
+
+        count = rag_service.import_corpus_files('corpus_busy', files, on_imported=lambda f: imported.append(f['id']))
+
+        self.assertEqual(count, 3)
+        self.assertEqual(sorted(imported), ['a', 'b', 'c'])
+        self.assertEqual(mock_import_files_async.call_count, 4)
+        self.assertEqual(overlaps, [0, 0, 0])
 
+    def test_corpus_busy_checks_the_wrapped_cause(self):
+        """Test a FailedPrecondition is recognised directly or as the cause of the SDK's RuntimeError"""
+        from google.api_core import exceptions as google_exceptions
+        busy = google_exceptions.FailedPrecondition('Corpus is busy')
+        try:
+            raise RuntimeError("Failed in importing the RagFiles due to: ", busy) from busy
+        except RuntimeError as e:
+            wrapped = e
+
+        self.assertTrue(rag_service._corpus_busy(busy))
+        self.assertTrue(rag_service._corpus_busy(wrapped))
+        self.assertFalse(rag_service._corpus_busy(RuntimeError("Failed in importing the RagFiles due to: ", ValueError('bad'))))
 
     @patch('app.services.rag_service.rag.retrieval_query')
     def test_retrieve_context(self, mock_retrieval_query):
@@ -58,5 +138,113 @@ class TestRagService(unittest.TestCase):
         self.assertEqual(contexts[0], "This is context 1.")
         self.assertEqual(sources[0]['filename'], "file1.pdf")
 
+    @patch('app.services.rag_service.rag.retrieval_query')
+    def test_retrieve_context_cache_hit(self, mock_retrieval_query):
+        """Test repeated normalized queries are served from the retrieval cache"""
+        mock_context = MagicMock()
+        mock_context.text = "Cached context."
+        mock_context.source_uri = "gs://bucket/file1.pdf"
+        mock_context.distance = 0.1
+        mock_retrieval_query.return_value.contexts.contexts = [mock_context]
+
+        first = rag_service.retrieve_context("corpus_id", "What is a test?")
+        second = rag_service.retrieve_context("corpus_id", "  what is a   TEST ")
+
+        self.assertEqual(first, second)
+        mock_retrieval_query.assert_called_once()
+        stats = rag_service.get_retrieval_cache_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+        # Different retrieval parameters are cached separately
+        rag_service.retrieve_context("corpus_id", "What is a test?", top_k=5)
+        self.assertEqual(mock_retrieval_query.call_count, 2)
+
+    @patch('app.services.rag_service.rag.retrieval_query')
+    def test_retrieve_context_cache_invalidation(self, mock_retrieval_query):
+        """Test invalidating a corpus forces a fresh retrieval"""
+        mock_retrieval_query.return_value.contexts.contexts = []
+
+        rag_service.retrieve_context("corpus_id", "What is a test?")
+        rag_service.invalidate_retrieval_cache("corpus_id")
+        rag_service.retrieve_context("corpus_id", "What is a test?")
+
+        self.assertEqual(mock_retrieval_query.call_count, 2)
+
+    @patch('app.services.rag_service._get_async_rag_client')
+    @patch('app.services.rag_service.rag.retrieval_query')
+    def test_retrieve_context_async_shares_cache(self, mock_retrieval_query, mock_get_async_client):
+        """Test async retrieval parses contexts like the sync path and shares its cache"""
+        mock_context = MagicMock()
+        mock_context.text = "Async context."
+        mock_context.source_uri = "gs://bucket/file1.pdf"
+        mock_context.distance = 0.2
+        response = MagicMock()
+        response.contexts.contexts = [mock_context]
+        mock_get_async_client.return_value.retrieve_contexts = AsyncMock(return_value=response)
+
+        contexts, sources = asyncio.run(rag_service.retrieve_context_async("corpus_id", "What is a test?"))
+        cached = rag_service.retrieve_context("corpus_id", "What is a test?")
+
+        self.assertEqual(contexts, ["Async context."])
+        self.assertEqual(sources[0]['filename'], "file1.pdf")
+        self.assertEqual(cached, (contexts, sources))
+        mock_retrieval_query.assert_not_called()
+        request = mock_get_async_client.return_value.retrieve_contexts.call_args.kwargs['request']
+        self.assertEqual(request.query.rag_retrieval_config.top_k, 10)
+
+    @patch('app.services.rag_service.rag.delete_file')
+    @patch('app.services.rag_service.rag.list_files')
+    def test_delete_corpus_files(self, mock_list_files, mock_delete_file):
+        """Test corpus files are deleted by the name of the GCS object they were imported from"""
+        rag_files = [MagicMock(display_name='Week 1.pdf'), MagicMock(display_name='Week 2.pdf')]
+        rag_files[0].name, rag_files[1].name = 'ragFiles/1', 'ragFiles/2'  # 'name' can't be set in the constructor
+        mock_list_files.return_value = rag_files
+
+        deleted = rag_service.delete_corpus_files('corpus_1', ['gs://b/courses/1/Week 2.pdf', None])
+
+        self.assertEqual(deleted, 1)
+        mock_delete_file.assert_called_once_with(name='ragFiles/2')
+        self.assertEqual(rag_service.delete_corpus_files('corpus_1', []), 0)
+
+    def test_pack_context_merges_overlapping_chunks(self):
+        """Test chunks from the same source sharing an overlap are merged once"""
+        overlap = "the base case stops the recursion from running forever "
+        chunks = [
+            {'text': "A recursive function calls itself, and " + overlap, 'source_uri': 'gs://b/a.pdf', 'distance': 0.2},
+            {'text': overlap + "so every recursive function needs one.", 'source_uri': 'gs://b/a.pdf', 'distance': 0.1},
+            {'text': overlap + "in other files too.", 'source_uri': 'gs://b/other.pdf', 'distance': 0.3},
+        ]
+
+        packed = rag_service.pack_context(chunks, max_tokens=0)
+
+        self.assertEqual(len(packed), 2)
+        self.assertEqual(packed[0], "A recursive function calls itself, and " + overlap + "so every recursive function needs one.")
+        self.assertEqual(packed[0].count("base case"), 1)
+        self.assertTrue(packed[1].endswith("in other files too."))
+
+    def test_pack_context_drops_duplicates_and_enforces_budget(self):
+        """Test near-duplicates are dropped and nearer chunks win the token budget"""
+        text = "Gradient descent updates the weights in the direction of the negative gradient of the loss"
+        chunks = [
+            {'text': "Far chunk " * 40, 'source_uri': 'gs://b/c.pdf', 'distance': 0.4},
+            {'text': text + ".", 'source_uri': 'gs://b/a.pdf', 'distance': 0.1},
+            {'text': "Recall: " + text, 'source_uri': 'gs://b/b.pdf', 'distance': 0.2},
+        ]
+
+        self.assertEqual(rag_service.pack_context(chunks, max_tokens=0), [text + ".", ("Far chunk " * 40).strip()])
+        self.assertEqual(rag_service.pack_context(chunks, max_tokens=30), [text + "."])
+
+    def test_retrieval_cache_byte_budget(self):
+        """Test the cache evicts least recently used entries over its byte budget"""
+        cache = rag_service._RetrievalCache(ttl_seconds=60, max_bytes=100, max_entries=10)
+        cache.put(('c', 'a', 10, 0.5), 'A', 60)
+        cache.put(('c', 'b', 10, 0.5), 'B', 60)
+
+        self.assertIsNone(cache.get(('c', 'a', 10, 0.5)))
+        self.assertEqual(cache.get(('c', 'b', 10, 0.5)), 'B')
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,6 +2,8 @@ import unittest
 from unittest.mock import patch
 import json
 
+from app.services.firestore_service import GraphVersionConflict
+
 def test_health_check(client):
     """Test the health check endpoint"""
     response = client.get('/health')
@@ -46,38 +48,216 @@ def test_chat(mock_gemini_service, mock_firestore_service, client):
     data = json.loads(response.data)
     assert data['answer'] == 'Test answer'
 
+@patch('app.routes.analytics_logging_service')
+@patch('app.routes.semantic_cache_service')
 @patch('app.routes.firestore_service')
-@patch('app.routes.canvas_service')
-@patch('app.routes.gcs_service')
-@patch('app.routes.rag_service')
-@patch('app.routes.kg_service')
 @patch('app.routes.gemini_service')
-def test_initialize_course(mock_gemini, mock_kg, mock_rag, mock_gcs, mock_canvas, mock_firestore, client):
-    """Test the initialize course endpoint"""
-    mock_canvas.get_course_files.return_value = ([{'id': '1', 'display_name': 'file1.pdf', 'local_path': '/fake/path'}], {'1': {}})
-    mock_gcs.upload_course_files.return_value = [{'id': '1', 'display_name': 'file1.pdf', 'gcs_uri': 'gs://bucket/file1.pdf'}]
-    mock_rag.create_and_provision_corpus.return_value = "corpus_id_123"
-    mock_kg.build_knowledge_graph.return_value = ("nodes", "edges", "data")
+def test_chat_semantic_cache_hit(mock_gemini_service, mock_firestore_service, mock_semantic_cache, mock_analytics, client):
+    """Test the chat endpoint answers repeated questions from the semantic cache"""
+    mock_analytics.get_query_vector.return_value = [0.1, 0.2]
+    mock_analytics.enqueue_chat_query.return_value = 'log_1'
+    mock_semantic_cache.lookup.return_value = {'answer': 'Cached answer', 'sources': [], 'similarity': 0.99, 'doc_id': 'old'}
 
-    response = client.post('/api/initialize-course', json={'course_id': '123'})
+    response = client.post('/api/chat', json={'course_id': '123', 'query': 'What is a test?'})
 
     assert response.status_code == 200
     data = json.loads(response.data)
-    assert data['status'] == 'complete'
-    assert data['corpus_id'] == 'corpus_id_123'
+    assert data['answer'] == 'Cached answer'
+    assert data['cached'] is True
+    mock_gemini_service.generate_answer_with_context.assert_not_called()
+    # Retrieval only starts after a cache miss
+    mock_gemini_service.retrieve_answer_context.assert_not_called()
+    mock_firestore_service.get_course_data.assert_not_called()
+    mock_analytics.enqueue_chat_query.assert_called_once()
+    assert mock_analytics.enqueue_chat_query.call_args.kwargs['query_vector'] == [0.1, 0.2]
+    assert data['log_doc_id'] == 'log_1'
+
+@patch('app.routes.analytics_logging_service')
+@patch('app.routes.semantic_cache_service')
+@patch('app.routes.firestore_service')
+@patch('app.routes.gemini_service')
+def test_chat_fans_out_and_reports_timings(mock_gemini_service, mock_firestore_service, mock_semantic_cache, mock_analytics, client):
+    """Test the chat endpoint retrieves after a cache miss and reports stage timings"""
+    mock_firestore_service.get_course_data.return_value.to_dict.return_value = {'corpus_id': 'test_corpus'}
+    mock_semantic_cache.lookup.return_value = None
+    mock_analytics.get_query_vector.return_value = [0.1, 0.2]
+    mock_analytics.enqueue_chat_query.return_value = 'log_1'
+    mock_gemini_service.retrieve_answer_context.return_value = (["Context."], [])
+    mock_gemini_service.generate_answer_with_context.return_value = ("Test answer", [])
+
+    response = client.post('/api/chat', json={'course_id': '123', 'query': 'What is a test?'})
+
+    assert response.status_code == 200
+    mock_gemini_service.retrieve_answer_context.assert_called_once_with('What is a test?', 'test_corpus')
+    assert mock_gemini_service.generate_answer_with_context.call_args.kwargs['context'] == (["Context."], [])
+    stages = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+    assert set(stages) == {'course', 'retrieve', 'embed', 'cache', 'generate', 'total'}
+    assert mock_analytics.enqueue_chat_query.call_args.kwargs['metrics']['streamed'] is False
+
+def test_performance_stats(client):
+    """Test the performance stats endpoint reports caches and coalescing to instructors only"""
+    assert client.get('/api/performance-stats').status_code == 403
+
+    with client.session_transaction() as sess:
+        sess['role'] = 'Instructor'
+    response = client.get('/api/performance-stats')
+
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert set(data) == {'retrieval_cache', 'semantic_cache', 'course_cache', 'coalescing'}
+
+@patch('app.routes.analytics_logging_service')
+@patch('app.routes.semantic_cache_service')
+@patch('app.routes.firestore_service')
+@patch('app.routes.gemini_service')
+def test_chat_stream(mock_gemini_service, mock_firestore_service, mock_semantic_cache, mock_analytics, client):
+    """Test the streaming chat endpoint emits sources, tokens and done events"""
+    mock_firestore_service.get_course_data.return_value.to_dict.return_value = {'corpus_id': 'test_corpus'}
+    mock_semantic_cache.lookup.return_value = None
+    mock_analytics.enqueue_chat_query.return_value = 'log_1'
+    sources = [{'filename': 'a.pdf', 'source_uri': 'gs://b/a.pdf', 'distance': 0.1}]
+    mock_gemini_service.generate_answer_with_context_stream.return_value = (iter(["Test ", "answer"]), sources)
+
+    response = client.post('/api/chat/stream', json={'course_id': '123', 'query': 'What is a test?'})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    events = [block.split('\n') for block in body.strip().split('\n\n')]
+    assert [lines[0] for lines in events] == ['event: sources', 'event: token', 'event: token', 'event: done']
+    assert json.loads(events[0][1][6:])['sources'] == sources
+    done = json.loads(events[-1][1][6:])
+    assert done['log_doc_id'] == 'log_1'
+    assert done['ttft_ms'] is not None
+    log_kwargs = mock_analytics.enqueue_chat_query.call_args.kwargs
+    assert log_kwargs['answer_text'] == 'Test answer'
+    assert log_kwargs['metrics']['ttft_ms'] == done['ttft_ms']
+
+@patch('app.routes.course_init_service')
+def test_initialize_course(mock_init, client):
+    """Test the initialize course endpoint queues a job and returns right away"""
+    mock_init.enqueue_initialization.return_value = 'job_123'
+
+    response = client.post('/api/initialize-course', json={'course_id': '123', 'topics': 'Recursion'})
+
+    assert response.status_code == 202
+    data = json.loads(response.data)
+    assert data['status'] == 'queued'
+    assert data['job_id'] == 'job_123'
+    assert data['status_url'] == '/api/jobs/job_123'
+    mock_init.enqueue_initialization.assert_called_once_with('123', topics='Recursion', summary_mode=None, resume=True)
+    assert client.post('/api/initialize-course', json={}).status_code == 400
+
+@patch('app.routes.course_init_service')
+@patch('app.routes.firestore_service')
+def test_sync_course(mock_firestore, mock_init, client):
+    """Test the sync endpoint queues a job for ACTIVE courses only"""
+    mock_firestore.get_course_state.return_value = 'ACTIVE'
+    mock_init.enqueue_sync.return_value = 'job_456'
+
+    response = client.post('/api/sync-course', json={'course_id': '123'})
+
+    assert response.status_code == 202
+    assert json.loads(response.data)['status_url'] == '/api/jobs/job_456'
+    mock_init.enqueue_sync.assert_called_once_with('123', summary_mode=None)
+
+    mock_firestore.get_course_state.return_value = 'GENERATING'
+    assert client.post('/api/sync-course', json={'course_id': '123'}).status_code == 409
+    assert client.post('/api/sync-course', json={}).status_code == 400
+
+    # A sync can't start while the course is being initialized
+    from app.services.job_queue_service import JobConflictError
+    mock_firestore.get_course_state.return_value = 'ACTIVE'
+    mock_init.enqueue_sync.side_effect = JobConflictError('busy', {'id': 'job_init'})
+    response = client.post('/api/sync-course', json={'course_id': '123'})
+    assert response.status_code == 409
+    assert response.get_json()['job_id'] == 'job_init'
+
+@patch('app.routes.job_queue_service')
+def test_get_job_status(mock_queue, client):
+    """Test the job status endpoint reports progress and 404s on unknown jobs"""
+    mock_queue.get_job_status.side_effect = lambda job_id: {
+        'job_id': job_id, 'status': 'running', 'stage': 'summarize', 'progress': 0.4, 'eta_seconds': 60.0
+    } if job_id == 'job_123' else None
+
+    response = client.get('/api/jobs/job_123')
+
+    assert response.status_code == 200
+    assert json.loads(response.data)['stage'] == 'summarize'
+    assert client.get('/api/jobs/missing').status_code == 404
+
+def test_shared_retrieval_timings_are_reported_per_request():
+    """Test a request that joined another's retrieval still reports its course/retrieve stages"""
+    from concurrent.futures import Future
+    from app import routes
+    shared = Future()
+    shared.set_result(('corpus1', (["Context."], []), {'course': 1.5, 'retrieve': 40.2}))
+    leader_timings, follower_timings = {'embed': 3.0}, {'embed': 2.5}
+
+    assert routes._answer_context(shared, leader_timings) == ('corpus1', (["Context."], []))
+    routes._answer_context(shared, follower_timings)
+
+    assert follower_timings == {'embed': 2.5, 'course': 1.5, 'retrieve': 40.2}
+    assert leader_timings['retrieve'] == 40.2
 
 @patch('app.routes.firestore_service')
 def test_get_graph(mock_firestore, client):
     """Test the get graph endpoint"""
-    mock_firestore.get_course_data.return_value.get.side_effect = ['nodes', 'edges', 'data', 'indexed_files']
+    mock_firestore.get_course_data.return_value.get.side_effect = ['indexed_files']
+    mock_firestore.get_knowledge_graph.return_value = (
+        [{'id': 'topic_1'}], [{'from': 'topic_1', 'to': '101'}], {'topic_1': {'summary': 'data'}}
+    )
 
     response = client.get('/api/get-graph?course_id=123')
 
     assert response.status_code == 200
     data = json.loads(response.data)
-    assert data['nodes'] == 'nodes'
-    assert data['edges'] == 'edges'
-    assert data['data'] == 'data'
+    assert json.loads(data['nodes']) == [{'id': 'topic_1'}]
+    assert json.loads(data['edges']) == [{'from': 'topic_1', 'to': '101'}]
+    assert json.loads(data['data']) == {'topic_1': {'summary': 'data'}}
+    assert data['indexed_files'] == 'indexed_files'
+
+@patch('app.routes.firestore_service')
+def test_get_graph_missing_course(mock_firestore, client):
+    """Test the get graph endpoint validates the course before reading its graph"""
+    mock_firestore.get_course_data.return_value.exists = False
+
+    assert client.get('/api/get-graph').status_code == 400
+    assert client.get('/api/get-graph?course_id=missing').status_code == 404
+    mock_firestore.get_knowledge_graph.assert_not_called()
+
+@patch('app.routes.firestore_service')
+def test_graph_skeleton_requires_course_id(mock_firestore, client):
+    """Test the skeleton endpoint rejects a missing course_id before touching Firestore"""
+    response = client.get('/api/graph-skeleton')
+
+    assert response.status_code == 400
+    mock_firestore.get_course_data.assert_not_called()
+
+@patch('app.routes.firestore_service')
+def test_graph_skeleton_and_topic_detail_errors(mock_firestore, client):
+    """Test skeleton and topic-detail failures return a JSON 500"""
+    mock_firestore.get_course_data.side_effect = RuntimeError("Firestore unavailable")
+
+    for url in ('/api/graph-skeleton?course_id=123', '/api/topic-detail?course_id=123&topic_id=topic_1'):
+        response = client.get(url)
+        assert response.status_code == 500
+        assert response.get_json()['message'] == 'Firestore unavailable'
+
+@patch('app.routes.firestore_service')
+def test_get_graph_raw_format(mock_firestore, client):
+    """Test format=raw passes the stored graph JSON through with indexed_files appended"""
+    mock_firestore.get_course_data.return_value.get.return_value = {'101': {'name': 'a.pdf'}}
+    mock_firestore.get_knowledge_graph_json.return_value = b'{"nodes":[{"id":"topic_1"}],"edges":[],"data":{}}'
+
+    response = client.get('/api/get-graph?course_id=123&format=raw')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    assert json.loads(response.data) == {
+        'nodes': [{'id': 'topic_1'}], 'edges': [], 'data': {}, 'indexed_files': {'101': {'name': 'a.pdf'}}
+    }
+    mock_firestore.get_knowledge_graph.assert_not_called()
 
 @patch('app.routes.gcs_service')
 def test_download_source(mock_gcs, client):
@@ -95,21 +275,61 @@ def test_rate_answer(mock_analytics, client):
     """Test the rate answer endpoint"""
     response = client.post('/api/rate-answer', json={'log_doc_id': '123', 'rating': 'helpful'})
     assert response.status_code == 200
-    mock_analytics.rate_answer.assert_called_with('123', 'helpful')
+    mock_analytics.rate_answer.assert_called_with('123', 'helpful', issued=False)
+
+    mock_analytics.rate_answer.return_value = False
+    response = client.post('/api/rate-answer', json={'log_doc_id': 'unknown', 'rating': 'helpful'})
+    assert response.status_code == 404
+
+@patch('app.routes.analytics_logging_service')
+@patch('app.routes.semantic_cache_service')
+def test_rate_answer_trusts_log_ids_issued_to_the_session(mock_semantic_cache, mock_analytics, client):
+    """Test an answer can be rated as issued (before its log lands) only by the session that received it"""
+    mock_analytics.enqueue_chat_query.return_value = 'log_9'
+    mock_semantic_cache.lookup.return_value = {'answer': 'Cached answer', 'sources': [], 'similarity': 0.99, 'doc_id': 'old'}
+    client.post('/api/chat', json={'course_id': '123', 'query': 'What is a test?'})
+
+    client.post('/api/rate-answer', json={'log_doc_id': 'log_9', 'rating': 'helpful'})
+    mock_analytics.rate_answer.assert_called_with('log_9', 'helpful', issued=True)
+
+    client.post('/api/rate-answer', json={'log_doc_id': 'log_8', 'rating': 'helpful'})
+    mock_analytics.rate_answer.assert_called_with('log_8', 'helpful', issued=False)
 
 @patch('app.routes.kg_service')
 @patch('app.routes.firestore_service')
 def test_remove_topic(mock_firestore, mock_kg, client):
     """Test the remove topic endpoint"""
     mock_firestore.get_course_data.return_value.exists = True
-    mock_firestore.get_course_data.return_value.to_dict.return_value = {'status': 'ACTIVE', 'kg_nodes': '[]', 'kg_edges': '[]', 'kg_data': '{}'}
-    mock_kg.remove_topic_from_graph.return_value = ("new_nodes", "new_edges", "new_data")
+    mock_firestore.get_course_data.return_value.to_dict.return_value = {'status': 'ACTIVE'}
+    mock_firestore.get_knowledge_graph.return_value = ([], [], {})
+    mock_kg.remove_topic_from_graph.return_value = ("[]", "[]", "{}")
 
     response = client.post('/api/remove-topic', json={'course_id': '123', 'topic_id': 'topic_1'})
 
     assert response.status_code == 200
     data = json.loads(response.data)
     assert data['status'] == 'success'
+    mock_firestore.get_course_data.assert_called_once_with('123', fresh=True)
+    mock_firestore.delete_graph_topic.assert_called_once_with('123', 'topic_1', topic_updates={}, expected_version=0)
+    mock_firestore.update_knowledge_graph.assert_not_called()
+
+@patch('app.routes.kg_service')
+@patch('app.routes.firestore_service')
+def test_remove_topic_concurrent_edit(mock_firestore, mock_kg, client):
+    """Test an edit computed from an outdated graph is rejected with 409"""
+    mock_firestore.get_course_data.return_value.exists = True
+    mock_firestore.get_course_data.return_value.to_dict.return_value = {'status': 'ACTIVE', 'kg_version': 3}
+    mock_firestore.get_knowledge_graph.return_value = ([], [], {})
+    mock_kg.remove_topic_from_graph.return_value = ("[]", "[]", "{}")
+    mock_firestore.delete_graph_topic.side_effect = GraphVersionConflict("changed")
+
+    response = client.post('/api/remove-topic', json={'course_id': '123', 'topic_id': 'topic_1'})
+
+    assert response.status_code == 409
+    assert response.get_json() == {
+        'error': 'The knowledge graph was changed by another edit. Reload and try again.', 'message': 'changed'
+    }
+    assert mock_firestore.delete_graph_topic.call_args.kwargs['expected_version'] == 3
 
 @patch('app.routes.analytics_logging_service')
 def test_log_node_click(mock_analytics, client):
@@ -142,12 +362,216 @@ def test_add_topic(mock_firestore, mock_kg, client):
     """Test the add topic endpoint"""
     mock_firestore.get_course_data.return_value.exists = True
     mock_firestore.get_course_data.return_value.to_dict.return_value = {
-        'status': 'ACTIVE', 'corpus_id': 'corpus1', 'kg_nodes': '[]', 'kg_edges': '[]', 'kg_data': '{}'
+        'status': 'ACTIVE', 'corpus_id': 'corpus1', 'source_index': {'uri': {}, 'name': {}, 'id': {}}
     }
-    mock_kg.add_topic_to_graph.return_value = ("new_nodes", "new_edges", "new_data")
+    mock_firestore.get_knowledge_graph.return_value = ([], [], {})
+    new_node = {'id': 'topic_1', 'label': 'New Topic', 'group': 'topic'}
+    mock_kg.build_topic.return_value = (new_node, [], {'summary': 'New summary', 'sources': []})
+    mock_kg.refresh_related_edges.return_value = ([], {'topic_1': {'summary': 'New summary', 'sources': []}})
 
     response = client.post('/api/add-topic', json={'course_id': '123', 'topic_name': 'New Topic'})
     assert response.status_code == 200
     data = json.loads(response.data)
     assert data['status'] == 'success'
+    assert json.loads(data['nodes']) == [new_node]
+    mock_firestore.put_graph_topic.assert_called_once_with(
+        '123', new_node, [], {'summary': 'New summary', 'sources': []}, source_index=None, topic_updates={},
+        expected_version=0
+    )
+
+@patch('app.services.kg_service.gemini_service.get_embeddings', return_value=[[1.0, 0.0]])
+@patch('app.routes.gemini_service')
+@patch('app.routes.firestore_service')
+def test_add_topic_saves_missing_source_index(mock_firestore, mock_gemini, mock_get_embeddings, client):
+    """Test add-topic builds the source index for older courses and stores it"""
+    mock_firestore.get_course_data.return_value.exists = True
+    mock_firestore.get_course_data.return_value.to_dict.return_value = {
+        'status': 'ACTIVE', 'corpus_id': 'corpus1',
+        'indexed_files': {'101': {'gcs_uri': 'gs://bucket/courses/123/Lecture 5.pdf', 'display_name': 'Lecture 5.pdf'}}
+    }
+    mock_firestore.get_knowledge_graph.return_value = (
+        [{'id': '101', 'label': 'Lecture 5.pdf', 'group': 'file_pdf'}], [], {}
+    )
+    mock_firestore.allocate_topic_ids.return_value = ['topic_1']
+
+    response = client.post('/api/add-topic', json={'course_id': '123', 'topic_name': 'New Topic', 'summary': 'Custom'})
+
+    assert response.status_code == 200
+    saved_index = mock_firestore.put_graph_topic.call_args.kwargs['source_index']
+    assert saved_index['uri'] == {'gs://bucket/courses/123/Lecture 5.pdf': '101'}
+    assert saved_index['name']['lecture 5.pdf'] == '101'
+
+@patch('app.services.kg_service.gemini_service.get_embeddings')
+@patch('app.routes.firestore_service')
+def test_add_topic_updates_related_topics(mock_firestore, mock_get_embeddings, client):
+    """Test add-topic stores related edges with the new topic and embeddings of older topics, not in the response"""
+    mock_firestore.get_course_data.return_value.exists = True
+    mock_firestore.get_course_data.return_value.to_dict.return_value = {
+        'status': 'ACTIVE', 'corpus_id': 'corpus1', 'source_index': {'uri': {}, 'name': {}, 'id': {}}
+    }
+    mock_firestore.get_knowledge_graph.return_value = (
+        [{'id': 'topic_1', 'label': 'Recursion', 'group': 'topic'}], [],
+        {'topic_1': {'summary': 'Functions calling themselves', 'sources': []}}
+    )
+    mock_get_embeddings.side_effect = lambda texts: [[1.0, 0.0]] * len(texts)
+    mock_firestore.allocate_topic_ids.return_value = ['topic_2']
+
+    response = client.post('/api/add-topic', json={'course_id': '123', 'topic_name': 'Induction', 'summary': 'Custom'})
+
+    assert response.status_code == 200
+    mock_get_embeddings.assert_called_once_with(['Functions calling themselves', 'Custom'])
+    args, kwargs = mock_firestore.put_graph_topic.call_args
+    assert args[2] == [{'from': 'topic_2', 'to': 'topic_1', 'type': 'related', 'similarity': 1.0}]
+    assert args[3]['embedding'] == [1.0, 0.0]
+    assert kwargs['topic_updates'] == {'topic_1': {'embedding': [1.0, 0.0]}}
+    assert 'embedding' not in json.loads(response.get_json()['data'])['topic_2']
+
+@patch('app.routes.firestore_service')
+def test_graph_skeleton_and_topic_detail(mock_firestore, client):
+    """Test the skeleton carries topics and counts only, and topic details are served on demand"""
+    mock_firestore.get_course_data.return_value.exists = True
+    mock_firestore.get_course_data.return_value.to_dict.return_value = {
+        'indexed_files': {'101': {'gcs_uri': 'gs://bucket/a.pdf', 'display_name': 'a.pdf'}}
+    }
+    nodes = [{'id': '101', 'label': 'a.pdf', 'group': 'file_pdf'},
+             {'id': 'topic_1', 'label': 'Recursion', 'group': 'topic'}]
+    edges = [{'from': 'topic_1', 'to': '101'}]
+    data = {'topic_1': {'summary': 'Long summary', 'sources': [{'filename': 'a.pdf'}]}}
+    mock_firestore.get_knowledge_graph.return_value = (nodes, edges, data)
+    mock_firestore.get_graph_topic.return_value = (nodes, edges, data)
+
+    skeleton = client.get('/api/graph-skeleton?course_id=123').get_json()
+
+    assert skeleton['topics'] == [{'id': 'topic_1', 'label': 'Recursion', 'group': 'topic',
+                                   'file_count': 1, 'source_count': 1}]
+    assert skeleton['counts'] == {'topics': 1, 'files': 1, 'edges': 1}
+    assert 'Long summary' not in json.dumps(skeleton)
+
+    detail = client.get('/api/topic-detail?course_id=123&topic_id=topic_1').get_json()
+
+    assert detail['summary'] == 'Long summary'
+    assert detail['files'][0]['gcs_uri'] == 'gs://bucket/a.pdf'
+    mock_firestore.get_graph_topic.assert_called_once_with('123', 'topic_1', mock_firestore.get_course_data.return_value)
+    assert client.get('/api/topic-detail?course_id=123&topic_id=topic_9').status_code == 404
+
+@patch('app.routes.firestore_service')
+def test_get_graph_conditional_and_compressed(mock_firestore, client):
+    """Test get-graph sends validators, answers a matching If-None-Match with 304 and gzips large bodies"""
+    from datetime import datetime, timezone
+    import gzip
+    updated_at = datetime(2026, 10, 1, 12, 0, tzinfo=timezone.utc)
+    mock_firestore.get_course_data.return_value.to_dict.return_value = {'kg_version': 4, 'kg_updated_at': updated_at}
+    mock_firestore.get_course_data.return_value.get.return_value = {}
+    nodes = [{'id': f'topic_{i}', 'label': 'Topic ' * 20, 'group': 'topic'} for i in range(50)]
+    mock_firestore.get_knowledge_graph.return_value = (nodes, [], {})
+
+    response = client.get('/api/get-graph?course_id=123', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(json.loads(gzip.decompress(response.data))['nodes']) == nodes
+    etag = response.headers['ETag']
+    assert response.headers['Last-Modified'] == 'Thu, 01 Oct 2026 12:00:00 GMT'
+
+    mock_firestore.get_knowledge_graph.reset_mock()
+    cached = client.get('/api/get-graph?course_id=123', headers={'If-None-Match': etag})
+
+    assert cached.status_code == 304
+    assert cached.data == b''
+    mock_firestore.get_knowledge_graph.assert_not_called()
+
+    mock_firestore.get_course_data.return_value.to_dict.return_value = {'kg_version': 5, 'kg_updated_at': updated_at}
+    assert client.get('/api/get-graph?course_id=123', headers={'If-None-Match': etag}).status_code == 200
+    # The cached course is checked against the stored version before a 304 is sent
+    mock_firestore.get_course_data.assert_called_with('123', validate='kg')
+
+@patch('app.routes.firestore_service')
+def test_unversioned_responses_are_not_compressed(mock_firestore, client):
+    """Test only the versioned graph and analytics responses are compressed"""
+    mock_firestore.get_init_logs.return_value = ['Uploading file ' * 20] * 50
+
+    response = client.get('/api/init-logs/123', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    assert len(response.get_json()['logs']) == 50
+
+def test_encode_body_respects_encoding_qualities():
+    """Test compression follows Accept-Encoding qualities instead of substring matches"""
+    from app import routes
+    body = b'x' * 4096
+
+    assert routes._encode_body(body, 'gzip;q=1, br;q=0')[1] == 'gzip'
+    assert routes._encode_body(body, 'gzip;q=0')[1] is None
+    assert routes._encode_body(body, 'identity, x-brotli')[1] is None
+    assert routes._encode_body(body, None)[1] is None
+    with patch('app.routes.brotli') as mock_brotli:
+        mock_brotli.compress.return_value = b'compressed'
+        assert routes._encode_body(body, 'gzip;q=0.5, br') == (b'compressed', 'br')
+        assert routes._encode_body(body, 'gzip, br;q=0.5')[1] == 'gzip'
+        assert routes._encode_body(body, 'gzip, br;q=0')[1] == 'gzip'
+
+@patch('app.services.kg_service.gemini_service.get_embeddings', side_effect=lambda texts: [[1.0, 0.0]] * len(texts))
+@patch('app.services.kg_service.gemini_service.generate_answer_with_context')
+@patch('app.routes.firestore_service')
+def test_add_topics_writes_once_and_reports_each_topic(mock_firestore, mock_generate, mock_get_embeddings, client):
+    """Test bulk add summarizes topics, reports per-topic failures and commits the rest in one write"""
+    mock_firestore.get_course_data.return_value.exists = True
+    mock_firestore.get_course_data.return_value.to_dict.return_value = {
+        'status': 'ACTIVE', 'corpus_id': 'corpus1', 'source_index': {'uri': {}, 'name': {'a.pdf': '101'}, 'id': {}}
+    }
+    mock_firestore.get_knowledge_graph.return_value = (
+        [{'id': '101', 'label': 'a.pdf', 'group': 'file_pdf'}, {'id': 'topic_1', 'label': 'Old', 'group': 'topic'}],
+        [], {'topic_1': {'summary': 'Old', 'sources': [], 'embedding': [0.0, 1.0]}}
+    )
+
+    def generate(query, corpus_id):
+        if 'Broken' in query:
+            raise ValueError("Corpus not found")
+        return "Generated summary", [{'filename': 'a.pdf'}]
+    mock_generate.side_effect = generate
+    # IDs come from the course's counter (another editor already took topic_2..topic_6)
+    mock_firestore.allocate_topic_ids.side_effect = lambda course_id, count: [f'topic_{7 + i}' for i in range(count)]
+
+    response = client.post('/api/add-topics', json={'course_id': '123', 'topics': [
+        'Sorting', {'name': 'Broken'}, {'name': 'Heaps', 'summary': 'Custom'}, {'name': ' '}
+    ]})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['status'] == 'partial'
+    assert [(r['status'], r.get('topic_id')) for r in body['results']] == [
+        ('added', 'topic_7'), ('failed', None), ('added', 'topic_8'), ('failed', None)
+    ]
+    mock_firestore.allocate_topic_ids.assert_called_once_with('123', 2)
+    assert mock_generate.call_count == 2
+    mock_get_embeddings.assert_called_once_with(['Generated summary', 'Custom'])
+    mock_firestore.put_graph_topics.assert_called_once()
+    written = mock_firestore.put_graph_topics.call_args.args[1]
+    assert [node['id'] for node, _, _ in written] == ['topic_7', 'topic_8']
+    assert {'from': 'topic_7', 'to': '101'} in written[0][1]
+    assert [e for e in written[1][1] if e.get('type') == 'related'] == [
+        {'from': 'topic_8', 'to': 'topic_7', 'type': 'related', 'similarity': 1.0}
+    ]
+
+
+@patch('app.routes.kg_service.build_topics')
+@patch('app.routes.firestore_service')
+def test_add_topics_rejects_invalid_entries_and_oversized_batches(mock_firestore, mock_build_topics, client):
+    """Test bulk add validates topic entries and the batch budget before summarizing"""
+    from app.services.firestore_service import MAX_BATCH_WRITES
+    for entry in (5, {'name': 5}, {'summary': 'No name'}, {'name': 'Heaps', 'summary': ['list']}):
+        response = client.post('/api/add-topics', json={'course_id': '123', 'topics': ['Sorting', entry]})
+        assert response.status_code == 400
+    mock_firestore.get_course_data.assert_not_called()
+
+    mock_firestore.get_course_data.return_value.exists = True
+    mock_firestore.get_course_data.return_value.to_dict.return_value = {'status': 'ACTIVE', 'corpus_id': 'corpus1'}
+    existing = [{'id': f'topic_{i}', 'label': f'T{i}', 'group': 'topic'} for i in range(MAX_BATCH_WRITES - 2)]
+    mock_firestore.get_knowledge_graph.return_value = (existing, [], {})
 
+    response = client.post('/api/add-topics', json={'course_id': '123', 'topics': ['Sorting', 'Heaps']})
+    assert response.status_code == 400
+    assert 'at most 1' in response.get_json()['error']
+    mock_build_topics.assert_not_called()
+    mock_firestore.put_graph_topics.assert_not_called()
@@ -0,0 +1,124 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+
+# Add parent directory to path to import app modules
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services import semantic_cache_service
+
+class TestSemanticCacheService(unittest.TestCase):
+    """Test suite for Semantic Cache service functions"""
+
+    def setUp(self):
+        semantic_cache_service.clear()
+        self.events = [
+            {'doc_id': '1', 'query_vector': [1.0, 0.0, 0.0], 'answer_text': 'Answer one',
+             'sources': [{'filename': 'a.pdf', 'distance': 0.1}]},
+            {'doc_id': '2', 'query_vector': [0.0, 1.0, 0.0], 'answer_text': 'Answer two',
+             'sources': [{'filename': 'b.pdf', 'distance': 0.2}], 'rating': 'not_helpful'},
+            {'doc_id': '3', 'query_vector': [0.0, 0.0, 1.0], 'answer_text': None, 'sources': []},
+        ]
+
+    @patch('app.services.semantic_cache_service.firestore_service')
+    def test_lookup_hit(self, mock_firestore_service):
+        """Test a near-identical question returns the stored answer"""
+        mock_firestore_service.get_analytics_events.return_value = self.events
+
+        hit = semantic_cache_service.lookup('course1', [0.99, 0.05, 0.0], threshold=0.95)
+
+        self.assertEqual(hit['answer'], 'Answer one')
+        self.assertEqual(hit['doc_id'], '1')
+        self.assertEqual(hit['sources'][0]['filename'], 'a.pdf')
+        mock_firestore_service.get_analytics_events.assert_called_once_with('course1', event_type='chat')
+
+    @patch('app.services.semantic_cache_service.firestore_service')
+    def test_lookup_skips_unhelpful_and_ungrounded_answers(self, mock_firestore_service):
+        """Test answers rated not_helpful or without sources are never served"""
+        mock_firestore_service.get_analytics_events.return_value = self.events
+
+        self.assertIsNone(semantic_cache_service.lookup('course1', [0.0, 1.0, 0.0]))
+        self.assertIsNone(semantic_cache_service.lookup('course1', [0.0, 0.0, 1.0]))
+        self.assertEqual(semantic_cache_service.get_stats()['misses'], 2)
+
+    @patch('app.services.semantic_cache_service.firestore_service')
+    def test_add_entry_and_invalidate(self, mock_firestore_service):
+        """Test new answers are searchable immediately and dropped on invalidation"""
+        mock_firestore_service.get_analytics_events.return_value = []
+
+        self.assertIsNone(semantic_cache_service.lookup('course1', [0.0, 1.0, 0.0]))
+        semantic_cache_service.add_entry('course1', [0.0, 1.0, 0.0], 'Fresh answer', [{'filename': 'c.pdf'}], 'doc9')
+        self.assertEqual(semantic_cache_service.lookup('course1', [0.0, 1.0, 0.0])['answer'], 'Fresh answer')
+
+        semantic_cache_service.invalidate_course('course1')
+        self.assertIsNone(semantic_cache_service.lookup('course1', [0.0, 1.0, 0.0]))
+
+    @patch('app.services.semantic_cache_service.firestore_service')
+    def test_invalidation_marker_is_shared_by_workers(self, mock_firestore_service):
+        """Test an invalidation stored by another worker drops answers logged before it"""
+        from datetime import datetime, timezone
+        before = datetime(2026, 10, 1, tzinfo=timezone.utc)
+        invalidated_at = datetime(2026, 10, 2, tzinfo=timezone.utc)
+        after = datetime(2026, 10, 3, tzinfo=timezone.utc)
+        course = mock_firestore_service.get_course_data.return_value
+        course.to_dict.return_value = {}
+        mock_firestore_service.get_analytics_events.return_value = [
+            {**self.events[0], 'timestamp': before},
+            {'doc_id': '4', 'query_vector': [0.0, 1.0, 0.0], 'answer_text': 'New answer',
+             'sources': [{'filename': 'b.pdf'}], 'timestamp': after},
+        ]
+
+        self.assertEqual(semantic_cache_service.lookup('course1', [1.0, 0.0, 0.0])['answer'], 'Answer one')
+        mock_firestore_service.get_course_data.assert_called_with('course1', validate='semantic_cache')
+
+        # Another worker invalidates the course
+        course.to_dict.return_value = {'semantic_cache_version': 1, 'semantic_cache_updated_at': invalidated_at}
+
+        self.assertIsNone(semantic_cache_service.lookup('course1', [1.0, 0.0, 0.0]))
+        self.assertEqual(semantic_cache_service.lookup('course1', [0.0, 1.0, 0.0])['answer'], 'New answer')
+        self.assertEqual(mock_firestore_service.get_analytics_events.call_count, 2)
+
+    @patch('app.services.semantic_cache_service.firestore_service')
+    def test_cold_course_is_loaded_once_for_concurrent_lookups(self, mock_firestore_service):
+        """Test lookups racing on a cold course share one Firestore scan"""
+        import threading
+        import time
+        started = threading.Event()
+
+        def slow_events(course_id, event_type):
+            started.set()
+            time.sleep(0.2)
+            return self.events
+        mock_firestore_service.get_analytics_events.side_effect = slow_events
+        results = []
+
+        def ask():
+            results.append(semantic_cache_service.lookup('course1', [1.0, 0.0, 0.0]))
+        first = threading.Thread(target=ask)
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=ask)
+        second.start()
+        first.join(5)
+        second.join(5)
+
+        self.assertEqual([hit['answer'] for hit in results], ['Answer one', 'Answer one'])
+        mock_firestore_service.get_analytics_events.assert_called_once()
+
+    @patch('app.services.semantic_cache_service.firestore_service')
+    def test_invalidate_course_stores_the_marker(self, mock_firestore_service):
+        """Test invalidation is written to the course document, not only dropped locally"""
+        semantic_cache_service.invalidate_course('course1')
+
+        mock_firestore_service.invalidate_semantic_cache.assert_called_once_with('course1')
+
+    @patch('app.services.semantic_cache_service.firestore_service')
+    def test_lookup_survives_firestore_errors(self, mock_firestore_service):
+        """Test a failing Firestore read is treated as a miss"""
+        mock_firestore_service.get_analytics_events.side_effect = RuntimeError("unavailable")
+
+        self.assertIsNone(semantic_cache_service.lookup('course1', [1.0, 0.0, 0.0]))
+
+if __name__ == '__main__':
+    unittest.main()